@@ -1,28 +1,81 @@
-from flask import Flask, request, jsonify
+from flask import Blueprint, Flask, Response, current_app, request, jsonify, send_file, stream_with_context
+import click
 from flask_cors import CORS
-from models import db, Company, User, Expense, ApprovalStep
+from models import db, Company, User, Expense, ApprovalStep, ApprovalRule, ApproverGroup, ApproverGroupMember, ApprovalVote, ArchivedExpense, Attachment
 from config import Config
+import database
+import metrics
+from fx import RateCache, fetch_latest_rates
+from migrations import current_version as current_schema_version, latest_version as latest_schema_version, upgrade as upgrade_schema
+from policy import PolicyContext, PolicyError, apply_plan, plan_steps, validate_rule
+from workflow import WorkflowError, decide_batch, decide_step, reassign_steps
+from rollups import GROUP_BY_COLUMNS, query_spend, rebuild as rebuild_rollups, record_new
+from hierarchy import HierarchyError, add_user, ancestors, check_manager, descendants, is_in_subtree, move_user, remove_user, rebuild as rebuild_hierarchy
+import tenancy
+import versions
+from versions import bump, bump_directory, bump_expenses, conditional
+import events
+import archive
+import attachments
+import duplicates
+import fx_history
+from base_amounts import base_fields, rerate as rerate_expenses
+import synthetic
+from importer import IMPORT_FORMATS, ExpenseImporter, iter_rows
+from export import EXPORT_FORMATS, STEP_MODES, build_export_query, stream_csv, stream_ndjson
+from listing import apply_expense_filters, keyset_page, parse_expense_filters, parse_page_size
+import search
+import serializers
+import sla
+from serializers import EXPENSE_FIELDS, EXPENSE_INCLUDES, parse_fieldset, serialize_expenses, serialize_rows
 from datetime import datetime
-import requests
+from sqlalchemy import and_, or_
+from sqlalchemy.exc import IntegrityError
+from sqlalchemy.orm import aliased, contains_eager, joinedload, selectinload
+import csv
+import io
 import os
-import time # Imported for potential exponential backoff in currency fetch
 
 # --- App Initialization ---
-app = Flask(__name__)
-# Load configuration from config.py (Config is assumed to be imported from config.py)
-app.config.from_object(Config)
+# Routes and CLI commands live on the `api` blueprint and create_app() builds a
+# configured app around it, one per worker process (see wsgi.py). Building the
+# app never touches the database: the schema comes from `flask init-db` and the
+# demo data from `flask seed-db`.
+api = Blueprint('api', __name__, cli_group=None)
 
-# Initialize extensions
-db.init_app(app)
-CORS(app) # Enables communication with the React frontend
+# Shared FX rate cache: one upstream fetch per base currency per TTL window.
+# Tests can replace rate_cache.fetcher with a local stub.
+rate_cache = RateCache(
+    fetcher=lambda base: fetch_latest_rates(base, url_template=current_app.config['FX_API_URL'])
+)
+
+
+def create_app(config_object=Config):
+    """Application factory: configuration, extensions and the API blueprint."""
+    app = Flask(__name__)
+    app.config.from_object(config_object)
+
+    database.init_app(app, db)  # Engine options (pool / SQLite pragmas) come from config
+    metrics.init_app(app, db)  # First, so request timings include the other hooks
+    CORS(app) # Enables communication with the React frontend
+    tenancy.init_app(app)  # Scopes queries to the X-Company-Id tenant when one is sent
+    serializers.init_app(app)  # orjson responses when it is installed
+    versions.init_app(app)  # ETags / 304s on the list endpoints the frontend polls
+    events.init_app(app)  # Wakes approval queue streams (optionally across workers)
+    rate_cache.configure(ttl=app.config['FX_CACHE_TTL'], stale_ttl=app.config['FX_CACHE_STALE_TTL'],
+                         max_entries=app.config['FX_CACHE_MAX_ENTRIES'],
+                         failure_backoff=app.config['FX_CACHE_FAILURE_BACKOFF'])
+
+    app.register_blueprint(api)
+    return app
 
 # --- Data Seeding Function ---
 
 def seed_demo_data():
     """Create demo data for hackathon presentation with unique passwords."""
     
-    # NOTE: db.drop_all() and db.create_all() are run in the __main__ block
-    # to ensure they are executed once outside of the web request lifecycle.
+    # NOTE: The schema is created/upgraded by `flask init-db` (or the dev
+    # server's __main__ block); seeding only runs against an empty database.
     
     print("Seeding demo data...")
     
@@ -113,9 +166,11 @@ def seed_demo_data():
     
     # Create approval steps for all approvers (Admin, Manager 1, Manager 2)
     approver_ids_1 = [admin.id, manager1.id, manager2.id]
+    expense1.pending_step_count = len(approver_ids_1)
     for approver_id in approver_ids_1:
         step = ApprovalStep(
             expense_id=expense1.id,
+            company_id=company.id,
             approver_id=approver_id,
             sequence=1,
             status='Waiting'
@@ -138,9 +193,11 @@ def seed_demo_data():
     db.session.flush()
     
     approver_ids_2 = [admin.id, manager1.id, manager2.id]
+    expense2.pending_step_count = len(approver_ids_2)
     for approver_id in approver_ids_2:
         step = ApprovalStep(
             expense_id=expense2.id,
+            company_id=company.id,
             approver_id=approver_id,
             sequence=1,
             status='Waiting'
@@ -165,6 +222,7 @@ def seed_demo_data():
     # Only need to mark ONE step as approved if this was approved by one person
     step3 = ApprovalStep(
         expense_id=expense3.id,
+        company_id=company.id,
         approver_id=manager1.id,
         sequence=1,
         status='Approved',
@@ -172,47 +230,50 @@ def seed_demo_data():
         decided_at=datetime.utcnow()
     )
     db.session.add(step3)
+
+    # Fingerprints and base amounts, as submission stores them
+    for expense in (expense1, expense2, expense3):
+        expense.fingerprint = duplicates.fingerprint(
+            expense.user_id, expense.amount, expense.currency, expense.date, expense.title
+        )
+        base = base_fields(expense.amount, expense.currency, company.base_currency,
+                           get_exchange_rate(expense.currency, company.base_currency))
+        for column, value in base.items():
+            setattr(expense, column, value)
+
+    # --- Approval Policy ---
+    # Direct manager first; large expenses then need any one Finance approver.
+    finance = ApproverGroup(
+        name='Finance Approvers',
+        company_id=company.id,
+        members=[ApproverGroupMember(user_id=admin.id), ApproverGroupMember(user_id=manager2.id)]
+    )
+    db.session.add(finance)
+    db.session.flush()
+
+    db.session.add_all([
+        ApprovalRule(company_id=company.id, name='Direct manager', sequence=1,
+                     approver_type='direct_manager'),
+        ApprovalRule(company_id=company.id, name='Finance review over 500', sequence=2,
+                     min_amount=500, approver_type='group', group_id=finance.id, quorum=1)
+    ])
     
+    rebuild_hierarchy()
+    sla.backfill(db.session.connection(), current_app.config['APPROVAL_SLA_HOURS'])  # The waiting demo steps
     db.session.commit()
+    rebuild_rollups()
     print("Demo data seeded successfully!")
 
 
 # --- Utility Functions ---
 
 def get_exchange_rate(from_currency, to_currency):
-    """Fetches exchange rate using external API with exponential backoff."""
-    if from_currency == to_currency:
-        return 1.0
-    
-    # Use exponential backoff for professional error handling
-    for attempt in range(3):
-        try:
-            # API: https://api.exchangerate-api.com/v4/latest/{BASE_CURRENCY}
-            url = f"https://api.exchangerate-api.com/v4/latest/{from_currency}"
-            response = requests.get(url, timeout=5)
-            response.raise_for_status()
-            data = response.json()
-            
-            if to_currency in data['rates']:
-                rate = data['rates'].get(to_currency)
-                # Since the API often gives BASE_to_X, and we want X_to_BASE (USD),
-                # we return the rate so the client can calculate correctly.
-                return rate
-            else:
-                return None
-                
-        except requests.RequestException as e:
-            if attempt < 2:
-                print(f"API request failed (Attempt {attempt+1}): {e}. Retrying...")
-                time.sleep(2 ** attempt)
-            else:
-                print(f"Failed to get exchange rate after 3 attempts.")
-                return None
-    return None
+    """Returns the from -> to exchange rate, served from the shared rate cache."""
+    return rate_cache.get_rate(from_currency, to_currency)
 
 # ==================== API ENDPOINTS ====================
 
-@app.route('/api/auth/login', methods=['POST'])
+@api.route('/api/auth/login', methods=['POST'])
 def login():
     """Simple authentication endpoint for demo (using plaintext password check)"""
     data = request.json
@@ -234,7 +295,7 @@ def login():
     }), 200
 
 
-@app.route('/api/auth/register', methods=['POST'])
+@api.route('/api/auth/register', methods=['POST'])
 def register():
     """Register a new user (default to Employee)"""
     data = request.json
@@ -250,16 +311,29 @@ def register():
     if existing_user:
         return jsonify({'error': 'User with this email already exists'}), 400
     
+    # Join the requested company, or the first company for the demo sign-up form
+    company_id = data.get('company_id')
+    if company_id is not None:
+        if not isinstance(company_id, int) or Company.query.get(company_id) is None:
+            return jsonify({'error': 'Invalid company_id'}), 400
+    else:
+        company_id = db.session.query(Company.id).order_by(Company.id).limit(1).scalar()
+        if company_id is None:
+            return jsonify({'error': 'No company exists to register into'}), 400
+
     # Create new user (default to Employee role for demo)
     user = User(
         name=data['name'],
         email=data['email'],
         password=data['password'],
         role='Employee',
-        company_id=1  # Default to first company for demo
+        company_id=company_id
     )
     
     db.session.add(user)
+    db.session.flush()
+    add_user(user.id, None)
+    bump([company_id])
     db.session.commit()
     
     return jsonify({
@@ -269,39 +343,31 @@ def register():
 
 # --- ADMIN USER MANAGEMENT ENDPOINTS ---
 
-@app.route('/api/users', methods=['GET'])
+@api.route('/api/users', methods=['GET'])
+@conditional(versions.tenant_company_key)
 def get_all_users():
     """Get all users (for Admin User Management view)"""
-    users = User.query.all()
-    # Need to convert manager_id to manager_name for display
-    users_data = []
-    manager_map = {u.id: u.name for u in users if u.role in ['Manager', 'Admin']}
-
-    for user in users:
-        user_dict = user.to_dict()
-        user_dict['manager_name'] = manager_map.get(user.manager_id, 'N/A')
-        users_data.append(user_dict)
-
+    # One projected query, manager_name resolved by the join
     return jsonify({
         'success': True,
-        'users': users_data
+        'users': serialize_rows(serializers.user_list_projection().all(), serializers.USER_FIELDS)
     }), 200
 
 
-@app.route('/api/admin/users/create', methods=['POST'])
+@api.route('/api/admin/users/create', methods=['POST'])
 def create_user_by_admin():
     """Admin endpoint to create a new user (Employee or Manager)"""
     data = request.json
     
     required_fields = ['name', 'email', 'password', 'role', 'company_id']
     
-    # FIX: Explicitly read inputs as strings for robustness
-    name = data.get('name', type=str)
-    email = data.get('email', type=str)
-    password = data.get('password', type=str)
-    role = data.get('role', type=str)
-    company_id = data.get('company_id', type=int)
-    manager_id = data.get('manager_id', type=int)
+    # request.json is a plain dict, so read the values directly
+    name = data.get('name')
+    email = data.get('email')
+    password = data.get('password')
+    role = data.get('role')
+    company_id = data.get('company_id')
+    manager_id = data.get('manager_id')
 
     # Basic presence check
     if not all([name, email, password, role, company_id]):
@@ -329,6 +395,9 @@ def create_user_by_admin():
     )
 
     db.session.add(user)
+    db.session.flush()
+    add_user(user.id, manager_id)
+    bump([user.company_id])
     db.session.commit()
 
     return jsonify({
@@ -337,7 +406,7 @@ def create_user_by_admin():
     }), 201
 
 
-@app.route('/api/admin/users/<int:user_id>', methods=['PUT'])
+@api.route('/api/admin/users/<int:user_id>', methods=['PUT'])
 def update_user_by_admin(user_id):
     """Admin endpoint to update user details (role, manager, name)"""
     data = request.json
@@ -348,10 +417,10 @@ def update_user_by_admin(user_id):
 
     # Update fields if present in data
     if 'name' in data:
-        user.name = data.get('name', type=str)
+        user.name = data.get('name')
     
     if 'email' in data:
-        new_email = data.get('email', type=str)
+        new_email = data.get('email')
         # Check if new email is unique (excluding self)
         if User.query.filter(User.email == new_email, User.id != user_id).first():
              return jsonify({'error': 'Email already in use'}), 400
@@ -361,18 +430,25 @@ def update_user_by_admin(user_id):
         user.role = data['role']
     
     if 'manager_id' in data:
-        manager_id = data.get('manager_id', type=int)
+        manager_id = data.get('manager_id')
         if manager_id is not None:
             # Check if manager is valid
             manager = User.query.get(manager_id)
             if not manager or manager.role not in ['Manager', 'Admin']:
                 return jsonify({'error': 'Invalid manager_id provided'}), 400
-        user.manager_id = manager_id
+        if manager_id != user.manager_id:
+            try:
+                check_manager(user.id, manager_id)
+            except HierarchyError as e:
+                return jsonify({'error': str(e)}), 400
+            move_user(user.id, manager_id)
+            user.manager_id = manager_id
     
     if 'password' in data and data['password']:
          # WARNING: plaintext update
-        user.password = data.get('password', type=str)
+        user.password = data['password']
 
+    bump_directory(user.company_id)
     db.session.commit()
 
     return jsonify({
@@ -381,7 +457,7 @@ def update_user_by_admin(user_id):
     }), 200
 
 
-@app.route('/api/admin/users/<int:user_id>', methods=['DELETE'])
+@api.route('/api/admin/users/<int:user_id>', methods=['DELETE'])
 def delete_user_by_admin(user_id):
     """Admin endpoint to delete a user"""
     user = User.query.get(user_id)
@@ -392,14 +468,25 @@ def delete_user_by_admin(user_id):
     if user.role == 'Admin' and User.query.filter_by(role='Admin').count() == 1:
         return jsonify({'error': 'Cannot delete the last Admin user'}), 400
 
-    # Before deletion, reassign direct reports to the Admin (id=1) for safety
-    admin_user = User.query.filter_by(role='Admin').first()
-    if admin_user:
-        User.query.filter_by(manager_id=user_id).update({'manager_id': admin_user.id})
+    # Before deletion, move the whole reporting subtree under an Admin of the
+    # company who does not report to this user (or to the top if there is none)
+    admin_ids = [row.id for row in db.session.query(User.id).filter(
+        User.company_id == user.company_id, User.role == 'Admin', User.id != user_id
+    ).order_by(User.id)]
+    new_manager_id = next((a for a in admin_ids if not is_in_subtree(a, user_id)), None)
+    remove_user(user_id, new_manager_id)
+
+    # Their Waiting steps go to the same Admin (or another one), so no expense is
+    # left waiting on an approver who no longer exists
+    reassign_steps(user_id, [new_manager_id] + admin_ids)
+
+    # Drop the user from any approver pools
+    ApproverGroupMember.query.filter_by(user_id=user_id).delete(synchronize_session=False)
     
     # Cascade deletes should handle ApprovalSteps and Expenses submitted by this user
     # (Expense model cascade ensures ApprovalSteps are deleted, but submitted expenses remain)
     
+    bump_directory(user.company_id)
     db.session.delete(user)
     db.session.commit()
 
@@ -408,9 +495,185 @@ def delete_user_by_admin(user_id):
         'message': f'User {user_id} deleted successfully.'
     }), 200
 
+
+@api.route('/api/users/<int:user_id>/reports', methods=['GET'])
+def get_reporting_subtree(user_id):
+    """Everyone who reports to a user, directly or indirectly, with their depth below them.
+
+    `max_depth=1` limits the list to direct reports.
+    """
+    user = User.query.get(user_id)
+    if not user:
+        return jsonify({'error': 'User not found'}), 404
+
+    max_depth = request.args.get('max_depth', type=int)
+    reports = descendants(user_id, max_depth=max_depth)
+    return jsonify({
+        'success': True,
+        'user': user.to_dict(),
+        'reports': [{**report.to_dict(), 'depth': depth} for report, depth in reports]
+    }), 200
+
+
+@api.route('/api/users/<int:user_id>/chain', methods=['GET'])
+def get_manager_chain(user_id):
+    """The user's managers from the direct manager up to the top of the tree."""
+    user = User.query.get(user_id)
+    if not user:
+        return jsonify({'error': 'User not found'}), 404
+
+    chain = ancestors(user_id)
+    return jsonify({
+        'success': True,
+        'user': user.to_dict(),
+        'depth': len(chain),
+        'chain': [{**manager.to_dict(), 'depth': depth} for manager, depth in chain]
+    }), 200
+
 # --- END ADMIN USER MANAGEMENT ENDPOINTS ---
 
-@app.route('/api/expenses', methods=['POST'])
+# --- APPROVAL POLICY ENDPOINTS ---
+
+@api.route('/api/admin/policies/<int:company_id>', methods=['GET'])
+def get_approval_policy(company_id):
+    """Get a company's approval rules and approver groups"""
+    rules = ApprovalRule.query.filter_by(company_id=company_id).order_by(ApprovalRule.sequence, ApprovalRule.id).all()
+    groups = ApproverGroup.query.filter_by(company_id=company_id).options(selectinload(ApproverGroup.members)).all()
+
+    return jsonify({
+        'success': True,
+        'rules': [rule.to_dict() for rule in rules],
+        'groups': [group.to_dict() for group in groups]
+    }), 200
+
+
+def _check_rule_targets(company_id, fields):
+    """Ensures a rule's approver user/group belong to the company."""
+    if fields['approver_user_id']:
+        approver = db.session.get(User, fields['approver_user_id'])
+        if not approver or approver.company_id != company_id:
+            raise PolicyError('Invalid approver_user_id provided')
+    if fields['group_id']:
+        group = db.session.get(ApproverGroup, fields['group_id'])
+        if not group or group.company_id != company_id:
+            raise PolicyError('Invalid group_id provided')
+
+
+@api.route('/api/admin/policies/<int:company_id>/rules', methods=['POST'])
+def create_approval_rule(company_id):
+    """Add a rule to a company's approval policy"""
+    try:
+        fields = validate_rule(request.json or {})
+        _check_rule_targets(company_id, fields)
+    except PolicyError as e:
+        return jsonify({'error': str(e)}), 400
+
+    rule = ApprovalRule(company_id=company_id, **fields)
+    db.session.add(rule)
+    db.session.commit()
+
+    return jsonify({
+        'success': True,
+        'rule': rule.to_dict()
+    }), 201
+
+
+@api.route('/api/admin/policies/rules/<int:rule_id>', methods=['PUT'])
+def update_approval_rule(rule_id):
+    """Replace an approval rule's conditions and approvers"""
+    rule = db.session.get(ApprovalRule, rule_id)
+    if not rule:
+        return jsonify({'error': 'Rule not found'}), 404
+
+    try:
+        fields = validate_rule({**rule.to_dict(), **(request.json or {})})
+        _check_rule_targets(rule.company_id, fields)
+    except PolicyError as e:
+        return jsonify({'error': str(e)}), 400
+
+    for key, value in fields.items():
+        setattr(rule, key, value)
+    db.session.commit()
+
+    return jsonify({
+        'success': True,
+        'rule': rule.to_dict()
+    }), 200
+
+
+@api.route('/api/admin/policies/rules/<int:rule_id>', methods=['DELETE'])
+def delete_approval_rule(rule_id):
+    """Deactivate an approval rule (existing steps keep their rule reference)"""
+    rule = db.session.get(ApprovalRule, rule_id)
+    if not rule:
+        return jsonify({'error': 'Rule not found'}), 404
+
+    rule.is_active = False
+    db.session.commit()
+
+    return jsonify({
+        'success': True,
+        'message': f'Rule {rule_id} deactivated.'
+    }), 200
+
+
+def _set_group_members(group, member_ids):
+    members = User.query.filter(User.id.in_(member_ids), User.company_id == group.company_id).all() if member_ids else []
+    if len(members) != len(set(member_ids)):
+        raise PolicyError('member_ids must be users of the same company')
+    group.members = [ApproverGroupMember(user_id=m.id) for m in members]
+
+
+@api.route('/api/admin/approver-groups', methods=['POST'])
+def create_approver_group():
+    """Create a shared approver pool"""
+    data = request.json or {}
+    if not data.get('name') or not data.get('company_id'):
+        return jsonify({'error': 'Missing required fields (name, company_id)'}), 400
+
+    group = ApproverGroup(name=data['name'], company_id=data['company_id'])
+    try:
+        _set_group_members(group, data.get('member_ids', []))
+    except PolicyError as e:
+        return jsonify({'error': str(e)}), 400
+
+    db.session.add(group)
+    bump([group.company_id])
+    db.session.commit()
+
+    return jsonify({
+        'success': True,
+        'group': group.to_dict()
+    }), 201
+
+
+@api.route('/api/admin/approver-groups/<int:group_id>', methods=['PUT'])
+def update_approver_group(group_id):
+    """Rename an approver pool or replace its members"""
+    group = db.session.get(ApproverGroup, group_id)
+    if not group:
+        return jsonify({'error': 'Group not found'}), 404
+
+    data = request.json or {}
+    if data.get('name'):
+        group.name = data['name']
+    if 'member_ids' in data:
+        try:
+            _set_group_members(group, data['member_ids'])
+        except PolicyError as e:
+            return jsonify({'error': str(e)}), 400
+
+    bump_directory(group.company_id)
+    db.session.commit()
+
+    return jsonify({
+        'success': True,
+        'group': group.to_dict()
+    }), 200
+
+# --- END APPROVAL POLICY ENDPOINTS ---
+
+@api.route('/api/expenses', methods=['POST'])
 def submit_expense():
     """Submit a new expense and initialize approval workflow"""
     data = request.json
@@ -436,91 +699,193 @@ def submit_expense():
     except (ValueError, TypeError):
         date_obj = datetime.utcnow().date()
 
+    # An Idempotency-Key makes retries of the same submission safe: the first
+    # request creates the expense, repeats get it back instead of a copy
+    idempotency_key = request.headers.get('Idempotency-Key') or data.get('idempotency_key')
+    if idempotency_key is not None:
+        idempotency_key = str(idempotency_key).strip()
+        if not idempotency_key or len(idempotency_key) > 100:
+            return jsonify({'error': 'Idempotency key must be 1 to 100 characters'}), 400
+
+    amount = float(data['amount'])
+    fingerprint = duplicates.fingerprint(user.id, amount, data['currency'], date_obj, data['title'])
+    if idempotency_key:
+        replay = idempotent_replay(user.id, idempotency_key, fingerprint)
+        if replay is not None:
+            return replay
+
+    # The same expense twice (double clicks, retries without a key) is refused
+    # unless the client confirms it; similar ones are only pointed out
+    if not data.get('allow_duplicate'):
+        duplicate_of = duplicates.find_exact(user.id, fingerprint)
+        if duplicate_of is not None:
+            return jsonify({
+                'error': 'Duplicate expense: resubmit with allow_duplicate to keep both',
+                'duplicate_of': duplicate_of
+            }), 409
+    possible_duplicates = duplicates.near_duplicates(
+        user.id, data['currency'], amount, date_obj,
+        current_app.config['DUPLICATE_WINDOW_DAYS'], current_app.config['DUPLICATE_AMOUNT_TOLERANCE']
+    )
+
+    # Fix the amount in the company base currency now, so reads never need FX lookups
+    company = db.session.get(Company, user.company_id)
+    base_currency = (company.base_currency if company else None) or current_app.config['COMPANY_BASE_CURRENCY']
+    base = base_fields(amount, data['currency'], base_currency,
+                       get_exchange_rate(data['currency'], base_currency))
+
     expense = Expense(
         user_id=data['user_id'],
         company_id=user.company_id,
         title=data['title'],
         description=data.get('description', ''),
-        amount=float(data['amount']),
+        amount=amount,
         currency=data['currency'],
         category=data.get('category', 'Other'),
         date=date_obj,
-        status='Pending'
+        status='Pending',
+        fingerprint=fingerprint,
+        idempotency_key=idempotency_key or None,
+        **base
     )
     
     db.session.add(expense)
-    db.session.flush()  # Get expense.id
-
-    # FIX: Determine all approvers (Direct Manager + all other Managers/Admins)
-    approver_ids = set()
-    
-    # 1. Add Direct Manager (if exists)
-    if user.manager_id:
-        approver_ids.add(user.manager_id)
-
-    # 2. Add all other Managers and Admins (excluding the submitter)
-    all_managers_and_admins = User.query.filter(
-        (User.role == 'Manager') | (User.role == 'Admin'),
-        User.id != user.id
-    ).all()
-    
-    for approver in all_managers_and_admins:
-        approver_ids.add(approver.id)
-
-    # Create approval steps for all identified approvers
-    if approver_ids:
-        for approver_id in approver_ids:
-            first_step = ApprovalStep(
-                expense_id=expense.id,
-                approver_id=approver_id,
-                sequence=1, # All initial approvals are parallel (sequence 1)
-                status='Waiting'
-            )
-            db.session.add(first_step)
-        
-        expense.status = 'Pending' # Explicitly set to Pending if approval steps were created
-    else:
-        # If no manager/admin exists, auto-approve
-        expense.status = 'Approved'
+    try:
+        db.session.flush()  # Get expense.id
+    except IntegrityError:
+        # A concurrent request with the same key got there first
+        db.session.rollback()
+        if idempotency_key:
+            replay = idempotent_replay(user.id, idempotency_key, fingerprint)
+            if replay is not None:
+                return replay
+        raise
+
+    # Create only the approval steps the company's policy requires
+    # Policy thresholds are in the base currency; unrated expenses fall back to the raw amount
+    policy = PolicyContext(user.company_id)
+    policy_amount = expense.base_amount if expense.base_amount is not None else expense.amount
+    steps = plan_steps(policy, user.id, user.manager_id, policy_amount, expense.category)
+    apply_plan(expense, steps)
+    record_new([expense])
+    bump_expenses([expense])
+    db.session.flush()  # Step ids for the queue events
+    events.track().record([expense.id])
     
     db.session.commit()
     
     return jsonify({
         'success': True,
-        'expense': expense.to_dict(include_steps=True)
+        'expense': expense.to_dict(include_steps=True),
+        'possible_duplicates': possible_duplicates
     }), 201
 
 
-@app.route('/api/approvals/<int:user_id>', methods=['GET'])
+def idempotent_replay(user_id, idempotency_key, fingerprint):
+    """The response to a repeated submission, or None if the user has not used this key."""
+    existing = duplicates.find_by_idempotency_key(user_id, idempotency_key)
+    if existing is None:
+        return None
+    if existing.fingerprint != fingerprint:
+        return jsonify({
+            'error': 'Idempotency key already used for a different expense',
+            'expense_id': existing.id
+        }), 409
+    expense = db.session.get(Expense, existing.id) or db.session.get(ArchivedExpense, existing.id)
+    return jsonify({
+        'success': True,
+        'idempotent_replay': True,
+        'expense': expense.to_dict(include_steps=True)
+    }), 200
+
+
+@api.route('/api/expenses/import', methods=['POST'])
+def import_expenses():
+    """Bulk import expenses from a streamed CSV or NDJSON upload.
+
+    Send the file as multipart field `file` or as the raw request body. The format
+    comes from `?format=csv|ndjson`, else the file extension or Content-Type.
+    Rows duplicating a stored expense are skipped unless `?allow_duplicates=1`.
+    """
+    upload = request.files.get('file')
+    fmt = request.args.get('format')
+    if not fmt:
+        hint = upload.filename if upload else request.content_type or ''
+        fmt = 'ndjson' if ('ndjson' in hint or 'jsonl' in hint) else 'csv'
+    if fmt not in IMPORT_FORMATS:
+        return jsonify({'error': f'Unsupported format: must be one of {", ".join(IMPORT_FORMATS)}'}), 400
+
+    stream = upload.stream if upload else io.BufferedReader(request.stream)
+    importer = ExpenseImporter(
+        batch_size=current_app.config['IMPORT_BATCH_SIZE'],
+        max_errors=current_app.config['IMPORT_MAX_ERRORS'],
+        rate_lookup=get_exchange_rate,
+        default_base_currency=current_app.config['COMPANY_BASE_CURRENCY'],
+        allow_duplicates=request.args.get('allow_duplicates', '').lower() in ('1', 'true')
+    )
+    report = importer.run(iter_rows(stream, fmt))
+
+    return jsonify({
+        'success': report.failed == 0,
+        **report.to_dict()
+    }), 200
+
+
+def approval_queue_version_keys(user_id):
+    # Queues change with any submission, decision or group change in the approver's company
+    company_id = db.session.query(User.company_id).filter(User.id == user_id).scalar()
+    return [(versions.COMPANY, company_id)] if company_id is not None else None
+
+
+@api.route('/api/approvals/<int:user_id>', methods=['GET'])
+@conditional(approval_queue_version_keys)
 def get_approval_queue(user_id):
     """Get expenses waiting for this user's approval"""
     
-    # Find all approval steps where this user is the approver and status is 'Waiting'
-    # NOTE: Since all initial steps are Sequence 1, the sequential check logic below is mainly for future expansion (Sequence 2, 3, etc.)
-    waiting_steps = ApprovalStep.query.filter_by(
-        approver_id=user_id,
-        status='Waiting'
-    ).all()
-    
-    # Build response with expense details
+    # Sequential gating as one set-based predicate: a Waiting step is actionable
+    # only if no earlier step on the same expense is still un-approved.
+    earlier = aliased(ApprovalStep)
+    preceding_step_pending = db.session.query(earlier.id).filter(
+        earlier.expense_id == ApprovalStep.expense_id,
+        earlier.sequence < ApprovalStep.sequence,
+        earlier.status != 'Approved'
+    ).exists()
+
+    # Expense + submitter are joined in, sibling steps + approvers are batch
+    # loaded, so the queue costs a fixed number of queries however long it is.
+    # Group steps reach every member of the pool who has not voted yet
+    member_groups = db.session.query(ApproverGroupMember.group_id).filter(
+        ApproverGroupMember.user_id == user_id
+    )
+    already_voted = db.session.query(ApprovalVote.step_id).filter(
+        ApprovalVote.step_id == ApprovalStep.id,
+        ApprovalVote.user_id == user_id
+    ).exists()
+
+    waiting_steps = ApprovalStep.query.join(ApprovalStep.expense).filter(
+        ApprovalStep.status == 'Waiting',
+        or_(
+            ApprovalStep.approver_id == user_id,
+            and_(
+                ApprovalStep.group_id.in_(member_groups),
+                Expense.user_id != user_id,
+                ~already_voted
+            )
+        ),
+        ~preceding_step_pending
+    ).options(
+        contains_eager(ApprovalStep.expense).joinedload(Expense.submitter),
+        contains_eager(ApprovalStep.expense)
+            .selectinload(Expense.approval_steps)
+            .options(joinedload(ApprovalStep.approver), joinedload(ApprovalStep.group))
+    ).order_by(ApprovalStep.id).all()
+
     approval_queue = []
     for step in waiting_steps:
-        # Before adding, check if there is an earlier step that is NOT approved/rejected (Sequential Check)
-        # This checks if a *preceding* step in the sequence is still pending.
-        # Since we only use sequence=1 currently, this check is bypassed.
-        preceding_step_pending = ApprovalStep.query.filter(
-            ApprovalStep.expense_id == step.expense_id,
-            ApprovalStep.sequence < step.sequence,
-            ApprovalStep.status != 'Approved'
-        ).first()
-
-        # Only add to queue if this is the first step OR the preceding step has been approved.
-        if not preceding_step_pending:
-            expense_data = step.expense.to_dict(include_steps=True) # Ensure steps are included for frontend grouping
-            expense_data['approval_step_id'] = step.id
-            expense_data['approval_sequence'] = step.sequence
-            
-            approval_queue.append(expense_data)
+        expense_data = step.expense.to_dict(include_steps=True) # Ensure steps are included for frontend grouping
+        expense_data['approval_step_id'] = step.id
+        expense_data['approval_sequence'] = step.sequence
+        approval_queue.append(expense_data)
     
     return jsonify({
         'success': True,
@@ -528,9 +893,34 @@ def get_approval_queue(user_id):
     }), 200
 
 
-@app.route('/api/approvals/<int:step_id>', methods=['PUT'])
+@api.route('/api/approvals/<int:user_id>/events', methods=['GET'])
+def stream_approval_events(user_id):
+    """Server-Sent Events stream of changes to this user's approval queue.
+
+    Resumes after the Last-Event-ID header (browsers send it on reconnect) or
+    ?last_event_id=. Event types: step_created, step_decided, expense_finalized,
+    plus `ready` (new stream) and `resync` (reload the queue; events were pruned).
+    """
+    if db.session.get(User, user_id) is None:
+        return jsonify({'error': 'User not found'}), 404
+
+    raw = request.headers.get('Last-Event-ID') or request.args.get('last_event_id')
+    try:
+        last_event_id = int(raw) if raw else None
+    except ValueError:
+        return jsonify({'error': 'Last-Event-ID must be an event id'}), 400
+
+    return Response(
+        stream_with_context(events.stream(user_id, last_event_id)),
+        mimetype='text/event-stream',
+        # No caching, and no proxy buffering of the stream
+        headers={'Cache-Control': 'no-cache', 'X-Accel-Buffering': 'no'}
+    )
+
+
+@api.route('/api/approvals/<int:step_id>', methods=['PUT'])
 def process_approval(step_id):
-    """Approve or reject an approval step with parallel/sequential logic"""
+    """Approve or reject an approval step (group steps count towards their quorum)"""
     data = request.json
     decision = data.get('decision')  # 'approved' or 'rejected'
     comments = data.get('comments', '')
@@ -543,40 +933,11 @@ def process_approval(step_id):
     if not step:
         return jsonify({'error': 'Approval step not found'}), 404
     
-    if step.status != 'Waiting':
-        return jsonify({'error': 'This approval has already been processed'}), 400
-    
-    # Update the current step
-    step.status = 'Approved' if decision == 'approved' else 'Rejected'
-    step.comments = comments
-    step.decided_at = datetime.utcnow()
-    
-    expense = step.expense
-    
-    if decision == 'rejected':
-        # If rejected, set entire expense to rejected and terminate workflow
-        # Mark ALL waiting steps for this expense as rejected/skipped.
-        expense.status = 'Rejected'
-        ApprovalStep.query.filter_by(
-            expense_id=expense.id,
-            status='Waiting'
-        ).update({'status': 'Skipped', 'comments': 'Rejected by another approver'}, synchronize_session=False)
-    else:
-        # If approved (parallel approval at Sequence 1)
-        
-        # Check if ALL other sequence 1 steps for this expense are now approved or already rejected/skipped
-        all_sequence_1_steps = ApprovalStep.query.filter_by(
-            expense_id=expense.id,
-            sequence=1
-        ).all()
-        
-        is_fully_approved_at_seq_1 = all(
-            s.status in ('Approved', 'Skipped') for s in all_sequence_1_steps
-        )
-        
-        if is_fully_approved_at_seq_1:
-            # All Sequence 1 managers/admins have acted. Finalize approval.
-            expense.status = 'Approved'
+    try:
+        expense = decide_step(step, decision, comments, data.get('approver_id'))
+    except WorkflowError as e:
+        db.session.rollback()
+        return jsonify({'error': e.message}), e.status_code
 
     db.session.commit()
     
@@ -586,17 +947,70 @@ def process_approval(step_id):
     }), 200
 
 
-@app.route('/api/utility/currency', methods=['GET'])
+@api.route('/api/approvals/batch', methods=['POST'])
+def process_approval_batch():
+    """Approve/reject many steps for one approver in a single transaction.
+
+    Body: {"approver_id": 2, "atomic": false,
+           "decisions": [{"step_id": 1, "decision": "approved", "comments": ""}, ...]}
+    Each item gets its own result. By default valid items are applied and invalid
+    ones are reported; with "atomic": true any invalid item means nothing is applied.
+    """
+    data = request.json or {}
+    approver_id = data.get('approver_id')
+    decisions = data.get('decisions')
+
+    if not isinstance(approver_id, int):
+        return jsonify({'error': 'approver_id is required'}), 400
+    if not isinstance(decisions, list) or not decisions:
+        return jsonify({'error': 'decisions must be a non-empty list'}), 400
+    if len(decisions) > current_app.config['MAX_BATCH_DECISIONS']:
+        return jsonify({'error': f'At most {current_app.config["MAX_BATCH_DECISIONS"]} decisions per batch'}), 400
+    if not all(isinstance(item, dict) for item in decisions):
+        return jsonify({'error': 'Each decision must be an object'}), 400
+
+    results, applied = decide_batch(approver_id, decisions, atomic=bool(data.get('atomic')))
+    if applied:
+        db.session.commit()
+    else:
+        db.session.rollback()
+
+    succeeded = sum(1 for r in results if r.get('ok'))
+    return jsonify({
+        'success': succeeded == len(results),
+        'applied': succeeded,
+        'failed': len(results) - succeeded,
+        'results': results
+    }), 200
+
+
+def historical_rate_matrix():
+    return fx_history.rate_matrix(current_app.config['FX_HISTORY_BASE'], current_app.config['FX_HISTORY_FILL_DAYS'])
+
+
+@api.route('/api/utility/currency', methods=['GET'])
 def convert_currency():
-    """Convert currency using external API"""
+    """Convert currency using external API, or the stored history with `date=YYYY-MM-DD`"""
     from_currency = request.args.get('from')
     to_currency = request.args.get('to')
     amount = request.args.get('amount', type=float)
+    on_date = request.args.get('date')
 
     if not all([from_currency, to_currency, amount]):
         return jsonify({'success': False, 'error': 'Missing parameters: from, to, amount'}), 400
     
-    rate = get_exchange_rate(from_currency, to_currency)
+    if on_date:
+        try:
+            _, rates = historical_rate_matrix().convert([amount], [from_currency.upper()], [on_date],
+                                                        to_currency.upper())
+        except ValueError as e:
+            return jsonify({'success': False, 'error': str(e)}), 400
+        rate = rates[0]
+        if rate is None:
+            return jsonify({'success': False, 'error': f'No stored rate for {from_currency} to {to_currency} '
+                                                       f'on {on_date}'}), 404
+    else:
+        rate = get_exchange_rate(from_currency, to_currency)
     
     if rate is not None:
         # Conversion Formula: Converted Amount = Original Amount * Rate
@@ -614,10 +1028,40 @@ def convert_currency():
     return jsonify({'success': False, 'error': f'Currency conversion failed for {from_currency} to {to_currency}'}), 500
 
 
-@app.route('/api/expenses/<int:expense_id>', methods=['GET'])
+@api.route('/api/utility/currency/batch', methods=['POST'])
+def convert_currency_batch():
+    """Convert many amounts, each at the stored rate for its own date, in one pass.
+
+    Body: {"to": "EUR", "amounts": [...], "currencies": [...], "dates": [...]}
+    or {"to": "EUR", "items": [[amount, currency, date], ...]}. Results are in
+    request order; items without a stored rate get null.
+    """
+    data = request.get_json(silent=True)
+    if not isinstance(data, dict):
+        return jsonify({'success': False, 'error': 'Expected a JSON object'}), 400
+    to_currency = str(data.get('to') or '').upper()
+    if len(to_currency) != 3:
+        return jsonify({'success': False, 'error': 'Missing or invalid target currency: to'}), 400
+
+    try:
+        amounts, currencies, dates = fx_history.parse_batch(data, current_app.config['FX_BATCH_MAX_ITEMS'])
+        converted, rates = historical_rate_matrix().convert(amounts, currencies, dates, to_currency)
+    except ValueError as e:
+        return jsonify({'success': False, 'error': str(e)}), 400
+
+    return jsonify({
+        'success': True,
+        'to_currency': to_currency,
+        'converted_amounts': converted,
+        'rates': rates,
+        'missing': sum(rate is None for rate in rates)
+    }), 200
+
+
+@api.route('/api/expenses/<int:expense_id>', methods=['GET'])
 def get_expense_details(expense_id):
-    """Get detailed information about a specific expense"""
-    expense = Expense.query.get(expense_id)
+    """Get detailed information about a specific expense (live or archived)"""
+    expense = Expense.query.get(expense_id) or ArchivedExpense.query.get(expense_id)
     
     if not expense:
         return jsonify({'success': False, 'error': 'Expense not found'}), 404
@@ -628,44 +1072,354 @@ def get_expense_details(expense_id):
     }), 200
 
 
-@app.route('/api/expenses/history/<int:user_id>', methods=['GET'])
-def get_user_expense_history(user_id):
-    """Get expense history for a specific user"""
-    expenses = Expense.query.filter_by(user_id=user_id).order_by(Expense.submitted_at.desc()).all()
-    
+# --- Receipt Attachments ---
+
+def attachment_root():
+    return current_app.config['ATTACHMENT_DIR'] or os.path.join(current_app.instance_path, 'attachments')
+
+
+@api.route('/api/expenses/<int:expense_id>/attachments', methods=['POST'])
+def upload_attachment(expense_id):
+    """Attach a receipt to an expense (live or archived).
+
+    Send the file as the raw request body, named with `?filename=`: it is
+    streamed to disk as it arrives. Multipart field `file` also works, but the
+    form parser spools it to a temporary file first. `?user_id=` records the
+    uploader. Identical files are stored once.
+    """
+    expense = Expense.query.get(expense_id) or ArchivedExpense.query.get(expense_id)
+    if not expense:
+        return jsonify({'error': 'Expense not found'}), 404
+
+    max_bytes = current_app.config['ATTACHMENT_MAX_BYTES']
+    upload = None
+    if request.mimetype == 'multipart/form-data':
+        # Boundaries and part headers come on top of the file itself
+        if (request.content_length or 0) > max_bytes + 64 * 1024:
+            return jsonify({'error': f'File too large: at most {max_bytes} bytes'}), 413
+        upload = request.files.get('file')
+        if upload is None:
+            return jsonify({'error': 'Missing multipart field: file'}), 400
+    elif (request.content_length or 0) > max_bytes:
+        return jsonify({'error': f'File too large: at most {max_bytes} bytes'}), 413
+
+    try:
+        attachment, created = attachments.attach(
+            expense,
+            upload.stream if upload else request.stream,
+            upload.filename if upload else request.args.get('filename'),
+            attachment_root(),
+            max_bytes,
+            current_app.config['ATTACHMENT_CHUNK_SIZE'],
+            uploaded_by=request.args.get('user_id', type=int)
+        )
+    except attachments.AttachmentError as e:
+        db.session.rollback()
+        return jsonify({'error': e.message}), e.status_code
+    db.session.commit()
+
+    return jsonify({
+        'success': True,
+        'attachment': attachment.to_dict(),
+        'deduplicated': not created
+    }), 201
+
+
+@api.route('/api/expenses/<int:expense_id>/attachments', methods=['GET'])
+def list_attachments(expense_id):
+    """List the receipts attached to an expense (live or archived)"""
+    if not (Expense.query.get(expense_id) or ArchivedExpense.query.get(expense_id)):
+        return jsonify({'error': 'Expense not found'}), 404
+    rows =Attachment.query.filter(Attachment.expense_id == expense_id).order_by(Attachment.id).all()
+    return jsonify({
+        'success': True,
+        'attachments': [attachment.to_dict() for attachment in rows]
+    }), 200
+
+
+@api.route('/api/attachments/<int:attachment_id>', methods=['GET'])
+def get_attachment(attachment_id):
+    """Attachment details; image dimensions are read on first request and kept"""
+    attachment = Attachment.query.get(attachment_id)
+    if not attachment:
+        return jsonify({'error': 'Attachment not found'}), 404
+    attachments.describe(attachment.stored_file, attachment_root())
     return jsonify({
         'success': True,
-        'expenses': [exp.to_dict(include_steps=True) for exp in expenses]
+        'attachment': attachment.to_dict()
     }), 200
 
 
-@app.route('/api/expenses/all', methods=['GET'])
+def send_stored_file(path, mimetype, etag, download_name=None, as_attachment=False):
+    """A file response for content that never changes: Range and conditional requests, private caching."""
+    response = send_file(path, mimetype=mimetype, as_attachment=as_attachment, download_name=download_name,
+                         conditional=True, etag=etag, max_age=current_app.config['ATTACHMENT_CACHE_SECONDS'])
+    response.cache_control.public = False
+    response.cache_control.private = True
+    response.cache_control.immutable = True
+    response.headers['X-Content-Type-Options'] = 'nosniff'
+    return response
+
+
+@api.route('/api/attachments/<int:attachment_id>/content', methods=['GET'])
+def download_attachment(attachment_id):
+    """Download a receipt (inline unless `?download=1`); supports Range and If-None-Match"""
+    attachment = Attachment.query.get(attachment_id)
+    if not attachment:
+        return jsonify({'error': 'Attachment not found'}), 404
+    path = attachments.body_path(attachment_root(), attachment.sha256)
+    if not os.path.exists(path):
+        return jsonify({'error': 'Attachment content is missing'}), 404
+    return send_stored_file(path, attachment.stored_file.content_type, attachment.sha256,
+                            download_name=attachment.filename,
+                            as_attachment=request.args.get('download', '').lower() in ('1', 'true'))
+
+
+@api.route('/api/attachments/<int:attachment_id>/thumbnail', methods=['GET'])
+def attachment_thumbnail(attachment_id):
+    """JPEG thumbnail of an image receipt (`?size=` on the long side), made on first request and kept"""
+    attachment = Attachment.query.get(attachment_id)
+    if not attachment:
+        return jsonify({'error': 'Attachment not found'}), 404
+    sizes = current_app.config['ATTACHMENT_THUMBNAIL_SIZES']
+    size = request.args.get('size', current_app.config['ATTACHMENT_THUMBNAIL_SIZE'], type=int)
+    if size not in sizes:
+        return jsonify({'error': f'Invalid size: must be one of {", ".join(map(str, sizes))}'}), 400
+    try:
+        path = attachments.ensure_thumbnail(attachment.stored_file, attachment_root(), size)
+    except attachments.AttachmentError as e:
+        return jsonify({'error': e.message}), e.status_code
+    return send_stored_file(path, 'image/jpeg', f'{attachment.sha256}-{size}')
+
+
+@api.route('/api/attachments/<int:attachment_id>', methods=['DELETE'])
+def delete_attachment(attachment_id):
+    """Remove a receipt from its expense (the stored file goes with `flask prune-attachments`)"""
+    attachment = Attachment.query.get(attachment_id)
+    if not attachment:
+        return jsonify({'error': 'Attachment not found'}), 404
+    db.session.delete(attachment)
+    db.session.commit()
+    return jsonify({'success': True}), 200
+
+
+def paginated_expense_response(user_id=None, default_per_page=20):
+    """Applies filters, fieldsets and keyset pagination from request args and builds the JSON body.
+
+    Lists live and archived expenses together (see archive.py). Rows come from
+    a column projection (see serializers.py); `fields=` limits the expense
+    fields and `include=` the nested collections (default: approval_steps).
+    """
+    try:
+        if 'page' in request.args:
+            # Offset pages are gone; failing beats silently serving page 1 again
+            raise ValueError('page is no longer supported: pass the previous response\'s next_cursor as cursor')
+        fields, includes = parse_fieldset(request.args, EXPENSE_FIELDS, EXPENSE_INCLUDES, ['approval_steps'])
+        filters = parse_expense_filters(request.args)
+        per_page = parse_page_size(request.args, default_per_page, current_app.config['MAX_PAGE_SIZE'])
+
+        def build_query(model):
+            query = serializers.expense_list_projection(fields, model)
+            if user_id is not None:
+                query = query.filter(model.user_id == user_id)
+            return apply_expense_filters(query, filters, model)
+
+        rows, next_cursor, archived_ids = archive.keyset_page_with_archive(
+            build_query, per_page, request.args.get('cursor')
+        )
+    except ValueError as e:
+        return jsonify({'success': False, 'error': str(e)}), 400
+
+    body = {
+        'success': True,
+        'expenses': serialize_expenses(rows, fields, includes, archived_ids),
+        'per_page': per_page,
+        'next_cursor': next_cursor
+    }
+    # COUNT(*) is only run when the client asks for it
+    if request.args.get('include_total', '').lower() in ('1', 'true'):
+        body['total'] = sum(build_query(model).order_by(None).count() for model in (Expense, ArchivedExpense))
+
+    return jsonify(body), 200
+
+
+@api.route('/api/expenses/history/<int:user_id>', methods=['GET'])
+@conditional(lambda user_id: [(versions.USER, user_id)])
+def get_user_expense_history(user_id):
+    """Get expense history for a specific user (cursor paginated, newest first)"""
+    return paginated_expense_response(user_id, current_app.config['DEFAULT_PAGE_SIZE'])
+
+
+@api.route('/api/expenses/all', methods=['GET'])
+@conditional(versions.tenant_company_key)
 def get_all_expenses():
-    """Get all expenses (for admin view) with pagination"""
+    """Get all expenses (for admin view) with cursor pagination"""
     # Note: user_id logic for filtering is disabled for the simple Admin 'all' view.
+    return paginated_expense_response(default_per_page=20)
 
-    # Get pagination parameters from query string
-    page = request.args.get('page', default=1, type=int)
-    per_page = request.args.get('per_page', default=20, type=int)
 
-    # FIX: Add ordering by submission date to ensure a consistent result set for pagination
-    pagination = Expense.query.order_by(Expense.submitted_at.desc()).paginate(
-        page=page, per_page=per_page, error_out=False
-    )
-    expenses = pagination.items
+@api.route('/api/expenses/search', methods=['GET'])
+@conditional(versions.tenant_company_key)
+def search_expenses():
+    """Full-text search over title, description, category and submitter name.
+
+    ?q= is required (whole words; prefix=1 lets the last word be a prefix, for
+    search as you type). Accepts the listing filters, user_id, fields=/include=
+    and per_page/cursor. Where the full-text index is available (`ranked` in the
+    response) results are ranked best first within windows of `rank_window`
+    matches, newest window first (see search.py); otherwise they are every
+    match, newest first. Either way every match can be paged to. Archived
+    expenses are not searched (`includes_archived` is false).
+    """
+    try:
+        terms = search.parse_terms(request.args.get('q'))
+        fields, includes = parse_fieldset(request.args, EXPENSE_FIELDS, EXPENSE_INCLUDES, [])
+        filters = parse_expense_filters(request.args)
+        per_page = parse_page_size(request.args, current_app.config['DEFAULT_PAGE_SIZE'],
+                                   current_app.config['MAX_PAGE_SIZE'])
+        query = apply_expense_filters(serializers.expense_list_projection(fields), filters)
+        user_id = request.args.get('user_id', type=int)
+        if user_id is not None:
+            query = query.filter(Expense.user_id == user_id)
+
+        ranked = search.fts_enabled()
+        if ranked:
+            rows, next_cursor = search.ranked_page(
+                query, terms, per_page, current_app.config['SEARCH_MAX_CANDIDATES'],
+                request.args.get('cursor'), company_id=tenancy.current_company_id(),
+                prefix=request.args.get('prefix', '').lower() in ('1', 'true')
+            )
+        else:
+            rows, next_cursor = keyset_page(query.filter(search.substring_filter(terms)), per_page,
+                                            request.args.get('cursor'))
+    except ValueError as e:
+        return jsonify({'success': False, 'error': str(e)}), 400
 
     return jsonify({
         'success': True,
-        # Ensure steps are included in to_dict for comprehensive admin view
-        'expenses': [exp.to_dict(include_steps=True) for exp in expenses], 
-        'page': page,
+        'expenses': serialize_expenses(rows, fields, includes),
         'per_page': per_page,
-        'total': pagination.total,
-        'pages': pagination.pages
+        'next_cursor': next_cursor,
+        'ranked': ranked,
+        'rank_window': current_app.config['SEARCH_MAX_CANDIDATES'] if ranked else None,
+        'includes_archived': False
+    }), 200
+
+
+@api.route('/api/expenses/export', methods=['GET'])
+def export_expenses():
+    """Stream expenses as CSV or NDJSON (oldest first).
+
+    Accepts the listing filters plus optional user_id/company_id, and
+    `steps=none|flat|nested` to add approval steps (one row per step when flat;
+    nested arrays are NDJSON only).
+    """
+    fmt = request.args.get('format', 'csv')
+    if fmt not in EXPORT_FORMATS:
+        return jsonify({'error': f'Unsupported format: must be one of {", ".join(EXPORT_FORMATS)}'}), 400
+    steps_mode = request.args.get('steps', 'none')
+    if steps_mode not in STEP_MODES:
+        return jsonify({'error': f'Invalid steps: must be one of {", ".join(STEP_MODES)}'}), 400
+    if steps_mode == 'nested' and fmt == 'csv':
+        return jsonify({'error': 'Nested steps are only available for ndjson; use steps=flat for csv'}), 400
+
+    try:
+        filters = parse_expense_filters(request.args)
+    except ValueError as e:
+        return jsonify({'error': str(e)}), 400
+
+    # Live and archived expenses, merged in id order
+    stmts = [build_export_query(filters, steps_mode,
+                                user_id=request.args.get('user_id', type=int),
+                                company_id=request.args.get('company_id', type=int),
+                                archived=archived)
+             for archived in (False, True)]
+    stream = stream_csv if fmt == 'csv' else stream_ndjson
+    body = stream(stmts, steps_mode, current_app.config['EXPORT_BATCH_SIZE'])
+
+    filename = f"expenses-{datetime.utcnow().strftime('%Y%m%d')}.{fmt}"
+    return Response(
+        stream_with_context(body),
+        mimetype='text/csv' if fmt == 'csv' else 'application/x-ndjson',
+        headers={'Content-Disposition': f'attachment; filename="{filename}"'}
+    )
+
+
+@api.route('/api/analytics/spend', methods=['GET'])
+def get_spend_analytics():
+    """Spend totals in the company base currency, served from the rollup table.
+
+    Query: company_id (required unless sent as X-Company-Id), group_by=category,month,user,status
+    (any subset), and optional status, category, user_id, period_from / period_to (YYYY-MM) filters.
+    """
+    company_id = request.args.get('company_id', type=int) or tenancy.current_company_id()
+    company = db.session.get(Company, company_id) if company_id else None
+    if not company:
+        return jsonify({'success': False, 'error': 'Valid company_id is required'}), 400
+
+    group_by = [g for g in request.args.get('group_by', 'category').split(',') if g]
+    unknown = [g for g in group_by if g not in GROUP_BY_COLUMNS]
+    if unknown:
+        return jsonify({'success': False, 'error': f'Unsupported group_by: {", ".join(unknown)}'}), 400
+
+    filters = {}
+    for field in ('status', 'category'):
+        if request.args.get(field):
+            filters[field] = request.args.get(field)
+    if request.args.get('user_id', type=int):
+        filters['user_id'] = request.args.get('user_id', type=int)
+    for field in ('period_from', 'period_to'):
+        value = request.args.get(field)
+        if value:
+            try:
+                datetime.strptime(value, '%Y-%m')
+            except ValueError:
+                return jsonify({'success': False, 'error': f'Invalid {field}: expected YYYY-MM'}), 400
+            filters[field] = value
+
+    # Totals use the base amounts fixed at submission; only expenses still waiting
+    # for the rerate job are converted here, at the current rate
+    base_currency = company.base_currency or current_app.config['COMPANY_BASE_CURRENCY']
+    rates, unconverted = {}, set()
+    totals = {}
+    for row in query_spend(company.id, group_by, filters):
+        *dims, currency, count, base_amount, unrated_count, unrated_amount = row
+        bucket = totals.setdefault(tuple(dims), {'expense_count': 0, 'total': 0.0})
+        bucket['expense_count'] += count
+        bucket['total'] += base_amount or 0.0
+        if unrated_count:
+            if currency not in rates:
+                rates[currency] = get_exchange_rate(currency, base_currency)
+            if rates[currency] is None:
+                unconverted.add(currency)
+            else:
+                bucket['total'] += unrated_amount * rates[currency]
+
+    user_names = {}
+    if 'user' in group_by:
+        user_ids = {dims[group_by.index('user')] for dims in totals}
+        user_names = dict(db.session.query(User.id, User.name).filter(User.id.in_(user_ids)).all())
+
+    results = []
+    for dims, bucket in sorted(totals.items(), key=lambda item: tuple(str(d) for d in item[0])):
+        entry = dict(zip(group_by, dims))
+        if 'user' in entry:
+            entry['user_name'] = user_names.get(entry['user'])
+        entry['expense_count'] = bucket['expense_count']
+        entry['total'] = round(bucket['total'], 2)
+        results.append(entry)
+
+    return jsonify({
+        'success': True,
+        'base_currency': base_currency,
+        'group_by': group_by,
+        'results': results,
+        # Rows in these currencies are counted but missing from totals (no FX rate)
+        'unconverted_currencies': sorted(unconverted)
     }), 200
 
 
-@app.route('/api/health', methods=['GET'])
+@api.route('/api/health', methods=['GET'])
 def health_check():
     """Health check endpoint"""
     return jsonify({
@@ -674,13 +1428,201 @@ def health_check():
     }), 200
 
 
+@api.route('/api/metrics', methods=['GET'])
+def metrics_endpoint():
+    """Per-endpoint latency, SQL and response size histograms (Prometheus text format)"""
+    return Response(metrics.registry.render(), mimetype='text/plain; version=0.0.4')
+
+
+# ==================== CLI COMMANDS ====================
+
+@api.cli.command('init-db')
+def init_db_command():
+    """Create the schema, or apply pending migrations. Never drops data."""
+    applied = upgrade_schema()
+    if applied:
+        print(f"Schema at version {latest_schema_version()} (applied {applied}).")
+    else:
+        print(f"Schema already at version {latest_schema_version()}.")
+
+
+@api.cli.command('seed-db')
+def seed_db_command():
+    """Load the demo company, users and approval policy into an empty database."""
+    with db.engine.connect() as conn:
+        if current_schema_version(conn) < latest_schema_version():
+            raise click.ClickException("The schema is missing or out of date; run `flask init-db` first.")
+    if Company.query.first() is not None:
+        raise click.ClickException("The database already has data; not seeding.")
+    seed_demo_data()
+
+
+@api.cli.command('rebuild-rollups')
+@click.option('--batch-size', default=5000, show_default=True, help='Expenses aggregated per batch.')
+def rebuild_rollups_command(batch_size):
+    """Recompute spend_rollups from the expenses table."""
+    rebuild_rollups(batch_size=batch_size)
+    print("Spend rollups rebuilt.")
+
+
+@api.cli.command('rebuild-hierarchy')
+def rebuild_hierarchy_command():
+    """Recompute the user_hierarchy closure table from users.manager_id."""
+    cycles = rebuild_hierarchy()
+    db.session.commit()
+    if cycles:
+        print(f"Warning: users {cycles} are on a manager cycle; treated as top-level.")
+    print("User hierarchy rebuilt.")
+
+
+@api.cli.command('rerate-expenses')
+@click.option('--batch-size', default=1000, show_default=True, help='Expenses updated per transaction.')
+@click.option('--all', 'rerate_all', is_flag=True, help='Recompute every expense, not just missing ones.')
+@click.option('--company-id', type=int, help='Limit to one company (e.g. after a base currency change).')
+def rerate_expenses_command(batch_size, rerate_all, company_id):
+    """Fill in (or recompute) base-currency amounts on existing expenses."""
+    updated, unrated = rerate_expenses(
+        get_exchange_rate, current_app.config['COMPANY_BASE_CURRENCY'],
+        batch_size=batch_size, only_missing=not rerate_all, company_id=company_id
+    )
+    print(f"Re-rated {updated} expenses; {unrated} still have no exchange rate.")
+
+
+@api.cli.command('prune-events')
+@click.option('--days', type=int, help='Keep this many days of events (default: EVENT_RETENTION_DAYS).')
+def prune_events_command(days):
+    """Delete old approval queue events (streams further behind are told to resync)."""
+    days = days if days is not None else current_app.config['EVENT_RETENTION_DAYS']
+    removed = events.prune(days)
+    print(f"Removed {removed} approval events older than {days} days.")
+
+
+@api.cli.command('archive-expenses')
+@click.option('--days', type=int, help='Archive expenses finalized more than this many days ago '
+                                       '(default: ARCHIVE_AFTER_DAYS).')
+@click.option('--batch-size', type=int, help='Expenses moved per transaction (default: ARCHIVE_BATCH_SIZE).')
+@click.option('--max-seconds', type=float, help='Stop after this long; the next run carries on.')
+def archive_expenses_command(days, batch_size, max_seconds):
+    """Move old Approved/Rejected expenses and their approval steps into the archive tables."""
+    days = days if days is not None else current_app.config['ARCHIVE_AFTER_DAYS']
+    batch_size = batch_size or current_app.config['ARCHIVE_BATCH_SIZE']
+    expenses, steps, finished = archive.archive(days, batch_size=batch_size, max_seconds=max_seconds)
+    print(f"Archived {expenses} expenses and {steps} approval steps finalized more than {days} days ago.")
+    if not finished:
+        print("Stopped at --max-seconds; run again to continue.")
+
+
+@api.cli.command('dedup-report')
+@click.option('--company-id', type=int, help='Only this company (default: all).')
+@click.option('--days', type=int, help='Dates this close count as near (default: DUPLICATE_WINDOW_DAYS).')
+@click.option('--tolerance', type=float, help='Amounts this close, as a fraction, count as near '
+                                              '(default: DUPLICATE_AMOUNT_TOLERANCE).')
+@click.option('--output', type=click.File('w'), default='-', help='CSV file to write (default: stdout).')
+def dedup_report_command(company_id, days, tolerance, output):
+    """Report suspected duplicate expenses, live and archived, as CSV."""
+    days = days if days is not None else current_app.config['DUPLICATE_WINDOW_DAYS']
+    tolerance = tolerance if tolerance is not None else current_app.config['DUPLICATE_AMOUNT_TOLERANCE']
+    writer = csv.DictWriter(output, fieldnames=duplicates.REPORT_FIELDS)
+    writer.writeheader()
+    counts = {'exact': 0, 'near': 0}
+    for row in duplicates.report(days, tolerance, company_id=company_id):
+        writer.writerow(row)
+        counts[row['kind']] += 1
+    click.echo(f"{counts['exact']} exact and {counts['near']} near duplicates "
+               f"(within {days} days and {tolerance:.1%}).", err=True)
+
+
+@api.cli.command('prune-attachments')
+@click.option('--grace-hours', type=float, help='Keep unused files this long after their last upload '
+                                                '(default: ATTACHMENT_PRUNE_GRACE_HOURS).')
+def prune_attachments_command(grace_hours):
+    """Delete stored receipt files that no attachment uses any more."""
+    if grace_hours is None:
+        grace_hours = current_app.config['ATTACHMENT_PRUNE_GRACE_HOURS']
+    files, freed = attachments.prune(attachment_root(), grace_hours)
+    print(f"Deleted {files} unused files ({freed / 1024 / 1024:.1f} MiB).")
+
+
+@api.cli.command('load-fx-rates')
+@click.argument('path', type=click.Path(exists=True, dir_okay=False), required=False)
+@click.option('--file-base', default='EUR', show_default=True, help='Currency the file quotes its rates in.')
+@click.option('--provider', help='Fetch from a provider instead of a file (default: FX_HISTORY_PROVIDER).')
+@click.option('--start', help='First day to fetch from the provider (YYYY-MM-DD).')
+@click.option('--end', help='Last day to fetch from the provider (default: today).')
+def load_fx_rates_command(path, file_base, provider, start, end):
+    """Load historical exchange rates from a CSV file or a rate provider."""
+    target_base = current_app.config['FX_HISTORY_BASE']
+    if path:
+        with open(path, 'rb') as stream:
+            rows, days = fx_history.load_file(stream, file_base, target_base, source=os.path.basename(path))
+    else:
+        name = provider or current_app.config['FX_HISTORY_PROVIDER']
+        if name not in fx_history.PROVIDERS:
+            raise click.UsageError(f"Unknown provider {name}: one of {', '.join(fx_history.PROVIDERS)}")
+        if not start:
+            raise click.UsageError('--start is required when fetching from a provider')
+        end_date = fx_history.parse_date(end) if end else datetime.utcnow().date()
+        rows, days = fx_history.load_provider(name, fx_history.parse_date(start), end_date, target_base)
+    print(f"Stored {rows} rates for {days} days (per {target_base}).")
+
+
+@api.cli.command('sla-scheduler')
+@click.option('--once', is_flag=True, help='Run a single pass over the overdue steps and exit.')
+@click.option('--poll-seconds', type=int, help='Longest sleep between passes (default: APPROVAL_SLA_POLL_SECONDS).')
+@click.option('--batch-size', type=int, help='Steps updated per transaction (default: APPROVAL_SLA_BATCH_SIZE).')
+def sla_scheduler_command(once, poll_seconds, batch_size):
+    """Remind approvers of overdue approval steps and escalate them up the manager chain.
+
+    A step's SLA counts from when it became actionable, not from when the expense was submitted.
+    """
+    if once:
+        reminded, escalated = sla.run_once(batch_size=batch_size)
+        print(f"Reminded {reminded} and escalated {escalated} overdue approval steps.")
+        return
+    print("SLA scheduler running (Ctrl-C to stop) ...")
+    try:
+        sla.run(poll_seconds, batch_size)
+    except KeyboardInterrupt:
+        pass
+
+
+@api.cli.command('rebuild-search-index')
+def rebuild_search_index_command():
+    """Re-fill the expense full-text index (SQLite FTS5) from the expenses table."""
+    with db.engine.begin() as conn:
+        count = search.rebuild(conn)
+    if count is not None:
+        print(f"Indexed {count} expenses for search.")
+    else:
+        print("No full-text index on this database; search uses substring matching.")
+
+
+@api.cli.command('generate-data')
+@click.option('--companies', default=1, show_default=True)
+@click.option('--users-per-company', default=50, show_default=True)
+@click.option('--expenses-per-user', default=20, show_default=True)
+@click.option('--span-of-control', default=6, show_default=True, help='Direct reports per manager.')
+@click.option('--days', default=365, show_default=True, help='Spread submissions over this many past days.')
+@click.option('--seed', default=42, show_default=True, help='Random seed; the same options give the same data.')
+def generate_data_command(companies, users_per_company, expenses_per_user, span_of_control, days, seed):
+    """Append synthetic companies, users and expenses for development and benchmarks."""
+    upgrade_schema()
+    counts = synthetic.generate(companies=companies, users_per_company=users_per_company,
+                                expenses_per_user=expenses_per_user, span_of_control=span_of_control,
+                                days=days, seed=seed)
+    print("Generated " + ", ".join(f"{n} {table}" for table, n in counts.items()) + ".")
+    print(f"Synthetic users log in with password '{synthetic.SYNTHETIC_PASSWORD}'.")
+
+
 # ==================== APP INITIALIZATION (The Final Fix) ====================
 
 if __name__ == '__main__':
-    # Set up the database and seed demo data before running the app
+    # Development server with auto-reload. The schema is brought up to date
+    # (never dropped) and an empty database gets the demo data, as running
+    # `flask init-db` and `flask seed-db` would. Production: see wsgi.py.
+    app = create_app()
     with app.app_context():
-        db.drop_all()
-        db.create_all()
-        seed_demo_data()
-    # Run the app
+        upgrade_schema()
+        if Company.query.first() is None:
+            seed_demo_data()
     app.run(debug=True, port=5000)
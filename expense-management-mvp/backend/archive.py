@@ -0,0 +1,141 @@
+import time
+from datetime import datetime, timedelta
+
+from sqlalchemy import delete, insert, literal, select, tuple_
+
+from listing import encode_cursor, keyset_page
+from models import (db, Expense, ApprovalStep, ApprovalVote, ArchivedExpense, ArchivedApprovalStep,
+                    ArchivedApprovalVote)
+import search
+from versions import bump_expenses
+
+# --- Expense Archival ---
+#
+# Approved and Rejected expenses never change again, yet they soon outnumber
+# the Pending work that submit, the approval queues and the decision endpoints
+# touch. archive() moves expenses finalized more than ARCHIVE_AFTER_DAYS ago,
+# with their approval steps and votes, into expenses_archive,
+# approval_steps_archive and approval_votes_archive, which have the same
+# columns and keep the same ids. The live tables (and their indexes, and the
+# search index) then only grow with recent work.
+#
+# Hot paths read only the live tables. History, the admin listing, expense
+# details and the export read both sides (keyset_page_with_archive() and
+# export.py), so archiving never changes what they return. Spend rollups
+# count archived expenses as before: moving a row does not touch its totals.
+#
+# Each batch moves its rows and commits in one transaction, and rows are
+# chosen by their state rather than a saved position, so the job can be
+# stopped at any point (Ctrl-C, a crash, --max-seconds) and simply run again.
+# Run one job at a time.
+
+FINALIZED_STATUSES = ('Approved', 'Rejected')
+
+# (live table, archive table) pairs, parents first
+ARCHIVED_TABLES = (
+    (Expense.__table__, ArchivedExpense.__table__),
+    (ApprovalStep.__table__, ArchivedApprovalStep.__table__),
+    (ApprovalVote.__table__, ArchivedApprovalVote.__table__),
+)
+
+
+def _candidates(status, cutoff, after, batch_size):
+    """The next finalized expenses in (submitted_at, id) order whose last decision is before cutoff.
+
+    Submission precedes every decision, so submitted_at < cutoff bounds the
+    scan on the (status, submitted_at, id) index; expenses with a step decided
+    since the cutoff are stepped over.
+    """
+    recent_decision = select(ApprovalStep.id).where(
+        ApprovalStep.expense_id == Expense.id, ApprovalStep.decided_at >= cutoff
+    ).exists()
+    conditions = [Expense.status == status, Expense.submitted_at < cutoff, ~recent_decision]
+    if after is not None:
+        conditions.append(tuple_(Expense.submitted_at, Expense.id) > after)
+    return db.session.execute(
+        select(Expense.id, Expense.submitted_at, Expense.company_id, Expense.user_id)
+        .where(*conditions)
+        .order_by(Expense.submitted_at, Expense.id)
+        .limit(batch_size)
+    ).all()
+
+
+def _move(expense_ids, archived_at):
+    """Copies the expenses, their steps and votes into the archive and deletes them; returns the step count."""
+    expenses, steps, votes = (live for live, _ in ARCHIVED_TABLES)
+    step_ids = select(steps.c.id).where(steps.c.expense_id.in_(expense_ids))
+    conditions = {
+        expenses.name: expenses.c.id.in_(expense_ids),
+        steps.name: steps.c.expense_id.in_(expense_ids),
+        votes.name: votes.c.step_id.in_(step_ids),
+    }
+
+    moved = {}
+    for live, archived in ARCHIVED_TABLES:
+        names = [c.name for c in live.columns]
+        columns = [live.c[name] for name in names]
+        if 'archived_at' in archived.c:
+            names.append('archived_at')
+            columns.append(literal(archived_at, archived.c.archived_at.type))
+        moved[live.name] = db.session.execute(
+            insert(archived).from_select(names, select(*columns).where(conditions[live.name]))
+        ).rowcount
+    # Children first, while the step id subquery can still find them
+    for live, _ in reversed(ARCHIVED_TABLES):
+        db.session.execute(delete(live).where(conditions[live.name]))
+    return moved[steps.name]
+
+
+def archive(older_than_days, batch_size=1000, max_seconds=None):
+    """Moves expenses finalized more than `older_than_days` ago into the archive tables.
+
+    Commits after every batch of `batch_size` expenses. Stops early once
+    max_seconds have passed; running it again carries on. Returns
+    (expenses moved, approval steps moved, finished).
+    """
+    cutoff = datetime.utcnow() - timedelta(days=older_than_days)
+    deadline = time.monotonic() + max_seconds if max_seconds else None
+    moved_expenses = moved_steps = 0
+    finished = True
+
+    for status in FINALIZED_STATUSES:
+        after = None
+        while finished:
+            rows = _candidates(status, cutoff, after, batch_size)
+            if not rows:
+                break
+            after = (rows[-1].submitted_at, rows[-1].id)
+
+            moved_steps += _move([row.id for row in rows], datetime.utcnow())
+            bump_expenses(rows)  # Search results (live only) change
+            db.session.commit()
+            moved_expenses += len(rows)
+            finished = deadline is None or time.monotonic() < deadline
+
+    if moved_expenses:
+        # The search triggers deleted every moved row from the index
+        search.optimize(db.session.connection())
+        db.session.commit()
+    return moved_expenses, moved_steps, finished
+
+
+# --- Reading Both Sides ---
+
+def keyset_page_with_archive(build_query, per_page, cursor=None):
+    """keyset_page() over live and archived expenses as one newest-first listing.
+
+    build_query(model) returns the filtered projection for Expense or
+    ArchivedExpense. Each side is read with the same seek (an index range scan
+    of per_page + 1 rows) and the two are merged, so cursors work as before.
+    Returns (rows, next_cursor, ids of the rows that came from the archive).
+    """
+    live_rows, live_next = keyset_page(build_query(Expense), per_page, cursor)
+    archived_rows, archived_next = keyset_page(build_query(ArchivedExpense), per_page, cursor,
+                                               model=ArchivedExpense)
+
+    rows = sorted(live_rows + archived_rows, key=lambda row: (row.submitted_at, row.id), reverse=True)
+    next_cursor = None
+    if len(rows) > per_page or live_next or archived_next:
+        rows = rows[:per_page]
+        next_cursor = encode_cursor(rows[-1])
+    return rows, next_cursor, {row.id for row in archived_rows}
@@ -0,0 +1,279 @@
+import hashlib
+import os
+import tempfile
+from datetime import datetime, timedelta
+
+from sqlalchemy import delete, select
+from sqlalchemy.exc import IntegrityError
+
+from models import db, Attachment, StoredFile
+
+try:
+    from PIL import Image
+except ImportError:  # Optional: without Pillow there are no thumbnails or image dimensions
+    Image = None
+
+# --- Receipt Attachments ---
+#
+# File bodies are content addressed: an upload is streamed to a temporary file
+# in fixed-size chunks while its SHA-256 is computed, then renamed to
+# <root>/ab/cd/<sha256>. A body that is already stored (the same receipt
+# attached twice, or to two expenses) is not kept twice: the temporary file
+# is dropped and the new Attachment row points at the existing StoredFile.
+# Memory use is one chunk per upload, whatever the file size.
+#
+# Stored files never change, so downloads are plain file responses (Range
+# requests, conditional GETs with the hash as ETag, sendfile where the server
+# offers it) and thumbnails and image dimensions are computed on first request
+# and kept: thumbnails next to the bodies, dimensions on the StoredFile row.
+#
+# Deleting an attachment only deletes its row; `flask prune-attachments`
+# removes bodies no attachment has used for ATTACHMENT_PRUNE_GRACE_HOURS.
+# An upload marks the StoredFile row as used before it decides whether its
+# body is already on disk, and the prune moves a body aside before deleting
+# its row (and puts it back if the row turned out to be in use), so an
+# upload racing the prune never ends up pointing at a missing file.
+
+# Magic numbers of the receipt formats we accept, checked against the first bytes
+SIGNATURES = (
+    (b'%PDF-', 'application/pdf'),
+    (b'\xff\xd8\xff', 'image/jpeg'),
+    (b'\x89PNG\r\n\x1a\n', 'image/png'),
+    (b'GIF87a', 'image/gif'),
+    (b'GIF89a', 'image/gif'),
+)
+SNIFF_BYTES = 16
+THUMBNAIL_TYPES = ('image/jpeg', 'image/png', 'image/gif', 'image/webp')
+
+
+class AttachmentError(Exception):
+    """An upload or read that cannot be served; carries the HTTP status to return."""
+
+    def __init__(self, message, status_code=400):
+        super().__init__(message)
+        self.message = message
+        self.status_code = status_code
+
+
+def sniff_content_type(head):
+    """The content type of a file from its first bytes, or None if it is not an accepted format."""
+    for signature, content_type in SIGNATURES:
+        if head.startswith(signature):
+            return content_type
+    if head[:4] == b'RIFF' and head[8:12] == b'WEBP':
+        return 'image/webp'
+    if head[4:8] == b'ftyp' and head[8:12] in (b'heic', b'heix', b'mif1'):
+        return 'image/heic'
+    return None
+
+
+def body_path(root, sha256):
+    return os.path.join(root, sha256[:2], sha256[2:4], sha256)
+
+
+def thumbnail_path(root, sha256, size):
+    return os.path.join(root, 'thumbnails', sha256[:2], f'{sha256}-{size}.jpg')
+
+
+def _write_once(path, write):
+    """Creates `path` through a temporary file in the same directory, so readers never see a partial file."""
+    os.makedirs(os.path.dirname(path), exist_ok=True)
+    fd, temp_path = tempfile.mkstemp(dir=os.path.dirname(path), prefix='.upload-')
+    try:
+        with os.fdopen(fd, 'wb') as out:
+            write(out)
+        os.replace(temp_path, path)
+    except BaseException:
+        os.unlink(temp_path)
+        raise
+
+
+# --- Storing ---
+
+def store_stream(stream, root, max_bytes, chunk_size=1024 * 1024):
+    """Streams an upload to a temporary file; returns (sha256, size, content_type, temp_path).
+
+    Pass temp_path to place() once the StoredFile row is recorded.
+    """
+    tmp_dir = os.path.join(root, 'tmp')
+    os.makedirs(tmp_dir, exist_ok=True)
+    fd, temp_path = tempfile.mkstemp(dir=tmp_dir, prefix='upload-')
+    digest = hashlib.sha256()
+    size = 0
+    head = b''
+    try:
+        with os.fdopen(fd, 'wb') as out:
+            while True:
+                chunk = stream.read(chunk_size)
+                if not chunk:
+                    break
+                size += len(chunk)
+                if size > max_bytes:
+                    raise AttachmentError(f'File too large: at most {max_bytes} bytes', 413)
+                if len(head) < SNIFF_BYTES:
+                    head += chunk[:SNIFF_BYTES - len(head)]
+                digest.update(chunk)
+                out.write(chunk)
+
+        if size == 0:
+            raise AttachmentError('Empty file')
+        content_type = sniff_content_type(head)
+        if content_type is None:
+            raise AttachmentError('Unsupported file type: expected PDF, JPEG, PNG, GIF, WebP or HEIC', 415)
+
+        return digest.hexdigest(), size, content_type, temp_path
+    except BaseException:
+        os.unlink(temp_path)
+        raise
+
+
+def place(temp_path, root, sha256):
+    """Moves an upload to its content address unless that body is already there; True if it was new."""
+    path = body_path(root, sha256)
+    if os.path.exists(path):
+        os.unlink(temp_path)
+        return False
+    os.makedirs(os.path.dirname(path), exist_ok=True)
+    os.replace(temp_path, path)
+    return True
+
+
+def record_stored_file(sha256, size, content_type):
+    """Inserts the StoredFile row for a body, or marks the existing one as used again."""
+    now = datetime.utcnow()
+    stored = db.session.get(StoredFile, sha256)
+    if stored is None:
+        try:
+            with db.session.begin_nested():
+                stored = StoredFile(sha256=sha256, size=size, content_type=content_type,
+                                    created_at=now, last_used_at=now)
+                db.session.add(stored)
+        except IntegrityError:
+            # Another upload of the same content recorded it first
+            stored = db.session.get(StoredFile, sha256)
+    stored.last_used_at = now
+    return stored
+
+
+def attach(expense, stream, filename, root, max_bytes, chunk_size, uploaded_by=None):
+    """Stores an upload and attaches it to a (live or archived) expense; returns (attachment, created).
+
+    `created` is False when the same content was already stored. The caller commits.
+    """
+    sha256, size, content_type, temp_path = store_stream(stream, root, max_bytes, chunk_size)
+    try:
+        record_stored_file(sha256, size, content_type)
+        db.session.flush()  # Marked as used before looking at the disk (see prune)
+    except BaseException:
+        os.unlink(temp_path)
+        raise
+    created = place(temp_path, root, sha256)
+    attachment = Attachment(expense_id=expense.id, company_id=expense.company_id, sha256=sha256,
+                            filename=clean_filename(filename, content_type), uploaded_by=uploaded_by)
+    db.session.add(attachment)
+    return attachment, created
+
+
+EXTENSIONS = {'application/pdf': 'pdf', 'image/jpeg': 'jpg', 'image/png': 'png', 'image/gif': 'gif',
+              'image/webp': 'webp', 'image/heic': 'heic'}
+
+
+def clean_filename(filename, content_type):
+    """The client's file name without any directory part, or a default one for the type."""
+    name = os.path.basename((filename or '').replace('\\', '/')).strip()
+    return name[:255] or f'receipt.{EXTENSIONS[content_type]}'
+
+
+# --- Reading ---
+
+def describe(stored, root):
+    """Fills in the image dimensions of a stored file the first time they are asked for."""
+    if stored.described_at is not None:
+        return stored
+    if Image is not None and stored.content_type in THUMBNAIL_TYPES:
+        try:
+            with Image.open(body_path(root, stored.sha256)) as image:  # Reads the header only
+                stored.width, stored.height = image.size
+        except (OSError, Image.DecompressionBombError):
+            pass
+    stored.described_at = datetime.utcnow()
+    db.session.commit()
+    return stored
+
+
+def ensure_thumbnail(stored, root, size):
+    """Path of a JPEG thumbnail at most `size` pixels on its long side, made on first request."""
+    if stored.content_type not in THUMBNAIL_TYPES:
+        raise AttachmentError('No thumbnail for this file type', 415)
+    if Image is None:
+        raise AttachmentError('Thumbnails are not available (Pillow is not installed)', 501)
+
+    path = thumbnail_path(root, stored.sha256, size)
+    if os.path.exists(path):
+        return path
+    try:
+        with Image.open(body_path(root, stored.sha256)) as image:
+            image.draft('RGB', (size, size))  # JPEG: decode at a reduced scale
+            image.thumbnail((size, size))
+            thumbnail = image.convert('RGB')
+    except (OSError, Image.DecompressionBombError):
+        raise AttachmentError('The image could not be read', 415)
+    _write_once(path, lambda out: thumbnail.save(out, 'JPEG', quality=85, optimize=True))
+    return path
+
+
+# --- Pruning ---
+
+def prune(root, grace_hours, batch_size=500):
+    """Deletes stored bodies (and their thumbnails) no attachment has used lately; returns (files, bytes).
+
+    Each body is moved aside first and its row deleted only if it is still
+    unused, re-checked by the DELETE itself. An upload that marked the row in
+    the meantime keeps it, and gets the body back; one that comes after the
+    row is gone records a new row and writes its own copy.
+    """
+    cutoff = datetime.utcnow() - timedelta(hours=grace_hours)
+    unused = ~select(Attachment.id).where(Attachment.sha256 == StoredFile.sha256).exists()
+    files = freed = 0
+    after = ''
+    while True:
+        rows = db.session.execute(
+            select(StoredFile.sha256, StoredFile.size)
+            .where(StoredFile.sha256 > after, StoredFile.last_used_at < cutoff, unused)
+            .order_by(StoredFile.sha256)
+            .limit(batch_size)
+        ).all()
+        db.session.rollback()  # Nothing held while files move
+        if not rows:
+            break
+        after = rows[-1].sha256
+
+        for row in rows:
+            path = body_path(root, row.sha256)
+            pruned_path = f'{path}.pruned'
+            if os.path.exists(path):
+                os.replace(path, pruned_path)
+            deleted = db.session.execute(
+                delete(StoredFile).where(StoredFile.sha256 == row.sha256, StoredFile.last_used_at < cutoff, unused)
+            ).rowcount
+            db.session.commit()
+            if not os.path.exists(pruned_path):
+                continue
+            if deleted:
+                os.unlink(pruned_path)
+                _remove_thumbnails(root, row.sha256)
+                files += 1
+                freed += row.size
+            elif os.path.exists(path):
+                os.unlink(pruned_path)  # An upload already wrote it again
+            else:
+                os.replace(pruned_path, path)
+    return files, freed
+
+
+def _remove_thumbnails(root, sha256):
+    directory = os.path.dirname(thumbnail_path(root, sha256, 0))
+    if os.path.isdir(directory):
+        for name in os.listdir(directory):
+            if name.startswith(sha256):
+                os.unlink(os.path.join(directory, name))
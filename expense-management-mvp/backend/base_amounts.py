@@ -0,0 +1,113 @@
+from datetime import datetime
+from types import SimpleNamespace
+
+from sqlalchemy import bindparam, func, select, update
+
+from models import db, Company, Expense, ArchivedExpense
+from rollups import add_rerate, apply_deltas, new_deltas
+from versions import bump_expenses
+
+# --- Base-Currency Amounts ---
+#
+# Every expense stores its amount converted to the company base currency, plus
+# the rate used, at submission time. Totals, comparisons and sorting in the base
+# currency are then plain SQL over an indexed column. Expenses submitted while no
+# rate was available keep base_amount NULL until rerate() fills them in.
+
+
+def base_fields(amount, currency, base_currency, rate):
+    """The Expense base_* / fx_* column values for one amount (all None without a rate)."""
+    if rate is None:
+        return {'base_amount': None, 'base_currency': None, 'fx_rate': None, 'fx_rated_at': None}
+    return {
+        'base_amount': round(amount * rate, 2),
+        'base_currency': base_currency,
+        'fx_rate': rate,
+        'fx_rated_at': datetime.utcnow()
+    }
+
+
+class RateMemo:
+    """Memoizes rate_lookup(from, to) for one batch, so each pair is looked up once."""
+
+    def __init__(self, rate_lookup):
+        self.rate_lookup = rate_lookup
+        self._rates = {}
+
+    def __call__(self, from_currency, to_currency):
+        pair = (from_currency, to_currency)
+        if pair not in self._rates:
+            self._rates[pair] = self.rate_lookup(from_currency, to_currency)
+        return self._rates[pair]
+
+
+def rerate(rate_lookup, default_base_currency, batch_size=1000, only_missing=True, company_id=None):
+    """Fills in (or, with only_missing=False, recomputes) base amounts in id-ordered batches.
+
+    Live and archived expenses are both covered. Each batch updates its rows
+    with one executemany UPDATE, moves the matching spend rollup totals, and
+    commits, so the job can be stopped and re-run.
+    Returns (updated, unrated) row counts; unrated rows had no rate available.
+    """
+    updated = unrated = 0
+    for model in (Expense, ArchivedExpense):
+        counts = _rerate_table(model, rate_lookup, default_base_currency, batch_size, only_missing, company_id)
+        updated += counts[0]
+        unrated += counts[1]
+    return updated, unrated
+
+
+def _rerate_table(model, rate_lookup, default_base_currency, batch_size, only_missing, company_id):
+    updated = unrated = 0
+    last_id = 0
+    expenses = model.__table__
+
+    while True:
+        conditions = [model.id > last_id]
+        if only_missing:
+            conditions.append(model.base_amount.is_(None))
+        if company_id is not None:
+            conditions.append(model.company_id == company_id)
+
+        rows = db.session.execute(
+            select(model.id, model.company_id, model.user_id, model.date, model.category,
+                   model.status, model.currency, model.amount, model.base_amount,
+                   func.coalesce(Company.base_currency, default_base_currency).label('target_currency'))
+            .join(Company, Company.id == model.company_id)
+            .where(*conditions)
+            .order_by(model.id)
+            .limit(batch_size)
+        ).all()
+        if not rows:
+            break
+        last_id = rows[-1].id
+
+        rates = RateMemo(rate_lookup)
+        params, deltas, rerated_rows = [], new_deltas(), []
+        for row in rows:
+            fields = base_fields(row.amount, row.currency, row.target_currency,
+                                 rates(row.currency, row.target_currency))
+            if fields['base_amount'] is None:
+                unrated += 1
+                continue
+            params.append({'b_id': row.id, **{f'b_{k}': v for k, v in fields.items()}})
+            rerated = SimpleNamespace(**{**row._mapping, 'base_amount': fields['base_amount']})
+            add_rerate(deltas, rerated, row.base_amount)
+            rerated_rows.append(row)
+
+        if params:
+            db.session.execute(
+                update(expenses).where(expenses.c.id == bindparam('b_id')).values(
+                    base_amount=bindparam('b_base_amount'),
+                    base_currency=bindparam('b_base_currency'),
+                    fx_rate=bindparam('b_fx_rate'),
+                    fx_rated_at=bindparam('b_fx_rated_at')
+                ),
+                params
+            )
+            apply_deltas(deltas)
+            bump_expenses(rerated_rows)
+        db.session.commit()
+        updated += len(params)
+
+    return updated, unrated
@@ -0,0 +1,102 @@
+"""Archival: job throughput, and endpoint latency before and after archiving.
+
+Builds a synthetic SQLite database (synthetic.py: a year of history, mostly
+finalized), times hot endpoints (approval queue, pending listing, search) and
+the endpoints that read both sides (history, admin listing, export), runs
+archive.archive() and times them all again. History and export return the
+same results either way; hot paths only see the live rows.
+
+    python benchmarks/archive.py --companies 4 --users-per-company 2500 --expenses-per-user 20 --days 30
+"""
+import argparse
+import os
+import statistics
+import sys
+import tempfile
+import time
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+import config  # noqa: E402
+
+DB_DIR = tempfile.mkdtemp(prefix='expense-bench-')
+config.Config.SQLALCHEMY_DATABASE_URI = f"sqlite:///{os.path.join(DB_DIR, 'bench.db')}"
+
+from sqlalchemy import func  # noqa: E402
+
+import archive  # noqa: E402
+from app import create_app  # noqa: E402
+from migrations import upgrade  # noqa: E402
+from models import db, Expense, ApprovalStep, ArchivedExpense  # noqa: E402
+import synthetic  # noqa: E402
+
+app = create_app()
+TENANT = {'X-Company-Id': '1'}
+
+
+def cases(approver_id, user_id):
+    return [
+        ('approval queue', 'hot', f'/api/approvals/{approver_id}'),
+        ('pending + total', 'hot', '/api/expenses/all?status=Pending&include_total=1&include='),
+        ('search', 'hot', '/api/expenses/search?q=hotel'),
+        ('history page 1', 'both', f'/api/expenses/history/{user_id}'),
+        ('admin listing', 'both', '/api/expenses/all?include='),
+        ('export company', 'both', '/api/expenses/export?format=csv&company_id=1'),
+    ]
+
+
+def measure(client, url, runs):
+    timings = []
+    for _ in range(runs + 1):
+        start = time.perf_counter()
+        response = client.get(url, headers=TENANT)
+        response.get_data()
+        timings.append((time.perf_counter() - start) * 1000)
+        assert response.status_code == 200, response.get_data(as_text=True)
+    return statistics.median(timings[1:])
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('--companies', type=int, default=4)
+    parser.add_argument('--users-per-company', type=int, default=2500)
+    parser.add_argument('--expenses-per-user', type=int, default=20)
+    parser.add_argument('--days', type=int, default=30, help='Archive expenses finalized this long ago.')
+    parser.add_argument('--batch-size', type=int, default=1000)
+    parser.add_argument('--runs', type=int, default=10)
+    args = parser.parse_args()
+
+    with app.app_context():
+        print(f"Building synthetic dataset in {DB_DIR} ...")
+        upgrade()
+        counts = synthetic.generate(companies=args.companies, users_per_company=args.users_per_company,
+                                    expenses_per_user=args.expenses_per_user)
+        print(f"{counts['expenses']} expenses, {counts['approval_steps']} approval steps")
+
+        # The company-1 approver with the longest queue, and a submitter
+        approver_id = db.session.query(ApprovalStep.approver_id).filter(
+            ApprovalStep.company_id == 1, ApprovalStep.status == 'Waiting', ApprovalStep.approver_id.isnot(None)
+        ).group_by(ApprovalStep.approver_id).order_by(func.count().desc()).limit(1).scalar()
+        user_id = db.session.query(Expense.user_id).filter(Expense.company_id == 1).limit(1).scalar()
+        db.session.remove()
+        client = app.test_client()
+
+        before = {name: measure(client, url, args.runs) for name, _, url in cases(approver_id, user_id)}
+
+        start = time.perf_counter()
+        moved, steps, _ = archive.archive(args.days, batch_size=args.batch_size)
+        elapsed = time.perf_counter() - start
+        live = db.session.query(func.count(Expense.id)).scalar()
+        archived = db.session.query(func.count(ArchivedExpense.id)).scalar()
+        db.session.remove()
+        print(f"Archived {moved} expenses ({steps} steps) in {elapsed:.1f} s "
+              f"({moved / elapsed:.0f} expenses/s); {live} live, {archived} archived\n")
+
+        print(f"{'endpoint':<18} {'reads':<6} {'before ms':>10} {'after ms':>10}")
+        for name, reads, url in cases(approver_id, user_id):
+            after = measure(client, url, args.runs)
+            print(f"{name:<18} {reads:<6} {before[name]:10.2f} {after:10.2f}")
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,153 @@
+"""Receipt attachments: upload/download throughput and upload memory use.
+
+Uploads generated files (never held in memory by the client either) through
+POST /api/expenses/<id>/attachments as raw bodies and reports:
+
+* one large upload: MB/s and the peak Python heap (tracemalloc) while it
+  runs, which stays around one chunk whatever the file size;
+* --threads concurrent uploads of distinct files: aggregate MB/s;
+* the same files uploaded again: stored once (disk use does not grow);
+* full and Range downloads: MB/s and latency.
+
+    python benchmarks/attachments.py --large-mb 512 --threads 8 --concurrent-mb 32
+"""
+import argparse
+import hashlib
+import os
+import statistics
+import sys
+import tempfile
+import threading
+import time
+import tracemalloc
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+import config  # noqa: E402
+
+DB_DIR = tempfile.mkdtemp(prefix='expense-bench-')
+config.Config.SQLALCHEMY_DATABASE_URI = f"sqlite:///{os.path.join(DB_DIR, 'bench.db')}"
+config.Config.ATTACHMENT_DIR = os.path.join(DB_DIR, 'attachments')
+
+from app import create_app  # noqa: E402
+from migrations import upgrade  # noqa: E402
+from models import db, Expense  # noqa: E402
+import synthetic  # noqa: E402
+
+app = create_app()
+MB = 1024 * 1024
+PDF_HEADER = b'%PDF-1.7\n'
+
+
+class GeneratedFile:
+    """A readable PDF-looking stream of `size` bytes, produced block by block from a seed."""
+
+    def __init__(self, size, seed):
+        self.size = size
+        self.remaining = size
+        self.block = hashlib.sha256(str(seed).encode()).digest() * (MB // 32)
+        self.counter = 0
+
+    def read(self, n=-1):
+        n = self.remaining if n is None or n < 0 else min(n, self.remaining)
+        out = bytearray()
+        while len(out) < n:
+            self.counter += 1
+            # Vary every block so the content (and its hash) depends on all of it
+            out += self.counter.to_bytes(8, 'big') + self.block[8:n - len(out)]
+        if self.remaining == self.size:
+            out[:len(PDF_HEADER)] = PDF_HEADER
+        self.remaining -= n
+        return bytes(out[:n])
+
+    # The test client measures the body by seeking to its end and back
+    def tell(self):
+        return self.size - self.remaining
+
+    def seek(self, offset, whence=0):
+        self.remaining = self.size - (offset if whence == 0 else self.size + offset)
+
+
+def upload(client, expense_id, size, seed):
+    body = GeneratedFile(size, seed)
+    response = client.post(f'/api/expenses/{expense_id}/attachments?filename=receipt-{seed}.pdf',
+                           input_stream=body, content_type='application/pdf')
+    assert response.status_code == 201, response.get_data(as_text=True)
+    return response.get_json()
+
+
+def disk_usage(root):
+    return sum(os.path.getsize(os.path.join(path, name)) for path, _, names in os.walk(root) for name in names)
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('--large-mb', type=int, default=256)
+    parser.add_argument('--threads', type=int, default=8)
+    parser.add_argument('--concurrent-mb', type=int, default=16, help='Size of each concurrent upload.')
+    parser.add_argument('--runs', type=int, default=20)
+    args = parser.parse_args()
+    app.config['ATTACHMENT_MAX_BYTES'] = max(args.large_mb, args.concurrent_mb) * MB
+
+    with app.app_context():
+        print(f"Storing in {DB_DIR} ...")
+        upgrade()
+        synthetic.generate(companies=1, users_per_company=20, expenses_per_user=2)
+        expense_id = db.session.query(Expense.id).limit(1).scalar()
+        db.session.remove()
+    client = app.test_client()
+    root = app.config['ATTACHMENT_DIR']
+
+    tracemalloc.start()
+    start = time.perf_counter()
+    large = upload(client, expense_id, args.large_mb * MB, seed='large')
+    elapsed = time.perf_counter() - start
+    _, peak = tracemalloc.get_traced_memory()
+    tracemalloc.stop()
+    print(f"\nLarge upload: {args.large_mb} MB in {elapsed:.2f} s ({args.large_mb / elapsed:.0f} MB/s), "
+          f"peak Python heap {peak / MB:.1f} MB (chunk {app.config['ATTACHMENT_CHUNK_SIZE'] / MB:.2f} MB)")
+
+    def concurrent(seeds):
+        errors = []
+
+        def worker(seed):
+            try:
+                upload(app.test_client(), expense_id, args.concurrent_mb * MB, seed)
+            except Exception as e:  # Reported below; a failed thread must not hang the run
+                errors.append(e)
+
+        threads = [threading.Thread(target=worker, args=(seed,)) for seed in seeds]
+        start = time.perf_counter()
+        for thread in threads:
+            thread.start()
+        for thread in threads:
+            thread.join()
+        assert not errors, errors
+        return time.perf_counter() - start
+
+    seeds = [f'concurrent-{i}' for i in range(args.threads)]
+    total_mb = args.threads * args.concurrent_mb
+    elapsed = concurrent(seeds)
+    before = disk_usage(root)
+    print(f"Concurrent uploads: {args.threads} x {args.concurrent_mb} MB in {elapsed:.2f} s "
+          f"({total_mb / elapsed:.0f} MB/s aggregate)")
+    elapsed = concurrent(seeds)
+    print(f"Same files again: {elapsed:.2f} s ({total_mb / elapsed:.0f} MB/s), "
+          f"disk use {before / MB:.0f} MB -> {disk_usage(root) / MB:.0f} MB")
+
+    url = f"/api/attachments/{large['attachment']['id']}/content"
+    for name, headers in (('full download', {}), ('range 1 MB', {'Range': f'bytes={10 * MB}-{11 * MB - 1}'})):
+        timings, size = [], 0
+        for _ in range(args.runs if headers else 3):
+            start = time.perf_counter()
+            response = client.get(url, headers=headers)
+            size = sum(len(chunk) for chunk in response.response)  # Streamed as the server would
+            response.close()
+            timings.append(time.perf_counter() - start)
+        median = statistics.median(timings)
+        print(f"{name}: {size / MB:.0f} MB, median {median * 1000:.1f} ms ({size / MB / median:.0f} MB/s), "
+              f"status {response.status_code}")
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,178 @@
+"""Concurrency stress test: parallel submit / approve / list clients against one database.
+
+Serves the app from a threaded local server on a fresh seeded database and runs
+submitter, approver and reader threads for a fixed time. Submitted expenses go
+to the demo manager, whose approver threads approve them as they arrive.
+Reports throughput, latency and the rate of "database is locked" failures.
+
+    python benchmarks/concurrency.py --submitters 8 --approvers 8 --readers 4 --seconds 20
+    python benchmarks/concurrency.py --baseline    # SQLite defaults: rollback journal, no pragmas
+
+Set DATABASE_URL to run against a server database instead of a temporary SQLite file.
+"""
+import argparse
+import json
+import logging
+import os
+import queue
+import statistics
+import sys
+import tempfile
+import threading
+import time
+import urllib.error
+import urllib.request
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+import config  # noqa: E402
+
+DB_DIR = tempfile.mkdtemp(prefix='expense-bench-')
+if not os.environ.get('DATABASE_URL'):
+    config.Config.SQLALCHEMY_DATABASE_URI = f"sqlite:///{os.path.join(DB_DIR, 'bench.db')}"
+if '--baseline' in sys.argv:
+    config.Config.SQLITE_TUNING = False
+
+from werkzeug.serving import make_server  # noqa: E402
+
+from app import create_app, seed_demo_data  # noqa: E402
+from migrations import upgrade  # noqa: E402
+from models import db, Company, User  # noqa: E402
+
+app = create_app()
+
+
+class LockErrorCounter(logging.Handler):
+    """Counts unhandled request exceptions caused by SQLite lock contention."""
+
+    def __init__(self):
+        super().__init__(level=logging.ERROR)
+        self.count = 0
+        self._lock = threading.Lock()
+
+    def emit(self, record):
+        if record.exc_info and 'database is locked' in str(record.exc_info[1]):
+            with self._lock:
+                self.count += 1
+
+
+class Stats:
+    def __init__(self):
+        self.latencies = []
+        self.errors = 0
+        self._lock = threading.Lock()
+
+    def add(self, ok, elapsed):
+        with self._lock:
+            if ok:
+                self.latencies.append(elapsed)
+            else:
+                self.errors += 1
+
+
+def call(base_url, method, path, body=None):
+    data = json.dumps(body).encode() if body is not None else None
+    req = urllib.request.Request(base_url + path, data=data, method=method,
+                                 headers={'Content-Type': 'application/json'})
+    try:
+        with urllib.request.urlopen(req, timeout=60) as resp:
+            return resp.status, json.loads(resp.read() or b'null')
+    except urllib.error.HTTPError as e:
+        return e.code, None
+
+
+def run(args, base_url, employee_ids, manager_id):
+    deadline = time.monotonic() + args.seconds
+    pending = queue.Queue()
+    stats = {'submit': Stats(), 'approve': Stats(), 'list': Stats()}
+
+    def submitter(n):
+        user_id = employee_ids[n % len(employee_ids)]
+        while time.monotonic() < deadline:
+            start = time.perf_counter()
+            status, body = call(base_url, 'POST', '/api/expenses',
+                                {'user_id': user_id, 'title': 'Stress', 'amount': 42, 'currency': 'USD'})
+            stats['submit'].add(status == 201, time.perf_counter() - start)
+            if status == 201:
+                for step in body['expense']['approval_steps']:
+                    if step['approver_id'] == manager_id:
+                        pending.put(step['id'])
+
+    def approver(_):
+        while time.monotonic() < deadline:
+            try:
+                step_id = pending.get(timeout=0.1)
+            except queue.Empty:
+                continue
+            start = time.perf_counter()
+            status, _ = call(base_url, 'PUT', f'/api/approvals/{step_id}',
+                             {'decision': 'approved', 'comments': 'ok', 'approver_id': manager_id})
+            stats['approve'].add(status == 200, time.perf_counter() - start)
+
+    def reader(_):
+        while time.monotonic() < deadline:
+            start = time.perf_counter()
+            status, _ = call(base_url, 'GET', '/api/expenses/all?per_page=20')
+            stats['list'].add(status == 200, time.perf_counter() - start)
+
+    threads = [threading.Thread(target=submitter, args=(n,)) for n in range(args.submitters)]
+    threads += [threading.Thread(target=approver, args=(n,)) for n in range(args.approvers)]
+    threads += [threading.Thread(target=reader, args=(n,)) for n in range(args.readers)]
+    for thread in threads:
+        thread.start()
+    for thread in threads:
+        thread.join()
+    return stats
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('--submitters', type=int, default=8)
+    parser.add_argument('--approvers', type=int, default=8)
+    parser.add_argument('--readers', type=int, default=4)
+    parser.add_argument('--seconds', type=float, default=15)
+    parser.add_argument('--baseline', action='store_true', help='Disable WAL and the SQLite pragmas.')
+    args = parser.parse_args()
+
+    logging.getLogger('werkzeug').setLevel(logging.ERROR)
+    lock_errors = LockErrorCounter()
+    app.logger.addHandler(lock_errors)
+    app.logger.propagate = False
+
+    with app.app_context():
+        upgrade()
+        if Company.query.first() is None:
+            seed_demo_data()
+        employee_ids = [u.id for u in User.query.filter_by(role='Employee').order_by(User.id)]
+        manager_id = db.session.get(User, employee_ids[0]).manager_id
+        print(f"Database: {app.config['SQLALCHEMY_DATABASE_URI']}"
+              f" ({'baseline' if args.baseline else 'tuned'} engine settings)")
+
+    server = make_server('127.0.0.1', 0, app, threaded=True)
+    threading.Thread(target=server.serve_forever, daemon=True).start()
+    base_url = f'http://127.0.0.1:{server.server_port}'
+
+    try:
+        stats = run(args, base_url, employee_ids, manager_id)
+    finally:
+        server.shutdown()
+
+    total_ok = total_err = 0
+    print(f"\n{'operation':<10} {'ok':>7} {'errors':>7} {'ops/s':>8} {'p50 ms':>8} {'p95 ms':>8}")
+    for name, s in stats.items():
+        ok = len(s.latencies)
+        total_ok += ok
+        total_err += s.errors
+        ms = sorted(x * 1000 for x in s.latencies)
+        p50 = statistics.median(ms) if ms else 0
+        p95 = ms[int(len(ms) * 0.95) - 1] if ms else 0
+        print(f"{name:<10} {ok:>7} {s.errors:>7} {ok / args.seconds:8.1f} {p50:8.1f} {p95:8.1f}")
+
+    requests_made = total_ok + total_err
+    print(f"\nThroughput: {total_ok / args.seconds:.1f} successful requests/s")
+    print(f"Lock errors: {lock_errors.count} of {requests_made} requests"
+          f" ({100 * lock_errors.count / max(requests_made, 1):.2f}%)")
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,118 @@
+"""Duplicate detection: cost of the submission-time checks and throughput of the batch report.
+
+Builds a synthetic SQLite database (synthetic.py), then times POST /api/expenses
+for new expenses (exact and near-duplicate lookups included), for exact
+resubmissions (refused with 409) and for Idempotency-Key retries (answered
+with the stored expense), and prints the query plan of every duplicate lookup
+a submission runs: each one must SEARCH an index, never SCAN the table.
+Finally it times duplicates.report() over all expenses.
+
+    python benchmarks/duplicates.py --companies 4 --users-per-company 2500 --expenses-per-user 20
+"""
+import argparse
+import os
+import statistics
+import sys
+import tempfile
+import time
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+import config  # noqa: E402
+
+DB_DIR = tempfile.mkdtemp(prefix='expense-bench-')
+config.Config.SQLALCHEMY_DATABASE_URI = f"sqlite:///{os.path.join(DB_DIR, 'bench.db')}"
+
+from sqlalchemy import event  # noqa: E402
+
+from app import create_app  # noqa: E402
+import duplicates  # noqa: E402
+from migrations import upgrade  # noqa: E402
+from models import db, User  # noqa: E402
+import synthetic  # noqa: E402
+
+app = create_app()
+TENANT = {'X-Company-Id': '1'}
+
+
+def submit(client, body, headers, expected_status):
+    start = time.perf_counter()
+    response = client.post('/api/expenses', json=body, headers=headers)
+    elapsed = (time.perf_counter() - start) * 1000
+    assert response.status_code == expected_status, response.get_data(as_text=True)
+    return elapsed
+
+
+def duplicate_lookup_plans(client, body):
+    """EXPLAIN QUERY PLAN of the duplicate lookups one submission runs."""
+    statements = []
+
+    def capture(conn, cursor, statement, parameters, context, executemany):
+        if statement.startswith('SELECT') and ('fingerprint' in statement or 'idempotency_key' in statement
+                                               or '.date BETWEEN' in statement):
+            statements.append((statement, parameters))
+
+    event.listen(db.engine, 'before_cursor_execute', capture)
+    try:
+        client.post('/api/expenses', json=body, headers={**TENANT, 'Idempotency-Key': 'plan'})
+    finally:
+        event.remove(db.engine, 'before_cursor_execute', capture)
+    with db.engine.connect() as conn:
+        return [[row[-1] for row in conn.exec_driver_sql('EXPLAIN QUERY PLAN ' + statement, parameters)]
+                for statement, parameters in statements]
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('--companies', type=int, default=4)
+    parser.add_argument('--users-per-company', type=int, default=2500)
+    parser.add_argument('--expenses-per-user', type=int, default=20)
+    parser.add_argument('--runs', type=int, default=200)
+    args = parser.parse_args()
+
+    with app.app_context():
+        print(f"Building synthetic dataset in {DB_DIR} ...")
+        upgrade()
+        counts = synthetic.generate(companies=args.companies, users_per_company=args.users_per_company,
+                                    expenses_per_user=args.expenses_per_user)
+        print(f"{counts['expenses']} expenses")
+        user_ids = db.session.query(User.id).filter(
+            User.company_id == 1, User.manager_id.isnot(None)
+        ).limit(args.runs).all()
+        db.session.remove()
+        client = app.test_client()
+
+        bodies = [{'user_id': user_id, 'title': f'Benchmark expense {i}', 'amount': 100 + i,
+                   'currency': 'USD', 'date': '2026-01-15'} for i, (user_id,) in enumerate(user_ids)]
+        rows = [
+            ('new expense', [submit(client, body, TENANT, 201) for body in bodies]),
+            ('exact duplicate', [submit(client, body, TENANT, 409) for body in bodies]),
+        ]
+        keyed = [({**body, 'title': f"Keyed {body['title']}"}, {**TENANT, 'Idempotency-Key': f'key-{i}'})
+                 for i, body in enumerate(bodies)]
+        rows.append(('keyed, first', [submit(client, body, headers, 201) for body, headers in keyed]))
+        rows.append(('keyed, retry', [submit(client, body, headers, 200) for body, headers in keyed]))
+
+        print(f"\n{'POST /api/expenses':<20} {'median ms':>10} {'p95 ms':>8}")
+        for name, timings in rows:
+            timings.sort()
+            print(f"{name:<20} {statistics.median(timings):10.2f} {timings[int(len(timings) * 0.95)]:8.2f}")
+
+        print("\nDuplicate lookup plans:")
+        plan_body = {**bodies[0], 'title': 'Plan expense', 'amount': 99.5}
+        for plan in duplicate_lookup_plans(client, plan_body):
+            print('  ' + ' / '.join(plan))
+        db.session.remove()
+
+        start = time.perf_counter()
+        found = {'exact': 0, 'near': 0}
+        for row in duplicates.report(app.config['DUPLICATE_WINDOW_DAYS'], app.config['DUPLICATE_AMOUNT_TOLERANCE']):
+            found[row['kind']] += 1
+        elapsed = time.perf_counter() - start
+        total = counts['expenses'] + 2 * len(bodies)
+        print(f"\nReport: {found['exact']} exact, {found['near']} near over ~{total} expenses "
+              f"in {elapsed:.1f} s ({total / elapsed:.0f} expenses/s)")
+
+
+if __name__ == '__main__':
+    main()
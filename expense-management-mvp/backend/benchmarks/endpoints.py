@@ -0,0 +1,334 @@
+"""Endpoint load test: every route in app.py against a synthetic dataset.
+
+Builds a temporary SQLite database with synthetic.generate(), then drives each
+route through the Flask test client (in process, so no network or server
+overhead is measured) and reports per route: p50 / p95 / p99 latency,
+sequential throughput, SQL statements per request and the status codes seen.
+Requests carry the X-Company-Id tenant header like the frontend does.
+
+Results are written as JSON for comparison across runs:
+
+    python benchmarks/endpoints.py --output before.json
+    python benchmarks/endpoints.py --output after.json --compare before.json
+    python benchmarks/endpoints.py --routes history,approvals --requests 200
+
+Routes without a case below are listed under "uncovered" in the output.
+"""
+import argparse
+import itertools
+import json
+import os
+import platform
+import statistics
+import sys
+import tempfile
+import time
+from datetime import datetime
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+import config  # noqa: E402
+
+DB_DIR = tempfile.mkdtemp(prefix='expense-bench-')
+config.Config.SQLALCHEMY_DATABASE_URI = f"sqlite:///{os.path.join(DB_DIR, 'bench.db')}"
+
+import sqlalchemy  # noqa: E402
+from sqlalchemy import event, func  # noqa: E402
+
+import synthetic  # noqa: E402
+from app import create_app, rate_cache  # noqa: E402
+from migrations import upgrade  # noqa: E402
+from models import db, User, Expense, ApprovalEvent, ApprovalStep, ApproverGroup  # noqa: E402
+
+app = create_app()
+
+
+class QueryCounter:
+    """Counts SQL statements sent to the engine."""
+
+    def __init__(self, engine):
+        self.count = 0
+        event.listen(engine, 'before_cursor_execute', self._on_execute)
+
+    def _on_execute(self, *args):
+        self.count += 1
+
+
+class Fixtures:
+    """Ids and helpers the request builders need, taken from the first synthetic company."""
+
+    def __init__(self, client, company_id):
+        self.client = client
+        self.company_id = company_id
+        self.headers = {'X-Company-Id': str(company_id)}
+        self._serial = itertools.count(1)
+
+        users = User.query.filter_by(company_id=company_id)
+        self.admin_id = users.filter_by(role='Admin').order_by(User.id).first().id
+        # The approver with the longest queue, and the submitter with the longest history
+        self.manager_id = db.session.query(ApprovalStep.approver_id).filter(
+            ApprovalStep.company_id == company_id, ApprovalStep.status == 'Waiting',
+            ApprovalStep.approver_id.isnot(None)
+        ).group_by(ApprovalStep.approver_id).order_by(func.count().desc()).limit(1).scalar()
+        self.employee_id = db.session.query(Expense.user_id).filter(
+            Expense.company_id == company_id
+        ).group_by(Expense.user_id).order_by(func.count().desc()).limit(1).scalar()
+        employee = db.session.get(User, self.employee_id)
+        self.employee_email = employee.email
+        self.employee_manager_id = employee.manager_id
+        self.leaf_id = users.filter_by(role='Employee').order_by(User.id.desc()).first().id
+        self.expense_id = db.session.query(Expense.id).filter(
+            Expense.company_id == company_id).order_by(Expense.id.desc()).limit(1).scalar()
+        self.group_id = ApproverGroup.query.filter_by(company_id=company_id).first().id
+
+    def serial(self):
+        return next(self._serial)
+
+    def post(self, url, body):
+        response = self.client.post(url, json=body, headers=self.headers)
+        assert response.status_code in (200, 201), (url, response.status_code, response.get_data(as_text=True))
+        return response.get_json()
+
+    def submit(self, amount=42):
+        body = {'user_id': self.employee_id, 'title': 'Bench', 'amount': amount, 'currency': 'USD'}
+        return self.post('/api/expenses', body)['expense']
+
+    def first_step(self, expense):
+        return expense['approval_steps'][0]
+
+    def new_events_url(self):
+        """Submits an expense; the manager's event stream URL resuming just before it."""
+        last_id = db.session.query(func.max(ApprovalEvent.id)).scalar() or 0
+        self.submit()
+        return f'/api/approvals/{self.employee_manager_id}/events?last_event_id={last_id}'
+
+
+def build_cases(fx):
+    """(name, method, url rule, builder) for each benchmarked request.
+
+    A builder runs untimed before every request (so it may create the rows the
+    request consumes) and returns (url, kwargs for the test client).
+    """
+    h = {'headers': fx.headers}
+
+    def user_body():
+        n = fx.serial()
+        return {'name': f'Bench {n}', 'email': f'bench{n}@bench.test', 'password': 'x', 'role': 'Employee',
+                'company_id': fx.company_id, 'manager_id': fx.admin_id}
+
+    def rule_body():
+        return {'name': f'Bench rule {fx.serial()}', 'approver_type': 'direct_manager', 'sequence': 9,
+                'is_active': False}
+
+    import_rows = ''.join(
+        json.dumps({'user_id': fx.employee_id, 'title': f'Import {i}', 'amount': 10 + i, 'currency': 'EUR'}) + '\n'
+        for i in range(100)
+    )
+
+    return [
+        # Auth and users
+        ('login', 'POST', '/api/auth/login',
+         lambda: ('/api/auth/login', {'json': {'email': fx.employee_email, 'password': synthetic.SYNTHETIC_PASSWORD}})),
+        ('register', 'POST', '/api/auth/register',
+         lambda: ('/api/auth/register', {'json': {**user_body(), 'company_id': fx.company_id}})),
+        ('list users', 'GET', '/api/users', lambda: ('/api/users', h)),
+        ('create user', 'POST', '/api/admin/users/create',
+         lambda: ('/api/admin/users/create', {'json': user_body(), **h})),
+        ('update user', 'PUT', '/api/admin/users/<int:user_id>',
+         lambda: (f'/api/admin/users/{fx.leaf_id}', {'json': {'name': f'Renamed {fx.serial()}'}, **h})),
+        ('delete user', 'DELETE', '/api/admin/users/<int:user_id>',
+         lambda: (f"/api/admin/users/{fx.post('/api/admin/users/create', user_body())['user']['id']}", h)),
+        ('reporting subtree', 'GET', '/api/users/<int:user_id>/reports',
+         lambda: (f'/api/users/{fx.admin_id}/reports', h)),
+        ('manager chain', 'GET', '/api/users/<int:user_id>/chain',
+         lambda: (f'/api/users/{fx.leaf_id}/chain', h)),
+
+        # Policies
+        ('get policy', 'GET', '/api/admin/policies/<int:company_id>',
+         lambda: (f'/api/admin/policies/{fx.company_id}', h)),
+        ('create rule', 'POST', '/api/admin/policies/<int:company_id>/rules',
+         lambda: (f'/api/admin/policies/{fx.company_id}/rules', {'json': rule_body(), **h})),
+        ('update rule', 'PUT', '/api/admin/policies/rules/<int:rule_id>',
+         lambda: (f"/api/admin/policies/rules/{fx.post(f'/api/admin/policies/{fx.company_id}/rules', rule_body())['rule']['id']}",
+                  {'json': {'name': 'Renamed rule'}, **h})),
+        ('delete rule', 'DELETE', '/api/admin/policies/rules/<int:rule_id>',
+         lambda: (f"/api/admin/policies/rules/{fx.post(f'/api/admin/policies/{fx.company_id}/rules', rule_body())['rule']['id']}", h)),
+        ('create group', 'POST', '/api/admin/approver-groups',
+         lambda: ('/api/admin/approver-groups',
+                  {'json': {'name': f'Bench group {fx.serial()}', 'company_id': fx.company_id,
+                            'member_ids': [fx.admin_id]}, **h})),
+        ('update group', 'PUT', '/api/admin/approver-groups/<int:group_id>',
+         lambda: (f'/api/admin/approver-groups/{fx.group_id}', {'json': {'name': 'Finance Approvers'}, **h})),
+
+        # Expenses
+        ('submit expense', 'POST', '/api/expenses',
+         lambda: ('/api/expenses', {'json': {'user_id': fx.employee_id, 'title': 'Bench', 'amount': 900,
+                                             'currency': 'EUR', 'category': 'Travel'}, **h})),
+        ('import 100 rows', 'POST', '/api/expenses/import',
+         lambda: ('/api/expenses/import?format=ndjson', {'data': import_rows, **h})),
+        ('approval queue', 'GET', '/api/approvals/<int:user_id>',
+         lambda: (f'/api/approvals/{fx.manager_id}', h)),
+        ('queue events catch-up', 'GET', '/api/approvals/<int:user_id>/events',
+         lambda: (fx.new_events_url(), h)),
+        ('approve step', 'PUT', '/api/approvals/<int:step_id>',
+         lambda: (f"/api/approvals/{fx.first_step(fx.submit())['id']}",
+                  {'json': {'decision': 'approved', 'approver_id': fx.employee_manager_id}, **h})),
+        ('approve batch of 10', 'POST', '/api/approvals/batch',
+         lambda: ('/api/approvals/batch', {'json': {
+             'approver_id': fx.employee_manager_id,
+             'decisions': [{'step_id': fx.first_step(fx.submit())['id'], 'decision': 'approved'} for _ in range(10)]
+         }, **h})),
+        ('convert currency', 'GET', '/api/utility/currency',
+         lambda: ('/api/utility/currency?from=EUR&to=USD&amount=100', h)),
+        ('expense detail', 'GET', '/api/expenses/<int:expense_id>',
+         lambda: (f'/api/expenses/{fx.expense_id}', h)),
+        ('history', 'GET', '/api/expenses/history/<int:user_id>',
+         lambda: (f'/api/expenses/history/{fx.employee_id}', h)),
+        ('history, sparse', 'GET', '/api/expenses/history/<int:user_id>',
+         lambda: (f'/api/expenses/history/{fx.employee_id}?fields=id,title,amount,status&include=', h)),
+        ('history, 304', 'GET', '/api/expenses/history/<int:user_id>',
+         lambda: (f'/api/expenses/history/{fx.employee_id}',
+                  {'headers': {**fx.headers, 'If-None-Match': fx.client.get(
+                      f'/api/expenses/history/{fx.employee_id}', headers=fx.headers).headers['ETag']}})),
+        ('all expenses', 'GET', '/api/expenses/all', lambda: ('/api/expenses/all', h)),
+        ('all expenses, Pending', 'GET', '/api/expenses/all', lambda: ('/api/expenses/all?status=Pending', h)),
+        ('search', 'GET', '/api/expenses/search', lambda: ('/api/expenses/search?q=hotel', h)),
+        ('export csv', 'GET', '/api/expenses/export',
+         lambda: (f'/api/expenses/export?format=csv&user_id={fx.employee_id}', h)),
+        ('spend analytics', 'GET', '/api/analytics/spend',
+         lambda: ('/api/analytics/spend?group_by=category,month', h)),
+        ('health', 'GET', '/api/health', lambda: ('/api/health', h)),
+        ('metrics', 'GET', '/api/metrics', lambda: ('/api/metrics', h)),
+    ]
+
+
+def percentile(sorted_values, pct):
+    if not sorted_values:
+        return 0.0
+    index = min(len(sorted_values) - 1, max(0, round(pct / 100 * len(sorted_values)) - 1))
+    return sorted_values[index]
+
+
+def run_case(client, counter, builder, method, n_requests, warmup):
+    timings, queries, statuses = [], [], {}
+    for i in range(warmup + n_requests):
+        url, kwargs = builder()
+        before = counter.count
+        start = time.perf_counter()
+        response = client.open(url, method=method, **kwargs)
+        response.get_data()  # Drain streamed bodies
+        elapsed = time.perf_counter() - start
+        if i < warmup:
+            continue
+        timings.append(elapsed * 1000)
+        queries.append(counter.count - before)
+        statuses[str(response.status_code)] = statuses.get(str(response.status_code), 0) + 1
+
+    ms = sorted(timings)
+    return {
+        'requests': n_requests,
+        'p50_ms': round(percentile(ms, 50), 3),
+        'p95_ms': round(percentile(ms, 95), 3),
+        'p99_ms': round(percentile(ms, 99), 3),
+        'mean_ms': round(statistics.fmean(ms), 3),
+        'throughput_rps': round(n_requests / (sum(ms) / 1000), 1),
+        'queries_per_request': round(statistics.fmean(queries), 2),
+        'status_codes': statuses
+    }
+
+
+def uncovered_routes(cases):
+    covered = {(rule, method) for _, method, rule, _ in cases}
+    return sorted(
+        f'{method} {rule.rule}'
+        for rule in app.url_map.iter_rules() if rule.endpoint != 'static'
+        for method in rule.methods - {'HEAD', 'OPTIONS'}
+        if (rule.rule, method) not in covered
+    )
+
+
+def compare(results, baseline_path):
+    with open(baseline_path) as f:
+        baseline = {r['name']: r for r in json.load(f)['results']}
+    print(f"\n{'endpoint':<24} {'p50 ms':>17} {'p95 ms':>17} {'queries':>13}", file=sys.stderr)
+    for r in results:
+        old = baseline.get(r['name'])
+        if old is None:
+            continue
+        cells = []
+        for key in ('p50_ms', 'p95_ms'):
+            change = (r[key] - old[key]) / old[key] * 100 if old[key] else 0.0
+            cells.append(f"{old[key]:7.2f}->{r[key]:7.2f} {change:+5.0f}%")
+        cells.append(f"{old['queries_per_request']:5.1f}->{r['queries_per_request']:5.1f}")
+        print(f"{r['name']:<24} " + ' '.join(cells), file=sys.stderr)
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('--companies', type=int, default=3)
+    parser.add_argument('--users-per-company', type=int, default=200)
+    parser.add_argument('--expenses-per-user', type=int, default=20)
+    parser.add_argument('--requests', type=int, default=50, help='Timed requests per endpoint.')
+    parser.add_argument('--warmup', type=int, default=3)
+    parser.add_argument('--routes', help='Comma separated substrings; only matching endpoint names run.')
+    parser.add_argument('--seed', type=int, default=42)
+    parser.add_argument('--output', help='Write the JSON results here instead of stdout.')
+    parser.add_argument('--compare', help='A previous --output file to print changes against.')
+    args = parser.parse_args()
+
+    # Rates come from the synthetic table instead of the network
+    rate_cache.fetcher = lambda base: {cur: synthetic.synthetic_rate(base, cur) for cur in synthetic.USD_RATES}
+    # Event streams end after their backlog, so each request is one catch-up read
+    app.config['SSE_MAX_STREAM_SECONDS'] = 0
+
+    with app.app_context():
+        print(f"Building synthetic dataset in {DB_DIR} ...", file=sys.stderr)
+        upgrade()
+        counts = synthetic.generate(companies=args.companies, users_per_company=args.users_per_company,
+                                    expenses_per_user=args.expenses_per_user, seed=args.seed)
+        client = app.test_client()
+        counter = QueryCounter(db.engine)
+        fx = Fixtures(client, company_id=1)
+
+        cases = build_cases(fx)
+        selected = [c for c in cases if not args.routes
+                    or any(part and part in c[0] for part in args.routes.split(','))]
+
+        results = []
+        for name, method, rule, builder in selected:
+            result = run_case(client, counter, builder, method, args.requests, args.warmup)
+            results.append({'name': name, 'method': method, 'route': rule, **result})
+            print(f"  {name:<24} p50 {result['p50_ms']:8.2f} ms  p95 {result['p95_ms']:8.2f} ms"
+                  f"  {result['queries_per_request']:6.1f} queries", file=sys.stderr)
+            db.session.remove()
+
+    report = {
+        'meta': {
+            'timestamp': datetime.utcnow().isoformat(timespec='seconds') + 'Z',
+            'python': platform.python_version(),
+            'sqlalchemy': sqlalchemy.__version__,
+            'database': 'sqlite',
+            'dataset': {**vars(args), **counts},
+        },
+        'results': results,
+        'uncovered': uncovered_routes(cases),
+    }
+    for key in ('output', 'compare', 'routes'):
+        report['meta']['dataset'].pop(key, None)
+
+    payload = json.dumps(report, indent=2)
+    if args.output:
+        with open(args.output, 'w') as f:
+            f.write(payload + '\n')
+        print(f"Results written to {args.output}", file=sys.stderr)
+    else:
+        print(payload)
+
+    if report['uncovered']:
+        print(f"Not benchmarked: {', '.join(report['uncovered'])}", file=sys.stderr)
+    if args.compare:
+        compare(results, args.compare)
+
+
+if __name__ == '__main__':
+    main()
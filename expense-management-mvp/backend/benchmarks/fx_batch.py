@@ -0,0 +1,159 @@
+"""Historical FX: batch conversion throughput against per-item rate lookups.
+
+Loads a synthetic rate history (--years of weekday rates for --currencies
+currencies) into a scratch SQLite database and times, for each batch size:
+
+* POST /api/utility/currency/batch end to end (JSON in and out included);
+* RateMatrix.convert alone, with numpy and with the pure-Python fallback;
+* the naive alternative: one indexed SELECT per item for its currency's
+  latest rate on or before its date (two per item, for the pair).
+
+    python benchmarks/fx_batch.py --years 10 --currencies 30 --sizes 1000 10000 100000
+"""
+import argparse
+import os
+import random
+import statistics
+import sys
+import tempfile
+import time
+from array import array
+from datetime import date, timedelta
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+import config  # noqa: E402
+
+DB_DIR = tempfile.mkdtemp(prefix='expense-bench-')
+config.Config.SQLALCHEMY_DATABASE_URI = f"sqlite:///{os.path.join(DB_DIR, 'bench.db')}"
+
+from sqlalchemy import select  # noqa: E402
+
+from app import create_app  # noqa: E402
+import fx_history  # noqa: E402
+from migrations import upgrade  # noqa: E402
+from models import db, FxRate  # noqa: E402
+
+app = create_app()
+
+
+def synthetic_history(currencies, start, end, seed=7):
+    """Random-walk weekday rates per USD, as fx_history.store() takes them."""
+    rng = random.Random(seed)
+    levels = {currency: rng.uniform(0.5, 150) for currency in currencies}
+    rates_by_day = {}
+    day = start
+    while day <= end:
+        if day.weekday() < 5:
+            for currency in currencies:
+                levels[currency] *= 1 + rng.gauss(0, 0.004)
+            rates_by_day[day] = {'USD': 1.0, **levels}
+        day += timedelta(days=1)
+    return rates_by_day
+
+
+def per_item_lookup(amounts, currencies, dates, to_currency):
+    """What a loop over get-rate-for-this-day would do."""
+    def rate(currency, day):
+        return db.session.execute(
+            select(FxRate.rate).where(FxRate.currency == currency, FxRate.date <= day)
+            .order_by(FxRate.date.desc()).limit(1)
+        ).scalar()
+
+    target = {}
+    converted = []
+    for amount, currency, day in zip(amounts, currencies, dates):
+        day = fx_history.parse_date(day)
+        if day not in target:
+            target[day] = rate(to_currency, day)
+        source = rate(currency, day)
+        converted.append(round(amount * (target[day] / source), 2) if source and target[day] else None)
+    return converted
+
+
+def same(a, b):
+    """Equal up to a cent: numpy and Python round halves of a cent differently now and then."""
+    return len(a) == len(b) and all(x == y or (x is not None and y is not None and abs(x - y) <= 0.0100001)
+                                    for x, y in zip(a, b))
+
+
+def timed(fn, runs):
+    timings = []
+    result = None
+    for _ in range(runs):
+        start = time.perf_counter()
+        result = fn()
+        timings.append(time.perf_counter() - start)
+    return statistics.median(timings), result
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('--years', type=int, default=10)
+    parser.add_argument('--currencies', type=int, default=30)
+    parser.add_argument('--sizes', type=int, nargs='+', default=[1000, 10000, 100000])
+    parser.add_argument('--naive-limit', type=int, default=10000, help='Largest batch to time per-item lookups on.')
+    parser.add_argument('--runs', type=int, default=5)
+    args = parser.parse_args()
+
+    currencies = ['EUR', 'GBP', 'JPY', 'INR', 'CAD'] + [f'X{i:02d}' for i in range(max(args.currencies - 5, 0))]
+    currencies = currencies[:args.currencies]
+    end = date(2026, 6, 30)
+    start = date(end.year - args.years, 7, 1)
+    rng = random.Random(11)
+    client = app.test_client()
+
+    with app.app_context():
+        print(f"Storing rates in {DB_DIR} ...")
+        upgrade()
+        began = time.perf_counter()
+        rows = fx_history.store(synthetic_history(currencies, start, end), 'synthetic')
+        print(f"{rows} rates ({args.years} years x {len(currencies) + 1} currencies) "
+              f"in {time.perf_counter() - began:.1f} s")
+        base, fill_days = app.config['FX_HISTORY_BASE'], app.config['FX_HISTORY_FILL_DAYS']
+        began = time.perf_counter()
+        matrix = fx_history.rate_matrix(base, fill_days)
+        print(f"Matrix build: {(time.perf_counter() - began) * 1000:.0f} ms, "
+              f"{matrix.days} days x {len(matrix.currencies)} currencies")
+        flat = matrix
+        if fx_history.np is not None:
+            # The same cells laid out the way the fallback keeps them
+            flat = fx_history.RateMatrix(matrix.start, matrix.currencies, matrix.days,
+                                         array('d', matrix.values.ravel().tolist()))
+
+        span = (end - start).days
+        print(f"\n{'items':>7} {'endpoint ms':>12} {'numpy ms':>9} {'python ms':>10} {'per-item ms':>12}")
+        for size in args.sizes:
+            amounts = [round(rng.uniform(1, 5000), 2) for _ in range(size)]
+            item_currencies = [rng.choice(currencies) for _ in range(size)]
+            dates = [(start + timedelta(days=rng.randrange(span))).isoformat() for _ in range(size)]
+            body = {'to': 'EUR', 'amounts': amounts, 'currencies': item_currencies, 'dates': dates}
+
+            def endpoint():
+                response = client.post('/api/utility/currency/batch', json=body)
+                assert response.status_code == 200, response.get_data(as_text=True)
+                return response.get_json()['converted_amounts']
+
+            endpoint_time, converted = timed(endpoint, args.runs)
+            numpy_time = python_time = None
+            if fx_history.np is not None:
+                numpy_time, numpy_result = timed(
+                    lambda: matrix._convert_numpy(amounts, item_currencies, dates, 'EUR'), args.runs)
+                assert same(numpy_result[0], converted)
+            python_time, python_result = timed(
+                lambda: flat._convert_python(amounts, item_currencies, dates, 'EUR'), args.runs)
+            assert same(python_result[0], converted)
+
+            naive = '-'
+            if size <= args.naive_limit:
+                naive_time, naive_result = timed(lambda: per_item_lookup(amounts, item_currencies, dates, 'EUR'), 1)
+                assert same(naive_result, converted)
+                naive = f'{naive_time * 1000:.0f}'
+            print(f"{size:>7} {endpoint_time * 1000:12.1f} "
+                  f"{'-' if numpy_time is None else f'{numpy_time * 1000:.1f}':>9} "
+                  f"{python_time * 1000:10.1f} {naive:>12}")
+        db.session.remove()
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,142 @@
+"""Per-tenant latency as the number of tenants on the platform grows.
+
+Grows one synthetic SQLite database tenant by tenant (every tenant has the same
+users and expenses) and, at each size, times tenant 1's hot endpoints with the
+X-Company-Id header (scoped) and without it (unscoped). Scoped medians should
+stay flat while unscoped ones grow with the platform.
+
+    python benchmarks/multi_tenant.py --tenants 1,10,50,100 --expenses-per-tenant 2000
+"""
+import argparse
+import os
+import random
+import statistics
+import sys
+import tempfile
+import time
+from datetime import datetime, timedelta
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+import config  # noqa: E402
+
+DB_DIR = tempfile.mkdtemp(prefix='expense-bench-')
+config.Config.SQLALCHEMY_DATABASE_URI = f"sqlite:///{os.path.join(DB_DIR, 'bench.db')}"
+
+from sqlalchemy import insert  # noqa: E402
+
+from app import create_app  # noqa: E402
+from migrations import upgrade  # noqa: E402
+from models import db, Company, User, Expense, ApprovalStep  # noqa: E402
+from rollups import rebuild as rebuild_rollups  # noqa: E402
+
+app = create_app()
+
+CHUNK = 5000
+
+
+def bulk_insert(model, rows):
+    for i in range(0, len(rows), CHUNK):
+        db.session.execute(insert(model), rows[i:i + CHUNK])
+
+
+def add_tenants(first, last, users_per_tenant, expenses_per_tenant, rng):
+    """Adds companies first..last, each with an identical shape of users and expenses."""
+    now = datetime.utcnow()
+    user_id = db.session.query(db.func.coalesce(db.func.max(User.id), 0)).scalar()
+    expense_id = db.session.query(db.func.coalesce(db.func.max(Expense.id), 0)).scalar()
+
+    companies, users, expenses, steps = [], [], [], []
+    for company_id in range(first, last + 1):
+        companies.append({'id': company_id, 'name': f'Company {company_id}', 'base_currency': 'USD'})
+        admin_id = user_id + 1
+        managers, employees = [], []
+        for u in range(users_per_tenant):
+            user_id += 1
+            if u == 0:
+                role, manager_id = 'Admin', None
+            elif u <= max(2, users_per_tenant // 10):
+                role, manager_id = 'Manager', admin_id
+                managers.append(user_id)
+            else:
+                role, manager_id = 'Employee', rng.choice(managers)
+                employees.append((user_id, manager_id))
+            users.append({'id': user_id, 'email': f'user{user_id}@bench.test', 'password': 'x',
+                          'name': f'User {user_id}', 'role': role, 'company_id': company_id,
+                          'manager_id': manager_id})
+
+        for _ in range(expenses_per_tenant):
+            expense_id += 1
+            submitter, manager_id = rng.choice(employees)
+            status = rng.choices(['Pending', 'Approved', 'Rejected'], [2, 6, 2])[0]
+            submitted_at = now - timedelta(minutes=rng.randint(0, 365 * 24 * 60))
+            expenses.append({'id': expense_id, 'user_id': submitter, 'company_id': company_id,
+                             'title': f'Expense {expense_id}', 'description': '',
+                             'amount': round(rng.uniform(5, 2000), 2), 'currency': 'USD',
+                             'category': rng.choice(['Travel', 'Meals', 'Office Supplies', 'Other']),
+                             'date': submitted_at.date(), 'status': status, 'submitted_at': submitted_at,
+                             'pending_step_count': 1 if status == 'Pending' else 0})
+            steps.append({'expense_id': expense_id, 'company_id': company_id, 'approver_id': manager_id,
+                          'sequence': 1, 'required_approvals': 1, 'approval_count': 0,
+                          'status': {'Pending': 'Waiting', 'Approved': 'Approved', 'Rejected': 'Skipped'}[status],
+                          'created_at': submitted_at})
+
+    bulk_insert(Company, companies)
+    bulk_insert(User, users)
+    bulk_insert(Expense, expenses)
+    bulk_insert(ApprovalStep, steps)
+    db.session.commit()
+
+
+def endpoints():
+    manager = User.query.filter_by(company_id=1, role='Manager').order_by(User.id).first()
+    return [
+        ('GET /api/users', '/api/users'),
+        ('GET all expenses, Pending', '/api/expenses/all?status=Pending'),
+        ('GET approval queue', f'/api/approvals/{manager.id}'),
+    ]
+
+
+def median_ms(client, url, headers, runs):
+    client.get(url, headers=headers)  # Warm up
+    timings = []
+    for _ in range(runs):
+        start = time.perf_counter()
+        client.get(url, headers=headers)
+        timings.append((time.perf_counter() - start) * 1000)
+    return statistics.median(timings)
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('--tenants', default='1,10,50,100', help='Comma separated tenant counts to measure at.')
+    parser.add_argument('--users-per-tenant', type=int, default=50)
+    parser.add_argument('--expenses-per-tenant', type=int, default=2000)
+    parser.add_argument('--runs', type=int, default=10)
+    args = parser.parse_args()
+    sizes = sorted(int(n) for n in args.tenants.split(','))
+
+    rng = random.Random(42)
+    rows = []
+    with app.app_context():
+        print(f"Building synthetic dataset in {DB_DIR} ...")
+        upgrade()
+        client = app.test_client()
+        tenants = 0
+        for size in sizes:
+            add_tenants(tenants + 1, size, args.users_per_tenant, args.expenses_per_tenant, rng)
+            tenants = size
+            rebuild_rollups()
+            for label, url in endpoints():
+                scoped = median_ms(client, url, {'X-Company-Id': '1'}, args.runs)
+                unscoped = median_ms(client, url, {}, args.runs)
+                rows.append((tenants, label, scoped, unscoped))
+            print(f"  measured at {tenants} tenants ({tenants * args.expenses_per_tenant} expenses)")
+
+    print(f"\n{'tenants':>7}  {'endpoint':<28} {'scoped ms':>10} {'unscoped ms':>12}")
+    for tenants, label, scoped, unscoped in rows:
+        print(f"{tenants:>7}  {label:<28} {scoped:10.2f} {unscoped:12.2f}")
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,191 @@
+"""Query plans and timings for the hot endpoints before/after schema migration 1.
+
+Builds a large synthetic SQLite database in the original (index-less, unversioned)
+schema, measures each hot endpoint, runs migrations.upgrade(), and measures again.
+
+    python benchmarks/schema_indexes.py --expenses 200000 --runs 20
+"""
+import argparse
+import os
+import random
+import statistics
+import sys
+import tempfile
+import time
+from datetime import datetime, timedelta
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+import config  # noqa: E402
+
+DB_DIR = tempfile.mkdtemp(prefix='expense-bench-')
+config.Config.SQLALCHEMY_DATABASE_URI = f"sqlite:///{os.path.join(DB_DIR, 'bench.db')}"
+
+from sqlalchemy import event, insert, text  # noqa: E402
+
+from app import create_app  # noqa: E402
+from migrations import upgrade  # noqa: E402
+from models import db, Company, User, Expense, ApprovalStep  # noqa: E402
+
+app = create_app()
+
+CHUNK = 5000
+
+
+def build_baseline_schema():
+    """Creates the tables exactly as the unversioned schema had them: no secondary indexes."""
+    db.metadata.create_all(db.engine)
+    with db.engine.begin() as conn:
+        for table in db.metadata.sorted_tables:
+            for index in table.indexes:
+                conn.execute(text(f'DROP INDEX IF EXISTS {index.name}'))
+
+
+def bulk_insert(model, rows):
+    for i in range(0, len(rows), CHUNK):
+        db.session.execute(insert(model), rows[i:i + CHUNK])
+
+
+def generate(companies, users_per_company, expenses, seed=42):
+    rng = random.Random(seed)
+    now = datetime.utcnow()
+
+    bulk_insert(Company, [{'id': c, 'name': f'Company {c}', 'base_currency': 'USD'}
+                          for c in range(1, companies + 1)])
+
+    users, approvers_by_company, employees = [], {}, []
+    user_id = 0
+    for c in range(1, companies + 1):
+        admin_id = user_id + 1
+        managers = []
+        for u in range(users_per_company):
+            user_id += 1
+            if u == 0:
+                role, manager_id = 'Admin', None
+            elif u <= max(2, users_per_company // 20):
+                role, manager_id = 'Manager', admin_id
+                managers.append(user_id)
+            else:
+                role, manager_id = 'Employee', rng.choice(managers)
+                employees.append((user_id, c, manager_id))
+            users.append({'id': user_id, 'email': f'user{user_id}@bench.test', 'password': 'x',
+                          'name': f'User {user_id}', 'role': role, 'company_id': c,
+                          'manager_id': manager_id})
+        approvers_by_company[c] = [admin_id] + managers
+    bulk_insert(User, users)
+
+    expense_rows, step_rows = [], []
+    for expense_id in range(1, expenses + 1):
+        submitter, company_id, manager_id = rng.choice(employees)
+        status = rng.choices(['Pending', 'Approved', 'Rejected'], [2, 6, 2])[0]
+        submitted_at = now - timedelta(minutes=rng.randint(0, 3 * 365 * 24 * 60))
+        expense_rows.append({'id': expense_id, 'user_id': submitter, 'company_id': company_id,
+                             'title': f'Expense {expense_id}', 'description': '',
+                             'amount': round(rng.uniform(5, 2000), 2), 'currency': 'USD',
+                             'category': rng.choice(['Travel', 'Meals', 'Office Supplies', 'Other']),
+                             'date': submitted_at.date(), 'status': status,
+                             'submitted_at': submitted_at})
+        approvers = {manager_id, *rng.sample(approvers_by_company[company_id], 2)}
+        step_status = {'Pending': 'Waiting', 'Approved': 'Approved', 'Rejected': 'Skipped'}[status]
+        for approver_id in approvers:
+            step_rows.append({'expense_id': expense_id, 'approver_id': approver_id, 'sequence': 1,
+                              'status': step_status, 'created_at': submitted_at})
+        if len(expense_rows) >= CHUNK:
+            bulk_insert(Expense, expense_rows)
+            bulk_insert(ApprovalStep, step_rows)
+            expense_rows, step_rows = [], []
+    bulk_insert(Expense, expense_rows)
+    bulk_insert(ApprovalStep, step_rows)
+    db.session.commit()
+
+
+def hot_endpoints():
+    manager = User.query.filter_by(role='Manager').first()
+    employee = User.query.filter_by(role='Employee').first()
+    return [
+        ('GET approval queue', 'get', f'/api/approvals/{manager.id}', None),
+        ('GET history page', 'get', f'/api/expenses/history/{employee.id}', None),
+        ('GET all expenses page', 'get', '/api/expenses/all', None),
+        ('GET all expenses, Pending', 'get', '/api/expenses/all?status=Pending', None),
+        ('POST submit expense', 'post', '/api/expenses',
+         {'user_id': employee.id, 'title': 'Bench', 'amount': 10, 'currency': 'USD'}),
+    ]
+
+
+def measure(client, endpoints, runs):
+    captured = []
+
+    def capture(conn, cursor, statement, parameters, context, executemany):
+        if statement.lstrip().upper().startswith('SELECT'):
+            captured.append((statement, parameters))
+
+    results = []
+    for label, method, url, body in endpoints:
+        captured.clear()
+        event.listen(db.engine, 'before_cursor_execute', capture)
+        getattr(client, method)(url, json=body)
+        event.remove(db.engine, 'before_cursor_execute', capture)
+
+        # One plan per distinct statement; repeats (lazy loads) are counted
+        distinct = {}
+        for statement, parameters in captured:
+            count = distinct.get(statement, (parameters, 0))[1]
+            distinct[statement] = (parameters, count + 1)
+
+        plans = []
+        with db.engine.connect() as conn:
+            for statement, (parameters, count) in distinct.items():
+                rows = conn.exec_driver_sql('EXPLAIN QUERY PLAN ' + statement, parameters).all()
+                plans.append((count, [row[-1] for row in rows]))
+
+        timings = []
+        for _ in range(runs):
+            start = time.perf_counter()
+            getattr(client, method)(url, json=body)
+            timings.append((time.perf_counter() - start) * 1000)
+        results.append((label, statistics.median(timings), plans))
+    return results
+
+
+def report(title, results):
+    print(f"\n=== {title} ===")
+    for label, median_ms, plans in results:
+        print(f"{label:<30} median {median_ms:9.2f} ms")
+        for count, plan in plans:
+            print(f"  statement executed {count}x:")
+            for line in plan:
+                print(f"    {line}")
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('--companies', type=int, default=5)
+    parser.add_argument('--users-per-company', type=int, default=200)
+    parser.add_argument('--expenses', type=int, default=100000)
+    parser.add_argument('--runs', type=int, default=10)
+    args = parser.parse_args()
+
+    with app.app_context():
+        print(f"Building synthetic dataset in {DB_DIR} ...")
+        build_baseline_schema()
+        generate(args.companies, args.users_per_company, args.expenses)
+        client = app.test_client()
+        endpoints = hot_endpoints()
+
+        before = measure(client, endpoints, args.runs)
+        report('Before migration (schema version 0)', before)
+
+        start = time.perf_counter()
+        applied = upgrade()
+        print(f"\nApplied migrations {applied} in {(time.perf_counter() - start):.2f} s")
+
+        after = measure(client, endpoints, args.runs)
+        report('After migration', after)
+
+        print("\n=== Speedup ===")
+        for (label, before_ms, _), (_, after_ms, _) in zip(before, after):
+            print(f"{label:<30} {before_ms:9.2f} ms -> {after_ms:9.2f} ms  ({before_ms / after_ms:6.1f}x)")
+
+
+if __name__ == '__main__':
+    main()
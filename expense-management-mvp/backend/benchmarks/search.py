@@ -0,0 +1,106 @@
+"""Expense search latency: FTS5 ranked search versus the substring fallback.
+
+Builds a synthetic SQLite database (synthetic.py, indexed by the search
+triggers as it is written) and times GET /api/expenses/search end to end for
+rare, common, prefix and filtered queries, scoped to one company and across
+all of them. It then follows next_cursor through --deep-pages pages of a
+common word, well past the first ranking window, and times the pages along
+the way. --fallback also times the substring matching used where FTS5 is
+unavailable (slow at this size: it scans every expense).
+
+    python benchmarks/search.py --companies 10 --users-per-company 5000 --expenses-per-user 20
+"""
+import argparse
+import os
+import statistics
+import sys
+import tempfile
+import time
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+import config  # noqa: E402
+
+DB_DIR = tempfile.mkdtemp(prefix='expense-bench-')
+config.Config.SQLALCHEMY_DATABASE_URI = f"sqlite:///{os.path.join(DB_DIR, 'bench.db')}"
+
+from app import create_app  # noqa: E402
+from migrations import upgrade  # noqa: E402
+from models import db, Expense  # noqa: E402
+import search  # noqa: E402
+import synthetic  # noqa: E402
+
+app = create_app()
+
+QUERIES = [
+    ('rare word', 'q=4242'),
+    ('submitter name', 'q=user+{user_id}'),
+    ('common word', 'q=hotel'),
+    ('common, filtered', 'q=hotel&status=Pending&min_base_amount=1000'),
+    ('prefix', 'q=conf&prefix=1'),
+    ('two words', 'q=team+dinner'),
+]
+
+
+def measure(client, url, headers, runs):
+    timings = []
+    for _ in range(runs + 1):
+        start = time.perf_counter()
+        response = client.get(url, headers=headers)
+        timings.append((time.perf_counter() - start) * 1000)
+        assert response.status_code == 200, response.get_data(as_text=True)
+    return statistics.median(timings[1:]), len(response.get_json()['expenses'])
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('--companies', type=int, default=10)
+    parser.add_argument('--users-per-company', type=int, default=5000)
+    parser.add_argument('--expenses-per-user', type=int, default=20)
+    parser.add_argument('--per-page', type=int, default=50)
+    parser.add_argument('--runs', type=int, default=10)
+    parser.add_argument('--deep-pages', type=int, default=100, help='Pages of a common word to follow.')
+    parser.add_argument('--fallback', action='store_true', help='Also time the substring fallback.')
+    args = parser.parse_args()
+
+    with app.app_context():
+        print(f"Building synthetic dataset in {DB_DIR} ...")
+        upgrade()
+        start = time.perf_counter()
+        counts = synthetic.generate(companies=args.companies, users_per_company=args.users_per_company,
+                                    expenses_per_user=args.expenses_per_user)
+        print(f"{counts['expenses']} expenses written and indexed in {time.perf_counter() - start:.0f} s")
+        user_id = db.session.query(Expense.user_id).filter(Expense.company_id == 1).limit(1).scalar()
+        client = app.test_client()
+
+        modes = [('fts', True)] + ([('substring', False)] if args.fallback else [])
+        print(f"\n{'query':<18} {'scope':<9} {'mode':<10} {'median ms':>10} {'rows':>5}")
+        for mode, enabled in modes:
+            search._installed[str(db.engine.url)] = enabled
+            for name, params in QUERIES:
+                url = f"/api/expenses/search?{params.format(user_id=user_id)}&per_page={args.per_page}"
+                for scope, headers in (('company', {'X-Company-Id': '1'}), ('all', {})):
+                    ms, rows = measure(client, url, headers, args.runs)
+                    print(f"{name:<18} {scope:<9} {mode:<10} {ms:10.2f} {rows:>5}")
+                db.session.remove()
+
+        search._installed[str(db.engine.url)] = True
+        print(f"\nDeep paging, q=hotel, company scope ({app.config['SEARCH_MAX_CANDIDATES']} matches per window):")
+        print(f"{'page':>6} {'ms':>8} {'rows so far':>12}")
+        url, headers = f'/api/expenses/search?q=hotel&per_page={args.per_page}', {'X-Company-Id': '1'}
+        cursor, seen = None, 0
+        for page in range(1, args.deep_pages + 1):
+            start = time.perf_counter()
+            body = client.get(url + (f'&cursor={cursor}' if cursor else ''), headers=headers).get_json()
+            ms = (time.perf_counter() - start) * 1000
+            seen += len(body['expenses'])
+            if page == 1 or page % 10 == 0 or body['next_cursor'] is None:
+                print(f"{page:>6} {ms:8.2f} {seen:>12}")
+            cursor = body['next_cursor']
+            if cursor is None:
+                break
+        db.session.remove()
+
+
+if __name__ == '__main__':
+    main()
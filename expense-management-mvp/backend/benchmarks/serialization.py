@@ -0,0 +1,126 @@
+"""List serialization: hydrated ORM + to_dict() versus column projection, per encoder.
+
+Builds a synthetic SQLite database, then times one list page (query + dict
+building + JSON encoding) for each variant and reports the encoded size:
+
+    orm+json        Expense.query with eager loads, to_dict(include_steps=True), stdlib json
+    proj+json       serializers.py projection with steps, stdlib json
+    proj+orjson     same dicts, orjson (skipped when orjson is not installed)
+    sparse+orjson   fields=id,title,amount,currency,status,submitted_at and no steps
+
+    python benchmarks/serialization.py --expenses 20000 --page-size 200 --runs 20
+"""
+import argparse
+import json
+import os
+import random
+import statistics
+import sys
+import tempfile
+import time
+from datetime import datetime, timedelta
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+import config  # noqa: E402
+
+DB_DIR = tempfile.mkdtemp(prefix='expense-bench-')
+config.Config.SQLALCHEMY_DATABASE_URI = f"sqlite:///{os.path.join(DB_DIR, 'bench.db')}"
+
+from sqlalchemy import insert  # noqa: E402
+from sqlalchemy.orm import joinedload, selectinload  # noqa: E402
+
+from app import create_app, seed_demo_data  # noqa: E402
+from listing import keyset_page  # noqa: E402
+from migrations import upgrade  # noqa: E402
+from models import db, Expense, ApprovalStep, User  # noqa: E402
+from serializers import EXPENSE_FIELDS, expense_list_projection, orjson, serialize_expenses  # noqa: E402
+
+app = create_app()
+
+SPARSE_FIELDS = ['id', 'title', 'amount', 'currency', 'status', 'submitted_at']
+
+
+def build_dataset(n_expenses, rng):
+    employees = [(u.id, u.manager_id) for u in User.query.filter_by(role='Employee')]
+    now = datetime.utcnow()
+    expense_id = db.session.query(db.func.coalesce(db.func.max(Expense.id), 0)).scalar()
+    expenses, steps = [], []
+    for _ in range(n_expenses):
+        expense_id += 1
+        user_id, manager_id = rng.choice(employees)
+        submitted_at = now - timedelta(minutes=rng.randint(0, 365 * 24 * 60))
+        expenses.append({'id': expense_id, 'user_id': user_id, 'company_id': 1,
+                         'title': f'Expense {expense_id}', 'description': 'Client visit ' * rng.randint(1, 8),
+                         'amount': round(rng.uniform(5, 2000), 2), 'currency': 'USD',
+                         'base_amount': None, 'category': 'Travel', 'date': submitted_at.date(),
+                         'status': 'Pending', 'submitted_at': submitted_at, 'pending_step_count': 2})
+        for sequence in (1, 2):
+            steps.append({'expense_id': expense_id, 'company_id': 1, 'approver_id': manager_id,
+                          'sequence': sequence, 'required_approvals': 1, 'approval_count': 0,
+                          'status': 'Waiting' if sequence == 1 else 'Pending', 'created_at': submitted_at})
+    db.session.execute(insert(Expense), expenses)
+    db.session.execute(insert(ApprovalStep), steps)
+    db.session.commit()
+
+
+def orm_page(page_size):
+    query = Expense.query.options(
+        joinedload(Expense.submitter),
+        selectinload(Expense.approval_steps).joinedload(ApprovalStep.approver)
+    )
+    expenses, _ = keyset_page(query, page_size)
+    return [e.to_dict(include_steps=True) for e in expenses]
+
+
+def projected_page(page_size, fields=EXPENSE_FIELDS, includes=('approval_steps',)):
+    rows, _ = keyset_page(expense_list_projection(fields), page_size)
+    return serialize_expenses(rows, fields, includes)
+
+
+def measure(build, encode, runs):
+    timings = []
+    for _ in range(runs + 1):
+        db.session.expunge_all()  # Each page starts from a cold identity map, as a request would
+        start = time.perf_counter()
+        body = encode({'success': True, 'expenses': build()})
+        timings.append((time.perf_counter() - start) * 1000)
+    return statistics.median(timings[1:]), len(body)
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('--expenses', type=int, default=20000)
+    parser.add_argument('--page-size', type=int, default=200)
+    parser.add_argument('--runs', type=int, default=20)
+    args = parser.parse_args()
+
+    stdlib = lambda obj: json.dumps(obj).encode()  # noqa: E731
+    variants = [
+        ('orm+json', lambda: orm_page(args.page_size), stdlib),
+        ('proj+json', lambda: projected_page(args.page_size), stdlib),
+    ]
+    if orjson is not None:
+        variants += [
+            ('proj+orjson', lambda: projected_page(args.page_size), orjson.dumps),
+            ('sparse+orjson', lambda: projected_page(args.page_size, SPARSE_FIELDS, ()), orjson.dumps),
+        ]
+    else:
+        print('orjson is not installed; skipping the orjson variants')
+
+    with app.app_context():
+        print(f"Building synthetic dataset in {DB_DIR} ...")
+        upgrade()
+        seed_demo_data()
+        build_dataset(args.expenses, random.Random(42))
+
+        baseline = None
+        print(f"\n{'variant':<14} {'median ms':>10} {'speedup':>8} {'bytes':>10}")
+        for name, build, encode in variants:
+            ms, size = measure(build, encode, args.runs)
+            baseline = baseline or ms
+            print(f"{name:<14} {ms:10.2f} {baseline / ms:7.1f}x {size:>10}")
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,145 @@
+"""Approval SLAs: cost of a scheduler pass as the approval_steps table grows.
+
+Grows a synthetic SQLite database (synthetic.py) a few companies at a time.
+After each round it makes a fixed number of actionable steps (--due) overdue,
+with every other Waiting step due far in the future, and times:
+
+* the overdue query alone, a range of the (status, due_at) index;
+* a full scheduler pass, which reminds (or escalates) every overdue step:
+  batched updates, events and version bumps included;
+* the query an SLA check needs without due times: Waiting steps older than
+  the SLA whose earlier steps are all approved, which has to visit them all.
+
+The first two stay flat while the table grows; the last grows with it.
+
+    python benchmarks/sla.py --rounds 4 --companies-per-round 2 --users-per-company 2500
+"""
+import argparse
+import os
+import random
+import statistics
+import sys
+import tempfile
+import time
+from datetime import datetime, timedelta
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+import config  # noqa: E402
+
+DB_DIR = tempfile.mkdtemp(prefix='expense-bench-')
+config.Config.SQLALCHEMY_DATABASE_URI = f"sqlite:///{os.path.join(DB_DIR, 'bench.db')}"
+
+from sqlalchemy import func, select, update  # noqa: E402
+from sqlalchemy.orm import aliased  # noqa: E402
+
+from app import create_app  # noqa: E402
+from migrations import upgrade  # noqa: E402
+from models import db, ApprovalStep  # noqa: E402
+import sla  # noqa: E402
+import synthetic  # noqa: E402
+
+app = create_app()
+
+
+def postpone_all(now):
+    """Every actionable step due in a year; returns their ids."""
+    steps = ApprovalStep.__table__
+    db.session.execute(update(steps).where(steps.c.status == 'Waiting', steps.c.due_at.isnot(None))
+                       .values(due_at=now + timedelta(days=365)))
+    db.session.commit()
+    with db.engine.connect() as conn:
+        conn.exec_driver_sql('PRAGMA wal_checkpoint(TRUNCATE)')  # Not left for a timed commit to do
+    return db.session.scalars(select(steps.c.id).where(steps.c.status == 'Waiting', steps.c.due_at.isnot(None))).all()
+
+
+def make_due(now, actionable, count, rng):
+    """Makes `count` of the actionable steps overdue at `now`."""
+    steps = ApprovalStep.__table__
+    overdue = rng.sample(actionable, min(count, len(actionable)))
+    db.session.execute(update(steps).where(steps.c.id.in_(overdue)).values(due_at=now - timedelta(minutes=1)))
+    db.session.commit()
+    return len(overdue)
+
+
+def scan_without_due_times(now):
+    """Overdue actionable steps found from created_at, as a check without due_at would."""
+    earlier = aliased(ApprovalStep)
+    blocked = select(earlier.id).where(
+        earlier.expense_id == ApprovalStep.expense_id,
+        earlier.sequence < ApprovalStep.sequence,
+        earlier.status != 'Approved'
+    ).exists()
+    cutoff = now - timedelta(hours=app.config['APPROVAL_SLA_HOURS'])
+    return db.session.scalars(
+        select(ApprovalStep.id).where(ApprovalStep.status == 'Waiting', ApprovalStep.created_at <= cutoff, ~blocked)
+    ).all()
+
+
+def timed(fn, runs):
+    timings = []
+    for _ in range(runs):
+        start = time.perf_counter()
+        fn()
+        timings.append((time.perf_counter() - start) * 1000)
+    return statistics.median(timings)
+
+
+def query_plan(statement):
+    with db.engine.connect() as conn:
+        compiled = statement.compile(conn)
+        rows = conn.exec_driver_sql('EXPLAIN QUERY PLAN ' + str(compiled), tuple(compiled.params.values()))
+        return ' / '.join(row[-1] for row in rows)
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('--rounds', type=int, default=4)
+    parser.add_argument('--companies-per-round', type=int, default=2)
+    parser.add_argument('--users-per-company', type=int, default=2500)
+    parser.add_argument('--expenses-per-user', type=int, default=10)
+    parser.add_argument('--days', type=int, default=30, help='Spread of submission dates (recent ones stay Pending).')
+    parser.add_argument('--due', type=int, default=200, help='Overdue steps per pass.')
+    parser.add_argument('--runs', type=int, default=5)
+    args = parser.parse_args()
+    rng = random.Random(3)
+
+    with app.app_context():
+        print(f"Building synthetic dataset in {DB_DIR} ...")
+        upgrade()
+        print(f"\n{'steps':>9} {'waiting':>8} {'overdue':>8} {'due query ms':>13} {'pass ms':>8} "
+              f"{'scan w/o due_at ms':>19}")
+        for round_number in range(args.rounds):
+            synthetic.generate(companies=args.companies_per_round, users_per_company=args.users_per_company,
+                               expenses_per_user=args.expenses_per_user, days=args.days, seed=round_number)
+            db.session.remove()
+            total, waiting = db.session.execute(
+                select(func.count(), func.count().filter(ApprovalStep.status == 'Waiting'))
+                .select_from(ApprovalStep)
+            ).one()
+
+            now = datetime.utcnow()
+            actionable = postpone_all(now)
+            scan_ms = timed(lambda: scan_without_due_times(now), args.runs)
+            queries, passes = [], []
+            for _ in range(args.runs):
+                overdue = make_due(now, actionable, args.due, rng)
+                queries.append(timed(lambda: sla._overdue(now, app.config['APPROVAL_SLA_BATCH_SIZE']), 1))
+                # Reminded steps are due again later, so each pass only sees this run's overdue steps
+                start = time.perf_counter()
+                reminded, escalated = sla.run_once(now)
+                passes.append((time.perf_counter() - start) * 1000)
+                assert reminded + escalated == overdue, (reminded, escalated, overdue)
+            print(f"{total:>9} {waiting:>8} {overdue:>8} {statistics.median(queries):13.2f} "
+                  f"{statistics.median(passes):8.1f} {scan_ms:19.1f}")
+
+        now = datetime.utcnow()
+        print("\nOverdue query plan:  " + query_plan(
+            select(ApprovalStep.id).where(ApprovalStep.status == 'Waiting', ApprovalStep.due_at <= now)
+            .order_by(ApprovalStep.due_at, ApprovalStep.id).limit(500)))
+        print("Next due time plan:  " + query_plan(
+            select(func.min(ApprovalStep.due_at)).where(ApprovalStep.status == 'Waiting')))
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,93 @@
+"""Startup time: `from app import create_app; create_app()` in fresh interpreters.
+
+Each run is a new Python process (so nothing is already imported) pointed at a
+database path that does not exist. The script fails (exit status 1) if the
+median time to import and build the app is over --target-ms, or if building
+it created the database file, i.e. opened a connection: workers must start
+without touching the database.
+
+    python benchmarks/startup.py --runs 15 --target-ms 1000
+    python benchmarks/startup.py --imports 15      # also list the slowest imports
+"""
+import argparse
+import json
+import os
+import statistics
+import subprocess
+import sys
+import tempfile
+import time
+
+BACKEND_DIR = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+
+PROBE = """
+import json, os, time
+start = time.perf_counter()
+from app import create_app
+imported = time.perf_counter()
+create_app()
+built = time.perf_counter()
+print(json.dumps({'import_ms': (imported - start) * 1000, 'create_ms': (built - imported) * 1000,
+                  'db_created': os.path.exists(os.environ['STARTUP_DB_PATH'])}))
+"""
+
+
+def probe(db_path, import_profile=False):
+    env = dict(os.environ, DATABASE_URL=f'sqlite:///{db_path}', STARTUP_DB_PATH=db_path)
+    command = [sys.executable] + (['-X', 'importtime'] if import_profile else []) + ['-c', PROBE]
+    start = time.perf_counter()
+    result = subprocess.run(command, cwd=BACKEND_DIR, env=env, capture_output=True, text=True, check=True)
+    process_ms = (time.perf_counter() - start) * 1000
+    return dict(json.loads(result.stdout.strip().splitlines()[-1]), process_ms=process_ms), result.stderr
+
+
+def slowest_imports(importtime_log, limit):
+    """Top-level imports by cumulative time, from `python -X importtime` output."""
+    rows = []
+    for line in importtime_log.splitlines():
+        if not line.startswith('import time:') or 'cumulative' in line:
+            continue
+        _, cumulative, name = (part.strip() for part in line[len('import time:'):].split('|'))
+        if not name.startswith(' '):
+            rows.append((int(cumulative) / 1000, name.strip()))
+    return sorted(rows, reverse=True)[:limit]
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('--runs', type=int, default=15)
+    parser.add_argument('--target-ms', type=float, default=1000,
+                        help='Maximum median import + create_app() time.')
+    parser.add_argument('--imports', type=int, default=0, metavar='N', help='List the N slowest imports.')
+    args = parser.parse_args()
+
+    db_path = os.path.join(tempfile.mkdtemp(prefix='expense-startup-'), 'never-created.db')
+    runs = [probe(db_path)[0] for _ in range(args.runs)]
+
+    print(f"{'phase':<14} {'median ms':>10} {'max ms':>8}")
+    for phase in ('import_ms', 'create_ms', 'process_ms'):
+        values = [run[phase] for run in runs]
+        print(f"{phase[:-3]:<14} {statistics.median(values):10.1f} {max(values):8.1f}")
+
+    if args.imports:
+        _, log = probe(db_path, import_profile=True)
+        print("\nSlowest imports (cumulative ms):")
+        for ms, name in slowest_imports(log, args.imports):
+            print(f"  {ms:8.1f}  {name}")
+
+    failures = []
+    startup_ms = statistics.median(run['import_ms'] + run['create_ms'] for run in runs)
+    if startup_ms > args.target_ms:
+        failures.append(f"median startup {startup_ms:.0f} ms is over the {args.target_ms:.0f} ms target")
+    if any(run['db_created'] for run in runs):
+        failures.append("create_app() connected to the database")
+
+    for failure in failures:
+        print(f"FAIL: {failure}")
+    if failures:
+        sys.exit(1)
+    print(f"OK: median startup {startup_ms:.0f} ms (target {args.target_ms:.0f} ms), no database connection")
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,68 @@
+from sqlalchemy import event
+from sqlalchemy.engine import make_url
+
+# --- Database Engine Configuration ---
+#
+# SQLite (the default) gets WAL journaling, so readers never block the single
+# writer and the writer never blocks readers, plus a busy timeout so that
+# concurrent writers queue for the lock instead of failing with "database is
+# locked". Server databases (PostgreSQL, MySQL) get a sized connection pool
+# with pre-ping and recycling instead.
+
+
+def normalize_database_url(url):
+    """Accepts the postgres:// scheme many hosting providers hand out."""
+    if url.startswith('postgres://'):
+        return 'postgresql://' + url[len('postgres://'):]
+    return url
+
+
+def engine_options(url, config):
+    """SQLALCHEMY_ENGINE_OPTIONS for the configured database."""
+    if make_url(url).get_backend_name() == 'sqlite':
+        # pysqlite's own lock wait, in seconds; the PRAGMA below sets the same
+        return {'connect_args': {'timeout': config['SQLITE_BUSY_TIMEOUT_MS'] / 1000}}
+    return {
+        'pool_size': config['DB_POOL_SIZE'],
+        'max_overflow': config['DB_MAX_OVERFLOW'],
+        'pool_timeout': config['DB_POOL_TIMEOUT'],
+        'pool_recycle': config['DB_POOL_RECYCLE'],
+        'pool_pre_ping': True
+    }
+
+
+def install_sqlite_pragmas(engine, config):
+    """Applies the SQLite pragmas to every new connection of `engine`."""
+    in_memory = engine.url.database in (None, '', ':memory:')
+    pragmas = [
+        f"PRAGMA busy_timeout = {config['SQLITE_BUSY_TIMEOUT_MS']}",
+        # NORMAL is durable across application crashes in WAL mode and avoids an fsync per commit
+        'PRAGMA synchronous = NORMAL',
+        f"PRAGMA cache_size = -{config['SQLITE_CACHE_SIZE_KB']}",
+        'PRAGMA temp_store = MEMORY'
+    ]
+    if not in_memory:
+        pragmas.insert(0, 'PRAGMA journal_mode = WAL')
+
+    @event.listens_for(engine, 'connect')
+    def set_pragmas(dbapi_connection, connection_record):
+        cursor = dbapi_connection.cursor()
+        for pragma in pragmas:
+            cursor.execute(pragma)
+        cursor.close()
+
+
+def init_app(app, db):
+    """Configures the engine from app.config and initializes Flask-SQLAlchemy."""
+    url = normalize_database_url(app.config['SQLALCHEMY_DATABASE_URI'])
+    app.config['SQLALCHEMY_DATABASE_URI'] = url
+    options = engine_options(url, app.config)
+    options.update(app.config.get('SQLALCHEMY_ENGINE_OPTIONS') or {})
+    app.config['SQLALCHEMY_ENGINE_OPTIONS'] = options
+
+    db.init_app(app)
+
+    if app.config['SQLITE_TUNING']:
+        with app.app_context():
+            if db.engine.dialect.name == 'sqlite':
+                install_sqlite_pragmas(db.engine, app.config)
@@ -0,0 +1,175 @@
+import hashlib
+import heapq
+import re
+import unicodedata
+from collections import deque
+from datetime import timedelta
+from operator import attrgetter
+
+from sqlalchemy import select
+
+from models import db, Expense, ArchivedExpense
+
+# --- Duplicate Detection ---
+#
+# Each expense stores a fingerprint: a hash of its user, amount (to the cent),
+# currency, date and title (case, accents of compatibility forms, punctuation
+# and spacing folded away). Double clicks, client retries and re-imported
+# files produce the same fingerprint, so one indexed equality lookup finds
+# them. The normalization is stored in the data: changing it needs a backfill
+# (migration 9 shows how).
+#
+# Clients that can send an Idempotency-Key get exact retries answered with the
+# original expense instead; the key is unique per user, which also settles
+# two requests racing each other.
+#
+# Near duplicates (same user and currency, amount within a tolerance, dates
+# within a few days) are an index range scan on
+# (user_id, currency, date, amount) and are reported as a warning, not refused.
+#
+# Rejected expenses are left out of every check: resubmitting one is how a
+# rejection gets corrected. Archived expenses (archive.py) are checked too.
+
+MODELS = (Expense, ArchivedExpense)
+
+
+def normalize_title(title):
+    """Case-folded words of a title, single-spaced, without punctuation."""
+    folded = unicodedata.normalize('NFKC', title or '').casefold()
+    return ' '.join(re.findall(r'\w+', folded))
+
+
+def fingerprint(user_id, amount, currency, expense_date, title):
+    raw = '|'.join([str(user_id), f'{round(float(amount), 2):.2f}', (currency or '').upper(),
+                    expense_date.isoformat() if expense_date else '', normalize_title(title)])
+    return hashlib.blake2b(raw.encode(), digest_size=16).hexdigest()
+
+
+def _first(build):
+    """The first row build(model) finds, live expenses before archived ones."""
+    for model in MODELS:
+        row = db.session.execute(build(model).limit(1)).first()
+        if row is not None:
+            return row
+    return None
+
+
+def find_by_idempotency_key(user_id, key):
+    """(id, fingerprint) of the user's expense submitted with this key, or None."""
+    return _first(lambda model: select(model.id, model.fingerprint).where(
+        model.user_id == user_id, model.idempotency_key == key
+    ))
+
+
+def find_exact(user_id, expense_fingerprint):
+    """Id of the user's oldest non-rejected expense with this fingerprint, or None."""
+    row = _first(lambda model: select(model.id).where(
+        model.fingerprint == expense_fingerprint, model.user_id == user_id, model.status != 'Rejected'
+    ).order_by(model.id))
+    return row.id if row is not None else None
+
+
+def existing_fingerprints(fingerprints):
+    """{fingerprint: oldest non-rejected expense id} for the fingerprints already stored."""
+    found = {}
+    fingerprints = list(fingerprints)
+    if not fingerprints:
+        return found
+    for model in reversed(MODELS):  # Live ids win: they are checked last
+        rows = db.session.execute(
+            select(model.fingerprint, model.id)
+            .where(model.fingerprint.in_(fingerprints), model.status != 'Rejected')
+            .order_by(model.id.desc())
+        )
+        found.update(rows.all())
+    return found
+
+
+def existing_idempotency_keys(user_keys):
+    """{(user_id, key): expense id} for the (user_id, key) pairs already used."""
+    found = {}
+    user_ids = {user_id for user_id, _ in user_keys}
+    keys = {key for _, key in user_keys}
+    if not keys:
+        return found
+    for model in MODELS:
+        rows = db.session.execute(
+            select(model.user_id, model.idempotency_key, model.id)
+            .where(model.user_id.in_(user_ids), model.idempotency_key.in_(keys))
+        )
+        for user_id, key, expense_id in rows:
+            if (user_id, key) in user_keys:
+                found[(user_id, key)] = expense_id
+    return found
+
+
+def near_duplicates(user_id, currency, amount, expense_date, window_days, tolerance, exclude_id=None, limit=5):
+    """Ids of the user's non-rejected expenses in the same currency within
+    `window_days` of the date and `tolerance` (a fraction) of the amount."""
+    window = timedelta(days=window_days)
+    ids = []
+    for model in MODELS:
+        conditions = [
+            model.user_id == user_id,
+            model.currency == currency,
+            model.date.between(expense_date - window, expense_date + window),
+            model.amount.between(amount * (1 - tolerance), amount * (1 + tolerance)),
+            model.status != 'Rejected'
+        ]
+        if exclude_id is not None:
+            conditions.append(model.id != exclude_id)
+        ids += db.session.scalars(select(model.id).where(*conditions).order_by(model.id).limit(limit)).all()
+    return sorted(ids)[:limit]
+
+
+# --- Report ---
+
+REPORT_FIELDS = ('kind', 'user_id', 'expense_id', 'duplicate_of', 'date', 'amount', 'currency', 'title', 'status')
+
+
+def report(window_days, tolerance, company_id=None, batch_size=5000):
+    """Yields a dict per suspected duplicate among existing expenses, live and archived.
+
+    Expenses are read once, in (user, currency, date, amount) index order,
+    with a sliding window of each user's last `window_days` days: an 'exact'
+    row shares its fingerprint with an earlier expense in the window, a 'near'
+    row is within `tolerance` of one's amount. `duplicate_of` is the lower id.
+    """
+    results = []
+    for model in MODELS:
+        stmt = select(model.id, model.user_id, model.currency, model.date, model.amount,
+                      model.fingerprint, model.title, model.status).where(model.status != 'Rejected')
+        if company_id is not None:
+            stmt = stmt.where(model.company_id == company_id)
+        stmt = stmt.order_by(model.user_id, model.currency, model.date, model.amount)
+        results.append(db.session.execute(stmt, execution_options={'yield_per': batch_size,
+                                                                   'stream_results': True}))
+    window = timedelta(days=window_days)
+    recent = deque()
+    try:
+        rows = heapq.merge(*results, key=attrgetter('user_id', 'currency', 'date', 'amount'))
+        for row in rows:
+            if recent and (recent[0].user_id, recent[0].currency) != (row.user_id, row.currency):
+                recent.clear()
+            while recent and recent[0].date < row.date - window:
+                recent.popleft()
+
+            # Rows without a fingerprint (never backfilled) cannot be exact duplicates
+            match = None
+            if row.fingerprint is not None:
+                match = next((r for r in recent if r.fingerprint == row.fingerprint), None)
+            kind = 'exact'
+            if match is None:
+                kind = 'near'
+                match = next((r for r in recent if abs(r.amount - row.amount) <= tolerance * row.amount), None)
+            if match is not None:
+                later, earlier = (row, match) if row.id > match.id else (match, row)
+                yield {
+                    'kind': kind, 'user_id': row.user_id, 'expense_id': later.id, 'duplicate_of': earlier.id,
+                    'date': later.date.isoformat(), 'amount': later.amount, 'currency': later.currency,
+                    'title': later.title, 'status': later.status
+                }
+            recent.append(row)
+    finally:
+        for result in results:
+            result.close()
@@ -0,0 +1,338 @@
+import json
+import threading
+import time
+from datetime import datetime, timedelta
+
+from flask import current_app
+from sqlalchemy import delete, event, func, insert, select
+from sqlalchemy.orm import Session
+
+from models import db, ApprovalEvent, ApprovalStep, ApproverGroupMember, Expense
+import sla
+
+# --- Approval Queue Events ---
+#
+# Writes that change approval queues record events in approval_events, in the
+# same transaction, with one row per recipient:
+#
+#   step_created       a step became actionable, or an actionable step was
+#                      reassigned to the recipient: it is in their queue now
+#   step_decided       a step left the queue (Approved, Rejected, Skipped), or the
+#                      recipient voted on a group step that still needs more votes
+#   expense_finalized  an expense the recipient approves or submitted was
+#                      Approved or Rejected
+#   step_reminder      a step in the recipient's queue is past its SLA (sla.py,
+#                      which also sends step_decided / step_created when it
+#                      escalates a step to another approver)
+#
+# Events are found by diffing the steps of the touched expenses before and
+# after the write (track() ... Changes.record()), so submit, single and batch
+# decisions and imports all share one definition of "actionable". Steps that
+# become actionable get their SLA due time here too.
+#
+# GET /api/approvals/<user_id>/events streams a user's rows after the
+# Last-Event-ID as Server-Sent Events: each read is an index range scan over
+# the new rows only, instead of a rebuild of the whole queue. Event ids come
+# from the database, so a client resumes at the same place in any worker.
+# After a commit the recipients are published to `broker`, which wakes their
+# open streams; streams it cannot reach (other workers, without a shared
+# broker) still see the rows at their next poll.
+
+STEP_CREATED = 'step_created'
+STEP_DECIDED = 'step_decided'
+EXPENSE_FINALIZED = 'expense_finalized'
+
+
+# --- Recording ---
+
+def _snapshot(expense_ids):
+    """({step_id: step row}, {expense_id: expense row}, {step_id: actionable}) for the expenses."""
+    if not expense_ids:
+        return {}, {}, {}
+    steps = db.session.execute(
+        select(ApprovalStep.id, ApprovalStep.expense_id, ApprovalStep.sequence, ApprovalStep.status,
+               ApprovalStep.approver_id, ApprovalStep.group_id, ApprovalStep.approval_count)
+        .where(ApprovalStep.expense_id.in_(expense_ids))
+        .execution_options(all_tenants=True)
+    ).all()
+    expenses = db.session.execute(
+        select(Expense.id, Expense.user_id, Expense.company_id, Expense.status, Expense.title,
+               Expense.amount, Expense.currency, Expense.base_amount, Expense.base_currency)
+        .where(Expense.id.in_(expense_ids))
+        .execution_options(all_tenants=True)
+    ).all()
+
+    # A Waiting step is actionable when every earlier step is Approved, i.e. it
+    # sits at the lowest sequence that is not Approved yet
+    open_sequence = {}
+    for step in steps:
+        if step.status != 'Approved':
+            current = open_sequence.get(step.expense_id)
+            open_sequence[step.expense_id] = step.sequence if current is None else min(current, step.sequence)
+    actionable = {
+        step.id: step.status == 'Waiting' and step.sequence == open_sequence[step.expense_id]
+        for step in steps
+    }
+    return {step.id: step for step in steps}, {e.id: e for e in expenses}, actionable
+
+
+class Changes:
+    """The queue-relevant state of some expenses, to diff against after a write."""
+
+    def __init__(self, expense_ids):
+        self.expense_ids = set(expense_ids)
+        self.steps, self.expenses, self.actionable = _snapshot(self.expense_ids)
+
+    def record(self, new_expense_ids=(), decider_id=None):
+        """Inserts events for everything that changed since the snapshot.
+
+        `new_expense_ids` are expenses created since (their actionable steps are
+        new); `decider_id` is the user whose vote a group step may have counted.
+        """
+        new_expense_ids = set(new_expense_ids)
+        expense_ids = self.expense_ids | new_expense_ids
+        steps, expenses, actionable = _snapshot(expense_ids)
+        group_ids = {s.group_id for s in steps.values() if s.group_id is not None}
+        members = {}
+        if group_ids:
+            for group_id, user_id in db.session.execute(
+                select(ApproverGroupMember.group_id, ApproverGroupMember.user_id)
+                .where(ApproverGroupMember.group_id.in_(group_ids))
+            ):
+                members.setdefault(group_id, []).append(user_id)
+
+        def recipients(step):
+            if step.approver_id is not None:
+                return [step.approver_id]
+            submitter_id = expenses[step.expense_id].user_id
+            return [u for u in members.get(step.group_id, ()) if u != submitter_id]
+
+        rows, became_actionable = [], []
+
+        def add(user_ids, kind, expense, step, payload):
+            for user_id in sorted(set(user_ids)):
+                rows.append({'user_id': user_id, 'company_id': expense.company_id, 'expense_id': expense.id,
+                             'step_id': step.id if step is not None else None, 'type': kind,
+                             'payload': json.dumps(payload)})
+
+        for step_id, step in sorted(steps.items()):
+            expense = expenses[step.expense_id]
+            before = self.steps.get(step_id)
+            step_payload = {'expense_id': expense.id, 'step_id': step_id,
+                            'sequence': step.sequence, 'status': step.status}
+            created_payload = {
+                **step_payload, 'submitter_id': expense.user_id, 'title': expense.title,
+                'amount': expense.amount, 'currency': expense.currency,
+                'base_amount': expense.base_amount, 'base_currency': expense.base_currency
+            }
+            if actionable[step_id] and not self.actionable.get(step_id, False):
+                became_actionable.append(step_id)
+                add(recipients(step), STEP_CREATED, expense, step, created_payload)
+            elif actionable[step_id] and before is not None and step.approver_id != before.approver_id:
+                # Reassigned (workflow.reassign_steps): new in the new approver's queue
+                add(recipients(step), STEP_CREATED, expense, step, created_payload)
+            elif self.actionable.get(step_id, False) and not actionable[step_id]:
+                add(recipients(step), STEP_DECIDED, expense, step, step_payload)
+            elif actionable[step_id] and decider_id is not None and step.approval_count != before.approval_count:
+                add([decider_id], STEP_DECIDED, expense, step, {**step_payload, 'status': 'Voted'})
+
+        for expense_id, expense in sorted(expenses.items()):
+            before = self.expenses.get(expense_id)
+            was_open = before.status == 'Pending' if before is not None else expense_id in new_expense_ids
+            if was_open and expense.status in ('Approved', 'Rejected'):
+                # The submitter, and everyone whose queue held one of its steps
+                involved = [expense.user_id]
+                for step in steps.values():
+                    if step.expense_id == expense_id and self.actionable.get(step.id, False):
+                        involved += recipients(step)
+                add(involved, EXPENSE_FINALIZED, expense, None,
+                    {'expense_id': expense_id, 'status': expense.status})
+
+        insert_events(rows)
+        sla.schedule(became_actionable)
+        return len(rows)
+
+
+def insert_events(rows):
+    """Inserts event rows (dicts without created_at); recipients are woken after the commit."""
+    if rows:
+        now = datetime.utcnow()
+        for row in rows:
+            row['created_at'] = now
+        db.session.execute(insert(ApprovalEvent.__table__), rows)
+        db.session.info.setdefault('approval_event_recipients', set()).update(r['user_id'] for r in rows)
+
+
+def track(expense_ids=()):
+    """Snapshots the given expenses before a write; call .record() after it (before commit)."""
+    return Changes(expense_ids)
+
+
+# Recipients are only woken once their events are committed (and visible)
+@event.listens_for(Session, 'after_commit')
+def _publish_committed(session):
+    user_ids = session.info.pop('approval_event_recipients', None)
+    if user_ids:
+        broker.publish(user_ids)
+
+
+@event.listens_for(Session, 'after_rollback')
+def _discard_rolled_back(session):
+    session.info.pop('approval_event_recipients', None)
+
+
+# --- Brokers ---
+
+class MemoryBroker:
+    """Wakes the open streams of this process when their user has new events."""
+
+    def __init__(self):
+        self._subscribers = {}  # user_id -> set of threading.Event
+        self._lock = threading.Lock()
+
+    def subscribe(self, user_id):
+        wakeup = threading.Event()
+        with self._lock:
+            self._subscribers.setdefault(user_id, set()).add(wakeup)
+        return wakeup
+
+    def unsubscribe(self, user_id, wakeup):
+        with self._lock:
+            waiting = self._subscribers.get(user_id)
+            if waiting is not None:
+                waiting.discard(wakeup)
+                if not waiting:
+                    del self._subscribers[user_id]
+
+    def publish(self, user_ids):
+        with self._lock:
+            wakeups = [w for u in user_ids for w in self._subscribers.get(u, ())]
+        for wakeup in wakeups:
+            wakeup.set()
+
+
+class RedisBroker(MemoryBroker):
+    """Also relays wakeups through Redis pub/sub, reaching streams in every worker and host.
+
+    The event rows stay in the database; Redis only carries "user N has news".
+    The subscriber thread starts with the first stream, so building the app
+    (and forking workers) opens no connection.
+    """
+
+    CHANNEL = 'expense-approval-events'
+
+    def __init__(self, url):
+        super().__init__()
+        import redis  # Optional dependency: pip install redis
+        self._redis = redis.Redis.from_url(url)
+        self._listener = None
+        self._listener_lock = threading.Lock()
+
+    def subscribe(self, user_id):
+        with self._listener_lock:
+            if self._listener is None:
+                self._listener = threading.Thread(target=self._listen, name='event-broker', daemon=True)
+                self._listener.start()
+        return super().subscribe(user_id)
+
+    def publish(self, user_ids):
+        super().publish(user_ids)  # Local streams do not wait for the round trip
+        try:
+            self._redis.publish(self.CHANNEL, json.dumps(sorted(user_ids)))
+        except Exception as e:
+            print(f"Event broker publish failed (streams will catch up by polling): {e}")
+
+    def _listen(self):
+        while True:
+            try:
+                pubsub = self._redis.pubsub(ignore_subscribe_messages=True)
+                pubsub.subscribe(self.CHANNEL)
+                for message in pubsub.listen():
+                    MemoryBroker.publish(self, json.loads(message['data']))
+            except Exception as e:
+                print(f"Event broker subscription lost: {e}. Reconnecting...")
+                time.sleep(1)
+
+
+broker = MemoryBroker()
+
+
+def init_app(app):
+    global broker
+    if app.config['EVENT_BROKER_URL']:
+        broker = RedisBroker(app.config['EVENT_BROKER_URL'])
+
+
+# --- Streaming ---
+
+def _format(event_id, kind, data):
+    return f'id: {event_id}\nevent: {kind}\ndata: {data}\n\n'
+
+
+def stream(user_id, last_event_id=None):
+    """Server-Sent Events for one user, resuming after last_event_id.
+
+    Without a last_event_id the stream starts at the current end of the log
+    (load the queue first) and says so with a `ready` event. If events after
+    last_event_id were pruned, a `resync` event asks the client to reload the
+    queue. With SSE_MAX_STREAM_SECONDS = 0 the backlog is sent and the stream
+    ends, which suits clients that prefer polling.
+    """
+    config = current_app.config
+    batch_size = config['SSE_BATCH_SIZE']
+    deadline = time.monotonic() + config['SSE_MAX_STREAM_SECONDS']
+    # Subscribe before the first read so no commit can slip in between
+    wakeup = broker.subscribe(user_id)
+    try:
+        yield f'retry: {config["SSE_RETRY_MS"]}\n\n'
+        oldest, newest = db.session.execute(
+            select(func.min(ApprovalEvent.id), func.max(ApprovalEvent.id))
+        ).one()
+        if last_event_id is None:
+            last_event_id = newest or 0
+            yield _format(last_event_id, 'ready', '{}')
+        elif last_event_id > (newest or 0) or (oldest or 1) - 1 > last_event_id or \
+                (oldest is None and last_event_id > 0):
+            last_event_id = newest or 0
+            yield _format(last_event_id, 'resync', '{}')
+
+        while True:
+            wakeup.clear()
+            rows = db.session.execute(
+                select(ApprovalEvent.id, ApprovalEvent.type, ApprovalEvent.payload)
+                .where(ApprovalEvent.user_id == user_id, ApprovalEvent.id > last_event_id)
+                .order_by(ApprovalEvent.id)
+                .limit(batch_size)
+            ).all()
+            db.session.rollback()  # Hand the connection back between reads
+            for event_id, kind, payload in rows:
+                yield _format(event_id, kind, payload)
+                last_event_id = event_id
+            if len(rows) == batch_size:
+                continue
+
+            remaining = deadline - time.monotonic()
+            if remaining <= 0:
+                return
+            if not wakeup.wait(min(config['SSE_POLL_INTERVAL'], remaining)):
+                yield ': keep-alive\n\n'
+    finally:
+        broker.unsubscribe(user_id, wakeup)
+
+
+# --- Retention ---
+
+def prune(older_than_days, batch_size=10000):
+    """Deletes events older than the given age in batches; returns how many were removed."""
+    cutoff = datetime.utcnow() - timedelta(days=older_than_days)
+    removed = 0
+    while True:
+        ids = db.session.scalars(
+            select(ApprovalEvent.id).where(ApprovalEvent.created_at < cutoff)
+            .order_by(ApprovalEvent.id).limit(batch_size)
+        ).all()
+        if not ids:
+            return removed
+        db.session.execute(delete(ApprovalEvent).where(ApprovalEvent.id.in_(ids)))
+        db.session.commit()
+        removed += len(ids)
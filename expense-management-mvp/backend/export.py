@@ -0,0 +1,137 @@
+import csv
+import heapq
+import io
+import json
+from itertools import islice
+from operator import itemgetter
+
+from sqlalchemy import select
+from sqlalchemy.orm import aliased
+
+from listing import apply_expense_filters
+from models import db, User, Expense, ApprovalStep, ApproverGroup, ArchivedExpense, ArchivedApprovalStep
+
+# --- Streaming Expense Export ---
+#
+# The export is one projected SELECT (no ORM objects) read through a streaming
+# result in `batch_size` partitions and written out chunk by chunk, so memory
+# stays flat and the first bytes leave before the query has finished.
+# Archived expenses (see archive.py) are exported too: the live and archive
+# queries both stream in id order and are merged row by row.
+
+EXPORT_FORMATS = ('csv', 'ndjson')
+STEP_MODES = ('none', 'flat', 'nested')
+
+EXPENSE_FIELDS = ('id', 'user_id', 'submitter_name', 'company_id', 'title', 'description', 'amount',
+                  'currency', 'category', 'date', 'status', 'submitted_at')
+STEP_FIELDS = ('step_id', 'step_sequence', 'step_approver_id', 'step_approver_name', 'step_group_id',
+               'step_status', 'step_comments', 'step_decided_at')
+
+
+def build_export_query(filters, steps_mode, user_id=None, company_id=None, archived=False):
+    """The export SELECT over the live tables, or with `archived` over the archive tables."""
+    expense, step = (ArchivedExpense, ArchivedApprovalStep) if archived else (Expense, ApprovalStep)
+    submitter = aliased(User)
+    columns = [
+        expense.id, expense.user_id, submitter.name.label('submitter_name'), expense.company_id,
+        expense.title, expense.description, expense.amount, expense.currency, expense.category,
+        expense.date, expense.status, expense.submitted_at
+    ]
+    stmt = select(*columns).join(submitter, submitter.id == expense.user_id)
+
+    if steps_mode != 'none':
+        approver = aliased(User)
+        stmt = stmt.add_columns(
+            step.id.label('step_id'),
+            step.sequence.label('step_sequence'),
+            step.approver_id.label('step_approver_id'),
+            db.func.coalesce(approver.name, ApproverGroup.name).label('step_approver_name'),
+            step.group_id.label('step_group_id'),
+            step.status.label('step_status'),
+            step.comments.label('step_comments'),
+            step.decided_at.label('step_decided_at')
+        ).outerjoin(step, step.expense_id == expense.id) \
+         .outerjoin(approver, approver.id == step.approver_id) \
+         .outerjoin(ApproverGroup, ApproverGroup.id == step.group_id)
+
+    stmt = apply_expense_filters(stmt, filters, expense)
+    if user_id is not None:
+        stmt = stmt.filter(expense.user_id == user_id)
+    if company_id is not None:
+        stmt = stmt.filter(expense.company_id == company_id)
+
+    order = [expense.id]
+    if steps_mode != 'none':
+        order += [step.sequence, step.id]
+    return stmt.order_by(*order)
+
+
+def _iter_rows(stmts, batch_size):
+    """Partitions of the rows of statements ordered by expense id, merged into one id order.
+
+    An expense lives in exactly one of the tables, so its rows stay together.
+    """
+    results = [db.session.execute(stmt, execution_options={'yield_per': batch_size, 'stream_results': True})
+               for stmt in stmts]
+    try:
+        if len(results) == 1:
+            yield from results[0].partitions()
+            return
+        rows = heapq.merge(*results, key=itemgetter(0))  # Expense id
+        while True:
+            partition = list(islice(rows, batch_size))
+            if not partition:
+                break
+            yield partition
+    finally:
+        for result in results:
+            result.close()
+
+
+def _plain(value):
+    return value.isoformat() if hasattr(value, 'isoformat') else value
+
+
+def stream_csv(stmts, steps_mode, batch_size):
+    fields = EXPENSE_FIELDS + (STEP_FIELDS if steps_mode == 'flat' else ())
+    buffer = io.StringIO()
+    writer = csv.writer(buffer)
+
+    writer.writerow(fields)
+    yield buffer.getvalue()
+
+    for partition in _iter_rows(stmts, batch_size):
+        buffer.seek(0)
+        buffer.truncate()
+        for row in partition:
+            writer.writerow([_plain(row[i]) for i in range(len(fields))])
+        yield buffer.getvalue()
+
+
+def stream_ndjson(stmts, steps_mode, batch_size):
+    if steps_mode != 'nested':
+        fields = EXPENSE_FIELDS + (STEP_FIELDS if steps_mode == 'flat' else ())
+        for partition in _iter_rows(stmts, batch_size):
+            yield ''.join(
+                json.dumps({f: _plain(row[i]) for i, f in enumerate(fields)}) + '\n' for row in partition
+            )
+        return
+
+    # Nested: rows arrive ordered by expense id, so each expense's steps are contiguous
+    current = None
+    for partition in _iter_rows(stmts, batch_size):
+        lines = []
+        for row in partition:
+            if current is None or current['id'] != row.id:
+                if current is not None:
+                    lines.append(json.dumps(current) + '\n')
+                current = {f: _plain(row[i]) for i, f in enumerate(EXPENSE_FIELDS)}
+                current['approval_steps'] = []
+            if row.step_id is not None:
+                current['approval_steps'].append({
+                    f[len('step_'):]: _plain(row[len(EXPENSE_FIELDS) + i]) for i, f in enumerate(STEP_FIELDS)
+                })
+        if lines:
+            yield ''.join(lines)
+    if current is not None:
+        yield json.dumps(current) + '\n'
@@ -0,0 +1,195 @@
+import logging
+import threading
+import time
+from collections import OrderedDict
+
+logger = logging.getLogger(__name__)
+
+# --- Upstream Fetcher ---
+
+FX_API_URL = "https://api.exchangerate-api.com/v4/latest/{base}"
+
+
+class RateFetchError(Exception):
+    """Raised when the upstream rate provider cannot be reached."""
+
+
+def fetch_latest_rates(base_currency, url_template=FX_API_URL, attempts=3, timeout=5):
+    """Fetches the full rate table for a base currency with exponential backoff."""
+    import requests  # Deferred: only the first upstream fetch pays for the import
+
+    for attempt in range(attempts):
+        try:
+            response = requests.get(url_template.format(base=base_currency), timeout=timeout)
+            response.raise_for_status()
+            return response.json()['rates']
+        except (requests.RequestException, ValueError, KeyError) as e:
+            if attempt < attempts - 1:
+                logger.warning("API request failed (Attempt %d): %s. Retrying...", attempt + 1, e)
+                time.sleep(2 ** attempt)
+            else:
+                raise RateFetchError(f"Failed to get exchange rates for {base_currency} after {attempts} attempts.") from e
+
+
+# --- Rate Cache ---
+
+class _Entry:
+    __slots__ = ('rates', 'fetched_at')
+
+    def __init__(self, rates, fetched_at):
+        self.rates = rates
+        self.fetched_at = fetched_at
+
+
+class _Flight:
+    """A single in-progress upstream fetch that concurrent callers wait on."""
+    __slots__ = ('done', 'rates')
+
+    def __init__(self):
+        self.done = threading.Event()
+        self.rates = None
+
+
+class RateCache:
+    """Process-wide cache of whole rate tables keyed by base currency.
+
+    A table is fresh for `ttl` seconds. Concurrent misses on the same base
+    share one upstream fetch, and if that fetch fails a table younger than
+    `stale_ttl` is served instead. After a failed fetch the base is not
+    fetched again for `failure_backoff` seconds: misses in that window get
+    the same answer (the stale table, or None) without waiting on retries.
+    `fetcher(base)` must return a mapping of currency -> rate, and can be
+    swapped for a local stub in tests.
+    """
+
+    def __init__(self, fetcher=fetch_latest_rates, ttl=3600, stale_ttl=86400,
+                 max_entries=32, failure_backoff=5, clock=time.monotonic):
+        self.fetcher = fetcher
+        self.ttl = ttl
+        self.stale_ttl = max(stale_ttl, ttl)
+        self.max_entries = max_entries
+        self.failure_backoff = failure_backoff
+        self.clock = clock
+        self._entries = OrderedDict()
+        self._inflight = {}
+        self._failed = {}  # base -> clock() of its last failed fetch
+        self._lock = threading.Lock()
+
+    def get_rates(self, base_currency):
+        """Returns the rate table for base_currency, or None if unavailable."""
+        with self._lock:
+            entry = self._entries.get(base_currency)
+            if entry is not None and self.clock() - entry.fetched_at < self.ttl:
+                self._entries.move_to_end(base_currency)
+                return entry.rates
+
+            failed_at = self._failed.get(base_currency)
+            if failed_at is not None and self.clock() - failed_at < self.failure_backoff:
+                return self._stale_rates(base_currency)  # Upstream just failed: do not retry yet
+
+            flight = self._inflight.get(base_currency)
+            is_leader = flight is None
+            if is_leader:
+                flight = _Flight()
+                self._inflight[base_currency] = flight
+
+        if not is_leader:
+            flight.done.wait()
+            return flight.rates
+
+        try:
+            rates = self._fetch(base_currency)
+            with self._lock:
+                if rates:
+                    self._store(base_currency, rates)
+                    self._failed.pop(base_currency, None)
+                else:
+                    now = self.clock()
+                    self._failed = {b: t for b, t in self._failed.items() if now - t < self.failure_backoff}
+                    self._failed[base_currency] = now
+                    rates = self._stale_rates(base_currency)
+                del self._inflight[base_currency]
+        except BaseException:
+            with self._lock:
+                del self._inflight[base_currency]
+            flight.done.set()
+            raise
+
+        flight.rates = rates
+        flight.done.set()
+        return rates
+
+    def get_rate(self, from_currency, to_currency):
+        """Returns the from -> to rate, deriving it from any fresh cached table."""
+        if from_currency == to_currency:
+            return 1.0
+
+        rate = self._derive_from_cache(from_currency, to_currency)
+        if rate is not None:
+            return rate
+
+        rates = self.get_rates(from_currency)
+        if not rates:
+            return None
+        return rates.get(to_currency)
+
+    def configure(self, ttl, stale_ttl, max_entries, failure_backoff=5):
+        """Applies an app's cache settings (called by create_app())."""
+        with self._lock:
+            self.ttl = ttl
+            self.stale_ttl = max(stale_ttl, ttl)
+            self.max_entries = max_entries
+            self.failure_backoff = failure_backoff
+            self._evict()
+
+    def clear(self):
+        with self._lock:
+            self._entries.clear()
+            self._failed.clear()
+
+    # --- Internal helpers (caller holds self._lock unless noted) ---
+
+    def _fetch(self, base_currency):
+        # Runs outside the lock so other bases are not blocked on network I/O
+        try:
+            return self.fetcher(base_currency)
+        except Exception as e:
+            logger.warning("Exchange rate fetch for %s failed: %s", base_currency, e)
+            return None
+
+    def _store(self, base_currency, rates):
+        self._entries[base_currency] = _Entry(dict(rates), self.clock())
+        self._entries.move_to_end(base_currency)
+        self._evict()
+
+    def _evict(self):
+        now = self.clock()
+        for base in [b for b, e in self._entries.items() if now - e.fetched_at >= self.stale_ttl]:
+            del self._entries[base]
+        while len(self._entries) > self.max_entries:
+            self._entries.popitem(last=False)
+
+    def _stale_rates(self, base_currency):
+        entry = self._entries.get(base_currency)
+        if entry is not None and self.clock() - entry.fetched_at < self.stale_ttl:
+            logger.info("Serving stale exchange rates for %s", base_currency)
+            return entry.rates
+        return None
+
+    def _derive_from_cache(self, from_currency, to_currency):
+        with self._lock:
+            now = self.clock()
+            direct = self._entries.get(from_currency)
+            if direct is not None and now - direct.fetched_at < self.ttl:
+                self._entries.move_to_end(from_currency)
+                return direct.rates.get(to_currency)
+
+            # Any fresh table quoting both currencies gives the cross rate
+            for entry in self._entries.values():
+                if now - entry.fetched_at >= self.ttl:
+                    continue
+                from_rate = entry.rates.get(from_currency)
+                to_rate = entry.rates.get(to_currency)
+                if from_rate and to_rate is not None:
+                    return to_rate / from_rate
+        return None
@@ -0,0 +1,338 @@
+import csv
+import io
+import threading
+from array import array
+from collections import defaultdict
+from datetime import date, datetime, timedelta
+
+from sqlalchemy import select
+
+from models import db, FxRate
+import versions
+
+try:
+    import numpy as np
+except ImportError:  # Optional: without numpy the same matrix is read with plain Python
+    np = None
+
+# --- Historical FX Rates ---
+#
+# fx_rates holds one row per (date, currency): units of that currency per one
+# unit of FX_HISTORY_BASE, the same quoting the live rate API uses. Rates are
+# loaded from a CSV file (ECB-style wide files or long date,currency,rate
+# files, quoted in any base) or a pluggable provider, rebased to
+# FX_HISTORY_BASE and upserted; `flask load-fx-rates` does both.
+#
+# Conversions never look rates up one by one. Each process keeps the whole
+# history as a dense matrix, one row per day and one column per currency,
+# with weekends, holidays and the days since the last load filled from the
+# previous rate for up to FX_HISTORY_FILL_DAYS. A batch is then converted by
+# indexing that matrix with the items' day and currency positions: one
+# vectorized pass with numpy, one list pass without it. The matrix is rebuilt
+# when a load bumps the ('fx', 0) data version, whichever process loaded it.
+#
+# A rate from A to B on a day is R[day, B] / R[day, A].
+
+
+def parse_date(value):
+    return datetime.strptime(value.strip(), '%Y-%m-%d').date()
+
+
+def _parse_rate(value):
+    try:
+        rate = float(value)
+    except (TypeError, ValueError):
+        return None  # 'N/A' and empty cells in published files
+    return rate if rate > 0 else None
+
+
+# --- Loading ---
+
+def parse_rate_file(text_stream):
+    """Yields (date, currency, rate) from a CSV rate file.
+
+    Long files have date, currency and rate columns. Wide files (the ECB
+    history, for one) have a date column followed by one column per currency.
+    Rates are as quoted in the file; rebase() converts them.
+    """
+    reader = csv.reader(text_stream)
+    header = [name.strip() for name in next(reader, [])]
+    lowered = [name.lower() for name in header]
+    if not header or lowered[0] != 'date':
+        raise ValueError('The first column must be "date"')
+
+    if 'currency' in lowered and 'rate' in lowered:
+        currency_col, rate_col = lowered.index('currency'), lowered.index('rate')
+        for row in reader:
+            if row:
+                rate = _parse_rate(row[rate_col])
+                if rate is not None:
+                    yield parse_date(row[0]), row[currency_col].strip().upper(), rate
+        return
+
+    currencies = [(i, name.upper()) for i, name in enumerate(header) if i > 0 and len(name) == 3]
+    for row in reader:
+        if not row:
+            continue
+        day = parse_date(row[0])
+        for i, currency in currencies:
+            rate = _parse_rate(row[i]) if i < len(row) else None
+            if rate is not None:
+                yield day, currency, rate
+
+
+def rebase(rates, file_base, target_base):
+    """{date: {currency: rate}} quoted per file_base -> quoted per target_base.
+
+    Days without a target_base rate cannot be rebased and are left out.
+    """
+    by_day = defaultdict(dict)
+    for day, currency, rate in rates:
+        by_day[day][currency] = rate
+    rebased = {}
+    for day, day_rates in by_day.items():
+        day_rates.setdefault(file_base, 1.0)
+        target = day_rates.get(target_base)
+        if target is None:
+            continue
+        rebased[day] = {currency: rate / target for currency, rate in day_rates.items()}
+    return rebased
+
+
+def _upsert_statement(dialect_name):
+    table = FxRate.__table__
+    if dialect_name == 'postgresql':
+        from sqlalchemy.dialects.postgresql import insert
+    else:
+        from sqlalchemy.dialects.sqlite import insert
+    stmt = insert(table)
+    return stmt.on_conflict_do_update(
+        index_elements=['date', 'currency'],
+        set_={column: stmt.excluded[column] for column in ('rate', 'source', 'loaded_at')}
+    )
+
+
+def store(rates_by_day, source, batch_size=5000):
+    """Upserts {date: {currency: rate}} (already in FX_HISTORY_BASE) and commits; returns the row count."""
+    now = datetime.utcnow()
+    statement = _upsert_statement(db.session.get_bind().dialect.name)
+    batch, count = [], 0
+    for day in sorted(rates_by_day):
+        for currency, rate in rates_by_day[day].items():
+            batch.append({'date': day, 'currency': currency, 'rate': rate, 'source': source, 'loaded_at': now})
+            if len(batch) >= batch_size:
+                db.session.execute(statement, batch)
+                count += len(batch)
+                batch = []
+    if batch:
+        db.session.execute(statement, batch)
+        count += len(batch)
+    if count:
+        versions.bump_fx_rates()
+    db.session.commit()
+    return count
+
+
+def load_file(binary_stream, file_base, target_base, source):
+    """Loads a CSV rate file; returns (rows stored, days)."""
+    text_stream = io.TextIOWrapper(binary_stream, encoding='utf-8-sig', newline='')
+    rebased = rebase(parse_rate_file(text_stream), file_base.upper(), target_base)
+    return store(rebased, source), len(rebased)
+
+
+# --- Providers ---
+#
+# A provider is fetch(start, end, base) -> iterable of (date, currency, rate)
+# quoted per `base`. Register more with @provider('name').
+
+PROVIDERS = {}
+
+
+def provider(name):
+    def register(fn):
+        PROVIDERS[name] = fn
+        return fn
+    return register
+
+
+@provider('frankfurter')
+def fetch_frankfurter(start, end, base, url='https://api.frankfurter.app', timeout=30):
+    """Daily ECB reference rates from the Frankfurter API, in yearly requests."""
+    import requests  # Deferred like the live fetcher
+
+    while start <= end:
+        until = min(end, date(start.year, 12, 31))
+        response = requests.get(f'{url}/{start.isoformat()}..{until.isoformat()}',
+                                params={'from': base}, timeout=timeout)
+        response.raise_for_status()
+        for day, rates in response.json()['rates'].items():
+            for currency, rate in rates.items():
+                yield parse_date(day), currency, rate
+        start = until + timedelta(days=1)
+
+
+def load_provider(name, start, end, target_base):
+    """Loads a provider's rates for [start, end]; returns (rows stored, days)."""
+    rebased = rebase(PROVIDERS[name](start, end, target_base), target_base, target_base)
+    return store(rebased, name), len(rebased)
+
+
+# --- Rate Matrix ---
+
+class RateMatrix:
+    """Dense days x currencies rate table; missing cells are NaN."""
+
+    def __init__(self, start, currencies, days, values):
+        self.start = start
+        self.currencies = currencies
+        self.columns = {currency: i for i, currency in enumerate(currencies)}
+        self.days = days
+        self.values = values  # numpy 2-D array, or a flat array('d') of days * len(currencies)
+
+    @classmethod
+    def build(cls, rows, base, fill_days):
+        """From (date, currency, rate) rows in date order; the base currency is always 1.0."""
+        rows = list(rows)
+        if not rows:
+            return cls(None, [base], 0, None)
+        start, end = rows[0][0], rows[-1][0]
+        currencies = sorted({currency for _, currency, _ in rows} | {base})
+        columns = {currency: i for i, currency in enumerate(currencies)}
+        # Carry the last rates forward past the end, for expenses dated after the last load
+        days = (end - start).days + 1 + fill_days
+        width = len(currencies)
+
+        if np is not None:
+            values = np.full((days, width), np.nan)
+            day_index = np.fromiter(((day - start).days for day, _, _ in rows), dtype=np.int64, count=len(rows))
+            column_index = np.fromiter((columns[c] for _, c, _ in rows), dtype=np.int64, count=len(rows))
+            values[day_index, column_index] = np.fromiter((r for _, _, r in rows), dtype=float, count=len(rows))
+            values[:, columns[base]] = 1.0
+            # Forward fill: each cell takes the last known day at or before it, within fill_days
+            known = np.where(~np.isnan(values), np.arange(days)[:, None], -1)
+            last_known = np.maximum.accumulate(known, axis=0)
+            usable = (last_known >= 0) & (np.arange(days)[:, None] - last_known <= fill_days)
+            filled = values[np.maximum(last_known, 0), np.arange(width)]
+            values = np.where(usable, filled, np.nan)
+        else:
+            nan = float('nan')
+            values = array('d', [nan]) * (days * width)
+            for day, currency, rate in rows:
+                values[(day - start).days * width + columns[currency]] = rate
+            for column in range(width):
+                last, last_day = nan, -fill_days - 1
+                for day in range(days):
+                    cell = day * width + column
+                    if column == columns[base]:
+                        values[cell] = 1.0
+                    elif values[cell] == values[cell]:  # Not NaN
+                        last, last_day = values[cell], day
+                    elif day - last_day <= fill_days:
+                        values[cell] = last
+        return cls(start, currencies, days, values)
+
+    def convert(self, amounts, currencies, dates, to_currency):
+        """Converts parallel lists in one pass; returns (converted, rates) with None where no rate is known.
+
+        Dates are 'YYYY-MM-DD' strings; raises ValueError for one that is not a date.
+        """
+        if np is not None:
+            return self._convert_numpy(amounts, currencies, dates, to_currency)
+        return self._convert_python(amounts, currencies, dates, to_currency)
+
+    def _convert_numpy(self, amounts, currencies, dates, to_currency):
+        amounts = np.asarray(amounts, dtype=float)
+        n = len(amounts)
+        if self.start is None or to_currency not in self.columns:
+            return [None] * n, [None] * n
+        try:
+            days = np.asarray(dates, dtype='datetime64[D]')
+        except ValueError:
+            raise ValueError('Every date must be YYYY-MM-DD')
+        day_index = (days - np.datetime64(self.start, 'D')).astype(np.int64)
+        # Currency codes to columns once per distinct code, not per item
+        codes, inverse = np.unique(np.asarray(currencies, dtype=str), return_inverse=True)
+        column_index = np.array([self.columns.get(code, -1) for code in codes], dtype=np.int64)[inverse]
+
+        valid = (day_index >= 0) & (day_index < self.days) & (column_index >= 0)
+        rows = np.where(valid, day_index, 0)
+        from_rates = np.where(valid, self.values[rows, np.where(valid, column_index, 0)], np.nan)
+        rates = self.values[rows, self.columns[to_currency]] / from_rates
+        converted = np.round(amounts * rates, 2)
+        known = ~np.isnan(rates)
+        return (np.where(known, converted, None).tolist(), np.where(known, rates, None).tolist())
+
+    def _convert_python(self, amounts, currencies, dates, to_currency):
+        n = len(amounts)
+        if self.start is None or to_currency not in self.columns:
+            return [None] * n, [None] * n
+        width, values, start, days = len(self.currencies), self.values, self.start, self.days
+        to_column = self.columns[to_currency]
+        columns = {code: self.columns.get(code) for code in set(currencies)}
+        try:
+            start_ordinal = start.toordinal()
+            offsets = [date.fromisoformat(day).toordinal() - start_ordinal for day in dates]
+        except ValueError:
+            raise ValueError('Every date must be YYYY-MM-DD')
+        converted, rates = [], []
+        for amount, currency, offset in zip(amounts, currencies, offsets):
+            column = columns[currency]
+            rate = None
+            if column is not None and 0 <= offset < days:
+                rate = values[offset * width + to_column] / values[offset * width + column]
+                if rate != rate:
+                    rate = None
+            rates.append(rate)
+            converted.append(round(float(amount) * rate, 2) if rate is not None else None)
+        return converted, rates
+
+
+_matrices = {}  # engine url -> (fx data version, RateMatrix)
+_lock = threading.Lock()
+
+
+def rate_matrix(base, fill_days):
+    """The process's rate matrix, rebuilt from fx_rates when a load has changed them."""
+    key = str(db.engine.url)
+    version = versions.current_versions([(versions.FX_RATES, 0)])[0][1]
+    cached = _matrices.get(key)
+    if cached is not None and cached[0] == version:
+        return cached[1]
+    with _lock:
+        cached = _matrices.get(key)
+        if cached is None or cached[0] != version:
+            rows = db.session.execute(
+                select(FxRate.date, FxRate.currency, FxRate.rate).order_by(FxRate.date)
+            ).tuples()
+            cached = (version, RateMatrix.build(rows, base, fill_days))
+            _matrices[key] = cached
+    return cached[1]
+
+
+def parse_batch(data, max_items):
+    """(amounts, currencies, dates) from a batch request body; raises ValueError.
+
+    Accepts parallel arrays (`amounts`, `currencies`, `dates`) or `items`, a
+    list of [amount, currency, date] triples.
+    """
+    if 'items' in data:
+        items = data['items']
+        if not isinstance(items, list) or not all(isinstance(i, list) and len(i) == 3 for i in items):
+            raise ValueError('items must be a list of [amount, currency, date] triples')
+        amounts, currencies, dates = (list(column) for column in zip(*items)) if items else ([], [], [])
+    else:
+        amounts, currencies, dates = data.get('amounts'), data.get('currencies'), data.get('dates')
+        if not all(isinstance(column, list) for column in (amounts, currencies, dates)):
+            raise ValueError('Send items, or amounts, currencies and dates as arrays')
+        if not len(amounts) == len(currencies) == len(dates):
+            raise ValueError('amounts, currencies and dates must have the same length')
+    if len(amounts) > max_items:
+        raise ValueError(f'At most {max_items} items per request')
+
+    if not all(isinstance(amount, (int, float)) and not isinstance(amount, bool) for amount in amounts):
+        raise ValueError('Every amount must be a number')
+    if not all(isinstance(currency, str) for currency in currencies):
+        raise ValueError('Every currency must be a 3-letter code')
+    if not all(isinstance(day, str) and len(day) == 10 for day in dates):
+        raise ValueError('Every date must be YYYY-MM-DD')
+    return amounts, [currency.upper() for currency in currencies], dates
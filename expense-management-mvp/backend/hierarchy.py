@@ -0,0 +1,182 @@
+from sqlalchemy import delete, insert, select, true
+
+from models import db, User, UserHierarchy
+
+# --- Org Hierarchy (closure table) ---
+#
+# user_hierarchy stores every (ancestor, descendant, depth) pair of the reporting
+# tree, including a depth-0 row for each user. "All ancestors", "all
+# descendants" and "depth" are then single indexed queries. Writers keep it in
+# step with User.manager_id inside the same transaction via add_user(),
+# move_user() and remove_user(); rebuild() recomputes it from manager_id.
+
+closure = UserHierarchy.__table__
+
+
+class HierarchyError(ValueError):
+    """Raised when a manager change would make the reporting tree cyclic."""
+
+
+def is_in_subtree(user_id, root_id):
+    """True if user_id is root_id or reports (directly or not) to root_id."""
+    return db.session.execute(
+        select(closure.c.depth).where(closure.c.ancestor_id == root_id, closure.c.descendant_id == user_id)
+    ).first() is not None
+
+
+def check_manager(user_id, manager_id):
+    """Raises HierarchyError if making manager_id the manager of user_id creates a cycle."""
+    if manager_id is not None and is_in_subtree(manager_id, user_id):
+        raise HierarchyError('Invalid manager_id: it would create a reporting cycle')
+
+
+def add_user(user_id, manager_id):
+    """Adds a new (leaf) user under manager_id. The user must be flushed first."""
+    db.session.execute(insert(closure).values(ancestor_id=user_id, descendant_id=user_id, depth=0))
+    if manager_id is not None:
+        db.session.execute(insert(closure).from_select(
+            ['ancestor_id', 'descendant_id', 'depth'],
+            select(closure.c.ancestor_id, user_id, closure.c.depth + 1).where(closure.c.descendant_id == manager_id)
+        ))
+
+
+def _reattach(root_id, new_manager_id, min_depth):
+    """Re-links the subtree rows below root_id (at depth >= min_depth) under new_manager_id.
+
+    Links from root_id's current managers are dropped first. With min_depth=0
+    the root moves with its subtree; with min_depth=1 only its reports do.
+    """
+    subtree = select(closure.c.descendant_id).where(
+        closure.c.ancestor_id == root_id, closure.c.depth >= min_depth
+    )
+    above = select(closure.c.ancestor_id).where(closure.c.descendant_id == root_id, closure.c.depth >= 1)
+    db.session.execute(delete(closure).where(
+        closure.c.descendant_id.in_(subtree), closure.c.ancestor_id.in_(above)
+    ))
+
+    if new_manager_id is not None:
+        sup, sub = closure.alias('sup'), closure.alias('sub')
+        db.session.execute(insert(closure).from_select(
+            ['ancestor_id', 'descendant_id', 'depth'],
+            select(sup.c.ancestor_id, sub.c.descendant_id, sup.c.depth + sub.c.depth + 1 - min_depth)
+            .select_from(sup.join(sub, true()))
+            .where(sup.c.descendant_id == new_manager_id, sub.c.ancestor_id == root_id,
+                   sub.c.depth >= min_depth)
+        ))
+
+
+def move_user(user_id, new_manager_id):
+    """Moves user_id and everyone below them under new_manager_id (None for a root).
+
+    Call check_manager() first; the caller updates User.manager_id.
+    """
+    _reattach(user_id, new_manager_id, min_depth=0)
+
+
+def remove_user(user_id, new_manager_id):
+    """Detaches user_id from the tree, moving their reports under new_manager_id.
+
+    Reassigns User.manager_id of the direct reports with one UPDATE, so the whole
+    subtree moves in a constant number of statements.
+    """
+    _reattach(user_id, new_manager_id, min_depth=1)
+    db.session.execute(delete(closure).where(
+        (closure.c.ancestor_id == user_id) | (closure.c.descendant_id == user_id)
+    ))
+    User.query.filter_by(manager_id=user_id).update({'manager_id': new_manager_id}, synchronize_session=False)
+
+
+# --- Queries ---
+
+def ancestors(user_id, max_depth=None):
+    """Returns [(User, depth)] above user_id, nearest manager first."""
+    query = db.session.query(User, UserHierarchy.depth).join(
+        UserHierarchy, UserHierarchy.ancestor_id == User.id
+    ).filter(UserHierarchy.descendant_id == user_id, UserHierarchy.depth >= 1)
+    if max_depth is not None:
+        query = query.filter(UserHierarchy.depth <= max_depth)
+    return query.order_by(UserHierarchy.depth).all()
+
+
+def ancestor_ids(user_id, max_depth=None):
+    """Ids of the managers above user_id, nearest first."""
+    stmt = select(closure.c.ancestor_id).where(closure.c.descendant_id == user_id, closure.c.depth >= 1)
+    if max_depth is not None:
+        stmt = stmt.where(closure.c.depth <= max_depth)
+    return list(db.session.execute(stmt.order_by(closure.c.depth)).scalars())
+
+
+def descendants(user_id, max_depth=None, include_self=False):
+    """Returns [(User, depth)] below user_id, ordered by depth then name."""
+    query = db.session.query(User, UserHierarchy.depth).join(
+        UserHierarchy, UserHierarchy.descendant_id == User.id
+    ).filter(UserHierarchy.ancestor_id == user_id)
+    if not include_self:
+        query = query.filter(UserHierarchy.depth >= 1)
+    if max_depth is not None:
+        query = query.filter(UserHierarchy.depth <= max_depth)
+    return query.order_by(UserHierarchy.depth, User.name).all()
+
+
+def depth_of(user_id):
+    """Number of managers above user_id (0 for the top of the tree)."""
+    return db.session.execute(
+        select(db.func.count()).select_from(closure).where(
+            closure.c.descendant_id == user_id, closure.c.depth >= 1
+        )
+    ).scalar()
+
+
+# --- Bulk Rebuild ---
+
+def closure_rows(manager_pairs):
+    """Computes closure rows from (user_id, manager_id) pairs.
+
+    Returns (rows, cycles): rows are (ancestor_id, descendant_id, depth) tuples;
+    cycles lists user ids found on a manager_id cycle. Cyclic users are treated
+    as the top of their chain so that every user still gets rows.
+    """
+    managers = dict(manager_pairs)
+    chains = {}  # user_id -> ancestor ids, nearest first
+    cycles = set()
+
+    for start in managers:
+        path, position, current = [], {}, start
+        while current is not None and current not in chains:
+            if current in position:
+                # Everyone from the first repeat onwards is on the cycle
+                on_cycle = path[position[current]:]
+                cycles.update(on_cycle)
+                chains.update((user_id, []) for user_id in on_cycle)
+                path = path[:position[current]]
+                break
+            position[current] = len(path)
+            path.append(current)
+            manager_id = managers.get(current)
+            current = manager_id if manager_id in managers else None
+
+        # Resolve back to front so each user extends its manager's chain
+        for user_id in reversed(path):
+            manager_id = managers.get(user_id)
+            chains[user_id] = [manager_id] + chains[manager_id] if manager_id in chains else []
+
+    rows = []
+    for user_id, chain in chains.items():
+        rows.append((user_id, user_id, 0))
+        rows.extend((ancestor_id, user_id, depth) for depth, ancestor_id in enumerate(chain, start=1))
+    return rows, sorted(cycles)
+
+
+def rebuild(connection=None, batch_size=5000):
+    """Recomputes user_hierarchy from users.manager_id; returns the ids on cycles."""
+    conn = connection if connection is not None else db.session
+    pairs = conn.execute(select(User.__table__.c.id, User.__table__.c.manager_id)).all()
+    rows, cycles = closure_rows(pairs)
+
+    conn.execute(delete(closure))
+    for start in range(0, len(rows), batch_size):
+        conn.execute(insert(closure), [
+            {'ancestor_id': a, 'descendant_id': d, 'depth': depth}
+            for a, d, depth in rows[start:start + batch_size]
+        ])
+    return cycles
@@ -0,0 +1,317 @@
+import csv
+import io
+import json
+from datetime import datetime
+from types import SimpleNamespace
+
+from sqlalchemy import insert
+
+from base_amounts import RateMemo, base_fields
+import duplicates
+from models import db, Company, User, Expense, ApprovalStep
+from policy import PolicyContext, plan_steps
+from rollups import record_new
+from versions import bump_expenses
+import events
+
+# --- Bulk Expense Import ---
+#
+# Rows are parsed lazily from the upload stream and processed in fixed-size
+# batches: each batch resolves its users with one query, plans approval steps
+# against per-company policy contexts that are loaded once per import, inserts
+# expenses and steps with one multi-row INSERT each, and commits. Only the
+# current batch and a capped error list are ever held in memory.
+#
+# Re-imported files are safe: rows whose fingerprint (duplicates.py) matches
+# a stored expense or an earlier row, or whose idempotency_key was already
+# used by that user, are skipped and reported rather than inserted again.
+# allow_duplicates=True keeps fingerprint matches (idempotency keys still apply).
+
+IMPORT_FORMATS = ('csv', 'ndjson')
+
+# Columns that tell inserted rows apart. Rows equal on all of them also get the
+# same approval plan, so which of them gets which id does not matter.
+ROW_KEY = ('user_id', 'fingerprint', 'category')
+
+
+def iter_csv_rows(binary_stream):
+    text_stream = io.TextIOWrapper(binary_stream, encoding='utf-8-sig', newline='')
+    for row in csv.DictReader(text_stream):
+        yield row
+
+
+def iter_ndjson_rows(binary_stream):
+    text_stream = io.TextIOWrapper(binary_stream, encoding='utf-8')
+    for line in text_stream:
+        line = line.strip()
+        if not line:
+            continue
+        try:
+            row = json.loads(line)
+        except ValueError:
+            yield ValueError('Invalid JSON')
+            continue
+        yield row if isinstance(row, dict) else ValueError('Each line must be a JSON object')
+
+
+def iter_rows(binary_stream, fmt):
+    """Yields (row_number, row dict or ValueError) from an uploaded stream."""
+    rows = iter_csv_rows(binary_stream) if fmt == 'csv' else iter_ndjson_rows(binary_stream)
+    # CSV row 1 is the header, so data starts at 2 to match spreadsheet line numbers
+    for number, row in enumerate(rows, start=2 if fmt == 'csv' else 1):
+        yield number, row
+
+
+def _clean_row(row):
+    """Validates one raw row, returning the Expense field dict (without company)."""
+    title = (row.get('title') or '').strip()
+    if not title:
+        raise ValueError('Missing required field: title')
+
+    try:
+        amount = float(row.get('amount'))
+    except (TypeError, ValueError):
+        raise ValueError('Invalid amount')
+    if amount <= 0:
+        raise ValueError('Amount must be positive')
+
+    currency = (row.get('currency') or '').strip().upper()
+    if len(currency) != 3:
+        raise ValueError('Invalid currency: expected a 3-letter ISO code')
+
+    date_str = row.get('date')
+    try:
+        date_obj = datetime.strptime(date_str, '%Y-%m-%d').date() if date_str else datetime.utcnow().date()
+    except (TypeError, ValueError):
+        raise ValueError('Invalid date: expected YYYY-MM-DD')
+
+    user_ref = row.get('user_id') or row.get('user_email')
+    if not user_ref:
+        raise ValueError('Missing required field: user_id or user_email')
+
+    idempotency_key = str(row.get('idempotency_key') or '').strip() or None
+    if idempotency_key and len(idempotency_key) > 100:
+        raise ValueError('Invalid idempotency_key: at most 100 characters')
+
+    return {
+        'user_ref': str(user_ref).strip(),
+        'title': title,
+        'description': row.get('description') or '',
+        'amount': amount,
+        'currency': currency,
+        'category': row.get('category') or 'Other',
+        'date': date_obj,
+        'idempotency_key': idempotency_key
+    }
+
+
+class ImportReport:
+    """Running totals plus the first `max_errors` row errors and skipped duplicates."""
+
+    def __init__(self, max_errors):
+        self.max_errors = max_errors
+        self.rows = 0
+        self.imported = 0
+        self.failed = 0
+        self.errors = []
+        self.duplicates = 0
+        self.duplicate_rows = []
+
+    def add_error(self, row_number, message):
+        self.failed += 1
+        if len(self.errors) < self.max_errors:
+            self.errors.append({'row': row_number, 'error': message})
+
+    def add_duplicate(self, row_number, **duplicate_of):
+        """A skipped row: duplicate_of=<expense id> or duplicate_of_row=<row number>."""
+        self.duplicates += 1
+        if len(self.duplicate_rows) < self.max_errors:
+            self.duplicate_rows.append({'row': row_number, **duplicate_of})
+
+    def to_dict(self):
+        return {
+            'rows': self.rows,
+            'imported': self.imported,
+            'failed': self.failed,
+            'errors': self.errors,
+            'errors_truncated': self.failed > len(self.errors),
+            'duplicates': self.duplicates,
+            'duplicate_rows': self.duplicate_rows,
+            'duplicate_rows_truncated': self.duplicates > len(self.duplicate_rows)
+        }
+
+
+def match_returned_ids(rows, returned):
+    """Ids from RETURNING (id, *ROW_KEY) rows, lined up with the inserted `rows`."""
+    ids_by_key = {}
+    for returned_row in returned:
+        ids_by_key.setdefault(tuple(returned_row[1:]), []).append(returned_row[0])
+    for ids in ids_by_key.values():
+        ids.sort(reverse=True)  # Popped from the end: equal rows take ids in ascending order
+    return [ids_by_key[tuple(row[name] for name in ROW_KEY)].pop() for row in rows]
+
+
+class ExpenseImporter:
+    def __init__(self, batch_size=500, max_errors=1000, rate_lookup=None, default_base_currency='USD',
+                 allow_duplicates=False):
+        self.batch_size = batch_size
+        self.allow_duplicates = allow_duplicates
+        self.report = ImportReport(max_errors)
+        self._policies = {}
+        # Without a rate lookup, rows are stored unrated for the rerate job
+        self._rates = RateMemo(rate_lookup or (lambda from_currency, to_currency: None))
+        self._base_currencies = {}
+        self.default_base_currency = default_base_currency
+
+    def run(self, numbered_rows):
+        batch = []
+        for number, row in numbered_rows:
+            self.report.rows += 1
+            if isinstance(row, Exception):
+                self.report.add_error(number, str(row))
+                continue
+            try:
+                batch.append((number, _clean_row(row)))
+            except ValueError as e:
+                self.report.add_error(number, str(e))
+                continue
+            if len(batch) >= self.batch_size:
+                self._flush(batch)
+                batch = []
+        if batch:
+            self._flush(batch)
+        return self.report
+
+    def _policy(self, company_id):
+        if company_id not in self._policies:
+            self._policies[company_id] = PolicyContext(company_id)
+        return self._policies[company_id]
+
+    def _base_currency(self, company_id):
+        if company_id not in self._base_currencies:
+            base = db.session.query(Company.base_currency).filter(Company.id == company_id).scalar()
+            self._base_currencies[company_id] = base or self.default_base_currency
+        return self._base_currencies[company_id]
+
+    def _resolve_users(self, batch):
+        """Loads every user referenced by the batch with a single query."""
+        refs = {fields['user_ref'] for _, fields in batch}
+        ids = {int(r) for r in refs if r.isdigit()}
+        emails = refs - {str(i) for i in ids}
+        users = User.query.filter(db.or_(User.id.in_(ids), User.email.in_(emails))).all() if refs else []
+        by_ref = {}
+        for user in users:
+            by_ref[str(user.id)] = user
+            by_ref[user.email] = user
+        return by_ref
+
+    def _skip_duplicates(self, candidates):
+        """Drops (and reports) rows already stored or already seen in this batch.
+
+        Stored matches are looked up for the whole batch at once, by
+        fingerprint and by (user, idempotency key); earlier batches are
+        committed, so they are found the same way.
+        """
+        keys = {(user.id, fields['idempotency_key']) for _, user, fields in candidates if fields['idempotency_key']}
+        stored_keys = duplicates.existing_idempotency_keys(keys)
+        stored_fingerprints = {} if self.allow_duplicates else duplicates.existing_fingerprints(
+            {fields['fingerprint'] for _, _, fields in candidates}
+        )
+
+        kept, seen_keys, seen_fingerprints = [], {}, {}
+        for number, user, fields in candidates:
+            key = (user.id, fields['idempotency_key']) if fields['idempotency_key'] else None
+            if key in stored_keys:
+                self.report.add_duplicate(number, duplicate_of=stored_keys[key])
+            elif key in seen_keys:
+                self.report.add_duplicate(number, duplicate_of_row=seen_keys[key])
+            elif fields['fingerprint'] in stored_fingerprints:
+                self.report.add_duplicate(number, duplicate_of=stored_fingerprints[fields['fingerprint']])
+            elif not self.allow_duplicates and fields['fingerprint'] in seen_fingerprints:
+                self.report.add_duplicate(number, duplicate_of_row=seen_fingerprints[fields['fingerprint']])
+            else:
+                kept.append((number, user, fields))
+                if key:
+                    seen_keys[key] = number
+                seen_fingerprints.setdefault(fields['fingerprint'], number)
+        return kept
+
+    def _flush(self, batch):
+        users = self._resolve_users(batch)
+        now = datetime.utcnow()
+
+        candidates = []
+        for number, fields in batch:
+            user = users.get(fields.pop('user_ref'))
+            if user is None:
+                self.report.add_error(number, 'User not found')
+                continue
+            fields['fingerprint'] = duplicates.fingerprint(user.id, fields['amount'], fields['currency'],
+                                                           fields['date'], fields['title'])
+            candidates.append((number, user, fields))
+
+        expense_rows, plans, numbers = [], [], []
+        for number, user, fields in self._skip_duplicates(candidates):
+            base_currency = self._base_currency(user.company_id)
+            base = base_fields(fields['amount'], fields['currency'], base_currency,
+                               self._rates(fields['currency'], base_currency))
+            policy_amount = base['base_amount'] if base['base_amount'] is not None else fields['amount']
+            steps = plan_steps(self._policy(user.company_id), user.id, user.manager_id,
+                               policy_amount, fields['category'])
+            expense_rows.append({
+                **fields,
+                **base,
+                'user_id': user.id,
+                'company_id': user.company_id,
+                'status': 'Pending' if steps else 'Approved',
+                'pending_step_count': len(steps),
+                'submitted_at': now
+            })
+            plans.append(steps)
+            numbers.append(number)
+
+        if not expense_rows:
+            return
+
+        try:
+            # Multi-row INSERT ... RETURNING, in whatever order the database
+            # returns the rows (neither SQLite nor Postgres promises VALUES order)
+            table = Expense.__table__
+            returned = db.session.execute(
+                insert(table).returning(table.c.id, *(table.c[name] for name in ROW_KEY)),
+                expense_rows
+            ).all()
+            expense_ids = match_returned_ids(expense_rows, returned)
+
+            step_rows = [
+                {
+                    'expense_id': expense_id,
+                    'company_id': row['company_id'],
+                    'approver_id': step.get('approver_id'),
+                    'group_id': step.get('group_id'),
+                    'rule_id': step.get('rule_id'),
+                    'sequence': step['sequence'],
+                    'required_approvals': step.get('required_approvals', 1),
+                    'approval_count': 0,
+                    'status': 'Waiting',
+                    'created_at': now
+                }
+                for expense_id, row, steps in zip(expense_ids, expense_rows, plans)
+                for step in steps
+            ]
+            if step_rows:
+                db.session.execute(insert(ApprovalStep.__table__), step_rows)
+            created = [SimpleNamespace(**row) for row in expense_rows]
+            record_new(created)
+            bump_expenses(created)
+            events.track().record(expense_ids)
+            db.session.commit()
+        except Exception as e:
+            db.session.rollback()
+            for number in numbers:
+                self.report.add_error(number, f'Batch insert failed: {e.__class__.__name__}')
+            return
+
+        self.report.imported += len(expense_rows)
+        # Keep the identity map from growing across batches
+        db.session.expunge_all()
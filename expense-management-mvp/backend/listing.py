@@ -0,0 +1,107 @@
+import base64
+import json
+from datetime import datetime
+
+from sqlalchemy import tuple_
+
+from models import Expense
+
+# --- Query Parameter Parsing ---
+
+EXPENSE_STATUSES = ('Pending', 'Approved', 'Rejected')
+
+
+def parse_date(value, field):
+    """Parses a YYYY-MM-DD query value, raising ValueError with the field name."""
+    try:
+        return datetime.strptime(value, '%Y-%m-%d').date()
+    except (ValueError, TypeError):
+        raise ValueError(f'Invalid {field}: expected YYYY-MM-DD')
+
+
+def parse_expense_filters(args):
+    """Reads status/category/date_from/date_to/min_base_amount/max_base_amount filters from request args."""
+    filters = {}
+
+    status = args.get('status')
+    if status:
+        if status not in EXPENSE_STATUSES:
+            raise ValueError(f'Invalid status: must be one of {", ".join(EXPENSE_STATUSES)}')
+        filters['status'] = status
+
+    category = args.get('category')
+    if category:
+        filters['category'] = category
+
+    if args.get('date_from'):
+        filters['date_from'] = parse_date(args.get('date_from'), 'date_from')
+    if args.get('date_to'):
+        filters['date_to'] = parse_date(args.get('date_to'), 'date_to')
+
+    # Bounds on the amount in the company base currency
+    for field in ('min_base_amount', 'max_base_amount'):
+        if args.get(field):
+            try:
+                filters[field] = float(args.get(field))
+            except ValueError:
+                raise ValueError(f'Invalid {field}: expected a number')
+
+    return filters
+
+
+def apply_expense_filters(query, filters, model=Expense):
+    """Adds parsed filters to a query over `model` (Expense, or ArchivedExpense for archive reads)."""
+    if 'status' in filters:
+        query = query.filter(model.status == filters['status'])
+    if 'category' in filters:
+        query = query.filter(model.category == filters['category'])
+    if 'date_from' in filters:
+        query = query.filter(model.date >= filters['date_from'])
+    if 'date_to' in filters:
+        query = query.filter(model.date <= filters['date_to'])
+    if 'min_base_amount' in filters:
+        query = query.filter(model.base_amount >= filters['min_base_amount'])
+    if 'max_base_amount' in filters:
+        query = query.filter(model.base_amount <= filters['max_base_amount'])
+    return query
+
+
+def parse_page_size(args, default, maximum):
+    per_page = args.get('per_page', default=default, type=int)
+    return max(1, min(per_page, maximum))
+
+
+# --- Keyset (Cursor) Pagination ---
+
+def encode_cursor(expense):
+    """Opaque cursor pointing just past `expense` in (submitted_at, id) DESC order."""
+    payload = json.dumps([expense.submitted_at.isoformat(), expense.id], separators=(',', ':'))
+    return base64.urlsafe_b64encode(payload.encode()).decode().rstrip('=')
+
+
+def decode_cursor(cursor):
+    try:
+        padded = cursor + '=' * (-len(cursor) % 4)
+        submitted_at, expense_id = json.loads(base64.urlsafe_b64decode(padded.encode()))
+        return datetime.fromisoformat(submitted_at), int(expense_id)
+    except (ValueError, TypeError):
+        raise ValueError('Invalid cursor')
+
+
+def keyset_page(query, per_page, cursor=None, model=Expense):
+    """Returns (expenses, next_cursor) for newest-first expense listings.
+
+    Seeks on the (submitted_at, id) row value instead of using OFFSET, so
+    every page is an index range scan of `per_page + 1` rows.
+    """
+    if cursor:
+        submitted_at, expense_id = decode_cursor(cursor)
+        query = query.filter(tuple_(model.submitted_at, model.id) < (submitted_at, expense_id))
+
+    rows = query.order_by(model.submitted_at.desc(), model.id.desc()).limit(per_page + 1).all()
+
+    next_cursor = None
+    if len(rows) > per_page:
+        rows = rows[:per_page]
+        next_cursor = encode_cursor(rows[-1])
+    return rows, next_cursor
@@ -0,0 +1,182 @@
+import threading
+import time
+from bisect import bisect_left
+from contextvars import ContextVar
+
+from flask import request
+from sqlalchemy import event
+
+# --- Request Metrics ---
+#
+# Every request records its latency, SQL statement count, time spent in the
+# database (from engine events) and response size into per-endpoint
+# histograms, labelled by URL rule (not the raw path) and method. /api/metrics
+# renders them in the Prometheus text format. The per-request cost is a few
+# perf_counter() calls per statement plus one locked update per request.
+# Metrics are per process; with several workers, scrape each one.
+#
+# With SLOW_REQUEST_MS set, statements and their durations are also kept for
+# the request, and requests slower than the threshold are logged with their
+# slowest statements.
+
+LATENCY_BUCKETS = (0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1, 2.5, 5, 10)
+STATEMENT_BUCKETS = (1, 2, 3, 5, 10, 20, 50, 100, 200)
+SIZE_BUCKETS = (256, 1024, 4096, 16384, 65536, 262144, 1048576, 4194304)
+
+
+class RequestStats:
+    __slots__ = ('started', 'statements', 'db_time', 'captured', 'capture_limit', 'status', 'size')
+
+    def __init__(self, capture_limit):
+        self.started = time.perf_counter()
+        self.statements = 0
+        self.db_time = 0.0
+        self.captured = [] if capture_limit else None
+        self.capture_limit = capture_limit
+        self.status = 500
+        self.size = None
+
+
+_current_stats = ContextVar('request_stats', default=None)
+
+
+class Histogram:
+    """Prometheus-style histogram with one series per label tuple."""
+
+    def __init__(self, name, description, buckets):
+        self.name = name
+        self.description = description
+        self.buckets = tuple(buckets)
+        self._series = {}  # labels -> [count per bucket (last is +Inf)..., sum]
+
+    def observe(self, labels, value):
+        series = self._series.get(labels)
+        if series is None:
+            series = self._series[labels] = [0] * (len(self.buckets) + 1) + [0.0]
+        series[bisect_left(self.buckets, value)] += 1
+        series[-1] += value
+
+    def render(self, label_names):
+        lines = [f'# HELP {self.name} {self.description}', f'# TYPE {self.name} histogram']
+        for labels, series in sorted(self._series.items()):
+            base = ','.join(f'{k}="{_escape(v)}"' for k, v in zip(label_names, labels))
+            cumulative = 0
+            for bound, count in zip(self.buckets + ('+Inf',), series[:-1]):
+                cumulative += count
+                lines.append(f'{self.name}_bucket{{{base},le="{bound}"}} {cumulative}')
+            lines.append(f'{self.name}_sum{{{base}}} {series[-1]}')
+            lines.append(f'{self.name}_count{{{base}}} {cumulative}')
+        return lines
+
+
+def _escape(value):
+    return str(value).replace('\\', '\\\\').replace('"', '\\"').replace('\n', '\\n')
+
+
+class Registry:
+    """The process-wide request metrics."""
+
+    LABELS = ('endpoint', 'method')
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        self.latency = Histogram('expense_http_request_duration_seconds',
+                                 'Request latency, including streamed bodies.', LATENCY_BUCKETS)
+        self.db_time = Histogram('expense_http_request_db_seconds',
+                                 'Time spent executing SQL per request.', LATENCY_BUCKETS)
+        self.statements = Histogram('expense_http_request_sql_statements',
+                                    'SQL statements executed per request.', STATEMENT_BUCKETS)
+        self.size = Histogram('expense_http_response_size_bytes',
+                              'Response body size (responses with a known length).', SIZE_BUCKETS)
+        self.requests = {}  # (endpoint, method, status) -> count
+
+    def record(self, endpoint, method, stats, elapsed):
+        labels = (endpoint, method)
+        with self._lock:
+            self.latency.observe(labels, elapsed)
+            self.db_time.observe(labels, stats.db_time)
+            self.statements.observe(labels, stats.statements)
+            if stats.size is not None:
+                self.size.observe(labels, stats.size)
+            key = (endpoint, method, str(stats.status))
+            self.requests[key] = self.requests.get(key, 0) + 1
+
+    def render(self):
+        with self._lock:
+            lines = ['# HELP expense_http_requests_total Requests handled, by status code.',
+                     '# TYPE expense_http_requests_total counter']
+            for (endpoint, method, status), count in sorted(self.requests.items()):
+                lines.append(f'expense_http_requests_total{{endpoint="{_escape(endpoint)}",'
+                             f'method="{method}",status="{status}"}} {count}')
+            for histogram in (self.latency, self.db_time, self.statements, self.size):
+                lines.extend(histogram.render(self.LABELS))
+        return '\n'.join(lines) + '\n'
+
+
+registry = Registry()
+
+
+def install_engine_hooks(engine):
+    """Times every statement on `engine` and charges it to the current request, if any."""
+
+    @event.listens_for(engine, 'before_cursor_execute')
+    def start_statement(conn, cursor, statement, parameters, context, executemany):
+        if _current_stats.get() is not None:
+            conn.info.setdefault('metrics_started', []).append(time.perf_counter())
+
+    @event.listens_for(engine, 'after_cursor_execute')
+    def end_statement(conn, cursor, statement, parameters, context, executemany):
+        stats = _current_stats.get()
+        started = conn.info.get('metrics_started')
+        if stats is None or not started:
+            return
+        elapsed = time.perf_counter() - started.pop()
+        stats.statements += 1
+        stats.db_time += elapsed
+        if stats.captured is not None and len(stats.captured) < stats.capture_limit:
+            stats.captured.append((elapsed, statement))
+
+
+def init_app(app, db):
+    """Registers the request hooks and engine events (METRICS_ENABLED turns them off)."""
+    if not app.config['METRICS_ENABLED']:
+        return
+    slow_ms = app.config['SLOW_REQUEST_MS']
+    capture_limit = app.config['SLOW_REQUEST_MAX_STATEMENTS'] if slow_ms else 0
+
+    with app.app_context():
+        install_engine_hooks(db.engine)
+
+    @app.before_request
+    def start_request():
+        request.environ['expense.metrics_token'] = _current_stats.set(RequestStats(capture_limit))
+
+    @app.after_request
+    def note_response(response):
+        stats = _current_stats.get()
+        if stats is not None:
+            stats.status = response.status_code
+            # The header, not calculate_content_length(): that would buffer streamed bodies
+            stats.size = response.content_length
+        return response
+
+    # Teardown runs after streamed bodies finish, so their queries are counted too
+    @app.teardown_request
+    def finish_request(exc):
+        token = request.environ.pop('expense.metrics_token', None)
+        if token is None:
+            return
+        stats = _current_stats.get()
+        _current_stats.reset(token)
+        elapsed = time.perf_counter() - stats.started
+        endpoint = request.url_rule.rule if request.url_rule is not None else '<unmatched>'
+        registry.record(endpoint, request.method, stats, elapsed)
+
+        if slow_ms and elapsed * 1000 >= slow_ms:
+            slowest = sorted(stats.captured, key=lambda s: s[0], reverse=True)[:5]
+            app.logger.warning(
+                'Slow request: %s %s took %.0f ms (%d SQL statements, %.0f ms in the database)%s',
+                request.method, request.full_path.rstrip('?'), elapsed * 1000, stats.statements,
+                stats.db_time * 1000,
+                ''.join(f'\n  {ms * 1000:8.1f} ms  {" ".join(sql.split())}' for ms, sql in slowest)
+            )
@@ -0,0 +1,304 @@
+from datetime import datetime
+
+from flask import current_app
+from sqlalchemy import MetaData, inspect, text
+
+from models import db
+import duplicates
+import search
+import sla
+
+# --- Versioned Schema Migrations ---
+#
+# Each migration is additive and idempotent (IF NOT EXISTS / column checks),
+# so an interrupted upgrade can simply be re-run. A brand new database is
+# built from the models with create_all() and stamped at the latest version;
+# an existing database (including the original unversioned schema, treated
+# as version 0) only gets the migrations it has not seen yet.
+
+MIGRATIONS = []
+
+
+def migration(version, description):
+    """Registers a migration function `fn(connection)` under a version number."""
+    def register(fn):
+        MIGRATIONS.append((version, description, fn))
+        MIGRATIONS.sort(key=lambda m: m[0])
+        return fn
+    return register
+
+
+def latest_version():
+    return MIGRATIONS[-1][0] if MIGRATIONS else 0
+
+
+# --- DDL helpers ---
+
+def create_index(conn, name, table, columns, unique=False):
+    unique_sql = 'UNIQUE ' if unique else ''
+    conn.execute(text(
+        f'CREATE {unique_sql}INDEX IF NOT EXISTS {name} ON {table} ({", ".join(columns)})'
+    ))
+
+
+def add_column(conn, table, column_name, column_ddl):
+    """Adds a column if the table does not already have it."""
+    existing = {c['name'] for c in inspect(conn).get_columns(table)}
+    if column_name not in existing:
+        conn.execute(text(f'ALTER TABLE {table} ADD COLUMN {column_name} {column_ddl}'))
+
+
+def relax_not_null(conn, table, column_name):
+    """Makes a column nullable, rebuilding the table where the database requires it."""
+    if conn.dialect.name != 'sqlite':
+        conn.execute(text(f'ALTER TABLE {table} ALTER COLUMN {column_name} DROP NOT NULL'))
+        return
+
+    metadata = MetaData()
+    metadata.reflect(conn)  # Whole schema, so foreign keys resolve in the copy
+    reflected = metadata.tables[table]
+    if reflected.c[column_name].nullable:
+        return
+
+    # SQLite cannot alter a column in place: copy into a new table, drop the old
+    # one, rename, then recreate its indexes (the documented 12-step procedure).
+    indexes = list(reflected.indexes)
+    rebuilt = reflected.to_metadata(metadata, name=f'{table}__rebuild')
+    rebuilt.indexes.clear()
+    rebuilt.c[column_name].nullable = True
+    rebuilt.create(conn)
+
+    columns = ', '.join(c.name for c in reflected.columns)
+    conn.execute(text(f'INSERT INTO {table}__rebuild ({columns}) SELECT {columns} FROM {table}'))
+    conn.execute(text(f'DROP TABLE {table}'))
+    conn.execute(text(f'ALTER TABLE {table}__rebuild RENAME TO {table}'))
+    for index in indexes:
+        index.create(conn, checkfirst=True)
+
+
+# --- Migrations ---
+
+@migration(1, 'Composite indexes for hot query filters')
+def add_hot_path_indexes(conn):
+    create_index(conn, 'ix_approval_steps_approver_status', 'approval_steps', ['approver_id', 'status'])
+    create_index(conn, 'ix_approval_steps_expense_sequence', 'approval_steps', ['expense_id', 'sequence'])
+    create_index(conn, 'ix_expenses_submitted_at_id', 'expenses', ['submitted_at', 'id'])
+    create_index(conn, 'ix_expenses_user_submitted_at_id', 'expenses', ['user_id', 'submitted_at', 'id'])
+    create_index(conn, 'ix_expenses_status_submitted_at_id', 'expenses', ['status', 'submitted_at', 'id'])
+    create_index(conn, 'ix_expenses_company_status', 'expenses', ['company_id', 'status'])
+    create_index(conn, 'ix_users_role_company', 'users', ['role', 'company_id'])
+
+
+@migration(2, 'Approval policy engine: pooled/quorum steps and incremental completion')
+def add_policy_engine_columns(conn):
+    # approver_groups, approver_group_members, approval_rules and approval_votes
+    # are new tables and are created by create_all() before migrations run.
+    add_column(conn, 'approval_steps', 'group_id', 'INTEGER REFERENCES approver_groups (id)')
+    add_column(conn, 'approval_steps', 'rule_id', 'INTEGER REFERENCES approval_rules (id)')
+    add_column(conn, 'approval_steps', 'required_approvals', 'INTEGER NOT NULL DEFAULT 1')
+    add_column(conn, 'approval_steps', 'approval_count', 'INTEGER NOT NULL DEFAULT 0')
+    relax_not_null(conn, 'approval_steps', 'approver_id')
+    create_index(conn, 'ix_approval_steps_group_status', 'approval_steps', ['group_id', 'status'])
+
+    add_column(conn, 'expenses', 'pending_step_count', 'INTEGER NOT NULL DEFAULT 0')
+    conn.execute(text(
+        "UPDATE expenses SET pending_step_count = ("
+        "SELECT COUNT(*) FROM approval_steps "
+        "WHERE approval_steps.expense_id = expenses.id AND approval_steps.status = 'Waiting'"
+        ") WHERE status = 'Pending'"
+    ))
+
+
+@migration(3, 'Backfill spend_rollups from existing expenses')
+def backfill_spend_rollups(conn):
+    # spend_rollups itself is created by create_all(); aggregate what is already there
+    from rollups import rollup_key
+
+    totals = {}
+    rows = conn.execute(text(
+        'SELECT company_id, date, category, user_id, status, currency, COUNT(id), SUM(amount) '
+        'FROM expenses GROUP BY company_id, date, category, user_id, status, currency'
+    ))
+    for company_id, expense_date, category, user_id, status, currency, count, amount in rows:
+        if isinstance(expense_date, str):
+            expense_date = datetime.strptime(expense_date, '%Y-%m-%d').date()
+        key = rollup_key(company_id, expense_date, category, user_id, status, currency)
+        total = totals.setdefault(key, [0, 0.0])
+        total[0] += count
+        total[1] += amount or 0.0
+
+    conn.execute(text('DELETE FROM spend_rollups'))
+    if totals:
+        conn.execute(
+            text('INSERT INTO spend_rollups (company_id, period, category, user_id, status, currency, '
+                 'expense_count, total_amount) VALUES (:c, :p, :cat, :u, :s, :cur, :n, :t)'),
+            [{'c': k[0], 'p': k[1], 'cat': k[2], 'u': k[3], 's': k[4], 'cur': k[5], 'n': n, 't': t}
+             for k, (n, t) in totals.items()]
+        )
+
+
+@migration(4, 'Backfill the user_hierarchy closure table')
+def backfill_user_hierarchy(conn):
+    # user_hierarchy is created by create_all(); derive its rows from manager_id
+    from hierarchy import rebuild
+
+    cycles = rebuild(conn)
+    if cycles:
+        print(f"Warning: users {cycles} are on a manager cycle; treated as top-level")
+
+
+@migration(5, 'Tenant scoping: approval_steps.company_id and company-led indexes')
+def add_tenant_indexes(conn):
+    add_column(conn, 'approval_steps', 'company_id', 'INTEGER REFERENCES companies (id)')
+    conn.execute(text(
+        'UPDATE approval_steps SET company_id = ('
+        'SELECT company_id FROM expenses WHERE expenses.id = approval_steps.expense_id'
+        ') WHERE company_id IS NULL'
+    ))
+    create_index(conn, 'ix_approval_steps_company_approver_status', 'approval_steps',
+                 ['company_id', 'approver_id', 'status'])
+    create_index(conn, 'ix_approval_steps_company_group_status', 'approval_steps',
+                 ['company_id', 'group_id', 'status'])
+
+    create_index(conn, 'ix_expenses_company_submitted_at_id', 'expenses', ['company_id', 'submitted_at', 'id'])
+    create_index(conn, 'ix_expenses_company_status_submitted_at_id', 'expenses',
+                 ['company_id', 'status', 'submitted_at', 'id'])
+    create_index(conn, 'ix_users_company_role', 'users', ['company_id', 'role'])
+    create_index(conn, 'ix_approver_groups_company', 'approver_groups', ['company_id'])
+
+    # Superseded by the company-led versions above
+    conn.execute(text('DROP INDEX IF EXISTS ix_expenses_company_status'))
+    conn.execute(text('DROP INDEX IF EXISTS ix_users_role_company'))
+
+
+@migration(6, 'Base-currency amounts on expenses and in spend rollups')
+def add_base_amounts(conn):
+    add_column(conn, 'expenses', 'base_amount', 'FLOAT')
+    add_column(conn, 'expenses', 'base_currency', 'VARCHAR(3)')
+    add_column(conn, 'expenses', 'fx_rate', 'FLOAT')
+    add_column(conn, 'expenses', 'fx_rated_at', 'DATETIME')
+    create_index(conn, 'ix_expenses_company_base_amount', 'expenses', ['company_id', 'base_amount'])
+
+    add_column(conn, 'spend_rollups', 'total_base_amount', 'FLOAT NOT NULL DEFAULT 0')
+    add_column(conn, 'spend_rollups', 'unrated_count', 'INTEGER NOT NULL DEFAULT 0')
+    add_column(conn, 'spend_rollups', 'unrated_amount', 'FLOAT NOT NULL DEFAULT 0')
+    # No expense has a base amount yet; `flask rerate-expenses` fills them in
+    # (needs FX rates, so it is not done here) and moves these totals as it goes.
+    conn.execute(text(
+        'UPDATE spend_rollups SET total_base_amount = 0, '
+        'unrated_count = expense_count, unrated_amount = total_amount'
+    ))
+
+
+@migration(7, 'Full-text search index over expenses')
+def add_expense_search(conn):
+    # SQLite only (FTS5); elsewhere search uses its substring fallback
+    count = search.rebuild(conn)
+    if count:
+        print(f"Indexed {count} expenses for search")
+
+
+@migration(8, 'Company-led expense history index')
+def add_company_history_index(conn):
+    # The *_archive tables are new and created by create_all() (see archive.py)
+    create_index(conn, 'ix_expenses_company_user_submitted_at_id', 'expenses',
+                 ['company_id', 'user_id', 'submitted_at', 'id'])
+
+
+@migration(9, 'Expense fingerprints and idempotency keys for duplicate detection')
+def add_expense_fingerprints(conn):
+    for table in ('expenses', 'expenses_archive'):
+        add_column(conn, table, 'fingerprint', 'VARCHAR(32)')
+        add_column(conn, table, 'idempotency_key', 'VARCHAR(100)')
+
+        # Backfill in id order, a batch of hashes per UPDATE round trip
+        last_id = 0
+        while True:
+            rows = conn.execute(text(
+                f'SELECT id, user_id, amount, currency, date, title FROM {table} '
+                'WHERE id > :last_id AND fingerprint IS NULL ORDER BY id LIMIT 5000'
+            ), {'last_id': last_id}).all()
+            if not rows:
+                break
+            last_id = rows[-1].id
+            conn.execute(text(f'UPDATE {table} SET fingerprint = :fp WHERE id = :id'), [
+                {'id': row.id, 'fp': duplicates.fingerprint(
+                    row.user_id, row.amount, row.currency,
+                    datetime.strptime(str(row.date), '%Y-%m-%d').date(), row.title)}
+                for row in rows
+            ])
+
+        create_index(conn, f'ix_{table}_fingerprint', table, ['fingerprint'])
+        create_index(conn, f'ix_{table}_user_idempotency_key', table, ['user_id', 'idempotency_key'], unique=True)
+        create_index(conn, f'ix_{table}_user_currency_date_amount', table, ['user_id', 'currency', 'date', 'amount'])
+
+
+@migration(10, 'Approval step SLA due times, reminders and escalations')
+def add_approval_sla(conn):
+    for table in ('approval_steps', 'approval_steps_archive'):
+        add_column(conn, table, 'due_at', 'DATETIME')
+        add_column(conn, table, 'reminder_count', 'INTEGER NOT NULL DEFAULT 0')
+        add_column(conn, table, 'escalation_count', 'INTEGER NOT NULL DEFAULT 0')
+    create_index(conn, 'ix_approval_steps_status_due_at', 'approval_steps', ['status', 'due_at'])
+    # Steps already waiting are due from their creation, as new ones would be
+    count = sla.backfill(conn, current_app.config['APPROVAL_SLA_HOURS'])
+    if count:
+        print(f"Scheduled SLA due times for {count} waiting approval steps")
+
+
+# --- Runner ---
+
+def _ensure_version_table(conn):
+    conn.execute(text(
+        'CREATE TABLE IF NOT EXISTS schema_version ('
+        'version INTEGER PRIMARY KEY, '
+        'description VARCHAR(200) NOT NULL, '
+        'applied_at TIMESTAMP NOT NULL)'
+    ))
+
+
+def _record(conn, version, description):
+    conn.execute(
+        text('INSERT INTO schema_version (version, description, applied_at) VALUES (:v, :d, :t)'),
+        {'v': version, 'd': description, 't': datetime.utcnow()}
+    )
+
+
+def current_version(conn):
+    if not inspect(conn).has_table('schema_version'):
+        return 0
+    return conn.execute(text('SELECT COALESCE(MAX(version), 0) FROM schema_version')).scalar()
+
+
+def upgrade(engine=None):
+    """Brings the database schema up to the latest version without dropping data.
+
+    Returns the list of versions that were applied.
+    """
+    engine = engine or db.engine
+    applied = []
+
+    with engine.begin() as conn:
+        is_fresh = not inspect(conn).has_table('expenses')
+        _ensure_version_table(conn)
+        # Creates only tables that do not exist yet; existing ones are untouched
+        db.metadata.create_all(conn)
+
+        if is_fresh:
+            for version, description, _ in MIGRATIONS:
+                _record(conn, version, description)
+            return [m[0] for m in MIGRATIONS]
+
+        version = current_version(conn)
+
+    for target, description, fn in MIGRATIONS:
+        if target <= version:
+            continue
+        # One transaction per migration so progress survives a later failure
+        with engine.begin() as conn:
+            print(f"Applying schema migration {target}: {description}")
+            fn(conn)
+            _record(conn, target, description)
+        applied.append(target)
+
+    return applied
@@ -27,6 +27,10 @@ class Company(db.Model):
 class User(db.Model):
     """User model with role-based access"""
     __tablename__ = 'users'
+    __table_args__ = (
+        # Tenant-scoped queries lead with company_id
+        db.Index('ix_users_company_role', 'company_id', 'role'),
+    )
     
     id = db.Column(db.Integer, primary_key=True)
     email = db.Column(db.String(120), unique=True, nullable=False)
@@ -59,6 +63,23 @@ class User(db.Model):
 class Expense(db.Model):
     """Expense submission model"""
     __tablename__ = 'expenses'
+    __table_args__ = (
+        # Keyset pagination walks these newest-first on (submitted_at, id)
+        db.Index('ix_expenses_submitted_at_id', 'submitted_at', 'id'),
+        db.Index('ix_expenses_user_submitted_at_id', 'user_id', 'submitted_at', 'id'),
+        db.Index('ix_expenses_status_submitted_at_id', 'status', 'submitted_at', 'id'),
+        # Tenant-scoped listings: same keyset order within one company
+        db.Index('ix_expenses_company_submitted_at_id', 'company_id', 'submitted_at', 'id'),
+        db.Index('ix_expenses_company_status_submitted_at_id', 'company_id', 'status', 'submitted_at', 'id'),
+        # Tenant-scoped history: equality on both columns, so SQLite never walks the whole company
+        db.Index('ix_expenses_company_user_submitted_at_id', 'company_id', 'user_id', 'submitted_at', 'id'),
+        # Range filters and sorting on the normalized amount within a company
+        db.Index('ix_expenses_company_base_amount', 'company_id', 'base_amount'),
+        # Duplicate checks at submission (see duplicates.py)
+        db.Index('ix_expenses_fingerprint', 'fingerprint'),
+        db.Index('ix_expenses_user_idempotency_key', 'user_id', 'idempotency_key', unique=True),
+        db.Index('ix_expenses_user_currency_date_amount', 'user_id', 'currency', 'date', 'amount'),
+    )
     
     id = db.Column(db.Integer, primary_key=True)
     user_id = db.Column(db.Integer, db.ForeignKey('users.id'), nullable=False)
@@ -75,6 +96,19 @@ class Expense(db.Model):
     
     status = db.Column(db.String(20), default='Pending')  # 'Pending', 'Approved', 'Rejected'
     submitted_at = db.Column(db.DateTime, default=datetime.utcnow)
+
+    # Approval steps not yet Approved; the expense is Approved when this hits 0
+    pending_step_count = db.Column(db.Integer, nullable=False, default=0)
+
+    # Amount in the company's base currency, fixed at submission (NULL until a rate was available)
+    base_amount = db.Column(db.Float)
+    base_currency = db.Column(db.String(3))
+    fx_rate = db.Column(db.Float)  # currency -> base_currency rate that produced base_amount
+    fx_rated_at = db.Column(db.DateTime)
+
+    # Hash of user, amount, currency, date and normalized title; equal for exact resubmissions
+    fingerprint = db.Column(db.String(32))
+    idempotency_key = db.Column(db.String(100))  # Client-chosen, unique per user when set
     
     # Relationships
     approval_steps = db.relationship('ApprovalStep', backref='expense', lazy=True, cascade='all, delete-orphan')
@@ -88,6 +122,9 @@ class Expense(db.Model):
             'description': self.description,
             'amount': self.amount,
             'currency': self.currency,
+            'base_amount': self.base_amount,
+            'base_currency': self.base_currency,
+            'fx_rate': self.fx_rate,
             'category': self.category,
             # --- FIX: Included date in the JSON response ---
             'date': self.date.isoformat() if self.date else None,
@@ -105,26 +142,354 @@ class Expense(db.Model):
 class ApprovalStep(db.Model):
     """Sequential approval workflow step"""
     __tablename__ = 'approval_steps'
+    __table_args__ = (
+        db.Index('ix_approval_steps_approver_status', 'approver_id', 'status'),
+        db.Index('ix_approval_steps_expense_sequence', 'expense_id', 'sequence'),
+        db.Index('ix_approval_steps_group_status', 'group_id', 'status'),
+        db.Index('ix_approval_steps_company_approver_status', 'company_id', 'approver_id', 'status'),
+        db.Index('ix_approval_steps_company_group_status', 'company_id', 'group_id', 'status'),
+        # The SLA scheduler reads overdue Waiting steps as one range (sla.py)
+        db.Index('ix_approval_steps_status_due_at', 'status', 'due_at'),
+    )
     
     id = db.Column(db.Integer, primary_key=True)
     expense_id = db.Column(db.Integer, db.ForeignKey('expenses.id'), nullable=False)
-    approver_id = db.Column(db.Integer, db.ForeignKey('users.id'), nullable=False)
+    # Copied from the expense so tenant scoping can filter steps without a join
+    company_id = db.Column(db.Integer, db.ForeignKey('companies.id'), nullable=True)
+    # Exactly one of approver_id (a single approver) or group_id (a shared pool) is set
+    approver_id = db.Column(db.Integer, db.ForeignKey('users.id'), nullable=True)
+    group_id = db.Column(db.Integer, db.ForeignKey('approver_groups.id'), nullable=True)
+    rule_id = db.Column(db.Integer, db.ForeignKey('approval_rules.id'), nullable=True)
     
     sequence = db.Column(db.Integer, nullable=False)  # Order of approval (1, 2, 3...)
-    status = db.Column(db.String(20), default='Waiting')  # 'Waiting', 'Approved', 'Rejected'
+    status = db.Column(db.String(20), default='Waiting')  # 'Waiting', 'Approved', 'Rejected', 'Skipped'
+    required_approvals = db.Column(db.Integer, nullable=False, default=1)  # Quorum for group steps
+    approval_count = db.Column(db.Integer, nullable=False, default=0)
     comments = db.Column(db.Text)
     decided_at = db.Column(db.DateTime)
+    # SLA (sla.py): set once the step is actionable; moved on by each reminder or escalation
+    due_at = db.Column(db.DateTime, nullable=True)
+    reminder_count = db.Column(db.Integer, nullable=False, default=0)  # Since the last escalation
+    escalation_count = db.Column(db.Integer, nullable=False, default=0)
     
     created_at = db.Column(db.DateTime, default=datetime.utcnow)
 
+    votes = db.relationship('ApprovalVote', lazy=True, cascade='all, delete-orphan')
+
     def to_dict(self):
         return {
             'id': self.id,
             'expense_id': self.expense_id,
             'approver_id': self.approver_id,
-            'approver_name': self.approver.name if self.approver else None,
+            'approver_name': self.approver.name if self.approver else (self.group.name if self.group else None),
+            'group_id': self.group_id,
             'sequence': self.sequence,
+            'required_approvals': self.required_approvals,
+            'approval_count': self.approval_count,
             'status': self.status,
             'comments': self.comments,
-            'decided_at': self.decided_at.isoformat() if self.decided_at else None
+            'decided_at': self.decided_at.isoformat() if self.decided_at else None,
+            'due_at': self.due_at.isoformat() if self.due_at else None,
+            'escalation_count': self.escalation_count
+        }
+
+
+class ApproverGroup(db.Model):
+    """Named pool of approvers, stored once and referenced by approval steps"""
+    __tablename__ = 'approver_groups'
+    __table_args__ = (
+        db.Index('ix_approver_groups_company', 'company_id'),
+    )
+
+    id = db.Column(db.Integer, primary_key=True)
+    company_id = db.Column(db.Integer, db.ForeignKey('companies.id'), nullable=False)
+    name = db.Column(db.String(100), nullable=False)
+    created_at = db.Column(db.DateTime, default=datetime.utcnow)
+
+    members = db.relationship('ApproverGroupMember', backref='group', lazy=True, cascade='all, delete-orphan')
+    steps = db.relationship('ApprovalStep', backref='group', lazy=True)
+
+    def to_dict(self):
+        return {
+            'id': self.id,
+            'company_id': self.company_id,
+            'name': self.name,
+            'member_ids': [m.user_id for m in self.members]
+        }
+
+
+class ApproverGroupMember(db.Model):
+    """Membership of a user in an approver group"""
+    __tablename__ = 'approver_group_members'
+    __table_args__ = (
+        db.Index('ix_approver_group_members_user', 'user_id'),
+    )
+
+    group_id = db.Column(db.Integer, db.ForeignKey('approver_groups.id'), primary_key=True)
+    user_id = db.Column(db.Integer, db.ForeignKey('users.id'), primary_key=True)
+
+
+class ApprovalRule(db.Model):
+    """One rule of a company's approval policy.
+
+    A rule applies when the expense matches its amount range and category (unset
+    conditions always match) and adds approvers of one type:
+    'direct_manager', 'manager_chain' (chain_depth levels up, one after another),
+    'user' (approver_user_id) or 'group' (any `quorum` members of group_id).
+    Rules run in `sequence` order; rules sharing a sequence run in parallel.
+    """
+    __tablename__ = 'approval_rules'
+    __table_args__ = (
+        db.Index('ix_approval_rules_company_active', 'company_id', 'is_active'),
+    )
+
+    id = db.Column(db.Integer, primary_key=True)
+    company_id = db.Column(db.Integer, db.ForeignKey('companies.id'), nullable=False)
+    name = db.Column(db.String(100), nullable=False)
+    sequence = db.Column(db.Integer, nullable=False, default=1)
+
+    # Conditions
+    min_amount = db.Column(db.Float)
+    max_amount = db.Column(db.Float)
+    category = db.Column(db.String(50))
+
+    # Approvers
+    approver_type = db.Column(db.String(20), nullable=False)
+    chain_depth = db.Column(db.Integer, nullable=False, default=1)
+    approver_user_id = db.Column(db.Integer, db.ForeignKey('users.id'))
+    group_id = db.Column(db.Integer, db.ForeignKey('approver_groups.id'))
+    quorum = db.Column(db.Integer, nullable=False, default=1)
+
+    is_active = db.Column(db.Boolean, nullable=False, default=True)
+    created_at = db.Column(db.DateTime, default=datetime.utcnow)
+
+    def to_dict(self):
+        return {
+            'id': self.id,
+            'company_id': self.company_id,
+            'name': self.name,
+            'sequence': self.sequence,
+            'min_amount': self.min_amount,
+            'max_amount': self.max_amount,
+            'category': self.category,
+            'approver_type': self.approver_type,
+            'chain_depth': self.chain_depth,
+            'approver_user_id': self.approver_user_id,
+            'group_id': self.group_id,
+            'quorum': self.quorum,
+            'is_active': self.is_active
+        }
+
+
+class ApprovalVote(db.Model):
+    """Individual member decision on a group (quorum) approval step"""
+    __tablename__ = 'approval_votes'
+
+    step_id = db.Column(db.Integer, db.ForeignKey('approval_steps.id'), primary_key=True)
+    user_id = db.Column(db.Integer, db.ForeignKey('users.id'), primary_key=True)
+    decision = db.Column(db.String(20), nullable=False)  # 'Approved', 'Rejected'
+    comments = db.Column(db.Text)
+    decided_at = db.Column(db.DateTime, default=datetime.utcnow)
+
+
+class SpendRollup(db.Model):
+    """Pre-aggregated expense totals, maintained incrementally on every status change"""
+    __tablename__ = 'spend_rollups'
+
+    company_id = db.Column(db.Integer, db.ForeignKey('companies.id'), primary_key=True)
+    period = db.Column(db.String(7), primary_key=True)  # 'YYYY-MM' of Expense.date
+    category = db.Column(db.String(50), primary_key=True)  # '' when the expense has none
+    user_id = db.Column(db.Integer, db.ForeignKey('users.id'), primary_key=True)
+    status = db.Column(db.String(20), primary_key=True)
+    currency = db.Column(db.String(3), primary_key=True)  # Totals are kept per original currency
+
+    expense_count = db.Column(db.Integer, nullable=False, default=0)
+    total_amount = db.Column(db.Float, nullable=False, default=0.0)
+    # Company base currency totals; expenses without a base_amount yet are counted apart
+    total_base_amount = db.Column(db.Float, nullable=False, default=0.0, server_default='0')
+    unrated_count = db.Column(db.Integer, nullable=False, default=0, server_default='0')
+    unrated_amount = db.Column(db.Float, nullable=False, default=0.0, server_default='0')
+
+
+class UserHierarchy(db.Model):
+    """Closure table of the reporting tree: one row per (ancestor, descendant) pair, self rows at depth 0"""
+    __tablename__ = 'user_hierarchy'
+    __table_args__ = (
+        # Ancestor lookups (chain) walk by descendant; subtree lookups use the primary key
+        db.Index('ix_user_hierarchy_descendant_depth', 'descendant_id', 'depth'),
+    )
+
+    ancestor_id = db.Column(db.Integer, db.ForeignKey('users.id'), primary_key=True)
+    descendant_id = db.Column(db.Integer, db.ForeignKey('users.id'), primary_key=True)
+    depth = db.Column(db.Integer, nullable=False)
+
+
+class DataVersion(db.Model):
+    """Change counter for one company or user, bumped in the same transaction as the write"""
+    __tablename__ = 'data_versions'
+
+    scope = db.Column(db.String(10), primary_key=True)  # 'company' or 'user'
+    scope_id = db.Column(db.Integer, primary_key=True)
+    version = db.Column(db.Integer, nullable=False, default=0)
+
+
+class FxRate(db.Model):
+    """Historical daily rate: units of `currency` per one FX_HISTORY_BASE unit on `date` (see fx_history.py)"""
+    __tablename__ = 'fx_rates'
+
+    date = db.Column(db.Date, primary_key=True)  # Date first: the rate matrix is read as one date range
+    currency = db.Column(db.String(3), primary_key=True)
+    rate = db.Column(db.Float, nullable=False)
+    source = db.Column(db.String(50))  # File name or provider
+    loaded_at = db.Column(db.DateTime, default=datetime.utcnow)
+
+
+class ApprovalEvent(db.Model):
+    """Approval queue change for one recipient; the id doubles as the Server-Sent Events id"""
+    __tablename__ = 'approval_events'
+    __table_args__ = (
+        db.Index('ix_approval_events_user_id', 'user_id', 'id'),
+        # Ids must never be reused after pruning, or Last-Event-ID could skip events
+        {'sqlite_autoincrement': True},
+    )
+
+    id = db.Column(db.Integer, primary_key=True)
+    user_id = db.Column(db.Integer, db.ForeignKey('users.id'), nullable=False)  # Recipient
+    company_id = db.Column(db.Integer, db.ForeignKey('companies.id'), nullable=True)
+    expense_id = db.Column(db.Integer, nullable=False)
+    step_id = db.Column(db.Integer, nullable=True)
+    type = db.Column(db.String(30), nullable=False)  # 'step_created', 'step_decided', 'expense_finalized', 'step_reminder'
+    payload = db.Column(db.Text, nullable=False)  # JSON object sent as the event data
+    created_at = db.Column(db.DateTime, default=datetime.utcnow, index=True)
+
+
+class ArchivedExpense(db.Model):
+    """Finalized expense moved out of `expenses` by archive.py (same columns, plus when it moved)"""
+    __tablename__ = 'expenses_archive'
+    __table_args__ = (
+        # The keyset orders history and the admin listing read, as on the live table
+        db.Index('ix_expenses_archive_submitted_at_id', 'submitted_at', 'id'),
+        db.Index('ix_expenses_archive_user_submitted_at_id', 'user_id', 'submitted_at', 'id'),
+        db.Index('ix_expenses_archive_company_submitted_at_id', 'company_id', 'submitted_at', 'id'),
+        db.Index('ix_expenses_archive_company_status_submitted_at_id', 'company_id', 'status', 'submitted_at', 'id'),
+        db.Index('ix_expenses_archive_company_user_submitted_at_id', 'company_id', 'user_id', 'submitted_at', 'id'),
+        db.Index('ix_expenses_archive_fingerprint', 'fingerprint'),
+        db.Index('ix_expenses_archive_user_idempotency_key', 'user_id', 'idempotency_key', unique=True),
+        db.Index('ix_expenses_archive_user_currency_date_amount', 'user_id', 'currency', 'date', 'amount'),
+    )
+
+    id = db.Column(db.Integer, primary_key=True)  # Kept from the live row
+    user_id = db.Column(db.Integer, db.ForeignKey('users.id'), nullable=False)
+    company_id = db.Column(db.Integer, db.ForeignKey('companies.id'), nullable=False)
+    title = db.Column(db.String(200), nullable=False)
+    description = db.Column(db.Text)
+    amount = db.Column(db.Float, nullable=False)
+    currency = db.Column(db.String(3), nullable=False)
+    category = db.Column(db.String(50))
+    date = db.Column(db.Date)
+    status = db.Column(db.String(20))  # 'Approved' or 'Rejected'
+    submitted_at = db.Column(db.DateTime)
+    pending_step_count = db.Column(db.Integer, nullable=False, default=0)
+    base_amount = db.Column(db.Float)
+    base_currency = db.Column(db.String(3))
+    fx_rate = db.Column(db.Float)
+    fx_rated_at = db.Column(db.DateTime)
+    fingerprint = db.Column(db.String(32))
+    idempotency_key = db.Column(db.String(100))
+    archived_at = db.Column(db.DateTime, nullable=False, default=datetime.utcnow)
+
+    submitter = db.relationship('User', lazy=True)
+    approval_steps = db.relationship('ArchivedApprovalStep', lazy=True)
+
+    to_dict = Expense.to_dict  # Same output as the live row
+
+
+class ArchivedApprovalStep(db.Model):
+    """Approval step of an archived expense"""
+    __tablename__ = 'approval_steps_archive'
+    __table_args__ = (
+        db.Index('ix_approval_steps_archive_expense_sequence', 'expense_id', 'sequence'),
+    )
+
+    id = db.Column(db.Integer, primary_key=True)
+    expense_id = db.Column(db.Integer, db.ForeignKey('expenses_archive.id'), nullable=False)
+    company_id = db.Column(db.Integer, db.ForeignKey('companies.id'), nullable=True)
+    approver_id = db.Column(db.Integer, db.ForeignKey('users.id'), nullable=True)
+    group_id = db.Column(db.Integer, db.ForeignKey('approver_groups.id'), nullable=True)
+    rule_id = db.Column(db.Integer, db.ForeignKey('approval_rules.id'), nullable=True)
+    sequence = db.Column(db.Integer, nullable=False)
+    status = db.Column(db.String(20))
+    required_approvals = db.Column(db.Integer, nullable=False, default=1)
+    approval_count = db.Column(db.Integer, nullable=False, default=0)
+    comments = db.Column(db.Text)
+    decided_at = db.Column(db.DateTime)
+    due_at = db.Column(db.DateTime)
+    reminder_count = db.Column(db.Integer, nullable=False, default=0)
+    escalation_count = db.Column(db.Integer, nullable=False, default=0)
+    created_at = db.Column(db.DateTime)
+
+    approver = db.relationship('User', lazy=True)
+    group = db.relationship('ApproverGroup', lazy=True)
+
+    to_dict = ApprovalStep.to_dict
+
+
+class ArchivedApprovalVote(db.Model):
+    """Group member vote on an archived approval step"""
+    __tablename__ = 'approval_votes_archive'
+
+    step_id = db.Column(db.Integer, db.ForeignKey('approval_steps_archive.id'), primary_key=True)
+    user_id = db.Column(db.Integer, db.ForeignKey('users.id'), primary_key=True)
+    decision = db.Column(db.String(20), nullable=False)
+    comments = db.Column(db.Text)
+    decided_at = db.Column(db.DateTime)
+
+
+class StoredFile(db.Model):
+    """A distinct file body, stored once on disk under its SHA-256 however many attachments share it"""
+    __tablename__ = 'stored_files'
+
+    sha256 = db.Column(db.String(64), primary_key=True)
+    size = db.Column(db.BigInteger, nullable=False)
+    content_type = db.Column(db.String(100), nullable=False)  # Sniffed from the content, not the client
+    created_at = db.Column(db.DateTime, default=datetime.utcnow)
+    last_used_at = db.Column(db.DateTime, default=datetime.utcnow)  # Last upload; pruning waits a grace period
+    # Filled in on first read (attachments.describe)
+    width = db.Column(db.Integer)
+    height = db.Column(db.Integer)
+    described_at = db.Column(db.DateTime)
+
+
+class Attachment(db.Model):
+    """Receipt file attached to an expense"""
+    __tablename__ = 'attachments'
+    __table_args__ = (
+        db.Index('ix_attachments_expense_id', 'expense_id', 'id'),
+        db.Index('ix_attachments_sha256', 'sha256'),
+    )
+
+    id = db.Column(db.Integer, primary_key=True)
+    # No foreign key: the expense may be live or archived (ids are kept)
+    expense_id = db.Column(db.Integer, nullable=False)
+    company_id = db.Column(db.Integer, db.ForeignKey('companies.id'), nullable=True)
+    sha256 = db.Column(db.String(64), db.ForeignKey('stored_files.sha256'), nullable=False)
+    filename = db.Column(db.String(255), nullable=False)
+    uploaded_by = db.Column(db.Integer, db.ForeignKey('users.id'), nullable=True)
+    created_at = db.Column(db.DateTime, default=datetime.utcnow)
+
+    stored_file = db.relationship('StoredFile', lazy='joined')
+
+    def to_dict(self):
+        stored = self.stored_file
+        return {
+            'id': self.id,
+            'expense_id': self.expense_id,
+            'filename': self.filename,
+            'content_type': stored.content_type,
+            'size': stored.size,
+            'sha256': self.sha256,
+            'width': stored.width,
+            'height': stored.height,
+            'uploaded_by': self.uploaded_by,
+            'created_at': self.created_at.isoformat() if self.created_at else None
         }
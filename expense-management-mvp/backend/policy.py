@@ -0,0 +1,175 @@
+from types import SimpleNamespace
+
+from hierarchy import ancestor_ids
+from models import db, User, ApprovalRule, ApproverGroupMember, ApprovalStep
+
+# --- Approval Policy Engine ---
+#
+# A company's policy is its list of active ApprovalRules. plan_steps() turns the
+# rules that match an expense into the minimal list of approval steps to create;
+# group rules become ONE step that points at the shared approver pool instead of
+# one step per member. When the matching rules yield no approvers (or the
+# company has no rules) the default policy applies: the submitter's direct
+# manager, or the company's first Admin if there is none.
+
+APPROVER_TYPES = ('direct_manager', 'manager_chain', 'user', 'group')
+
+
+class PolicyError(ValueError):
+    """Raised for invalid policy rule definitions."""
+
+
+class PolicyContext:
+    """Per-company policy state, loaded once and reusable across many expenses."""
+
+    def __init__(self, company_id):
+        self.company_id = company_id
+        # Plain snapshots, so the context stays usable across commits in batch jobs
+        self.rules = [SimpleNamespace(**rule.to_dict()) for rule in ApprovalRule.query.filter_by(
+            company_id=company_id, is_active=True
+        ).order_by(ApprovalRule.sequence, ApprovalRule.id)]
+        self._group_sizes = None
+        self._chains = {}
+        self._admin_ids = None
+
+    def manager_chain(self, user_id, depth):
+        """Up to `depth` managers above user_id, nearest first (one query per user)."""
+        if user_id not in self._chains:
+            self._chains[user_id] = ancestor_ids(user_id)
+        return self._chains[user_id][:depth]
+
+    def group_size(self, group_id):
+        if self._group_sizes is None:
+            group_ids = [r.group_id for r in self.rules if r.approver_type == 'group']
+            self._group_sizes = dict(db.session.query(
+                ApproverGroupMember.group_id, db.func.count(ApproverGroupMember.user_id)
+            ).filter(
+                ApproverGroupMember.group_id.in_(group_ids)
+            ).group_by(ApproverGroupMember.group_id).all()) if group_ids else {}
+        return self._group_sizes.get(group_id, 0)
+
+    def fallback_admin_id(self, submitter_id):
+        """First Admin of the company other than the submitter."""
+        if self._admin_ids is None:
+            self._admin_ids = [row.id for row in db.session.query(User.id).filter(
+                User.company_id == self.company_id, User.role == 'Admin'
+            ).order_by(User.id).limit(2)]
+        return next((a for a in self._admin_ids if a != submitter_id), None)
+
+
+def rule_matches(rule, amount, category):
+    if rule.min_amount is not None and amount < rule.min_amount:
+        return False
+    if rule.max_amount is not None and amount > rule.max_amount:
+        return False
+    if rule.category and rule.category != category:
+        return False
+    return True
+
+
+def plan_steps(ctx, submitter_id, manager_id, amount, category):
+    """Returns the approval steps (as dicts) the company policy requires for an expense.
+
+    Steps are ordered by (rule.sequence, chain level) and numbered densely from 1.
+    The submitter never approves their own expense and an approver appears at most
+    once (at their earliest position).
+    """
+    candidates = []  # ((rule sequence, level), step dict)
+
+    for rule in ctx.rules:
+        if not rule_matches(rule, amount, category):
+            continue
+        if rule.approver_type == 'direct_manager':
+            if manager_id:
+                candidates.append(((rule.sequence, 1), {'approver_id': manager_id, 'rule_id': rule.id}))
+        elif rule.approver_type == 'manager_chain':
+            for level, approver_id in enumerate(ctx.manager_chain(submitter_id, rule.chain_depth), start=1):
+                candidates.append(((rule.sequence, level), {'approver_id': approver_id, 'rule_id': rule.id}))
+        elif rule.approver_type == 'user':
+            if rule.approver_user_id:
+                candidates.append(((rule.sequence, 1), {'approver_id': rule.approver_user_id, 'rule_id': rule.id}))
+        elif rule.approver_type == 'group':
+            size = ctx.group_size(rule.group_id)
+            if size:
+                candidates.append(((rule.sequence, 1), {
+                    'group_id': rule.group_id,
+                    'rule_id': rule.id,
+                    'required_approvals': max(1, min(rule.quorum, size))
+                }))
+
+    if not candidates:
+        approver_id = manager_id or ctx.fallback_admin_id(submitter_id)
+        if approver_id:
+            candidates.append(((1, 1), {'approver_id': approver_id}))
+
+    candidates.sort(key=lambda c: c[0])
+
+    steps, stages, seen_approvers, seen_groups = [], [], set(), set()
+    for stage, step in candidates:
+        approver_id = step.get('approver_id')
+        if approver_id is not None:
+            if approver_id == submitter_id or approver_id in seen_approvers:
+                continue
+            seen_approvers.add(approver_id)
+        elif step['group_id'] in seen_groups:
+            continue
+        else:
+            seen_groups.add(step['group_id'])
+        steps.append(step)
+        stages.append(stage)
+
+    # Number the surviving stages densely: 1, 2, 3...
+    numbers = {stage: n for n, stage in enumerate(sorted(set(stages)), start=1)}
+    for step, stage in zip(steps, stages):
+        step['sequence'] = numbers[stage]
+    return steps
+
+
+def apply_plan(expense, steps):
+    """Creates the planned ApprovalSteps for an expense and sets its status/counter."""
+    for step in steps:
+        db.session.add(ApprovalStep(
+            expense_id=expense.id,
+            company_id=expense.company_id,
+            approver_id=step.get('approver_id'),
+            group_id=step.get('group_id'),
+            rule_id=step.get('rule_id'),
+            sequence=step['sequence'],
+            required_approvals=step.get('required_approvals', 1),
+            status='Waiting'
+        ))
+    expense.pending_step_count = len(steps)
+    # No approver required by policy: auto-approve
+    expense.status = 'Pending' if steps else 'Approved'
+
+
+def validate_rule(data):
+    """Validates a rule payload, returning the cleaned field dict."""
+    approver_type = data.get('approver_type')
+    if approver_type not in APPROVER_TYPES:
+        raise PolicyError(f'approver_type must be one of {", ".join(APPROVER_TYPES)}')
+    if approver_type == 'user' and not data.get('approver_user_id'):
+        raise PolicyError('approver_user_id is required for user rules')
+    if approver_type == 'group' and not data.get('group_id'):
+        raise PolicyError('group_id is required for group rules')
+
+    try:
+        fields = {
+            'name': data.get('name') or approver_type,
+            'sequence': int(data.get('sequence', 1)),
+            'min_amount': float(data['min_amount']) if data.get('min_amount') is not None else None,
+            'max_amount': float(data['max_amount']) if data.get('max_amount') is not None else None,
+            'category': data.get('category') or None,
+            'approver_type': approver_type,
+            'chain_depth': int(data.get('chain_depth', 1)),
+            'approver_user_id': data.get('approver_user_id'),
+            'group_id': data.get('group_id'),
+            'quorum': int(data.get('quorum', 1)),
+            'is_active': bool(data.get('is_active', True))
+        }
+    except (ValueError, TypeError):
+        raise PolicyError('sequence, chain_depth, quorum and amounts must be numeric')
+
+    if fields['sequence'] < 1 or fields['chain_depth'] < 1 or fields['quorum'] < 1:
+        raise PolicyError('sequence, chain_depth and quorum must be at least 1')
+    return fields
@@ -0,0 +1,175 @@
+from collections import defaultdict
+from types import SimpleNamespace
+
+from sqlalchemy import case, func, select
+
+from models import db, Expense, ArchivedExpense, SpendRollup
+
+# --- Spend Rollups ---
+#
+# spend_rollups holds (count, amount, base amount, unrated count / amount) per
+# (company, month, category, user, status, currency). Writers call record_new() / record_transition() inside the
+# same transaction that changes Expense.status, so the table is always in step
+# with expenses; rebuild() recomputes it from scratch in id-range batches.
+
+KEY_COLUMNS = ('company_id', 'period', 'category', 'user_id', 'status', 'currency')
+TOTAL_COLUMNS = ('expense_count', 'total_amount', 'total_base_amount', 'unrated_count', 'unrated_amount')
+
+
+def rollup_key(company_id, expense_date, category, user_id, status, currency):
+    period = expense_date.strftime('%Y-%m') if expense_date else ''
+    return (company_id, period, category or '', user_id, status, currency)
+
+
+def _upsert_statement(dialect_name):
+    table = SpendRollup.__table__
+    if dialect_name == 'postgresql':
+        from sqlalchemy.dialects.postgresql import insert
+    else:
+        from sqlalchemy.dialects.sqlite import insert
+    stmt = insert(table)
+    return stmt.on_conflict_do_update(
+        index_elements=list(KEY_COLUMNS),
+        set_={column: table.c[column] + stmt.excluded[column] for column in TOTAL_COLUMNS}
+    )
+
+
+def new_deltas():
+    """{key: [count, amount, base_amount, unrated_count, unrated_amount]} accumulator."""
+    return defaultdict(lambda: [0, 0.0, 0.0, 0, 0.0])
+
+
+def add_expense(delta, expense, sign=1):
+    """Adds (sign=1) or removes (sign=-1) one expense's totals from a delta."""
+    delta[0] += sign
+    delta[1] += sign * expense.amount
+    if expense.base_amount is None:
+        delta[3] += sign
+        delta[4] += sign * expense.amount
+    else:
+        delta[2] += sign * expense.base_amount
+
+
+def apply_deltas(deltas):
+    """Adds new_deltas() totals to the rollup table with one upsert batch."""
+    params = [
+        {**dict(zip(KEY_COLUMNS, key)), **dict(zip(TOTAL_COLUMNS, totals))}
+        for key, totals in deltas.items()
+        if any(totals)
+    ]
+    if params:
+        db.session.execute(_upsert_statement(db.session.get_bind().dialect.name), params)
+
+
+def _key_for(expense, status):
+    return rollup_key(expense.company_id, expense.date, expense.category,
+                      expense.user_id, status, expense.currency)
+
+
+def record_new(expenses):
+    """Counts newly created expenses (ORM objects or row mappings) at their status."""
+    deltas = new_deltas()
+    for expense in expenses:
+        add_expense(deltas[_key_for(expense, expense.status)], expense)
+    apply_deltas(deltas)
+
+
+def record_transition(expenses, old_status, new_status):
+    """Moves expenses from their old_status bucket to new_status."""
+    deltas = new_deltas()
+    for expense in expenses:
+        add_expense(deltas[_key_for(expense, old_status)], expense, sign=-1)
+        add_expense(deltas[_key_for(expense, new_status)], expense)
+    apply_deltas(deltas)
+
+
+def add_rerate(deltas, expense, old_base_amount):
+    """Adds the change from old_base_amount to expense.base_amount to a new_deltas() batch."""
+    delta = deltas[_key_for(expense, expense.status)]
+    add_expense(delta, SimpleNamespace(amount=expense.amount, base_amount=old_base_amount), sign=-1)
+    add_expense(delta, expense)
+
+
+def rebuild(batch_size=5000):
+    """Recomputes all rollups from live and archived expenses, aggregating one id range at a time.
+
+    Each batch commits, so totals are partial until the rebuild finishes.
+    """
+    SpendRollup.query.delete(synchronize_session=False)
+    for model in (Expense, ArchivedExpense):
+        _aggregate(model, batch_size)
+
+
+def _aggregate(model, batch_size):
+    last_id = 0
+    while True:
+        upper = db.session.execute(
+            select(model.id).where(model.id > last_id).order_by(model.id)
+            .offset(batch_size - 1).limit(1)
+        ).scalar()
+        in_range = [model.id > last_id] + ([model.id <= upper] if upper else [])
+
+        unrated = model.base_amount.is_(None)
+        rows = db.session.execute(
+            select(model.company_id, model.date, model.category, model.user_id,
+                   model.status, model.currency,
+                   func.count(model.id),
+                   func.coalesce(func.sum(model.amount), 0.0),
+                   func.coalesce(func.sum(model.base_amount), 0.0),
+                   func.sum(case((unrated, 1), else_=0)),
+                   func.coalesce(func.sum(case((unrated, model.amount), else_=0.0)), 0.0))
+            .where(*in_range)
+            .group_by(model.company_id, model.date, model.category, model.user_id,
+                      model.status, model.currency)
+        ).all()
+
+        deltas = new_deltas()
+        for company_id, expense_date, category, user_id, status, currency, *totals in rows:
+            delta = deltas[rollup_key(company_id, expense_date, category, user_id, status, currency)]
+            for i, value in enumerate(totals):
+                delta[i] += value
+        apply_deltas(deltas)
+        db.session.commit()
+
+        if not upper:
+            break
+        last_id = upper
+
+
+# --- Analytics Queries ---
+
+GROUP_BY_COLUMNS = {
+    'category': SpendRollup.category,
+    'month': SpendRollup.period,
+    'user': SpendRollup.user_id,
+    'status': SpendRollup.status
+}
+
+
+def query_spend(company_id, group_by, filters):
+    """Sums rollups for a company grouped by the requested dimensions plus currency.
+
+    Returns rows of (*dimension values, currency, expense_count, total_base_amount,
+    unrated_count, unrated_amount); unrated rows still need an FX rate to convert.
+    """
+    dims = [GROUP_BY_COLUMNS[name] for name in group_by]
+    conditions = [SpendRollup.company_id == company_id]
+    if 'status' in filters:
+        conditions.append(SpendRollup.status == filters['status'])
+    if 'category' in filters:
+        conditions.append(SpendRollup.category == filters['category'])
+    if 'user_id' in filters:
+        conditions.append(SpendRollup.user_id == filters['user_id'])
+    if 'period_from' in filters:
+        conditions.append(SpendRollup.period >= filters['period_from'])
+    if 'period_to' in filters:
+        conditions.append(SpendRollup.period <= filters['period_to'])
+
+    return db.session.execute(
+        select(*dims, SpendRollup.currency,
+               func.sum(SpendRollup.expense_count), func.sum(SpendRollup.total_base_amount),
+               func.sum(SpendRollup.unrated_count), func.sum(SpendRollup.unrated_amount))
+        .where(*conditions)
+        .group_by(*dims, SpendRollup.currency)
+        .having(func.sum(SpendRollup.expense_count) != 0)
+    ).all()
@@ -0,0 +1,253 @@
+import base64
+import json
+import re
+import unicodedata
+
+from sqlalchemy import and_, column, event, inspect, literal_column, or_, select, table, text
+
+from models import db, User, Expense
+
+# --- Expense Search ---
+#
+# On SQLite the expense_search FTS5 table indexes each expense's title,
+# description, category and submitter name under rowid = expense id. Triggers
+# on expenses and users keep it in sync on every insert, update and delete,
+# including bulk Core INSERTs, so no application code has to remember it.
+# The company is indexed as a token (c<id>) so a tenant's search only walks
+# that company's postings.
+#
+# Ranking reads bounded windows of candidates: the newest SEARCH_MAX_CANDIDATES
+# matches that pass the filters, scored by which fields hold each term (title
+# matches weigh most), then the next SEARCH_MAX_CANDIDATES older ones, and so
+# on; results page through the windows in turn, so deep pages cost what the
+# first one does. bm25() would need every match of every term for its term
+# statistics, which for a common word on millions of rows costs far more than
+# the page being served; with every term required (AND), field weights give
+# nearly the same order for documents this short.
+#
+# Archived expenses (archive.py) are not indexed: search covers live expenses.
+#
+# Where FTS5 is not available (other databases, or SQLite builds without it)
+# search falls back to case-insensitive substring matching on the same fields,
+# newest first: correct everywhere, but a scan rather than an index lookup.
+
+SEARCH_TABLE = 'expense_search'
+# Field weights for ranking: title, description, category, submitter name
+WEIGHTS = (10.0, 1.0, 3.0, 5.0)
+MAX_TERMS = 8
+
+fts = table(SEARCH_TABLE, column('rowid'), column('title'), column('description'),
+            column('category'), column('submitter_name'), column('company'))
+
+_SYNC_DDL = [
+    f"""CREATE VIRTUAL TABLE IF NOT EXISTS {SEARCH_TABLE} USING fts5(
+        title, description, category, submitter_name, company,
+        tokenize = 'unicode61 remove_diacritics 2', prefix = '2 3')""",
+    f"""CREATE TRIGGER IF NOT EXISTS expense_search_insert AFTER INSERT ON expenses BEGIN
+        INSERT INTO {SEARCH_TABLE} (rowid, title, description, category, submitter_name, company)
+        VALUES (new.id, new.title, new.description, new.category,
+                (SELECT name FROM users WHERE users.id = new.user_id), 'c' || new.company_id);
+    END""",
+    f"""CREATE TRIGGER IF NOT EXISTS expense_search_update
+    AFTER UPDATE OF title, description, category, user_id, company_id ON expenses BEGIN
+        UPDATE {SEARCH_TABLE} SET title = new.title, description = new.description, category = new.category,
+            submitter_name = (SELECT name FROM users WHERE users.id = new.user_id),
+            company = 'c' || new.company_id
+        WHERE rowid = old.id;
+    END""",
+    f"""CREATE TRIGGER IF NOT EXISTS expense_search_delete AFTER DELETE ON expenses BEGIN
+        DELETE FROM {SEARCH_TABLE} WHERE rowid = old.id;
+    END""",
+    f"""CREATE TRIGGER IF NOT EXISTS expense_search_rename AFTER UPDATE OF name ON users BEGIN
+        UPDATE {SEARCH_TABLE} SET submitter_name = new.name
+        WHERE rowid IN (SELECT id FROM expenses WHERE user_id = new.id);
+    END""",
+    f"""CREATE TRIGGER IF NOT EXISTS expense_search_user_delete AFTER DELETE ON users BEGIN
+        UPDATE {SEARCH_TABLE} SET submitter_name = NULL
+        WHERE rowid IN (SELECT id FROM expenses WHERE user_id = old.id);
+    END""",
+]
+
+
+def install(conn):
+    """Creates the FTS table and its triggers (idempotent); False where FTS5 is unavailable."""
+    if conn.dialect.name != 'sqlite':
+        return False
+    if not conn.exec_driver_sql("SELECT 1 FROM pragma_compile_options WHERE compile_options = 'ENABLE_FTS5'").first():
+        return False
+    for statement in _SYNC_DDL:
+        conn.execute(text(statement))
+    return True
+
+
+def rebuild(conn):
+    """Re-fills the index from expenses and users; returns the number indexed (None without FTS5)."""
+    if not install(conn):
+        return None
+    conn.execute(text(f'DELETE FROM {SEARCH_TABLE}'))
+    return conn.execute(text(
+        f"""INSERT INTO {SEARCH_TABLE} (rowid, title, description, category, submitter_name, company)
+        SELECT expenses.id, expenses.title, expenses.description, expenses.category, users.name,
+               'c' || expenses.company_id
+        FROM expenses LEFT OUTER JOIN users ON users.id = expenses.user_id"""
+    )).rowcount
+
+
+def optimize(conn):
+    """Merges the index segments after bulk deletes (archival), dropping their tombstones."""
+    if inspect(conn).has_table(SEARCH_TABLE):
+        conn.execute(text(f"INSERT INTO {SEARCH_TABLE} ({SEARCH_TABLE}) VALUES ('optimize')"))
+
+
+# A brand new database gets the index with its tables (upgrade() stamps it
+# without running migrations); existing ones get it from migration 7
+@event.listens_for(Expense.__table__, 'after_create')
+def _install_with_expenses(target, connection, **kw):
+    install(connection)
+
+
+_installed = {}  # engine url -> whether the FTS table exists
+
+
+def fts_enabled():
+    engine = db.engine
+    key = str(engine.url)
+    if key not in _installed:
+        _installed[key] = engine.dialect.name == 'sqlite' and inspect(engine).has_table(SEARCH_TABLE)
+    return _installed[key]
+
+
+# --- Queries ---
+
+def _fold(value):
+    """Lower-cased and without diacritics, like the unicode61 tokenizer sees it."""
+    if value.isascii():
+        return value.lower()
+    decomposed = unicodedata.normalize('NFKD', value.lower())
+    return ''.join(c for c in decomposed if not unicodedata.combining(c))
+
+
+def parse_terms(q):
+    """The words of a search string (folded, at most MAX_TERMS); raises ValueError if none."""
+    terms = re.findall(r'\w+', _fold(q or ''))[:MAX_TERMS]
+    if not terms:
+        raise ValueError('q must contain at least one word')
+    return terms
+
+
+def match_expression(terms, company_id=None, prefix=False):
+    """FTS5 query: every term must match as a word; with `prefix` the last one may be a word prefix.
+
+    Prefix queries merge the postings of every word they match, so they are
+    meant for search-as-you-type, not as the default.
+    """
+    expression = ' '.join(f'"{term}"' for term in terms) + ('*' if prefix else '')
+    if company_id is not None:
+        expression = f'company : c{int(company_id)} AND ({expression})'
+    return expression
+
+
+def term_patterns(terms, prefix=False):
+    """One regex per term matching it as a whole word (with `prefix`, the last one as a word prefix)."""
+    return [re.compile(rf'\b{re.escape(term)}' + ('' if prefix and i == len(terms) - 1 else r'\b'))
+            for i, term in enumerate(terms)]
+
+
+def score(patterns, fields):
+    """Sum over terms of the weights of the fields that contain them (title counts most)."""
+    folded = [_fold(value) for value in fields if value]
+    weights = [weight for weight, value in zip(WEIGHTS, fields) if value]
+    return sum(weight for pattern in patterns for weight, text in zip(weights, folded) if pattern.search(text))
+
+
+def _encode_cursor(top, bottom, rank, expense_id):
+    payload = json.dumps([top, bottom, rank, expense_id], separators=(',', ':'))
+    return base64.urlsafe_b64encode(payload.encode()).decode().rstrip('=')
+
+
+def _decode_cursor(cursor):
+    try:
+        padded = cursor + '=' * (-len(cursor) % 4)
+        top, bottom, rank, expense_id = json.loads(base64.urlsafe_b64decode(padded.encode()))
+        return int(top), int(bottom), (float(rank), int(expense_id))
+    except (ValueError, TypeError):
+        raise ValueError('Invalid cursor')
+
+
+def _window(candidates, top, bottom, max_candidates):
+    """The newest max_candidates matches with bottom <= id < top, and the window's actual bounds.
+
+    A window that ends before the oldest match gets its lowest id as bottom;
+    the last one gets 0, so the next window (top = bottom) is empty.
+    """
+    if top is not None:
+        candidates = candidates.filter(fts.c.rowid < top)
+    if bottom is not None:
+        candidates = candidates.filter(fts.c.rowid >= bottom)
+    rows = candidates.order_by(fts.c.rowid.desc()).limit(max_candidates).all()
+    if not rows:
+        return rows, top, bottom or 0  # A cursor's window can empty out (deletes); older ones remain
+    if top is None:
+        top = rows[0].rowid + 1  # Pinned, so later submissions do not shift the windows
+    if bottom is None:
+        bottom = rows[-1].rowid if len(rows) == max_candidates else 0
+    return rows, top, bottom
+
+
+def ranked_page(query, terms, per_page, max_candidates, cursor=None, company_id=None, prefix=False):
+    """Returns (rows, next_cursor) for a filtered expense projection matching `terms`.
+
+    Matches are ranked in windows: the newest max_candidates matches that pass
+    the filters are ranked by where the terms occur, then the next
+    max_candidates older ones, and so on. A request reads only the windows its
+    page spans, so its cost does not grow with how common a word is or how
+    deep the page is, and every match is reachable. The cursor carries the
+    window's id bounds and the (rank, id) position within it.
+    """
+    candidates = query.join(fts, fts.c.rowid == Expense.id).with_entities(
+        fts.c.rowid, fts.c.title, fts.c.description, fts.c.category, fts.c.submitter_name
+    ).filter(
+        literal_column(SEARCH_TABLE).op('MATCH')(match_expression(terms, company_id, prefix))
+    )
+    patterns = term_patterns(terms, prefix)
+    top, bottom, after = _decode_cursor(cursor) if cursor else (None, None, None)
+
+    # One more than the page, to know whether a next page exists
+    ranked = []
+    while len(ranked) <= per_page:
+        window, top, bottom = _window(candidates, top, bottom, max_candidates)
+        keys = sorted(((score(patterns, fields), expense_id) for expense_id, *fields in window), reverse=True)
+        if after is not None:
+            keys = [key for key in keys if key < after]
+            after = None
+        ranked.extend((top, bottom, rank, expense_id) for rank, expense_id in keys)
+        if bottom == 0:
+            break
+        top, bottom = bottom, None
+
+    page, next_cursor = ranked[:per_page], None
+    if len(ranked) > per_page:
+        next_cursor = _encode_cursor(*page[-1])
+    # The page's rows in full, in ranked order. The ids are already tenant
+    # checked; without the company criteria SQLite reliably picks the primary key
+    rows = {}
+    if page:
+        rows = {row.id: row for row in query.filter(Expense.id.in_([key[-1] for key in page]))
+                .execution_options(all_tenants=True)}
+    return [rows[key[-1]] for key in page if key[-1] in rows], next_cursor
+
+
+def substring_filter(terms):
+    """Portable fallback: every term appears in the title, description, category or submitter name."""
+    conditions = []
+    for term in terms:
+        submitter_matches = select(User.id).where(
+            User.id == Expense.user_id, User.name.icontains(term, autoescape=True)
+        ).exists()
+        conditions.append(or_(
+            Expense.title.icontains(term, autoescape=True),
+            Expense.description.icontains(term, autoescape=True),
+            Expense.category.icontains(term, autoescape=True),
+            submitter_matches
+        ))
+    return and_(*conditions)
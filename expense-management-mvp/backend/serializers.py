@@ -0,0 +1,188 @@
+from flask.json.provider import DefaultJSONProvider
+from sqlalchemy.orm import aliased
+
+from models import db, User, Expense, ApprovalStep, ApproverGroup, ArchivedApprovalStep
+
+try:
+    import orjson
+except ImportError:  # Optional: falls back to the standard library encoder
+    orjson = None
+
+# --- Column-Projected Serialization ---
+#
+# List endpoints select exactly the columns a response needs (joins supply the
+# submitter / approver names) and build plain dicts from the rows, instead of
+# hydrating Expense / ApprovalStep / User objects and walking relationships in
+# to_dict(). Output keys and formats match the models' to_dict().
+# `fields=` picks the top-level fields and `include=` the nested collections.
+
+EXPENSE_INCLUDES = ('approval_steps',)
+
+
+def _iso(value):
+    return value.isoformat() if value is not None else None
+
+
+def expense_columns(model=Expense):
+    """{field: column expression} for list responses over `model`; submitter_name needs the User join."""
+    submitter = aliased(User, name='submitter')
+    columns = {
+        'id': model.id,
+        'user_id': model.user_id,
+        'submitter_name': submitter.name,
+        'title': model.title,
+        'description': model.description,
+        'amount': model.amount,
+        'currency': model.currency,
+        'base_amount': model.base_amount,
+        'base_currency': model.base_currency,
+        'fx_rate': model.fx_rate,
+        'category': model.category,
+        'date': model.date,
+        'status': model.status,
+        'submitted_at': model.submitted_at
+    }
+    return columns, submitter
+
+
+# Spelled out rather than taken from expense_columns(): building the alias at
+# import time would configure every mapper on startup
+EXPENSE_FIELDS = ('id', 'user_id', 'submitter_name', 'title', 'description', 'amount', 'currency',
+                  'base_amount', 'base_currency', 'fx_rate', 'category', 'date', 'status', 'submitted_at')
+FORMATTERS = {'date': _iso, 'submitted_at': _iso, 'decided_at': _iso, 'created_at': _iso}
+
+
+def parse_fieldset(args, allowed_fields, allowed_includes, default_includes):
+    """Reads ?fields=a,b and ?include=x from request args; raises ValueError on unknown names.
+
+    Without fields= every field is returned; without include= the endpoint's
+    defaults apply (an empty include= drops all nested collections).
+    """
+    fields = list(allowed_fields)
+    if args.get('fields'):
+        fields = [f for f in args.get('fields').split(',') if f]
+        unknown = [f for f in fields if f not in allowed_fields]
+        if unknown:
+            raise ValueError(f'Unknown fields: {", ".join(unknown)}')
+
+    includes = list(default_includes)
+    if 'include' in args:
+        includes = [i for i in args.get('include').split(',') if i]
+        unknown = [i for i in includes if i not in allowed_includes]
+        if unknown:
+            raise ValueError(f'Unknown include: {", ".join(unknown)}')
+    return fields, includes
+
+
+def expense_list_projection(fields, model=Expense):
+    """A query selecting `fields` (plus id and submitted_at, which keyset paging needs) from `model`."""
+    columns, submitter = expense_columns(model)
+    selected = dict.fromkeys(['id', 'submitted_at', *fields])
+    query = db.session.query(*(columns[f].label(f) for f in selected)).select_from(model)
+    if 'submitter_name' in selected:
+        query = query.outerjoin(submitter, submitter.id == model.user_id)
+    return query
+
+
+def step_rows(expense_ids, model=ApprovalStep):
+    """{expense_id: [step dict]} for every step of the given expenses (in `model`'s table), in one query."""
+    if not expense_ids:
+        return {}
+    approver = aliased(User, name='approver')
+    rows = db.session.query(
+        model.id, model.expense_id, model.approver_id,
+        approver.name.label('approver_name'), ApproverGroup.name.label('group_name'),
+        model.group_id, model.sequence, model.required_approvals,
+        model.approval_count, model.status, model.comments, model.decided_at, model.due_at,
+        model.escalation_count
+    ).outerjoin(approver, approver.id == model.approver_id) \
+     .outerjoin(ApproverGroup, ApproverGroup.id == model.group_id) \
+     .filter(model.expense_id.in_(expense_ids)) \
+     .order_by(model.expense_id, model.sequence, model.id)
+
+    steps = {}
+    for (step_id, expense_id, approver_id, approver_name, group_name, group_id, sequence,
+         required_approvals, approval_count, status, comments, decided_at, due_at, escalation_count) in rows:
+        steps.setdefault(expense_id, []).append({
+            'id': step_id,
+            'expense_id': expense_id,
+            'approver_id': approver_id,
+            'approver_name': approver_name if approver_name is not None else group_name,
+            'group_id': group_id,
+            'sequence': sequence,
+            'required_approvals': required_approvals,
+            'approval_count': approval_count,
+            'status': status,
+            'comments': comments,
+            'decided_at': _iso(decided_at),
+            'due_at': _iso(due_at),
+            'escalation_count': escalation_count
+        })
+    return steps
+
+
+def serialize_rows(rows, fields, formatters=FORMATTERS):
+    """Plain dicts with just `fields` from projected rows (columns labelled by field name)."""
+    if not rows:
+        return []
+    # Positional access: Row attribute / _mapping lookups cost more than building the dict
+    positions = {name: i for i, name in enumerate(rows[0]._fields)}
+    getters = [(f, positions[f], formatters.get(f)) for f in fields]
+    return [{f: (fmt(row[i]) if fmt else row[i]) for f, i, fmt in getters} for row in rows]
+
+
+def serialize_expenses(rows, fields, includes, archived_ids=()):
+    """Expense dicts; the steps of `archived_ids` come from the archive table."""
+    expenses = serialize_rows(rows, fields)
+    if 'approval_steps' in includes:
+        steps = step_rows([row.id for row in rows if row.id not in archived_ids])
+        if archived_ids:
+            steps.update(step_rows([row.id for row in rows if row.id in archived_ids], ArchivedApprovalStep))
+        for expense, row in zip(expenses, rows):
+            expense['approval_steps'] = steps.get(row.id, [])
+    return expenses
+
+
+# --- Users ---
+
+USER_FIELDS = ('id', 'email', 'name', 'role', 'company_id', 'manager_id', 'manager_name')
+
+
+def user_list_projection():
+    """All users with the name of their (Manager/Admin) manager, as one projected query."""
+    manager = aliased(User, name='manager')
+    return db.session.query(
+        User.id.label('id'), User.email.label('email'), User.name.label('name'), User.role.label('role'),
+        User.company_id.label('company_id'), User.manager_id.label('manager_id'),
+        db.func.coalesce(manager.name, 'N/A').label('manager_name')
+    ).outerjoin(manager, db.and_(manager.id == User.manager_id, manager.role.in_(['Manager', 'Admin'])))
+
+
+# --- JSON Encoding ---
+
+# Datetimes still go through DefaultJSONProvider.default, so they encode exactly as before
+ORJSON_OPTIONS = (orjson.OPT_NON_STR_KEYS | orjson.OPT_PASSTHROUGH_DATETIME) if orjson else 0
+
+
+class OrjsonProvider(DefaultJSONProvider):
+    """Flask JSON provider backed by orjson; same output as the default one, minus key sorting."""
+
+    def dumps(self, obj, **kwargs):
+        return orjson.dumps(obj, default=self.default, option=ORJSON_OPTIONS).decode()
+
+    def loads(self, s, **kwargs):
+        return orjson.loads(s)
+
+    def response(self, *args, **kwargs):
+        obj = self._prepare_response_obj(args, kwargs)
+        return self._app.response_class(
+            orjson.dumps(obj, default=self.default, option=ORJSON_OPTIONS),
+            mimetype=self.mimetype
+        )
+
+
+def init_app(app):
+    """Switches the app to orjson when it is installed."""
+    if orjson is not None and app.config['USE_ORJSON']:
+        app.json = OrjsonProvider(app)
+
@@ -0,0 +1,254 @@
+import json
+import time
+from datetime import datetime, timedelta
+
+from flask import current_app
+from sqlalchemy import bindparam, func, select, update
+
+from models import db, ApprovalStep, ApprovalVote, ApproverGroupMember, Expense, UserHierarchy
+import events
+from versions import bump_expenses
+
+# --- Approval SLAs ---
+#
+# A Waiting step gets a due time when it becomes actionable (reaches the head
+# of its expense's sequence): APPROVAL_SLA_HOURS after its created_at for a
+# first step, after the moment the previous step was approved for a later one,
+# so a step is never overdue the instant it reaches its approver. Blocked
+# steps have no due time. events.Changes.record() sets it, because that is
+# where every writer (submit, decisions, imports) finds newly actionable steps.
+#
+# The scheduler (`flask sla-scheduler`) never scans the steps. Each pass reads
+# the overdue ones as one range of the (status, due_at) index, earliest
+# first and a batch at a time, so its cost follows the number of overdue
+# steps, not the size of the table; between passes it sleeps until the
+# earliest due time (one index seek), at most APPROVAL_SLA_POLL_SECONDS.
+#
+# An overdue step is first reminded: a step_reminder event goes to whoever
+# can decide it and the step is due again APPROVAL_SLA_REMINDER_HOURS later.
+# After APPROVAL_SLA_REMINDERS reminders a single-approver step is escalated:
+# it moves to the next manager above its approver in the submitter's chain
+# (step_decided with status 'Escalated' to the old approver, step_created to
+# the new one) and gets a fresh SLA. Group steps, and steps whose approver is
+# at the top of the chain, keep being reminded.
+#
+# Each batch is applied with one executemany per kind of update, every row
+# guarded by the step's state as read (Waiting, same due_at), then re-read to
+# see which took: a decision or another scheduler that got there first wins,
+# and only the steps this pass changed produce events.
+
+STEP_REMINDER = 'step_reminder'
+ESCALATED = 'Escalated'
+
+
+def due_time(start):
+    return start + timedelta(hours=current_app.config['APPROVAL_SLA_HOURS'])
+
+
+def schedule(step_ids, now=None):
+    """Gives newly actionable steps their due time (steps that already have one keep it)."""
+    if not step_ids:
+        return
+    db.session.execute(
+        update(ApprovalStep.__table__)
+        .where(ApprovalStep.__table__.c.id.in_(step_ids), ApprovalStep.__table__.c.due_at.is_(None))
+        .values(due_at=due_time(now or datetime.utcnow()))
+    )
+
+
+def backfill(conn, sla_hours, batch_size=5000):
+    """Sets due_at = created_at + sla_hours on actionable Waiting steps that have none; returns the count."""
+    steps = ApprovalStep.__table__
+    earlier = steps.alias('earlier')
+    blocked = select(earlier.c.id).where(
+        earlier.c.expense_id == steps.c.expense_id,
+        earlier.c.sequence < steps.c.sequence,
+        earlier.c.status != 'Approved'
+    ).exists()
+    count, last_id = 0, 0
+    while True:
+        rows = conn.execute(
+            select(steps.c.id, steps.c.created_at)
+            .where(steps.c.id > last_id, steps.c.status == 'Waiting', steps.c.due_at.is_(None), ~blocked)
+            .order_by(steps.c.id).limit(batch_size)
+        ).all()
+        if not rows:
+            return count
+        last_id = rows[-1].id
+        conn.execute(
+            update(steps).where(steps.c.id == bindparam('b_id')).values(due_at=bindparam('b_due')),
+            [{'b_id': row.id, 'b_due': (row.created_at or datetime.utcnow()) + timedelta(hours=sla_hours)}
+             for row in rows]
+        )
+        count += len(rows)
+
+
+# --- Scheduler ---
+
+def _overdue(now, batch_size):
+    return db.session.execute(
+        select(ApprovalStep.id, ApprovalStep.expense_id, ApprovalStep.company_id, ApprovalStep.approver_id,
+               ApprovalStep.group_id, ApprovalStep.sequence, ApprovalStep.due_at, ApprovalStep.reminder_count,
+               Expense.user_id, Expense.title, Expense.amount, Expense.currency, Expense.base_amount,
+               Expense.base_currency)
+        .join(Expense, Expense.id == ApprovalStep.expense_id)
+        .where(ApprovalStep.status == 'Waiting', ApprovalStep.due_at <= now)
+        .order_by(ApprovalStep.due_at, ApprovalStep.id)
+        .limit(batch_size)
+        .execution_options(all_tenants=True)
+    ).all()
+
+
+def next_due():
+    """The earliest due time of a Waiting step, or None."""
+    return db.session.execute(
+        select(func.min(ApprovalStep.due_at)).where(ApprovalStep.status == 'Waiting')
+        .execution_options(all_tenants=True)
+    ).scalar()
+
+
+def _escalation_targets(rows):
+    """{step_id: manager to escalate to} for the single-approver steps in rows that have one."""
+    rows = [row for row in rows if row.approver_id is not None]
+    if not rows:
+        return {}
+    chains = {}
+    for descendant_id, ancestor_id in db.session.execute(
+        select(UserHierarchy.descendant_id, UserHierarchy.ancestor_id)
+        .where(UserHierarchy.descendant_id.in_({row.user_id for row in rows}), UserHierarchy.depth >= 1)
+        .order_by(UserHierarchy.descendant_id, UserHierarchy.depth)
+    ):
+        chains.setdefault(descendant_id, []).append(ancestor_id)
+    # Someone who already approves another step of the expense is not asked twice
+    taken = {}
+    for expense_id, approver_id in db.session.execute(
+        select(ApprovalStep.expense_id, ApprovalStep.approver_id)
+        .where(ApprovalStep.expense_id.in_({row.expense_id for row in rows}), ApprovalStep.approver_id.isnot(None))
+        .execution_options(all_tenants=True)
+    ):
+        taken.setdefault(expense_id, set()).add(approver_id)
+
+    targets = {}
+    for row in rows:
+        chain = chains.get(row.user_id, [])
+        above = chain[chain.index(row.approver_id) + 1:] if row.approver_id in chain else chain
+        target = next((m for m in above if m not in taken[row.expense_id]), None)
+        if target is not None:
+            targets[row.id] = target
+    return targets
+
+
+def _reminder_recipients(rows):
+    """{step_id: [user ids]} who can decide each step: its approver, or the group members yet to vote."""
+    group_rows = [row for row in rows if row.group_id is not None]
+    members, voted = {}, {}
+    if group_rows:
+        for group_id, user_id in db.session.execute(
+            select(ApproverGroupMember.group_id, ApproverGroupMember.user_id)
+            .where(ApproverGroupMember.group_id.in_({row.group_id for row in group_rows}))
+        ):
+            members.setdefault(group_id, []).append(user_id)
+        for step_id, user_id in db.session.execute(
+            select(ApprovalVote.step_id, ApprovalVote.user_id)
+            .where(ApprovalVote.step_id.in_([row.id for row in group_rows]))
+        ):
+            voted.setdefault(step_id, set()).add(user_id)
+    return {
+        row.id: [row.approver_id] if row.approver_id is not None else
+        [u for u in members.get(row.group_id, ()) if u != row.user_id and u not in voted.get(row.id, ())]
+        for row in rows
+    }
+
+
+def _record_events(planned, recipients):
+    rows = []
+
+    def add(user_ids, kind, row, payload):
+        rows.extend({'user_id': user_id, 'company_id': row.company_id, 'expense_id': row.expense_id,
+                     'step_id': row.id, 'type': kind, 'payload': json.dumps(payload)}
+                    for user_id in sorted(set(user_ids)))
+
+    for row, target, due in planned:
+        payload = {'expense_id': row.expense_id, 'step_id': row.id, 'sequence': row.sequence,
+                   'due_at': due.isoformat()}
+        if target is None:
+            add(recipients[row.id], STEP_REMINDER, row, {
+                **payload, 'status': 'Waiting', 'reminder': row.reminder_count + 1,
+                'overdue_since': row.due_at.isoformat()
+            })
+        else:
+            add([row.approver_id], events.STEP_DECIDED, row, {**payload, 'status': ESCALATED})
+            add([target], events.STEP_CREATED, row, {
+                **payload, 'status': 'Waiting', 'escalated_from': row.approver_id,
+                'submitter_id': row.user_id, 'title': row.title, 'amount': row.amount,
+                'currency': row.currency, 'base_amount': row.base_amount, 'base_currency': row.base_currency
+            })
+    events.insert_events(rows)
+
+
+def run_once(now=None, batch_size=None):
+    """Reminds or escalates every step overdue at `now`, a batch per transaction; returns (reminded, escalated)."""
+    config = current_app.config
+    now = now or datetime.utcnow()
+    batch_size = batch_size or config['APPROVAL_SLA_BATCH_SIZE']
+    reminder_due = now + timedelta(hours=config['APPROVAL_SLA_REMINDER_HOURS'])
+    escalation_due = due_time(now)
+    steps = ApprovalStep.__table__
+    guard = (steps.c.id == bindparam('b_id'), steps.c.status == 'Waiting', steps.c.due_at == bindparam('b_old'))
+    reminded = escalated = 0
+
+    while True:
+        rows = _overdue(now, batch_size)
+        if not rows:
+            return reminded, escalated
+        targets = _escalation_targets(
+            [row for row in rows if row.reminder_count >= config['APPROVAL_SLA_REMINDERS']]
+        ) if config['APPROVAL_SLA_ESCALATE'] else {}
+        planned = [(row, targets.get(row.id), escalation_due if row.id in targets else reminder_due)
+                   for row in rows]
+
+        reminders = [{'b_id': row.id, 'b_old': row.due_at} for row, target, _ in planned if target is None]
+        escalations = [{'b_id': row.id, 'b_old': row.due_at, 'b_approver': target}
+                       for row, target, _ in planned if target is not None]
+        if reminders:
+            db.session.execute(
+                update(steps).where(*guard)
+                .values(due_at=reminder_due, reminder_count=steps.c.reminder_count + 1),
+                reminders
+            )
+        if escalations:
+            db.session.execute(
+                update(steps).where(*guard)
+                .values(approver_id=bindparam('b_approver'), due_at=escalation_due, reminder_count=0,
+                        escalation_count=steps.c.escalation_count + 1),
+                escalations
+            )
+
+        # Which updates took: a step decided (or handled by another scheduler) meanwhile did not change
+        applied = set(db.session.scalars(
+            select(steps.c.id).where(steps.c.id.in_([row.id for row in rows]), steps.c.status == 'Waiting',
+                                     steps.c.due_at.in_({reminder_due, escalation_due}))
+        ))
+        planned = [(row, target, due) for row, target, due in planned if row.id in applied]
+        _record_events(planned, _reminder_recipients([row for row, target, _ in planned if target is None]))
+        bump_expenses([row for row, _, _ in planned])  # Steps (and queues) are part of the expense listings
+        db.session.commit()
+
+        reminded += sum(1 for _, target, _ in planned if target is None)
+        escalated += sum(1 for _, target, _ in planned if target is not None)
+        if len(rows) < batch_size or not planned:
+            return reminded, escalated
+
+
+def run(poll_seconds=None, batch_size=None):
+    """Runs passes forever, sleeping until the next due time (at most poll_seconds) in between."""
+    poll_seconds = poll_seconds or current_app.config['APPROVAL_SLA_POLL_SECONDS']
+    while True:
+        started = datetime.utcnow()
+        reminded, escalated = run_once(started, batch_size)
+        if reminded or escalated:
+            print(f"{started.isoformat(timespec='seconds')} reminded {reminded}, escalated {escalated}")
+        upcoming = next_due()
+        db.session.remove()  # No connection held while sleeping
+        wait = poll_seconds if upcoming is None else (upcoming - datetime.utcnow()).total_seconds()
+        time.sleep(min(max(wait, 0.1), poll_seconds))
@@ -0,0 +1,231 @@
+import math
+import random
+from datetime import datetime, timedelta
+
+from sqlalchemy import func, insert, select
+
+from models import (db, Company, User, Expense, ApprovalStep, ApproverGroup, ApproverGroupMember,
+                    ApprovalRule, ApprovalVote)
+import duplicates
+from hierarchy import rebuild as rebuild_hierarchy
+from rollups import rebuild as rebuild_rollups
+import sla
+from versions import bump
+
+# --- Synthetic Data Generator ---
+#
+# Builds realistic volumes for development and benchmarks: N companies, each
+# with an Admin at the top of a manager tree (span_of_control reports per
+# manager), M expenses per user in mixed currencies, and approval steps, votes
+# and statuses that are consistent with the workflow (pending, part-approved,
+# approved, rejected). The company policy matches the demo seed: the direct
+# manager first, then any one Finance approver over 500. Rows are written with
+# multi-row INSERTs and explicit ids, and appended after any existing data.
+# Every synthetic user's password is SYNTHETIC_PASSWORD.
+
+SYNTHETIC_PASSWORD = 'synthetic'
+FINANCE_THRESHOLD = 500
+
+# Fixed USD value of one unit, so amounts and base amounts are reproducible
+USD_RATES = {'USD': 1.0, 'EUR': 1.08, 'GBP': 1.27, 'INR': 0.012, 'JPY': 0.0067, 'CAD': 0.73}
+BASE_CURRENCIES = ['USD', 'EUR', 'INR']
+CATEGORIES = ['Travel', 'Meals', 'Office Supplies', 'Software', 'Training', 'Other']
+TITLES = ['Client lunch', 'Taxi to airport', 'Hotel stay', 'Conference ticket', 'Team dinner',
+          'Monitor', 'Online course', 'Train ticket', 'Software license', 'Office snacks']
+
+
+def synthetic_rate(from_currency, to_currency):
+    """Rate between two USD_RATES currencies (None for unknown ones, like a missing FX quote)."""
+    if from_currency not in USD_RATES or to_currency not in USD_RATES:
+        return None
+    return USD_RATES[from_currency] / USD_RATES[to_currency]
+
+
+class _Ids:
+    """Hands out explicit primary keys after the current maximum of each table."""
+
+    def __init__(self, models):
+        self._next = {
+            model: (db.session.execute(select(func.coalesce(func.max(model.id), 0))).scalar() or 0) + 1
+            for model in models
+        }
+
+    def __call__(self, model):
+        value = self._next[model]
+        self._next[model] += 1
+        return value
+
+
+def _insert(model, rows, batch_size):
+    for start in range(0, len(rows), batch_size):
+        db.session.execute(insert(model.__table__), rows[start:start + batch_size])
+
+
+def _company_users(ids, company_id, n_users, span_of_control):
+    """User rows as a tree: user 0 is the Admin, user i reports to user (i - 1) // span."""
+    user_ids = [ids(User) for _ in range(n_users)]
+    users = []
+    for i, user_id in enumerate(user_ids):
+        has_reports = i * span_of_control + 1 < n_users
+        users.append({
+            'id': user_id,
+            'email': f'user{user_id}@company{company_id}.synthetic.test',
+            'password': SYNTHETIC_PASSWORD,
+            'name': f'User {user_id}',
+            'role': 'Admin' if i == 0 else ('Manager' if has_reports else 'Employee'),
+            'company_id': company_id,
+            'manager_id': user_ids[(i - 1) // span_of_control] if i else None
+        })
+    return users
+
+
+def _expense_steps(rng, ids, expense, manager_id, group_id, finance_ids, now):
+    """Steps (and group votes) for one expense, in a state drawn for its status."""
+    needs_finance = (expense['base_amount'] or expense['amount']) > FINANCE_THRESHOLD
+    plan = [{'approver_id': manager_id, 'group_id': None}]
+    if needs_finance:
+        plan.append({'approver_id': None, 'group_id': group_id})
+
+    status = expense['status']
+    if status == 'Pending':
+        decided = rng.randrange(len(plan))  # Steps before this one are already approved
+        outcomes = ['Approved'] * decided + ['Waiting'] * (len(plan) - decided)
+    elif status == 'Approved':
+        outcomes = ['Approved'] * len(plan)
+    else:
+        rejected_at = rng.randrange(len(plan))
+        outcomes = ['Approved'] * rejected_at + ['Rejected'] + ['Skipped'] * (len(plan) - rejected_at - 1)
+
+    voters = [u for u in finance_ids if u != expense['user_id']]
+    steps, votes = [], []
+    actionable_since = expense['submitted_at']  # The first Waiting step is due from here (sla.py)
+    for sequence, (approver, outcome) in enumerate(zip(plan, outcomes), start=1):
+        decided_at = (expense['submitted_at'] + timedelta(hours=rng.randint(1, 72))
+                      if outcome in ('Approved', 'Rejected') else None)
+        decided_at = min(decided_at, now) if decided_at else None
+        first_waiting = outcome == 'Waiting' and (sequence == 1 or outcomes[sequence - 2] == 'Approved')
+        step_id = ids(ApprovalStep)
+        steps.append({
+            'id': step_id,
+            'expense_id': expense['id'],
+            'company_id': expense['company_id'],
+            'approver_id': approver['approver_id'],
+            'group_id': approver['group_id'],
+            'sequence': sequence,
+            'required_approvals': 1,
+            'approval_count': 1 if approver['group_id'] and outcome == 'Approved' else 0,
+            'status': outcome,
+            'comments': 'Rejected by another approver' if outcome == 'Skipped' else None,
+            'created_at': expense['submitted_at'],
+            'decided_at': decided_at,
+            'due_at': sla.due_time(actionable_since) if first_waiting else None
+        })
+        if outcome == 'Approved':
+            actionable_since = decided_at
+        if approver['group_id'] and outcome in ('Approved', 'Rejected') and voters:
+            votes.append({'step_id': step_id, 'user_id': rng.choice(voters), 'decision': outcome,
+                          'comments': None, 'decided_at': decided_at})
+
+    expense['pending_step_count'] = outcomes.count('Waiting')
+    return steps, votes
+
+
+def generate(companies=1, users_per_company=50, expenses_per_user=20, span_of_control=6,
+             days=365, unrated_share=0.05, seed=42, batch_size=5000):
+    """Appends synthetic companies with users, policies, expenses and approval history.
+
+    Commits once per company, then rebuilds the hierarchy closure table and the
+    spend rollups. Returns the number of rows created per table.
+    """
+    rng = random.Random(seed)
+    ids = _Ids([Company, User, Expense, ApprovalStep, ApproverGroup, ApprovalRule])
+    now = datetime.utcnow()
+    counts = dict.fromkeys(['companies', 'users', 'expenses', 'approval_steps', 'approval_votes'], 0)
+    company_ids = []
+
+    for c in range(companies):
+        company_id = ids(Company)
+        company_ids.append(company_id)
+        base_currency = BASE_CURRENCIES[c % len(BASE_CURRENCIES)]
+        db.session.execute(insert(Company.__table__),
+                           [{'id': company_id, 'name': f'Synthetic Co {company_id}', 'base_currency': base_currency}])
+
+        users = _company_users(ids, company_id, max(users_per_company, 2), span_of_control)
+        _insert(User, users, batch_size)
+
+        # Finance group: the Admin and the first two managers below them
+        group_id = ids(ApproverGroup)
+        finance_ids = [u['id'] for u in users if u['role'] != 'Employee'][:3]
+        db.session.execute(insert(ApproverGroup.__table__),
+                           [{'id': group_id, 'company_id': company_id, 'name': 'Finance Approvers', 'created_at': now}])
+        db.session.execute(insert(ApproverGroupMember.__table__),
+                           [{'group_id': group_id, 'user_id': u} for u in finance_ids])
+        # Both rows need the same keys: a multi-row INSERT takes its columns from the first
+        rule = {'company_id': company_id, 'chain_depth': 1, 'quorum': 1, 'is_active': True, 'created_at': now}
+        db.session.execute(insert(ApprovalRule.__table__), [
+            {**rule, 'id': ids(ApprovalRule), 'name': 'Direct manager', 'sequence': 1,
+             'min_amount': None, 'approver_type': 'direct_manager', 'group_id': None},
+            {**rule, 'id': ids(ApprovalRule), 'name': f'Finance review over {FINANCE_THRESHOLD}', 'sequence': 2,
+             'min_amount': FINANCE_THRESHOLD, 'approver_type': 'group', 'group_id': group_id}
+        ])
+
+        # Mostly the company currency, with a tail of foreign ones
+        currencies = list(USD_RATES)
+        currency_weights = [8 if cur == base_currency else 1 for cur in currencies]
+
+        expenses, steps, votes = [], [], []
+        for user in users:
+            if user['manager_id'] is None:
+                continue  # The Admin has nobody to approve their expenses
+            for _ in range(expenses_per_user):
+                currency = rng.choices(currencies, currency_weights)[0]
+                usd_amount = math.exp(rng.uniform(math.log(5), math.log(5000)))
+                amount = round(usd_amount / USD_RATES[currency], 2)
+                submitted_at = now - timedelta(minutes=rng.randint(0, days * 24 * 60))
+                rated = rng.random() >= unrated_share
+                rate = synthetic_rate(currency, base_currency) if rated else None
+                # Recent expenses are more likely to still be in flight
+                age = (now - submitted_at).days
+                status = rng.choices(['Pending', 'Approved', 'Rejected'],
+                                     [6 if age < 14 else 1, 8, 1.5])[0]
+                expense = {
+                    'id': ids(Expense),
+                    'user_id': user['id'],
+                    'company_id': company_id,
+                    'title': rng.choice(TITLES),
+                    'description': f"Synthetic expense {rng.randint(1000, 9999)}",
+                    'amount': amount,
+                    'currency': currency,
+                    'base_amount': round(amount * rate, 2) if rate is not None else None,
+                    'base_currency': base_currency if rate is not None else None,
+                    'fx_rate': rate,
+                    'fx_rated_at': submitted_at if rate is not None else None,
+                    'category': rng.choice(CATEGORIES),
+                    'date': submitted_at.date(),
+                    'status': status,
+                    'submitted_at': submitted_at
+                }
+                expense['fingerprint'] = duplicates.fingerprint(user['id'], amount, currency,
+                                                                expense['date'], expense['title'])
+                expense_steps, expense_votes = _expense_steps(
+                    rng, ids, expense, user['manager_id'], group_id, finance_ids, now)
+                expenses.append(expense)
+                steps.extend(expense_steps)
+                votes.extend(expense_votes)
+
+        _insert(Expense, expenses, batch_size)
+        _insert(ApprovalStep, steps, batch_size)
+        _insert(ApprovalVote, votes, batch_size)
+        db.session.commit()
+
+        counts['companies'] += 1
+        counts['users'] += len(users)
+        counts['expenses'] += len(expenses)
+        counts['approval_steps'] += len(steps)
+        counts['approval_votes'] += len(votes)
+
+    rebuild_hierarchy()
+    bump(company_ids)  # Unscoped list ETags cover every company
+    db.session.commit()
+    rebuild_rollups()
+    return counts
@@ -0,0 +1,81 @@
+from contextlib import contextmanager
+from contextvars import ContextVar
+
+from flask import jsonify, request
+from sqlalchemy import event
+from sqlalchemy.orm import Session, with_loader_criteria
+
+from models import (Company, User, Expense, ApprovalStep, ApprovalRule, ApproverGroup, SpendRollup, ApprovalEvent,
+                    ArchivedExpense, ArchivedApprovalStep, Attachment)
+
+# --- Tenant Scoping ---
+#
+# When a request names a company (X-Company-Id header or ?company_id=), every
+# ORM SELECT in that request gets `company_id = :tenant` added for each tenant
+# owned model, including joined, eager and lazy loads. Queries then hit the
+# company-led composite indexes and cost grows with the tenant, not the
+# platform. Without a tenant the API behaves as before (unscoped), so scripts,
+# migrations and CLI commands are unaffected; use tenant() to scope them.
+
+TENANT_HEADER = 'X-Company-Id'
+TENANT_MODELS = (User, Expense, ApprovalStep, ApprovalRule, ApproverGroup, SpendRollup, ApprovalEvent,
+                 ArchivedExpense, ArchivedApprovalStep, Attachment)
+
+_current_company = ContextVar('current_company_id', default=None)
+
+
+def current_company_id():
+    return _current_company.get()
+
+
+@contextmanager
+def tenant(company_id):
+    """Scopes ORM queries in the block to one company (None for unscoped)."""
+    token = _current_company.set(company_id)
+    try:
+        yield
+    finally:
+        _current_company.reset(token)
+
+
+@event.listens_for(Session, 'do_orm_execute')
+def _scope_to_tenant(execute_state):
+    company_id = _current_company.get()
+    if (
+        company_id is None
+        or not execute_state.is_select
+        or execute_state.is_column_load
+        or execute_state.is_relationship_load
+        or execute_state.execution_options.get('all_tenants', False)
+    ):
+        return
+
+    # Criteria propagate to relationship and eager loads from here
+    options = [
+        with_loader_criteria(model, lambda cls: cls.company_id == company_id, include_aliases=True)
+        for model in TENANT_MODELS
+    ]
+    options.append(with_loader_criteria(Company, lambda cls: cls.id == company_id, include_aliases=True))
+    execute_state.statement = execute_state.statement.options(*options)
+
+
+def init_app(app):
+    """Reads the tenant for each request and clears it afterwards."""
+
+    @app.before_request
+    def bind_tenant():
+        raw = request.headers.get(TENANT_HEADER) or request.args.get('company_id')
+        if not raw:
+            return None
+        try:
+            company_id = int(raw)
+        except ValueError:
+            return jsonify({'error': f'Invalid {TENANT_HEADER}: expected a company id'}), 400
+        request.environ['expense.tenant_token'] = _current_company.set(company_id)
+        return None
+
+    @app.teardown_request
+    def release_tenant(exc):
+        token = request.environ.pop('expense.tenant_token', None)
+        if token is not None:
+            _current_company.reset(token)
@@ -0,0 +1,54 @@
+import os
+import sys
+
+import pytest
+
+BACKEND_DIR = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.insert(0, BACKEND_DIR)
+
+from config import Config  # noqa: E402
+
+# Stands in for the FX API: no test waits on (or depends on) the network
+TEST_RATES = {'USD': 1.0, 'EUR': 0.9, 'GBP': 0.8, 'INR': 83.0, 'JPY': 150.0}
+
+
+def stub_rates(base):
+    return {currency: rate / TEST_RATES[base] for currency, rate in TEST_RATES.items()}
+
+
+@pytest.fixture
+def app(tmp_path):
+    """An app on a fresh SQLite database in tmp_path, schema created."""
+    import app as app_module
+    from migrations import upgrade
+    from models import db
+
+    class TestConfig(Config):
+        TESTING = True
+        SQLALCHEMY_DATABASE_URI = f"sqlite:///{tmp_path / 'test.db'}"
+        ATTACHMENT_DIR = str(tmp_path / 'attachments')
+
+    app = app_module.create_app(TestConfig)
+    app_module.rate_cache.fetcher = stub_rates
+    app_module.rate_cache.clear()
+    with app.app_context():
+        upgrade()
+    yield app
+    with app.app_context():
+        db.session.remove()
+        db.engine.dispose()
+
+
+@pytest.fixture
+def client(app):
+    return app.test_client()
+
+
+@pytest.fixture
+def seeded(app):
+    """The demo company (seed_demo_data) in the app's database."""
+    from app import seed_demo_data
+
+    with app.app_context():
+        seed_demo_data()
+    return app
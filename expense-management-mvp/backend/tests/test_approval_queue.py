@@ -0,0 +1,81 @@
+from contextlib import contextmanager
+
+from sqlalchemy import event
+
+from models import db, ApprovalStep, User
+
+
+@contextmanager
+def count_statements(engine):
+    statements = []
+
+    def record(conn, cursor, statement, parameters, context, executemany):
+        statements.append(statement)
+
+    event.listen(engine, 'before_cursor_execute', record)
+    try:
+        yield statements
+    finally:
+        event.remove(engine, 'before_cursor_execute', record)
+
+
+def user_id(email):
+    return db.session.query(User.id).filter_by(email=email).scalar()
+
+
+def submit(client, submitter_id, count, amount, offset):
+    for i in range(count):
+        response = client.post('/api/expenses', json={
+            'user_id': submitter_id, 'title': f'Queue test {offset + i}', 'amount': amount + offset + i,
+            'currency': 'USD', 'date': '2026-01-15'
+        })
+        assert response.status_code == 201, response.get_data(as_text=True)
+
+
+def queue(app, client, approver_id):
+    """(items in the approver's queue, SQL statements it took)."""
+    with app.app_context():
+        engine = db.engine
+    with count_statements(engine) as statements:
+        response = client.get(f'/api/approvals/{approver_id}')
+    assert response.status_code == 200
+    return len(response.get_json()['approvals']), len(statements)
+
+
+def test_queue_statement_count_does_not_grow_with_the_queue(seeded):
+    app, client = seeded, seeded.test_client()
+    with app.app_context():
+        manager_id = user_id('manager@company.com')
+        employee_ids = [user_id('employee1@company.com'), user_id('employee2@company.com')]
+
+    small, small_statements = queue(app, client, manager_id)
+    assert small == 2  # The demo expenses
+
+    # Direct-manager steps for both employees; the large ones also get a Finance group step
+    submit(client, employee_ids[0], 14, amount=100, offset=0)
+    submit(client, employee_ids[1], 14, amount=1000, offset=100)
+    large, large_statements = queue(app, client, manager_id)
+    assert large == 30
+    assert large_statements == small_statements
+
+
+def test_group_queue_statement_count_does_not_grow_with_the_queue(seeded):
+    app, client = seeded, seeded.test_client()
+    with app.app_context():
+        manager_id = user_id('manager@company.com')
+        finance_member_id = user_id('manager2@company.com')
+        employee_id = user_id('employee1@company.com')
+
+    small, small_statements = queue(app, client, finance_member_id)
+
+    # Approving the manager step puts each large expense in the Finance pool's queue
+    submit(client, employee_id, 20, amount=1000, offset=0)
+    with app.app_context():
+        step_ids = [s.id for s in ApprovalStep.query.filter_by(approver_id=manager_id, status='Waiting', sequence=1)]
+    for step_id in step_ids:
+        response = client.put(f'/api/approvals/{step_id}', json={'decision': 'approved', 'approver_id': manager_id})
+        assert response.status_code == 200, response.get_data(as_text=True)
+
+    large, large_statements = queue(app, client, finance_member_id)
+    assert large == small + 20
+    assert large_statements == small_statements
@@ -0,0 +1,56 @@
+import json
+from datetime import datetime, timedelta
+
+import archive
+from models import db, ApprovalStep, ArchivedApprovalStep, ArchivedExpense, Expense, User
+
+
+def test_archived_expense_is_still_listed_detailed_and_exported_but_not_queued(seeded):
+    client = seeded.test_client()
+    with seeded.app_context():
+        ids = {u.email.split('@')[0]: u.id for u in User.query}
+        expense = Expense.query.filter_by(title='Client Lunch Meeting').one()
+        expense_id = expense.id
+        steps = {s.approver_id: s.id for s in expense.approval_steps}
+
+    for approver_id, step_id in steps.items():
+        response = client.put(f'/api/approvals/{step_id}', json={'decision': 'approved', 'approver_id': approver_id})
+        assert response.status_code == 200
+    before = client.get(f'/api/expenses/{expense_id}').get_json()['expense']
+    assert before['status'] == 'Approved'
+
+    with seeded.app_context():
+        # Finalized long ago
+        long_ago = datetime.utcnow() - timedelta(days=200)
+        Expense.query.filter_by(id=expense_id).update({'submitted_at': long_ago})
+        ApprovalStep.query.filter_by(expense_id=expense_id).update({'decided_at': long_ago})
+        db.session.commit()
+        assert archive.archive(180) == (1, 3, True)
+        assert db.session.get(Expense, expense_id) is None
+        assert ApprovalStep.query.filter_by(expense_id=expense_id).count() == 0
+        assert db.session.get(ArchivedExpense, expense_id) is not None
+        assert ArchivedApprovalStep.query.filter_by(expense_id=expense_id).count() == 3
+
+    # Detail, with its steps, as before
+    after = client.get(f'/api/expenses/{expense_id}').get_json()['expense']
+    assert {k: after[k] for k in ('id', 'title', 'status', 'amount')} == \
+        {k: before[k] for k in ('id', 'title', 'status', 'amount')}
+    assert sorted(s['id'] for s in after['approval_steps']) == sorted(steps.values())
+
+    # Listings
+    history = client.get(f"/api/expenses/history/{ids['employee1']}").get_json()['expenses']
+    listed = next(e for e in history if e['id'] == expense_id)
+    assert sorted(s['id'] for s in listed['approval_steps']) == sorted(steps.values())
+    assert expense_id in {e['id'] for e in client.get('/api/expenses/all').get_json()['expenses']}
+
+    # Export
+    lines = client.get('/api/expenses/export?format=ndjson&steps=nested').get_data(as_text=True).splitlines()
+    exported = next(row for row in map(json.loads, lines) if row['id'] == expense_id)
+    assert len(exported['approval_steps']) == 3
+
+    # Queues and search read live tables only
+    for approver_id in steps:
+        queue = client.get(f'/api/approvals/{approver_id}').get_json()['approvals']
+        assert expense_id not in {item['id'] for item in queue}
+    found = client.get('/api/expenses/search?q=lunch').get_json()['expenses']
+    assert expense_id not in {e['id'] for e in found}
@@ -0,0 +1,28 @@
+from models import Expense
+
+
+def test_attachments_of_a_missing_expense_are_not_found(seeded):
+    client = seeded.test_client()
+    with seeded.app_context():
+        expense_id = Expense.query.filter_by(title='Client Lunch Meeting').one().id
+
+    response = client.get(f'/api/expenses/{expense_id}/attachments')
+    assert response.status_code == 200
+    assert response.get_json()['attachments'] == []
+
+    for method in (client.get, client.post):
+        response = method('/api/expenses/999999/attachments?filename=receipt.txt', data=b'receipt')
+        assert response.status_code == 404
+        assert response.get_json()['error'] == 'Expense not found'
+
+
+def test_uploaded_attachment_is_listed(seeded):
+    client = seeded.test_client()
+    with seeded.app_context():
+        expense_id = Expense.query.filter_by(title='Client Lunch Meeting').one().id
+
+    response = client.post(f'/api/expenses/{expense_id}/attachments?filename=receipt.pdf',
+                           data=b'%PDF-1.4\n%%EOF\n', content_type='application/pdf')
+    assert response.status_code == 201
+    listed = client.get(f'/api/expenses/{expense_id}/attachments').get_json()['attachments']
+    assert [a['filename'] for a in listed] == ['receipt.pdf']
@@ -0,0 +1,98 @@
+from datetime import datetime, timedelta
+
+from sqlalchemy import update
+
+from models import db, ApprovalStep, Expense, User
+import workflow
+
+
+def ids(app):
+    with app.app_context():
+        users = {u.email.split('@')[0]: u.id for u in User.query}
+        steps = {(s.expense_id, s.approver_id): s.id for s in ApprovalStep.query.filter_by(status='Waiting')}
+        expense_ids = sorted({expense_id for expense_id, _ in steps})
+    return users, steps, expense_ids
+
+
+def batch(client, approver_id, decisions, **options):
+    return client.post('/api/approvals/batch', json={'approver_id': approver_id, 'decisions': decisions, **options})
+
+
+def test_partial_failure_applies_only_the_valid_items(seeded):
+    client = seeded.test_client()
+    users, steps, (first, second) = ids(seeded)
+    admin = users['admin']
+
+    response = batch(client, admin, [
+        {'step_id': steps[(first, admin)], 'decision': 'approved'},
+        {'step_id': steps[(first, users['manager'])], 'decision': 'approved'},  # Not the admin's step
+        {'step_id': 999999, 'decision': 'approved'},
+        {'step_id': steps[(second, admin)], 'decision': 'maybe'},
+        {'step_id': steps[(first, admin)], 'decision': 'approved'},  # Duplicate
+    ])
+    body = response.get_json()
+    assert body['success'] is False
+    assert [r['ok'] for r in body['results']] == [True, False, False, False, False]
+    assert [r.get('code') for r in body['results'][1:]] == [403, 404, 400, 400]
+
+    with seeded.app_context():
+        assert db.session.get(ApprovalStep, steps[(first, admin)]).status == 'Approved'
+        assert db.session.get(ApprovalStep, steps[(first, users['manager'])]).status == 'Waiting'
+        assert db.session.get(Expense, first).pending_step_count == 2
+
+
+def test_atomic_batch_applies_nothing_when_an_item_fails(seeded):
+    client = seeded.test_client()
+    users, steps, (first, second) = ids(seeded)
+    admin = users['admin']
+
+    body = batch(client, admin, [
+        {'step_id': steps[(first, admin)], 'decision': 'approved'},
+        {'step_id': steps[(second, users['manager2'])], 'decision': 'rejected'},
+    ], atomic=True).get_json()
+    assert [r['ok'] for r in body['results']] == [False, False]
+    with seeded.app_context():
+        assert db.session.get(ApprovalStep, steps[(first, admin)]).status == 'Waiting'
+
+
+def test_step_decided_concurrently_is_not_counted_twice(seeded, monkeypatch):
+    client = seeded.test_client()
+    users, steps, (first, _) = ids(seeded)
+    admin, step_id = users['admin'], steps[(first, users['admin'])]
+    check_decision = workflow.check_decision
+
+    def decided_elsewhere(step, *args):
+        check_decision(step, *args)
+        # Another request approves the same step between validation and the batch UPDATE
+        if step.id == step_id:
+            steps_table, expenses_table = ApprovalStep.__table__, Expense.__table__
+            db.session.execute(update(steps_table).where(steps_table.c.id == step_id).values(
+                status='Approved', decided_at=datetime.utcnow() - timedelta(seconds=1)))
+            db.session.execute(update(expenses_table).where(expenses_table.c.id == first).values(
+                pending_step_count=expenses_table.c.pending_step_count - 1))
+
+    monkeypatch.setattr(workflow, 'check_decision', decided_elsewhere)
+    body = batch(client, admin, [{'step_id': step_id, 'decision': 'approved'}]).get_json()
+    assert body['results'][0]['expense_status'] == 'Pending'
+
+    with seeded.app_context():
+        expense = db.session.get(Expense, first)
+        assert expense.pending_step_count == 2  # The step counted once, by the other request
+        assert expense.status == 'Pending'
+
+
+def test_batch_size_is_limited(seeded):
+    client = seeded.test_client()
+    seeded.config['MAX_BATCH_DECISIONS'] = 2
+    users, steps, (first, second) = ids(seeded)
+    admin = users['admin']
+
+    response = batch(client, admin, [
+        {'step_id': steps[(first, admin)], 'decision': 'approved'},
+        {'step_id': steps[(second, admin)], 'decision': 'approved'},
+        {'step_id': 999999, 'decision': 'approved'},
+    ])
+    assert response.status_code == 400
+    assert 'At most 2' in response.get_json()['error']
+    with seeded.app_context():
+        assert db.session.get(ApprovalStep, steps[(first, admin)]).status == 'Waiting'
@@ -0,0 +1,77 @@
+import pytest
+
+from models import db, User
+import versions
+
+
+@pytest.fixture
+def response_cache(monkeypatch):
+    # ETags only differ by data version, so entries must not outlive a test's database
+    monkeypatch.setattr(versions.response_cache, 'max_entries', 16)
+    versions.response_cache.clear()
+    yield versions.response_cache
+    versions.response_cache.clear()
+
+
+def user_ids(app):
+    with app.app_context():
+        return {u.email.split('@')[0]: u.id for u in User.query}
+
+
+def submit(client, user_id, title):
+    response = client.post('/api/expenses', json={'user_id': user_id, 'title': title, 'amount': 42, 'currency': 'USD'})
+    assert response.status_code == 201
+
+
+def test_matching_if_none_match_gets_304(seeded):
+    client, ids = seeded.test_client(), user_ids(seeded)
+    url = f"/api/expenses/history/{ids['employee1']}"
+
+    first = client.get(url)
+    assert first.status_code == 200 and first.headers['ETag']
+    again = client.get(url, headers={'If-None-Match': first.headers['ETag']})
+    assert again.status_code == 304
+    assert again.get_data() == b''
+    assert again.headers['ETag'] == first.headers['ETag']
+
+
+def test_write_invalidates_the_etag(seeded):
+    client, ids = seeded.test_client(), user_ids(seeded)
+    url = f"/api/expenses/history/{ids['employee1']}"
+    etag = client.get(url).headers['ETag']
+
+    # Another user's submission does not touch this history
+    submit(client, ids['employee2'], 'Not theirs')
+    assert client.get(url, headers={'If-None-Match': etag}).status_code == 304
+
+    submit(client, ids['employee1'], 'Theirs')
+    response = client.get(url, headers={'If-None-Match': etag})
+    assert response.status_code == 200
+    assert response.headers['ETag'] != etag
+    assert 'Theirs' in {e['title'] for e in response.get_json()['expenses']}
+
+
+def test_bump_changes_the_etag(seeded):
+    client, ids = seeded.test_client(), user_ids(seeded)
+    url = '/api/expenses/all'
+    etag = client.get(url).headers['ETag']
+
+    with seeded.app_context():
+        company_id = db.session.get(User, ids['admin']).company_id
+        versions.bump([company_id])
+        db.session.commit()
+    response = client.get(url, headers={'If-None-Match': etag})
+    assert response.status_code == 200
+    assert response.headers['ETag'] != etag
+
+
+def test_response_cache_is_not_served_after_a_write(seeded, response_cache):
+    client, ids = seeded.test_client(), user_ids(seeded)
+    url = '/api/expenses/all'
+
+    before = client.get(url).get_json()
+    assert len(response_cache._entries) == 1
+    assert client.get(url).get_json() == before  # From the cache
+    submit(client, ids['employee1'], 'Cached?')
+    titles = {e['title'] for e in client.get(url).get_json()['expenses']}
+    assert 'Cached?' in titles
@@ -0,0 +1,44 @@
+from models import db, Expense, User
+import duplicates
+
+
+def report(app):
+    with app.app_context():
+        return list(duplicates.report(app.config['DUPLICATE_WINDOW_DAYS'],
+                                      app.config['DUPLICATE_AMOUNT_TOLERANCE']))
+
+
+def test_seeded_expenses_have_fingerprints_and_base_amounts(seeded):
+    with seeded.app_context():
+        for expense in Expense.query:
+            assert expense.fingerprint == duplicates.fingerprint(
+                expense.user_id, expense.amount, expense.currency, expense.date, expense.title)
+            assert expense.base_currency == 'USD' and expense.base_amount is not None
+    assert report(seeded) == []
+
+
+def test_expenses_without_fingerprints_are_not_exact_duplicates(seeded):
+    with seeded.app_context():
+        Expense.query.update({'fingerprint': None})
+        db.session.commit()
+    assert report(seeded) == []
+
+
+def test_exact_duplicate_is_refused_until_confirmed_then_reported(seeded):
+    client = seeded.test_client()
+    with seeded.app_context():
+        expense = Expense.query.filter_by(title='Client Lunch Meeting').one()
+        original_id = expense.id
+        payload = {'user_id': expense.user_id, 'title': expense.title, 'amount': expense.amount,
+                   'currency': expense.currency, 'date': expense.date.isoformat()}
+
+    response = client.post('/api/expenses', json=payload)
+    assert response.status_code == 409
+    assert response.get_json()['duplicate_of'] == original_id
+
+    response = client.post('/api/expenses', json={**payload, 'allow_duplicate': True})
+    assert response.status_code == 201
+    copy_id = response.get_json()['expense']['id']
+
+    [row] = report(seeded)
+    assert (row['kind'], row['expense_id'], row['duplicate_of']) == ('exact', copy_id, original_id)
@@ -0,0 +1,78 @@
+from datetime import datetime, timedelta
+
+import pytest
+
+from models import db, ApprovalEvent, User
+import events
+
+
+@pytest.fixture
+def stream_app(seeded):
+    # Send the backlog and end the stream, in batches smaller than the backlog
+    seeded.config.update(SSE_MAX_STREAM_SECONDS=0, SSE_BATCH_SIZE=2)
+    return seeded
+
+
+def user_ids(app):
+    with app.app_context():
+        return {u.email.split('@')[0]: u.id for u in User.query}
+
+
+def read_stream(client, user_id, last_event_id=None):
+    """[(id, event type)] sent on one connection."""
+    headers = {'Last-Event-ID': str(last_event_id)} if last_event_id is not None else {}
+    response = client.get(f'/api/approvals/{user_id}/events', headers=headers)
+    assert response.status_code == 200
+    sent = []
+    for message in response.get_data(as_text=True).split('\n\n'):
+        fields = dict(line.split(': ', 1) for line in message.splitlines() if ': ' in line and line[0] != ':')
+        if 'event' in fields:
+            sent.append((int(fields['id']), fields['event']))
+    return sent
+
+
+def submit(client, user_id, count):
+    for i in range(count):
+        response = client.post('/api/expenses', json={
+            'user_id': user_id, 'title': f'Stream test {i}', 'amount': 20 + i, 'currency': 'USD'
+        })
+        assert response.status_code == 201
+
+
+def test_reconnect_with_last_event_id_resumes_without_gaps_or_repeats(stream_app):
+    client, ids = stream_app.test_client(), user_ids(stream_app)
+    manager = ids['manager']
+    [(start, kind)] = read_stream(client, manager)
+    assert kind == 'ready'
+
+    submit(client, ids['employee1'], 5)
+    backlog = read_stream(client, manager, start)
+    assert [kind for _, kind in backlog] == ['step_created'] * 5
+
+    # The connection dropped after the second event: the reconnect picks up from there
+    resumed = read_stream(client, manager, backlog[1][0])
+    assert backlog[:2] + resumed == backlog
+    assert read_stream(client, manager, backlog[-1][0]) == []
+
+
+def test_prune_keeps_events_inside_the_retention_window(stream_app):
+    client, ids = stream_app.test_client(), user_ids(stream_app)
+    manager = ids['manager']
+    submit(client, ids['employee1'], 4)
+    with stream_app.app_context():
+        kept_before = ApprovalEvent.query.count()
+        old = [e.id for e in ApprovalEvent.query.order_by(ApprovalEvent.id).limit(3)]
+        ApprovalEvent.query.filter(ApprovalEvent.id.in_(old)).update(
+            {'created_at': datetime.utcnow() - timedelta(days=8)}, synchronize_session=False)
+        ApprovalEvent.query.filter(~ApprovalEvent.id.in_(old)).update(
+            {'created_at': datetime.utcnow() - timedelta(days=6)}, synchronize_session=False)
+        db.session.commit()
+
+        assert events.prune(7) == 3
+        remaining = [e.id for e in ApprovalEvent.query.order_by(ApprovalEvent.id)]
+        assert len(remaining) == kept_before - 3
+        assert not set(old) & set(remaining)
+
+    # A client further behind than the retained events is told to reload its queue
+    assert read_stream(client, manager, old[0] - 1)[0][1] == 'resync'
+    assert read_stream(client, manager, old[-1])[0][1] != 'resync'
@@ -0,0 +1,161 @@
+import threading
+
+import pytest
+
+from conftest import TEST_RATES, stub_rates
+from fx import RateCache
+
+
+class FakeClock:
+    def __init__(self):
+        self.now = 1000.0
+
+    def __call__(self):
+        return self.now
+
+
+class Upstream:
+    """A fetcher that records its calls and fails while `down` is set."""
+
+    def __init__(self):
+        self.calls = []
+        self.down = False
+
+    def __call__(self, base):
+        self.calls.append(base)
+        if self.down:
+            raise RuntimeError('upstream unavailable')
+        return stub_rates(base)
+
+
+def make_cache(upstream, clock, **settings):
+    settings = {'ttl': 60, 'stale_ttl': 600, 'max_entries': 32, 'failure_backoff': 5, **settings}
+    return RateCache(fetcher=upstream, clock=clock, **settings)
+
+
+# --- Freshness ---
+
+def test_table_is_fresh_for_ttl():
+    clock, upstream = FakeClock(), Upstream()
+    cache = make_cache(upstream, clock)
+
+    assert cache.get_rates('USD') == stub_rates('USD')
+    clock.now += 59
+    assert cache.get_rates('USD') == stub_rates('USD')
+    assert upstream.calls == ['USD']
+
+    clock.now += 1  # Expired: refetched
+    cache.get_rates('USD')
+    assert upstream.calls == ['USD', 'USD']
+
+
+def test_concurrent_misses_share_one_fetch():
+    clock, upstream = FakeClock(), Upstream()
+    release = threading.Event()
+
+    def slow_fetcher(base):
+        release.wait()
+        return upstream(base)
+
+    cache = make_cache(slow_fetcher, clock)
+    results = []
+    threads = [threading.Thread(target=lambda: results.append(cache.get_rates('USD'))) for _ in range(8)]
+    for thread in threads:
+        thread.start()
+    release.set()
+    for thread in threads:
+        thread.join()
+
+    # Callers that missed while the fetch ran waited on it; later ones found the table fresh
+    assert upstream.calls == ['USD']
+    assert results == [stub_rates('USD')] * 8
+
+
+def test_least_recently_used_table_is_evicted():
+    clock, upstream = FakeClock(), Upstream()
+    cache = make_cache(upstream, clock, max_entries=2)
+    cache.get_rates('USD')
+    cache.get_rates('EUR')
+    cache.get_rates('USD')  # EUR is now the least recently used
+    cache.get_rates('GBP')
+
+    cache.get_rates('USD')
+    assert upstream.calls == ['USD', 'EUR', 'GBP']
+    cache.get_rates('EUR')
+    assert upstream.calls == ['USD', 'EUR', 'GBP', 'EUR']
+
+
+# --- Upstream failures ---
+
+def test_stale_table_is_served_only_within_stale_ttl():
+    clock, upstream = FakeClock(), Upstream()
+    cache = make_cache(upstream, clock)
+    rates = cache.get_rates('USD')
+    upstream.down = True
+
+    clock.now += 61  # Past ttl, within stale_ttl
+    assert cache.get_rates('USD') == rates
+    clock.now += 600  # Past stale_ttl (and the backoff)
+    assert cache.get_rates('USD') is None
+    assert upstream.calls == ['USD', 'USD', 'USD']
+
+
+def test_failed_fetch_is_not_retried_within_the_backoff():
+    clock, upstream = FakeClock(), Upstream()
+    cache = make_cache(upstream, clock)
+    upstream.down = True
+
+    assert cache.get_rates('USD') is None
+    clock.now += 4
+    assert cache.get_rates('USD') is None
+    assert upstream.calls == ['USD']
+
+    clock.now += 2  # Backoff over: the next miss asks upstream again
+    upstream.down = False
+    assert cache.get_rates('USD') == stub_rates('USD')
+    assert upstream.calls == ['USD', 'USD']
+
+
+def test_backoff_serves_the_stale_table():
+    clock, upstream = FakeClock(), Upstream()
+    cache = make_cache(upstream, clock)
+    rates = cache.get_rates('USD')
+
+    clock.now += 61
+    upstream.down = True
+    assert cache.get_rates('USD') == rates
+    assert cache.get_rates('USD') == rates
+    assert upstream.calls == ['USD', 'USD']
+
+
+def test_backoff_is_per_base():
+    clock, upstream = FakeClock(), Upstream()
+    cache = make_cache(upstream, clock)
+    upstream.down = True
+    cache.get_rates('USD')
+
+    upstream.down = False
+    assert cache.get_rates('EUR') == stub_rates('EUR')
+    assert upstream.calls == ['USD', 'EUR']
+
+
+# --- Cross rates ---
+
+def test_cross_rate_is_derived_from_a_fresh_table():
+    clock, upstream = FakeClock(), Upstream()
+    cache = make_cache(upstream, clock)
+    cache.get_rates('USD')
+
+    assert cache.get_rate('EUR', 'GBP') == pytest.approx(TEST_RATES['GBP'] / TEST_RATES['EUR'])
+    assert cache.get_rate('INR', 'INR') == 1.0
+    assert upstream.calls == ['USD']
+
+
+def test_cross_rate_is_not_derived_from_an_expired_table():
+    clock, upstream = FakeClock(), Upstream()
+    cache = make_cache(upstream, clock)
+    cache.get_rates('USD')
+
+    clock.now += 60
+    assert cache.get_rate('EUR', 'GBP') == pytest.approx(TEST_RATES['GBP'] / TEST_RATES['EUR'])
+    assert upstream.calls == ['USD', 'EUR']  # Fetched the EUR table instead
@@ -0,0 +1,97 @@
+import pytest
+
+from hierarchy import HierarchyError, ancestors, check_manager, closure_rows, descendants
+from models import db, User, UserHierarchy
+
+
+@pytest.fixture
+def org(seeded):
+    """The demo org plus a team lead under manager1 and an employee under the lead:
+
+        admin -> manager1 -> lead -> employee3
+                          -> employee1, employee2
+              -> manager2
+    """
+    client = seeded.test_client()
+    with seeded.app_context():
+        ids = {u.email.split('@')[0]: u.id for u in User.query}
+        company_id = db.session.get(User, ids['admin']).company_id
+
+    def create(name, role, manager_id):
+        response = client.post('/api/admin/users/create', json={
+            'name': name, 'email': f'{name}@company.com', 'password': 'pw', 'role': role,
+            'company_id': company_id, 'manager_id': manager_id
+        })
+        assert response.status_code == 201, response.get_data(as_text=True)
+        return response.get_json()['user']['id']
+
+    ids['lead'] = create('lead', 'Manager', ids['manager'])
+    ids['employee3'] = create('employee3', 'Employee', ids['lead'])
+    return seeded, client, ids
+
+
+def chain(user_id):
+    return [(user.id, depth) for user, depth in ancestors(user_id)]
+
+
+def below(user_id):
+    return {(user.id, depth) for user, depth in descendants(user_id)}
+
+
+def assert_closure_matches_manager_ids():
+    """The maintained closure table equals one recomputed from users.manager_id."""
+    expected, cycles = closure_rows(db.session.query(User.id, User.manager_id).all())
+    stored = db.session.query(UserHierarchy.ancestor_id, UserHierarchy.descendant_id, UserHierarchy.depth).all()
+    assert cycles == []
+    assert sorted(stored) == sorted(expected)
+
+
+def test_moving_a_manager_under_their_own_descendant_is_rejected(org):
+    app, client, ids = org
+    for new_manager in ('lead', 'manager'):  # A report of a report, and themselves
+        response = client.put(f"/api/admin/users/{ids['manager']}", json={'manager_id': ids[new_manager]})
+        assert response.status_code == 400
+        assert 'cycle' in response.get_json()['error']
+
+    with app.app_context():
+        with pytest.raises(HierarchyError):
+            check_manager(ids['manager'], ids['employee3'])
+        check_manager(ids['manager'], ids['manager2'])  # A sibling is fine
+        assert db.session.get(User, ids['manager']).manager_id == ids['admin']
+        assert_closure_matches_manager_ids()
+
+
+def test_ancestors_and_descendants_after_moving_a_subtree(org):
+    app, client, ids = org
+    response = client.put(f"/api/admin/users/{ids['manager']}", json={'manager_id': ids['manager2']})
+    assert response.status_code == 200
+
+    with app.app_context():
+        assert chain(ids['employee3']) == [(ids['lead'], 1), (ids['manager'], 2), (ids['manager2'], 3),
+                                           (ids['admin'], 4)]
+        assert below(ids['manager2']) == {
+            (ids['manager'], 1), (ids['lead'], 2), (ids['employee1'], 2), (ids['employee2'], 2),
+            (ids['employee3'], 3)
+        }
+        assert (ids['manager'], 1) not in below(ids['admin'])
+        assert_closure_matches_manager_ids()
+
+
+def test_ancestors_and_descendants_after_removing_a_user(org):
+    app, client, ids = org
+    response = client.delete(f"/api/admin/users/{ids['manager']}")
+    assert response.status_code == 200
+
+    with app.app_context():
+        # manager1's reports now report to the admin, with their own reports below them
+        assert chain(ids['employee3']) == [(ids['lead'], 1), (ids['admin'], 2)]
+        assert chain(ids['employee1']) == [(ids['admin'], 1)]
+        assert below(ids['lead']) == {(ids['employee3'], 1)}
+        assert below(ids['admin']) == {
+            (ids['manager2'], 1), (ids['lead'], 1), (ids['employee1'], 1), (ids['employee2'], 1),
+            (ids['employee3'], 2)
+        }
+        assert db.session.query(UserHierarchy).filter(
+            (UserHierarchy.ancestor_id == ids['manager']) | (UserHierarchy.descendant_id == ids['manager'])
+        ).count() == 0
+        assert_closure_matches_manager_ids()
@@ -0,0 +1,40 @@
+import json
+import random
+
+from importer import ROW_KEY, match_returned_ids
+from models import db, ApprovalStep, Expense, User
+
+
+def test_returned_ids_are_matched_by_row_key_not_position():
+    rows = [{'user_id': 1, 'fingerprint': f'fp{i % 3}', 'category': 'Meals', 'amount': i} for i in range(9)]
+    returned = [(100 + i, *(row[name] for name in ROW_KEY)) for i, row in enumerate(rows)]
+    random.Random(5).shuffle(returned)
+
+    ids = match_returned_ids(rows, returned)
+    assert sorted(ids) == list(range(100, 109))
+    for row, expense_id in zip(rows, ids):
+        assert f'fp{(expense_id - 100) % 3}' == row['fingerprint']
+
+
+def test_imported_steps_belong_to_their_own_expense(seeded):
+    client = seeded.test_client()
+    # Over 500 the Finance group rule adds a second step, so a mix-up shows in the step counts
+    amounts = [120, 900, 75, 2400, 60, 650, 650, 650]
+    lines = [json.dumps({'user_email': 'employee1@company.com', 'title': f'Import {i}', 'amount': amount,
+                         'currency': 'USD', 'date': '2026-03-02', 'category': 'Travel'})
+             for i, amount in enumerate(amounts[:-2])]
+    lines += [lines[-1]] * 2  # Identical rows: equal keys
+    response = client.post('/api/expenses/import?format=ndjson&allow_duplicates=1',
+                           data='\n'.join(lines), content_type='application/x-ndjson')
+    assert response.status_code == 200, response.get_data(as_text=True)
+    assert response.get_json()['imported'] == len(amounts)
+
+    with seeded.app_context():
+        employee_id = db.session.query(User.id).filter_by(email='employee1@company.com').scalar()
+        imported = Expense.query.filter(Expense.title.like('Import %')).all()
+        assert len(imported) == len(amounts)
+        for expense in imported:
+            steps = ApprovalStep.query.filter_by(expense_id=expense.id).all()
+            assert len(steps) == (2 if expense.amount > 500 else 1), expense.title
+            assert expense.pending_step_count == len(steps)
+            assert expense.user_id == employee_id
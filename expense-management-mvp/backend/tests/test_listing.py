@@ -0,0 +1,38 @@
+from models import db, Expense, User
+
+
+def submit(client, user_id, count):
+    for i in range(count):
+        response = client.post('/api/expenses', json={
+            'user_id': user_id, 'title': f'Listing test {i}', 'amount': 10 + i, 'currency': 'USD'
+        })
+        assert response.status_code == 201, response.get_data(as_text=True)
+
+
+def test_following_next_cursor_lists_every_expense_once(seeded):
+    client = seeded.test_client()
+    with seeded.app_context():
+        employee_id = db.session.query(User.id).filter_by(email='employee1@company.com').scalar()
+    submit(client, employee_id, 7)
+    with seeded.app_context():
+        expected = [e.id for e in Expense.query.filter_by(user_id=employee_id)
+                    .order_by(Expense.submitted_at.desc(), Expense.id.desc())]
+
+    seen, cursor = [], None
+    while True:
+        url = f'/api/expenses/history/{employee_id}?per_page=3' + (f'&cursor={cursor}' if cursor else '')
+        body = client.get(url).get_json()
+        assert len(body['expenses']) <= 3
+        seen.extend(e['id'] for e in body['expenses'])
+        cursor = body['next_cursor']
+        if cursor is None:
+            break
+    assert seen == expected
+
+
+def test_offset_page_parameter_is_rejected(seeded):
+    client = seeded.test_client()
+    for url in ('/api/expenses/all?page=2', '/api/expenses/history/1?page=1'):
+        response = client.get(url)
+        assert response.status_code == 400
+        assert 'cursor' in response.get_json()['error']
@@ -0,0 +1,67 @@
+import pytest
+
+from models import db, User
+import search
+
+
+@pytest.fixture
+def searchable(seeded):
+    """23 more expenses mentioning "hotel" (the demo data has one), every third in the title.
+
+    Ranking windows hold 5 matches.
+    """
+    with seeded.app_context():
+        if not search.fts_enabled():
+            pytest.skip('SQLite build without FTS5')
+        employee_id = db.session.query(User.id).filter_by(email='employee1@company.com').scalar()
+    seeded.config['SEARCH_MAX_CANDIDATES'] = 5
+    client = seeded.test_client()
+    for i in range(23):
+        title, description = (f'Hotel {i}', 'Conference') if i % 3 == 0 else (f'Stay {i}', 'hotel night')
+        response = client.post('/api/expenses', json={
+            'user_id': employee_id, 'title': title, 'description': description,
+            'amount': 100 + i, 'currency': 'USD'
+        })
+        assert response.status_code == 201
+    return seeded, client, employee_id
+
+
+def pages(client, url):
+    cursor, seen = None, []
+    while True:
+        body = client.get(url + (f'&cursor={cursor}' if cursor else '')).get_json()
+        assert body['ranked'] is True and body['includes_archived'] is False
+        seen.append([e['title'] for e in body['expenses']])
+        cursor = body['next_cursor']
+        if cursor is None:
+            return seen
+
+
+def test_every_match_is_reachable_past_the_ranking_window(searchable):
+    app, client, _ = searchable
+    seen = pages(client, '/api/expenses/search?q=hotel&per_page=4')
+
+    titles = [title for page in seen for title in page]
+    assert sorted(titles) == sorted(['Conference Travel'] + [f'Hotel {i}' for i in range(0, 23, 3)] +
+                                    [f'Stay {i}' for i in range(23) if i % 3])
+    assert all(len(page) == 4 for page in seen[:-1])
+    # The newest window (ids 25..21: i = 22..18) is ranked: title matches first
+    assert titles[:5] == ['Hotel 21', 'Hotel 18', 'Stay 22', 'Stay 20', 'Stay 19']
+
+
+def test_submissions_while_paging_do_not_shift_the_pages(searchable):
+    app, client, employee_id = searchable
+    url = '/api/expenses/search?q=hotel&per_page=4'
+    first = client.get(url).get_json()
+    response = client.post('/api/expenses', json={
+        'user_id': employee_id, 'title': 'Hotel late', 'amount': 999, 'currency': 'USD'
+    })
+    assert response.status_code == 201
+
+    cursor, titles = first['next_cursor'], [e['title'] for e in first['expenses']]
+    while cursor:
+        body = client.get(f'{url}&cursor={cursor}').get_json()
+        titles += [e['title'] for e in body['expenses']]
+        cursor = body['next_cursor']
+    assert len(titles) == len(set(titles)) == 24
+    assert 'Hotel late' not in titles
@@ -0,0 +1,115 @@
+import json
+from datetime import datetime, timedelta
+
+import pytest
+
+from models import db, ApprovalEvent, ApprovalStep, User
+import sla
+
+MINUTE = timedelta(minutes=1)
+
+
+@pytest.fixture
+def sla_app(seeded):
+    seeded.config.update(APPROVAL_SLA_HOURS=48, APPROVAL_SLA_REMINDER_HOURS=24, APPROVAL_SLA_REMINDERS=2,
+                         APPROVAL_SLA_ESCALATE=True)
+    with seeded.app_context():
+        # Only the steps a test submits can become overdue
+        ApprovalStep.query.update({'due_at': None})
+        db.session.commit()
+    return seeded
+
+
+def user_ids(app):
+    with app.app_context():
+        return {u.email.split('@')[0]: u.id for u in User.query}
+
+
+def submit(app, user_id, amount):
+    response = app.test_client().post('/api/expenses', json={
+        'user_id': user_id, 'title': 'SLA test', 'amount': amount, 'currency': 'USD'
+    })
+    assert response.status_code == 201
+    expense_id = response.get_json()['expense']['id']
+    with app.app_context():
+        return [s.id for s in ApprovalStep.query.filter_by(expense_id=expense_id).order_by(ApprovalStep.sequence)]
+
+
+def step_state(step_id):
+    step = db.session.get(ApprovalStep, step_id)
+    return step.approver_id, step.reminder_count, step.due_at
+
+
+def step_events(step_id):
+    return [(e.user_id, e.type, json.loads(e.payload))
+            for e in ApprovalEvent.query.filter_by(step_id=step_id).order_by(ApprovalEvent.id)]
+
+
+def test_reminders_then_escalation_up_the_chain_until_the_top(sla_app):
+    ids = user_ids(sla_app)
+    [step_id] = submit(sla_app, ids['employee1'], 100)
+
+    with sla_app.app_context():
+        approver, reminders, due = step_state(step_id)
+        assert (approver, reminders) == (ids['manager'], 0)
+        created = len(step_events(step_id))
+        assert sla.run_once(due - MINUTE) == (0, 0)
+
+        # Overdue: reminded, and due again a reminder interval later
+        now = due + MINUTE
+        assert sla.run_once(now) == (1, 0)
+        assert step_state(step_id) == (ids['manager'], 1, now + timedelta(hours=24))
+        [(user_id, kind, payload)] = step_events(step_id)[created:]
+        assert (user_id, kind, payload['reminder']) == (ids['manager'], sla.STEP_REMINDER, 1)
+        assert sla.run_once(now) == (0, 0)  # Not due again yet
+
+        now += timedelta(hours=24, minutes=1)
+        assert sla.run_once(now) == (1, 0)
+        assert step_state(step_id)[:2] == (ids['manager'], 2)
+
+        # APPROVAL_SLA_REMINDERS reminders later: to manager1's manager, with a fresh SLA
+        created = len(step_events(step_id))
+        now += timedelta(hours=24, minutes=1)
+        assert sla.run_once(now) == (0, 1)
+        assert step_state(step_id) == (ids['admin'], 0, now + timedelta(hours=48))
+        assert [(user_id, kind, payload['status']) for user_id, kind, payload in step_events(step_id)[created:]] == [
+            (ids['manager'], 'step_decided', sla.ESCALATED), (ids['admin'], 'step_created', 'Waiting')
+        ]
+
+        # The admin is the top of the chain: reminded for good, never escalated
+        for reminder in range(1, 5):
+            now = step_state(step_id)[2] + MINUTE
+            assert sla.run_once(now) == (1, 0)
+            assert step_state(step_id)[:2] == (ids['admin'], reminder)
+        assert db.session.get(ApprovalStep, step_id).escalation_count == 1
+
+
+def test_escalation_skips_managers_already_approving_the_expense(sla_app):
+    ids = user_ids(sla_app)
+    [step_id] = submit(sla_app, ids['employee1'], 100)
+    with sla_app.app_context():
+        # Nobody above manager1 is free to take it
+        db.session.add(ApprovalStep(expense_id=db.session.get(ApprovalStep, step_id).expense_id,
+                                    approver_id=ids['admin'], sequence=2, status='Waiting'))
+        db.session.commit()
+        row = sla._overdue(datetime.utcnow() + timedelta(days=30), 10)
+        assert [r.id for r in row] == [step_id]
+        assert sla._escalation_targets(row) == {}
+
+
+def test_sla_starts_when_a_step_becomes_actionable_not_at_creation(sla_app):
+    ids = user_ids(sla_app)
+    first, finance = submit(sla_app, ids['employee1'], 900)  # Manager, then the Finance group
+    with sla_app.app_context():
+        assert step_state(finance)[2] is None  # Blocked behind the manager's step
+        long_ago = datetime.utcnow() - timedelta(days=10)
+        ApprovalStep.query.filter_by(id=finance).update({'created_at': long_ago})
+        db.session.commit()
+
+    response = sla_app.test_client().put(f'/api/approvals/{first}',
+                                         json={'decision': 'approved', 'approver_id': ids['manager']})
+    assert response.status_code == 200
+    with sla_app.app_context():
+        due = step_state(finance)[2]
+        assert due - datetime.utcnow() > timedelta(hours=47)
+        assert sla.run_once() == (0, 0)
@@ -0,0 +1,32 @@
+import json
+import os
+import statistics
+import subprocess
+import sys
+
+from conftest import BACKEND_DIR
+
+# Same budget as benchmarks/startup.py --target-ms
+STARTUP_BUDGET_MS = 1000
+
+PROBE = """
+import json, time
+start = time.perf_counter()
+from app import create_app
+create_app()
+print(json.dumps({'startup_ms': (time.perf_counter() - start) * 1000}))
+"""
+
+
+def probe(db_path):
+    env = dict(os.environ, DATABASE_URL=f'sqlite:///{db_path}')
+    result = subprocess.run([sys.executable, '-c', PROBE], cwd=BACKEND_DIR, env=env,
+                            capture_output=True, text=True, check=True)
+    return json.loads(result.stdout.strip().splitlines()[-1])['startup_ms']
+
+
+def test_create_app_is_fast_and_does_not_touch_the_database(tmp_path):
+    db_path = tmp_path / 'never-created.db'
+    timings = [probe(db_path) for _ in range(3)]  # Median of fresh interpreters: one slow run is noise
+    assert statistics.median(timings) < STARTUP_BUDGET_MS, timings
+    assert not db_path.exists()  # Building the app opened no connection
@@ -0,0 +1,56 @@
+from models import db, ApprovalEvent, ApprovalStep, User
+
+
+def user_id(email):
+    return db.session.query(User.id).filter_by(email=email).scalar()
+
+
+def test_deleting_a_manager_moves_their_waiting_steps_to_an_admin(seeded):
+    client = seeded.test_client()
+    with seeded.app_context():
+        manager_id, admin_id = user_id('manager@company.com'), user_id('admin@company.com')
+        employee_id = user_id('employee1@company.com')
+    response = client.post('/api/expenses', json={
+        'user_id': employee_id, 'title': 'Taxi', 'amount': 40, 'currency': 'USD'
+    })
+    assert response.status_code == 201
+    with seeded.app_context():
+        moved = [s.id for s in ApprovalStep.query.filter_by(approver_id=manager_id, status='Waiting')]
+    assert len(moved) == 3  # Two demo expenses and the new one
+
+    response = client.delete(f'/api/admin/users/{manager_id}')
+    assert response.status_code == 200
+
+    with seeded.app_context():
+        assert ApprovalStep.query.filter(
+            ApprovalStep.status == 'Waiting', ApprovalStep.approver_id.is_(None), ApprovalStep.group_id.is_(None)
+        ).count() == 0
+        assert {s.approver_id for s in ApprovalStep.query.filter(ApprovalStep.id.in_(moved))} == {admin_id}
+        notified = {e.step_id for e in ApprovalEvent.query.filter_by(user_id=admin_id, type='step_created')}
+        assert set(moved) <= notified
+
+    # The admin can now decide them, and the expense completes
+    for step_id in moved:
+        response = client.put(f'/api/approvals/{step_id}', json={'decision': 'approved', 'approver_id': admin_id})
+        assert response.status_code == 200, response.get_data(as_text=True)
+    queue = client.get(f'/api/approvals/{admin_id}').get_json()['approvals']
+    assert 'Taxi' not in {item['title'] for item in queue}
+
+
+def test_step_without_approver_or_group_cannot_be_decided(seeded):
+    client = seeded.test_client()
+    with seeded.app_context():
+        step = ApprovalStep.query.filter_by(status='Waiting').first()
+        step.approver_id = None
+        db.session.commit()
+        step_id, admin_id = step.id, user_id('admin@company.com')
+
+    response = client.put(f'/api/approvals/{step_id}', json={'decision': 'approved'})
+    assert response.status_code == 409
+    response = client.post('/api/approvals/batch', json={
+        'approver_id': admin_id,
+        'decisions': [{'step_id': step_id, 'decision': 'approved'}]
+    })
+    assert response.get_json()['results'][0]['ok'] is False
+    with seeded.app_context():
+        assert db.session.get(ApprovalStep, step_id).status == 'Waiting'
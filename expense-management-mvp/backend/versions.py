@@ -0,0 +1,176 @@
+import hashlib
+import threading
+from collections import OrderedDict
+from functools import wraps
+
+from flask import current_app, request
+from sqlalchemy import func, select, tuple_
+
+from models import db, DataVersion, User
+import tenancy
+
+# --- Data Versions & Conditional GET ---
+#
+# Writes bump a counter for the company they touch and for each user whose
+# expense history they change, in the same transaction as the write. Read
+# endpoints wrapped in @conditional() hash the request URL, the tenant and the
+# counters they depend on into a strong ETag before the view runs: a matching
+# If-None-Match gets a 304, and a hit in the optional in-process ResponseCache
+# is served without running the view's queries. Counters live in the database,
+# so ETags agree across worker processes.
+#
+#   ('company', id)  any expense, approval, user or group write in the company
+#   ('user', id)     the user's own expenses changed (submit, decision, import, rerate)
+#   ('fx', 0)        historical FX rates were loaded (fx_history.py)
+
+COMPANY = 'company'
+USER = 'user'
+FX_RATES = 'fx'
+
+
+def _upsert_statement(dialect_name):
+    table = DataVersion.__table__
+    if dialect_name == 'postgresql':
+        from sqlalchemy.dialects.postgresql import insert
+    else:
+        from sqlalchemy.dialects.sqlite import insert
+    return insert(table).on_conflict_do_update(
+        index_elements=['scope', 'scope_id'],
+        set_={'version': table.c.version + 1}
+    )
+
+
+def bump(company_ids=(), user_ids=()):
+    """Increments the counters of the given companies and users (creating them at 1)."""
+    params = [{'scope': COMPANY, 'scope_id': c, 'version': 1} for c in sorted(set(company_ids))]
+    params += [{'scope': USER, 'scope_id': u, 'version': 1} for u in sorted(set(user_ids))]
+    if params:
+        db.session.execute(_upsert_statement(db.session.get_bind().dialect.name), params)
+
+
+def bump_fx_rates():
+    """Historical FX rates changed: cached rate matrices are rebuilt."""
+    db.session.execute(_upsert_statement(db.session.get_bind().dialect.name),
+                       [{'scope': FX_RATES, 'scope_id': 0, 'version': 1}])
+
+
+def bump_expenses(expenses):
+    """Bumps the companies and submitters of written expenses (ORM objects or rows)."""
+    expenses = list(expenses)
+    bump({e.company_id for e in expenses}, {e.user_id for e in expenses})
+
+
+def bump_directory(company_id):
+    """Users or approver groups changed: their names appear in every history of the company."""
+    user_ids = db.session.scalars(
+        select(User.id).where(User.company_id == company_id).execution_options(all_tenants=True)
+    ).all()
+    bump([company_id], user_ids)
+
+
+def current_versions(keys):
+    """{(scope, scope_id): version} for the given keys; missing counters are 0.
+
+    scope_id None stands for every counter of that scope, summed (counters only
+    grow, so the sum changes whenever any of them does).
+    """
+    versions = {}
+    exact = [key for key in keys if key[1] is not None]
+    if exact:
+        rows = db.session.execute(
+            select(DataVersion.scope, DataVersion.scope_id, DataVersion.version)
+            .where(tuple_(DataVersion.scope, DataVersion.scope_id).in_(exact))
+        )
+        versions.update({(scope, scope_id): version for scope, scope_id, version in rows})
+    for scope, _ in (key for key in keys if key[1] is None):
+        versions[(scope, None)] = db.session.scalar(
+            select(func.coalesce(func.sum(DataVersion.version), 0)).where(DataVersion.scope == scope)
+        )
+    return [(key, versions.get(key, 0)) for key in keys]
+
+
+def tenant_company_key():
+    """The company counter for the request's tenant, or all companies when unscoped."""
+    return [(COMPANY, tenancy.current_company_id())]
+
+
+# --- Response Cache ---
+
+class ResponseCache:
+    """Process-wide LRU of response bodies keyed by ETag; max_entries=0 disables it."""
+
+    def __init__(self, max_entries=0):
+        self.max_entries = max_entries
+        self._entries = OrderedDict()
+        self._lock = threading.Lock()
+
+    def get(self, etag):
+        with self._lock:
+            entry = self._entries.get(etag)
+            if entry is not None:
+                self._entries.move_to_end(etag)
+            return entry
+
+    def put(self, etag, body, mimetype):
+        if self.max_entries <= 0:
+            return
+        with self._lock:
+            self._entries[etag] = (body, mimetype)
+            self._entries.move_to_end(etag)
+            while len(self._entries) > self.max_entries:
+                self._entries.popitem(last=False)
+
+    def clear(self):
+        with self._lock:
+            self._entries.clear()
+
+
+response_cache = ResponseCache()
+
+
+def init_app(app):
+    response_cache.max_entries = app.config['RESPONSE_CACHE_SIZE']
+
+
+def make_etag(keys):
+    versions = current_versions(keys)
+    raw = f'{request.full_path}|{tenancy.current_company_id()}|{versions}'
+    return hashlib.blake2b(raw.encode(), digest_size=16).hexdigest()
+
+
+def _finish(response, etag):
+    response.set_etag(etag)
+    # Browsers keep the body but revalidate with If-None-Match on every fetch
+    response.headers['Cache-Control'] = 'no-cache'
+    return response
+
+
+def conditional(version_keys):
+    """View decorator adding ETag / If-None-Match handling to a JSON GET endpoint.
+
+    `version_keys(**view_args)` returns the (scope, scope_id) counters the
+    response depends on, or None to run the view unconditionally.
+    """
+    def decorate(view):
+        @wraps(view)
+        def wrapper(**view_args):
+            keys = version_keys(**view_args)
+            if keys is None:
+                return view(**view_args)
+
+            etag = make_etag(keys)
+            if request.if_none_match.contains(etag):
+                return _finish(current_app.response_class(status=304), etag)
+
+            cached = response_cache.get(etag)
+            if cached is not None:
+                body, mimetype = cached
+                return _finish(current_app.response_class(body, mimetype=mimetype), etag)
+
+            response = current_app.make_response(view(**view_args))
+            if response.status_code != 200:
+                return response
+            response_cache.put(etag, response.get_data(), response.mimetype)
+            return _finish(response, etag)
+        return wrapper
+    return decorate
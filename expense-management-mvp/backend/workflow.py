@@ -0,0 +1,361 @@
+from collections import Counter
+from datetime import datetime
+
+from sqlalchemy import bindparam, insert, select, update
+from sqlalchemy.orm import aliased, joinedload
+
+from models import db, Expense, ApprovalStep, ApproverGroupMember, ApprovalVote
+from rollups import record_transition
+import events
+from versions import bump_expenses
+
+# --- Approval Decisions ---
+#
+# Completion is tracked incrementally: Expense.pending_step_count starts at the
+# number of steps created by the policy and is decremented (in SQL, so concurrent
+# approvers cannot lose an update) each time a step becomes Approved. The expense
+# is Approved when it reaches zero; any rejection rejects the expense and skips
+# the remaining Waiting steps.
+
+
+class WorkflowError(Exception):
+    """A decision that cannot be applied; carries the HTTP status to return."""
+
+    def __init__(self, message, status_code=400):
+        super().__init__(message)
+        self.message = message
+        self.status_code = status_code
+
+
+def earlier_step_pending(step):
+    return db.session.query(ApprovalStep.id).filter(
+        ApprovalStep.expense_id == step.expense_id,
+        ApprovalStep.sequence < step.sequence,
+        ApprovalStep.status != 'Approved'
+    ).first() is not None
+
+
+def check_decision(step, submitter_id, decider_id, earlier_pending, is_member, has_voted):
+    """Raises WorkflowError if decider_id may not decide this step right now."""
+    if step.status != 'Waiting':
+        raise WorkflowError('This approval has already been processed')
+    if earlier_pending:
+        raise WorkflowError('Earlier approval steps are still pending', 409)
+
+    if step.group_id is not None:
+        if decider_id is None:
+            raise WorkflowError('approver_id is required for group approval steps')
+        if decider_id == submitter_id:
+            raise WorkflowError('Submitters cannot approve their own expense', 403)
+        if not is_member:
+            raise WorkflowError('User is not a member of this approver group', 403)
+        if has_voted:
+            raise WorkflowError('You have already voted on this approval')
+    elif step.approver_id is None:
+        # Nobody may decide a step that lost its approver (see reassign_steps)
+        raise WorkflowError('This approval step has no approver', 409)
+    elif decider_id is not None and decider_id != step.approver_id:
+        raise WorkflowError('User is not the approver for this step', 403)
+
+
+def reject_expense(expense):
+    record_transition([expense], expense.status, 'Rejected')
+    expense.status = 'Rejected'
+    expense.pending_step_count = 0
+    ApprovalStep.query.filter_by(
+        expense_id=expense.id,
+        status='Waiting'
+    ).update({'status': 'Skipped', 'comments': 'Rejected by another approver'}, synchronize_session=False)
+
+
+def complete_step(expense):
+    """Counts one more Approved step against the expense and finalizes it at zero."""
+    expense.pending_step_count = Expense.pending_step_count - 1
+    db.session.flush()
+    # Reading the attribute reloads the value computed by the database
+    if expense.pending_step_count <= 0:
+        record_transition([expense], expense.status, 'Approved')
+        expense.status = 'Approved'
+
+
+def decide_step(step, decision, comments='', decider_id=None):
+    """Applies one approver's decision ('approved'/'rejected') to a step.
+
+    Raises WorkflowError if the decision is not allowed. The caller commits.
+    """
+    is_member = has_voted = False
+    if step.group_id is not None and decider_id is not None:
+        is_member = db.session.query(ApproverGroupMember.user_id).filter_by(
+            group_id=step.group_id, user_id=decider_id
+        ).first() is not None
+        has_voted = db.session.get(ApprovalVote, (step.id, decider_id)) is not None
+    check_decision(step, step.expense.user_id, decider_id,
+                   earlier_step_pending(step), is_member, has_voted)
+
+    expense = step.expense
+    now = datetime.utcnow()
+    approved = decision == 'approved'
+    bump_expenses([expense])
+    changes = events.track([expense.id])
+
+    if step.group_id is not None:
+        db.session.add(ApprovalVote(
+            step_id=step.id,
+            user_id=decider_id,
+            decision='Approved' if approved else 'Rejected',
+            comments=comments,
+            decided_at=now
+        ))
+        if approved:
+            step.approval_count = ApprovalStep.approval_count + 1
+            db.session.flush()
+            if step.approval_count < step.required_approvals:
+                changes.record(decider_id=decider_id)
+                return expense  # Quorum not reached yet
+
+    step.status = 'Approved' if approved else 'Rejected'
+    step.comments = comments
+    step.decided_at = now
+
+    if approved:
+        complete_step(expense)
+    else:
+        reject_expense(expense)
+    changes.record(decider_id=decider_id)
+    return expense
+
+
+# --- Reassignment ---
+
+def reassign_steps(user_id, candidate_ids):
+    """Moves user_id's Waiting steps to the first of candidate_ids who can take them.
+
+    For each step that is the first candidate who did not submit the expense,
+    preferring one who does not already approve another step of it. Returns
+    the number of steps moved; a step with no possible candidate is left as
+    it is. The caller commits.
+    """
+    candidate_ids = [c for c in candidate_ids if c is not None and c != user_id]
+    rows = db.session.execute(
+        select(ApprovalStep.id, ApprovalStep.expense_id, Expense.user_id)
+        .join(Expense, Expense.id == ApprovalStep.expense_id)
+        .where(ApprovalStep.approver_id == user_id, ApprovalStep.status == 'Waiting')
+    ).all()
+    if not rows or not candidate_ids:
+        return 0
+
+    taken = {}
+    for expense_id, approver_id in db.session.execute(
+        select(ApprovalStep.expense_id, ApprovalStep.approver_id)
+        .where(ApprovalStep.expense_id.in_({row.expense_id for row in rows}), ApprovalStep.approver_id.isnot(None))
+    ):
+        taken.setdefault(expense_id, set()).add(approver_id)
+
+    moves = []
+    for row in rows:
+        eligible = [c for c in candidate_ids if c != row.user_id]
+        target = next((c for c in eligible if c not in taken[row.expense_id]), eligible[0] if eligible else None)
+        if target is not None:
+            moves.append({'b_id': row.id, 'b_approver': target})
+    if not moves:
+        return 0
+
+    changes = events.track({row.expense_id for row in rows})
+    steps_table = ApprovalStep.__table__
+    db.session.execute(
+        update(steps_table).where(steps_table.c.id == bindparam('b_id'), steps_table.c.status == 'Waiting')
+        .values(approver_id=bindparam('b_approver')),
+        moves
+    )
+    db.session.expire_all()
+    bump_expenses(db.session.execute(
+        select(Expense.company_id, Expense.user_id).where(Expense.id.in_({row.expense_id for row in rows}))
+    ).all())
+    changes.record()
+    return len(moves)
+
+
+# --- Batch Decisions ---
+
+def decide_batch(decider_id, items, atomic=False):
+    """Applies many decisions from one approver in a single transaction.
+
+    `items` are dicts with step_id, decision and optional comments. Every item is
+    validated against the state before the batch (so a sequence-2 step cannot be
+    unlocked by a sequence-1 approval in the same batch) and in request order: an
+    item on an expense rejected by an earlier item fails. Valid items are applied
+    with set-based statements; invalid ones are reported and skipped, unless
+    `atomic` is set, in which case any failure applies nothing.
+
+    Returns (results, applied) where results has one entry per item. The caller
+    commits when applied is True.
+    """
+    step_ids = {item.get('step_id') for item in items if isinstance(item.get('step_id'), int)}
+    steps = {
+        s.id: s for s in ApprovalStep.query.filter(ApprovalStep.id.in_(step_ids)).options(
+            joinedload(ApprovalStep.expense).load_only(Expense.id, Expense.user_id, Expense.status)
+        )
+    } if step_ids else {}
+
+    # Everything validation needs, fetched with one query each
+    earlier = aliased(ApprovalStep)
+    blocked_ids = {row.id for row in db.session.query(ApprovalStep.id).filter(
+        ApprovalStep.id.in_(step_ids),
+        db.session.query(earlier.id).filter(
+            earlier.expense_id == ApprovalStep.expense_id,
+            earlier.sequence < ApprovalStep.sequence,
+            earlier.status != 'Approved'
+        ).exists()
+    )} if step_ids else set()
+    member_group_ids = {row.group_id for row in db.session.query(ApproverGroupMember.group_id).filter(
+        ApproverGroupMember.user_id == decider_id
+    )}
+    voted_step_ids = {row.step_id for row in db.session.query(ApprovalVote.step_id).filter(
+        ApprovalVote.user_id == decider_id, ApprovalVote.step_id.in_(step_ids)
+    )} if step_ids else set()
+
+    results, accepted, seen, rejected_expenses = [], [], set(), set()
+    for item in items:
+        step_id = item.get('step_id')
+        decision = item.get('decision')
+        result = {'step_id': step_id}
+        results.append(result)
+
+        step = steps.get(step_id)
+        try:
+            if decision not in ('approved', 'rejected'):
+                raise WorkflowError('Decision must be "approved" or "rejected"')
+            if step is None:
+                raise WorkflowError('Approval step not found', 404)
+            if step_id in seen:
+                raise WorkflowError('Duplicate step_id in batch')
+            if step.expense_id in rejected_expenses:
+                raise WorkflowError('Expense was rejected earlier in this batch')
+            check_decision(step, step.expense.user_id, decider_id,
+                           step_id in blocked_ids, step.group_id in member_group_ids,
+                           step_id in voted_step_ids)
+        except WorkflowError as e:
+            result.update({'ok': False, 'error': e.message, 'code': e.status_code})
+            continue
+
+        seen.add(step_id)
+        if decision == 'rejected':
+            rejected_expenses.add(step.expense_id)
+        result.update({'ok': True, 'expense_id': step.expense_id})
+        accepted.append((step, decision, item.get('comments') or ''))
+
+    failed = len(results) - len(accepted)
+    if not accepted or (atomic and failed):
+        for result in results:
+            if result.get('ok'):
+                result.update({'ok': False, 'error': 'Not applied: batch is atomic and another item failed'})
+                result.pop('expense_id', None)
+        return results, False
+
+    final_status = _apply_accepted(decider_id, accepted, rejected_expenses)
+    for result in results:
+        if result.get('ok'):
+            result['expense_status'] = final_status[result['expense_id']]
+    return results, True
+
+
+def _apply_accepted(decider_id, accepted, rejected_expenses):
+    """Writes validated decisions with set-based statements; returns {expense_id: status}."""
+    now = datetime.utcnow()
+    steps_table = ApprovalStep.__table__
+    expenses_table = Expense.__table__
+    affected = {s.expense_id for s, _, _ in accepted}
+    changes = events.track(affected)
+
+    group_items = [(s, d, c) for s, d, c in accepted if s.group_id is not None]
+    if group_items:
+        db.session.execute(insert(ApprovalVote.__table__), [
+            {'step_id': s.id, 'user_id': decider_id, 'decision': 'Approved' if d == 'approved' else 'Rejected',
+             'comments': c, 'decided_at': now}
+            for s, d, c in group_items
+        ])
+        group_approved_ids = [s.id for s, d, _ in group_items if d == 'approved']
+        if group_approved_ids:
+            db.session.execute(
+                update(steps_table).where(steps_table.c.id.in_(group_approved_ids))
+                .values(approval_count=steps_table.c.approval_count + 1)
+            )
+        # Group approvals only close the step once the quorum is met
+        quorum_met = {row.id for row in db.session.execute(
+            select(steps_table.c.id).where(
+                steps_table.c.id.in_(group_approved_ids),
+                steps_table.c.approval_count >= steps_table.c.required_approvals
+            )
+        )} if group_approved_ids else set()
+    else:
+        quorum_met = set()
+
+    closing = [
+        (s, d, c) for s, d, c in accepted
+        if s.group_id is None or d == 'rejected' or s.id in quorum_met
+    ]
+    if closing:
+        db.session.execute(
+            update(steps_table)
+            .where(steps_table.c.id == bindparam('b_id'), steps_table.c.status == 'Waiting')
+            .values(status=bindparam('b_status'), comments=bindparam('b_comments'), decided_at=now),
+            [{'b_id': s.id, 'b_status': 'Approved' if d == 'approved' else 'Rejected', 'b_comments': c}
+             for s, d, c in closing]
+        )
+
+    # Incremental completion: subtract the steps this batch actually Approved per
+    # expense. The guarded UPDATE skips a step a concurrent decision closed first
+    # (possible at READ COMMITTED), and that step must not be counted twice.
+    approving = [s for s, d, _ in closing if d == 'approved' and s.expense_id not in rejected_expenses]
+    approved_ids = set(db.session.scalars(
+        select(steps_table.c.id).where(
+            steps_table.c.id.in_([s.id for s in approving]),
+            steps_table.c.status == 'Approved',
+            steps_table.c.decided_at == now
+        )
+    )) if approving else set()
+    completed = Counter(s.expense_id for s in approving if s.id in approved_ids)
+    if completed:
+        db.session.execute(
+            update(expenses_table).where(expenses_table.c.id == bindparam('b_id'))
+            .values(pending_step_count=expenses_table.c.pending_step_count - bindparam('b_count')),
+            [{'b_id': expense_id, 'b_count': count} for expense_id, count in completed.items()]
+        )
+        db.session.execute(
+            update(expenses_table).where(
+                expenses_table.c.id.in_(list(completed)),
+                expenses_table.c.status == 'Pending',
+                expenses_table.c.pending_step_count <= 0
+            ).values(status='Approved')
+        )
+
+    if rejected_expenses:
+        db.session.execute(
+            update(expenses_table).where(expenses_table.c.id.in_(rejected_expenses))
+            .values(status='Rejected', pending_step_count=0)
+        )
+        db.session.execute(
+            update(steps_table).where(
+                steps_table.c.expense_id.in_(rejected_expenses),
+                steps_table.c.status == 'Waiting'
+            ).values(status='Skipped', comments='Rejected by another approver')
+        )
+
+    # Core statements bypass the ORM, so drop any stale loaded state
+    db.session.expire_all()
+    rows = db.session.execute(
+        select(expenses_table.c.id, expenses_table.c.status, expenses_table.c.company_id,
+               expenses_table.c.user_id, expenses_table.c.date, expenses_table.c.category,
+               expenses_table.c.currency, expenses_table.c.amount, expenses_table.c.base_amount)
+        .where(expenses_table.c.id.in_(affected))
+    ).all()
+
+    # Every affected expense was Pending before the batch (it had Waiting steps)
+    for new_status in ('Approved', 'Rejected'):
+        finalized = [row for row in rows if row.status == new_status]
+        if finalized:
+            record_transition(finalized, 'Pending', new_status)
+    bump_expenses(rows)
+    changes.record(decider_id=decider_id)
+
+    return {row.id: row.status for row in rows}
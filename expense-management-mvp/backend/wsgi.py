@@ -0,0 +1,34 @@
+"""Production entry point.
+
+Prepare the database once per deploy (both commands are safe to re-run):
+
+    flask --app app init-db      # create the schema / apply pending migrations
+    flask --app app seed-db      # optional: demo data for an empty database
+
+then serve the WSGI app with a multi-worker server, for example:
+
+    gunicorn --workers 4 --threads 4 --bind 0.0.0.0:8000 wsgi:app
+    waitress-serve --threads 8 --port 8000 wsgi:app
+
+create_app() opens no database connections, so gunicorn's --preload is safe:
+each worker's pool connects on its first request. Request metrics are per
+process (scrape /api/metrics on every worker). `python wsgi.py` runs waitress
+when it is installed, otherwise werkzeug's threaded server, on $HOST:$PORT.
+"""
+import os
+
+from app import create_app
+
+app = create_app()
+
+
+if __name__ == '__main__':
+    host = os.environ.get('HOST', '0.0.0.0')
+    port = int(os.environ.get('PORT', 8000))
+    try:
+        from waitress import serve
+    except ImportError:
+        from werkzeug.serving import run_simple
+        run_simple(host, port, app, threaded=True)
+    else:
+        serve(app, host=host, port=port, threads=int(os.environ.get('THREADS', 8)))
@@ -6,6 +6,10 @@ import React, { useState, useEffect } from 'react';
 
 const API_BASE = 'http://localhost:5000/api';
 
+// Company of the logged-in user; sent on list requests so the API only scans that tenant
+let activeCompanyId = null;
+const tenantHeaders = () => (activeCompanyId ? { 'X-Company-Id': String(activeCompanyId) } : {});
+
 // --- Message Toast Component (Professional UI Alert System) ---
 const MessageToast = ({ message, type, onClose }) => {
     if (!message) return null;
@@ -54,6 +58,7 @@ const App = () => {
     });
     const [isSubmitting, setIsSubmitting] = useState(false);
     const [employeeHistory, setEmployeeHistory] = useState([]);
+    const [employeeHistoryCursor, setEmployeeHistoryCursor] = useState(null); // next_cursor of the last page loaded
 
     // Approval Queue State (Manager)
     const [approvalQueue, setApprovalQueue] = useState([]);
@@ -62,6 +67,7 @@ const App = () => {
 
     // All Expenses State (Admin)
     const [allExpenses, setAllExpenses] = useState([]);
+    const [allExpensesCursor, setAllExpensesCursor] = useState(null);
     
     // Admin User Management State
     const [allUsers, setAllUsers] = useState([]);
@@ -131,6 +137,7 @@ const App = () => {
             const data = await response.json();
 
             if (response.ok && data.success) {
+                activeCompanyId = data.user.company_id;
                 setCurrentUser(data.user);
                 setLoginEmail('');
                 setLoginPassword('');
@@ -188,23 +195,30 @@ const App = () => {
     };
 
     const handleLogout = () => {
+        activeCompanyId = null;
         setCurrentUser(null);
         setApprovalQueue([]);
         setAllExpenses([]);
+        setAllExpensesCursor(null);
         setEmployeeHistory([]);
+        setEmployeeHistoryCursor(null);
         setAllUsers([]);
         setManagers([]);
         setConvertedAmounts({});
         showToast("Logged out successfully.", 'warning');
     };
 
-    const fetchEmployeeHistory = async (userId) => {
+    // Listings are cursor paginated: without a cursor this loads the first page,
+    // with one it appends the next page ("Load more")
+    const fetchEmployeeHistory = async (userId, cursor = null) => {
         if (!userId) return;
         try {
-            const response = await fetch(`${API_BASE}/expenses/history/${userId}`);
+            const query = cursor ? `?cursor=${encodeURIComponent(cursor)}` : '';
+            const response = await fetch(`${API_BASE}/expenses/history/${userId}${query}`, { headers: tenantHeaders() });
             const data = await response.json();
             if (response.ok && data.success) {
-                setEmployeeHistory(data.expenses);
+                setEmployeeHistory(prev => (cursor ? [...prev, ...data.expenses] : data.expenses));
+                setEmployeeHistoryCursor(data.next_cursor);
             }
         } catch (error) {
             console.error('Error fetching employee history:', error);
@@ -222,18 +236,29 @@ const App = () => {
         e.preventDefault();
         setIsSubmitting(true);
 
-        try {
-            const response = await fetch(`${API_BASE}/expenses`, {
-                method: 'POST',
-                headers: { 'Content-Type': 'application/json' },
-                body: JSON.stringify({
-                    user_id: currentUser.id, title: expenseForm.title, description: expenseForm.description,
-                    amount: parseFloat(expenseForm.amount), currency: expenseForm.currency,
-                    category: expenseForm.category, date: expenseForm.date
-                })
-            });
+        const submit = (allowDuplicate) => fetch(`${API_BASE}/expenses`, {
+            method: 'POST',
+            headers: { 'Content-Type': 'application/json' },
+            body: JSON.stringify({
+                user_id: currentUser.id, title: expenseForm.title, description: expenseForm.description,
+                amount: parseFloat(expenseForm.amount), currency: expenseForm.currency,
+                category: expenseForm.category, date: expenseForm.date, allow_duplicate: allowDuplicate
+            })
+        });
 
-            const data = await response.json();
+        try {
+            let response = await submit(false);
+            let data = await response.json();
+
+            // The same expense was already submitted: only keep both if the user says so
+            if (response.status === 409 && data.duplicate_of) {
+                if (!window.confirm(`This looks like a duplicate of expense #${data.duplicate_of}. Submit it anyway?`)) {
+                    showToast('Submission cancelled: duplicate of expense #' + data.duplicate_of, 'error');
+                    return;
+                }
+                response = await submit(true);
+                data = await response.json();
+            }
 
             if (response.ok && data.success) {
                 showToast('✅ Expense submitted successfully!', 'success');
@@ -257,7 +282,7 @@ const App = () => {
     const fetchApprovalQueue = async (userId) => {
         setLoadingQueue(true);
         try {
-            const response = await fetch(`${API_BASE}/approvals/${userId}`);
+            const response = await fetch(`${API_BASE}/approvals/${userId}`, { headers: tenantHeaders() });
             const data = await response.json();
 
             if (response.ok && data.success) {
@@ -266,7 +291,9 @@ const App = () => {
                     const existing = acc[expense.id] || { ...expense, approval_steps: expense.approval_steps };
 
                     // Find the approval step relevant to the current user
-                    const userStep = expense.approval_steps.find(s => s.approver_id === userId);
+                    // Group (pooled) steps have no approver_id, so fall back to the step the API matched
+                    const userStep = expense.approval_steps.find(s => s.approver_id === userId)
+                        || expense.approval_steps.find(s => s.id === expense.approval_step_id);
                     
                     // Add the relevant step ID needed for processing the approval
                     // This is the step ID the manager/admin will approve/reject.
@@ -318,7 +345,7 @@ const App = () => {
             const response = await fetch(`${API_BASE}/approvals/${stepId}`, {
                 method: 'PUT',
                 headers: { 'Content-Type': 'application/json' },
-                body: JSON.stringify({ decision, comments })
+                body: JSON.stringify({ decision, comments, approver_id: currentUser.id })
             });
 
             const data = await response.json();
@@ -342,13 +369,15 @@ const App = () => {
         }
     };
     
-    const fetchAllExpenses = async () => {
+    const fetchAllExpenses = async (cursor = null) => {
         try {
-            const response = await fetch(`${API_BASE}/expenses/all`);
+            const query = cursor ? `?cursor=${encodeURIComponent(cursor)}` : '';
+            const response = await fetch(`${API_BASE}/expenses/all${query}`, { headers: tenantHeaders() });
             const data = await response.json();
 
             if (response.ok && data.success) {
-                setAllExpenses(data.expenses);
+                setAllExpenses(prev => (cursor ? [...prev, ...data.expenses] : data.expenses));
+                setAllExpensesCursor(data.next_cursor);
             }
         } catch (error) {
             console.error('Error fetching all expenses:', error);
@@ -358,7 +387,7 @@ const App = () => {
     const fetchAllUsers = async () => {
         setIsUserManagementLoading(true);
         try {
-            const response = await fetch(`${API_BASE}/users`);
+            const response = await fetch(`${API_BASE}/users`, { headers: tenantHeaders() });
             const data = await response.json();
 
             if (response.ok && data.success) {
@@ -494,6 +523,12 @@ const App = () => {
                             </div>
                         </div>
                     ))}
+                    {employeeHistoryCursor && (
+                        <button onClick={() => fetchEmployeeHistory(currentUser.id, employeeHistoryCursor)}
+                            className="w-full py-3 bg-white text-sky-600 font-semibold rounded-xl border shadow hover:bg-sky-50 transition">
+                            Load more
+                        </button>
+                    )}
                 </div>
             )}
         </div>
@@ -625,7 +660,8 @@ const App = () => {
     // Manager Approval Item Component - Used in Manager View to display one unique expense
     const ApprovalQueueItem = ({ expense, currentUser, handleApproval, convertedAmounts }) => {
         // Find the specific step ID relevant to the currentUser for this expense
-        const currentUserStep = expense.approval_steps.find(step => step.approver_id === currentUser.id);
+        const currentUserStep = expense.approval_steps.find(step => step.approver_id === currentUser.id)
+            || expense.approval_steps.find(step => step.id === expense.approval_step_id);
         const stepId = currentUserStep ? currentUserStep.id : null;
         
         // Determine if this user has already acted on this expense
@@ -890,7 +926,7 @@ const App = () => {
                             <div className="bg-white rounded-xl shadow-xl overflow-hidden border border-gray-200">
                                 <div className="bg-gray-800 text-white px-6 py-4 flex justify-between items-center shadow-lg">
                                     <h2 className="text-xl font-bold">All Expenses Overview</h2>
-                                    <button onClick={fetchAllExpenses}
+                                    <button onClick={() => fetchAllExpenses()}
                                         className="px-4 py-2 bg-sky-500 text-white rounded-lg hover:bg-sky-600 transition font-semibold shadow-md">
                                         🔄 Refresh Data
                                     </button>
@@ -953,6 +989,14 @@ const App = () => {
                                         {allExpenses.filter(exp => adminExpenseFilter === 'all' || exp.status.toLowerCase() === adminExpenseFilter).length === 0 && (
                                             <div className="p-12 text-center text-gray-500">No {adminExpenseFilter} expenses found</div>
                                         )}
+                                        {allExpensesCursor && (
+                                            <div className="p-4 text-center">
+                                                <button onClick={() => fetchAllExpenses(allExpensesCursor)}
+                                                    className="px-4 py-2 bg-sky-500 text-white rounded-lg hover:bg-sky-600 transition font-semibold shadow-md">
+                                                    Load more
+                                                </button>
+                                            </div>
+                                        )}
                                     </div>
                                 )}
                             </div>